@@ -0,0 +1,311 @@
+"""
+Throughput benchmarks of the obfuscation kernels.
+
+Run all benchmarks, or the named ones, from the project root:
+    PYTHONPATH=$(pwd) python benchmarks/run_benchmarks.py [name ...]
+"""
+import argparse
+import collections
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+import pandas as pd
+from src.obfuscation_methods import make_value_obfuscator
+from src.redaction import redact_series
+from src.pseudonym_map import PseudonymMap, pseudonymize_series
+from src.obfuscator import (
+    iter_df_chunks,
+    obfuscate_fields_in_df,
+    obfuscate_file,
+)
+from src.engines import duckdb
+from src.chunk_writers import get_chunk_writer
+from src.pipeline import run_pipelined_obfuscation, run_fan_out_obfuscation
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark: a function of the number of rows returning
+    a list of result rows
+    """
+    def register(func: Callable[[int], list[dict]]):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def measure(case: str, func: Callable, data_bytes: int,
+            repeat: int = 3) -> dict:
+    """
+    Time the best of repeat runs of func
+
+    Args:
+        case (str): name of the measured case
+        func (Callable): function to time, called without arguments
+        data_bytes (int): bytes processed by one run
+
+    Returns:
+        dict: 'case', 'seconds' and 'mb_per_s'
+    """
+    seconds = min(_time(func) for _ in range(repeat))
+    return {"case": case, "seconds": round(seconds, 4),
+            "mb_per_s": round(data_bytes / seconds / 1e6, 1)}
+
+
+def _time(func: Callable) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def measure_rss(case: str, func: Callable, data_bytes: int,
+                *args) -> dict:
+    """
+    Run func(*args) once in a new process, so that its peak RSS is not
+    hidden by earlier cases. func and args must be picklable.
+
+    Args:
+        case (str): name of the measured case
+        func (Callable): module level function to run
+        data_bytes (int): bytes processed by the run
+
+    Returns:
+        dict: 'case', 'seconds', 'mb_per_s' and 'peak_rss_mb', the
+              growth of the peak RSS of the process during the run
+    """
+    with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn")) as executor:
+        seconds, rss_bytes = executor.submit(
+            _run_with_rss, func, *args).result()
+    return {"case": case, "seconds": round(seconds, 4),
+            "mb_per_s": round(data_bytes / seconds / 1e6, 1),
+            "peak_rss_mb": round(rss_bytes / 1e6, 1)}
+
+
+def _run_with_rss(func: Callable, *args) -> tuple[float, int]:
+    # ru_maxrss is in KB on Linux
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = _time(lambda: func(*args))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, (after - before) * 1024
+
+
+def make_feedback(rows: int, pii_share: float = 0.5,
+                  seed: int = 0) -> pd.Series:
+    """
+    Free-text customer feedback, pii_share of it mentioning emails,
+    phone numbers, card numbers or names
+    """
+    rng = random.Random(seed)
+    clean = ["Great service, the parcel arrived two days early.",
+             "Product works as described but the manual is unclear.",
+             "Refund processed quickly, would order again next month."]
+    with_pii = ["Please email me at {n}.smith@example.com about order {n}.",
+                "Call me back on 07700 9{n:05d} after 5pm, thanks.",
+                "Card 4111 1111 1111 {n:04d} was charged twice.",
+                "Mrs Jones said the courier for order {n} was rude."]
+    values = []
+    for n in range(rows):
+        if rng.random() < pii_share:
+            values.append(rng.choice(with_pii).format(n=n % 10000))
+        else:
+            values.append(rng.choice(clean))
+    return pd.Series(values, name="customer_feedback")
+
+
+@benchmark("redaction")
+def bench_redaction(rows: int) -> list[dict]:
+    feedback = make_feedback(rows)
+    data_bytes = int(feedback.str.len().sum())
+    redact = make_value_obfuscator("redact")
+    return [
+        measure("per value (re)", lambda: feedback.map(redact),
+                data_bytes),
+        measure("column (re2, 1 thread)",
+                lambda: redact_series(feedback, max_workers=1),
+                data_bytes),
+        measure("column (re2, 1 thread per CPU)",
+                lambda: redact_series(feedback), data_bytes),
+    ]
+
+
+@benchmark("pseudonyms")
+def bench_pseudonyms(rows: int) -> list[dict]:
+    names = pd.Series([f"Customer {n}" for n in range(rows)])
+    data_bytes = int(names.str.len().sum())
+    with tempfile.TemporaryDirectory() as directory:
+        counter = itertools.count()
+
+        def new_map() -> PseudonymMap:
+            return PseudonymMap(os.path.join(directory, f"{next(counter)}.db"),
+                                capacity=rows)
+
+        seen = new_map()
+        pseudonymize_series(names, seen)
+        return [
+            measure("new values (column)",
+                    lambda: pseudonymize_series(names, new_map()),
+                    data_bytes),
+            measure("seen values (column)",
+                    lambda: pseudonymize_series(names, seen), data_bytes),
+            measure("seen values (per value)",
+                    lambda: names.map(seen.pseudonymize_value), data_bytes),
+        ]
+
+
+def make_customers(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Customer records with several string columns
+    """
+    rng = random.Random(seed)
+    feedback = make_feedback(rows, seed=seed)
+    return pd.DataFrame({
+        "customer_id": range(rows),
+        "name": [f"Customer {rng.randrange(10 ** 6)}" for _ in range(rows)],
+        "email": [f"user{n}@example.com" for n in range(rows)],
+        "city": [rng.choice(["Leeds", "London", "York"])
+                 for _ in range(rows)],
+        "customer_feedback": feedback,
+    })
+
+
+def obfuscate_csv_file(path: str, chunk_size: int, arrow_strings: bool,
+                       csv_engine: str):
+    """
+    Read a csv file in chunks, mask its PII and write each chunk to csv
+    """
+    with open(path, "rb") as csv_file:
+        for chunk in iter_df_chunks(csv_file, "csv", chunk_size,
+                                    ["name", "email"],
+                                    arrow_strings=arrow_strings,
+                                    csv_engine=csv_engine):
+            writer = get_chunk_writer("csv", io.BytesIO())
+            writer.write(obfuscate_fields_in_df(chunk, ["name", "email"],
+                                                "mask"))
+
+
+@benchmark("arrow_strings")
+def bench_arrow_strings(rows: int) -> list[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "customers.csv")
+        make_customers(rows).to_csv(path, index=False)
+        data_bytes = os.path.getsize(path)
+        # One chunk, so the peak RSS is the memory of a chunk
+        return [
+            measure_rss("object strings (c)", obfuscate_csv_file,
+                        data_bytes, path, rows, False, "c"),
+            measure_rss("arrow strings (c)", obfuscate_csv_file,
+                        data_bytes, path, rows, True, "c"),
+            measure_rss("object strings (pyarrow)", obfuscate_csv_file,
+                        data_bytes, path, rows, False, "pyarrow"),
+            measure_rss("arrow strings (pyarrow)", obfuscate_csv_file,
+                        data_bytes, path, rows, True, "pyarrow"),
+        ]
+
+
+@benchmark("engines")
+def bench_engines(rows: int) -> list[dict]:
+    content = make_customers(rows).to_csv(index=False)
+    method = {"name": "mask", "email": "hash", "customer_feedback": "redact"}
+    engines = ["pandas", "arrow"] + (["duckdb"] if duckdb else [])
+    return [
+        measure(f"{engine} csv -> {output_format}",
+                lambda engine=engine, output_format=output_format:
+                obfuscate_file(content, list(method), "csv", output_format,
+                               chunk_size=50000, obfuscate_method=method,
+                               engine=engine),
+                len(content), repeat=1)
+        for engine in engines for output_format in ["csv", "parquet"]
+    ]
+
+
+@benchmark("fan_out")
+def bench_fan_out(rows: int) -> list[dict]:
+    content = make_customers(rows).to_csv(index=False).encode("utf8")
+    fields = ["name", "email"]
+    output_formats = ["parquet", "csv"]
+
+    def one_job_per_format():
+        for output_format in output_formats:
+            run_pipelined_obfuscation(io.BytesIO(content), "csv", fields,
+                                      list, output_format=output_format,
+                                      chunk_size=50000)
+
+    return [
+        measure("one job per format (parquet, csv)", one_job_per_format,
+                len(content), repeat=1),
+        measure("fan-out (parquet, csv)",
+                lambda: run_fan_out_obfuscation(
+                    io.BytesIO(content), "csv", fields,
+                    {output_format: list for output_format in output_formats},
+                    chunk_size=50000),
+                len(content), repeat=1),
+    ]
+
+
+def obfuscate_json_pipelined(path: str, chunk_size: int,
+                             max_memory_mb: int | None):
+    """
+    Obfuscate a JSON array file to parquet with the pipelined stages,
+    discarding the output parts
+    """
+    with open(path, "rb") as json_file:
+        run_pipelined_obfuscation(
+            json_file, "json", ["name", "email"],
+            lambda parts: collections.deque(parts, maxlen=0),
+            output_format="parquet", chunk_size=chunk_size,
+            max_memory_mb=max_memory_mb)
+
+
+@benchmark("memory_governor")
+def bench_memory_governor(rows: int) -> list[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "customers.json")
+        make_customers(rows).to_json(path, orient="records")
+        data_bytes = os.path.getsize(path)
+        # The limit is under the RSS of the imports alone, so that the
+        # governor shrinks the chunks after the first one
+        return [
+            measure_rss("json -> parquet, no limit",
+                        obfuscate_json_pipelined, data_bytes, path,
+                        rows // 4, None),
+            measure_rss("json -> parquet, max_memory_mb=64",
+                        obfuscate_json_pipelined, data_bytes, path,
+                        rows // 4, 64),
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser("Obfuscator benchmarks")
+    parser.add_argument("names", nargs="*",
+                        help=f"benchmarks to run among {list(BENCHMARKS)}, " +
+                             "all by default")
+    parser.add_argument("--rows", type=int, default=200000,
+                        help="rows of generated data, 200000 by default")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {sorted(unknown)}")
+    for name in args.names or BENCHMARKS:
+        print(f"== {name} ({args.rows} rows)")
+        for result in BENCHMARKS[name](args.rows):
+            line = f"{result['case']:<36}{result['seconds']:>10.4f} s" + \
+                f"{result['mb_per_s']:>10.1f} MB/s"
+            if "peak_rss_mb" in result:
+                line += f"{result['peak_rss_mb']:>10.1f} MB peak RSS"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
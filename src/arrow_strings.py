@@ -0,0 +1,92 @@
+from typing import Callable
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# Strings kept in one Arrow buffer (offsets + UTF-8 bytes) instead of
+# one Python object per cell, about 50 bytes less per cell
+ARROW_STRING = pd.ArrowDtype(pa.string())
+
+
+def arrow_types_mapper(arrow_type: pa.DataType) -> pd.ArrowDtype | None:
+    """
+    types_mapper of pa.Table.to_pandas reading Arrow strings as
+    ARROW_STRING columns, other types keep their default conversion
+
+    Args:
+        arrow_type (pa.DataType): type of a column
+
+    Returns:
+        pd.ArrowDtype: ARROW_STRING for strings, None otherwise
+    """
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return ARROW_STRING
+    return None
+
+
+def is_arrow_string(series: pd.Series) -> bool:
+    """
+    Whether a column holds Arrow-backed strings
+    """
+    return isinstance(series.dtype, pd.ArrowDtype) and \
+        pa.types.is_string(series.dtype.pyarrow_dtype)
+
+
+def to_arrow_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the object columns of a DataFrame holding only strings and
+    missing values to ARROW_STRING. Columns of other objects (numbers,
+    nested records, ...) are kept.
+
+    Args:
+        df (pd.DataFrame): DataFrame, e.g. a chunk just read
+
+    Returns:
+        pd.DataFrame: the DataFrame, converted in place
+    """
+    for column in df.columns[df.dtypes == object]:
+        try:
+            array = pa.array(df[column], type=pa.string(), from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            continue
+        df[column] = string_series(array, df[column])
+    return df
+
+
+def string_array(series: pd.Series) -> pa.Array:
+    """
+    Arrow array of an ARROW_STRING column, without copying its buffers
+    """
+    return pa.array(series.array)
+
+
+def string_series(array: pa.Array, like: pd.Series) -> pd.Series:
+    """
+    ARROW_STRING column holding an Arrow array, with the index and name
+    of another column
+    """
+    return pd.Series(pd.arrays.ArrowExtensionArray(array),
+                     index=like.index, name=like.name)
+
+
+def map_valid(array: pa.Array,
+              func: Callable[[list[str]], list[str]]) -> pa.Array:
+    """
+    Replace the non-null strings of an array by the results of a
+    function of the whole list of them, e.g. one bulk vault lookup.
+    Nulls are kept.
+
+    Args:
+        array (pa.Array): Arrow strings
+        func (Callable): maps a list of strings to as many strings
+
+    Returns:
+        pa.Array: strings returned by func, at the place of the values
+    """
+    valid = array.is_valid()
+    values = array.filter(valid).to_pylist()
+    if not values:
+        return array
+    return pc.replace_with_mask(array, valid,
+                                pa.array(func(values), type=pa.string()))
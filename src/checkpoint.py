@@ -0,0 +1,338 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from typing import Callable
+from src.csv_passthrough import (
+    _iter_records, rewrite_csv_pii_fields, strip_bom
+)
+from src.obfuscation_methods import draw_salt, get_field_method
+from src.compression import split_compression_extension
+from src.tokenization import TokenVault
+from src.pseudonym_map import PseudonymMap
+from src.utils import get_s3_client
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+DOWNLOAD_BLOCK_SIZE = 8 * 1024 * 1024
+# S3 rejects multipart parts smaller than 5 MB, except the last one
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CHECKPOINT_PREFIX = "_checkpoints/"
+
+
+class CheckpointStore:
+    """
+    Where the progress of checkpointed jobs is saved, one JSON
+    document per job
+    """
+
+    def load(self, job_id: str) -> dict | None:
+        """
+        Returns:
+            dict: last saved state of the job, None if there is none
+        """
+        raise NotImplementedError
+
+    def save(self, job_id: str, state: dict):
+        raise NotImplementedError
+
+    def delete(self, job_id: str):
+        raise NotImplementedError
+
+
+class LocalCheckpointStore(CheckpointStore):
+    """
+    Checkpoints saved as <directory>/<job_id>.json, replaced atomically
+    so that a crash while saving keeps the previous checkpoint
+
+    Args:
+        directory (str): directory of the checkpoint files
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def load(self, job_id: str) -> dict | None:
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, job_id: str, state: dict):
+        tmp_path = self._path(job_id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(job_id))
+
+    def delete(self, job_id: str):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore(CheckpointStore):
+    """
+    Checkpoints saved as s3://<bucket>/<prefix><job_id>.json
+
+    Args:
+        bucket (str): bucket of the checkpoints
+        prefix (str): key prefix of the checkpoints
+    """
+
+    def __init__(self, bucket: str,
+                 prefix: str = DEFAULT_CHECKPOINT_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def load(self, job_id: str) -> dict | None:
+        s3_client = get_s3_client()
+        try:
+            body = s3_client.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}{job_id}.json")["Body"]
+            return json.loads(body.read())
+        except s3_client.exceptions.NoSuchKey:
+            return None
+
+    def save(self, job_id: str, state: dict):
+        get_s3_client().put_object(
+            Bucket=self.bucket, Key=f"{self.prefix}{job_id}.json",
+            Body=json.dumps(state).encode("utf8"))
+
+    def delete(self, job_id: str):
+        get_s3_client().delete_object(Bucket=self.bucket,
+                                      Key=f"{self.prefix}{job_id}.json")
+
+
+def get_checkpoint_store(location: str) -> CheckpointStore:
+    """
+    Build a checkpoint store from its location:
+    "s3://<bucket>/<prefix>" for S3, otherwise a local directory
+
+    Args:
+        location (str): where checkpoints are saved
+
+    Returns:
+        CheckpointStore: the checkpoint store
+    """
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[5:].partition("/")
+        return S3CheckpointStore(bucket, prefix or DEFAULT_CHECKPOINT_PREFIX)
+    return LocalCheckpointStore(location)
+
+
+def get_job_id(s3_bucket: str, file_key: str, output_key: str) -> str:
+    """
+    Identify a checkpointed job by its input and output
+
+    Returns:
+        str: job id
+    """
+    return hashlib.sha256(
+        f"{s3_bucket}/{file_key}->{output_key}".encode("utf8")
+    ).hexdigest()[:32]
+
+
+def _read_header(s3_client, s3_bucket: str, file_key: str) -> tuple:
+    body = s3_client.get_object(Bucket=s3_bucket, Key=file_key)["Body"]
+    try:
+        header, terminator = next(_iter_records(body, 64 * 1024),
+                                  (b"", b""))
+    finally:
+        body.close()
+    return header, terminator
+
+
+def _new_state(s3_client, s3_bucket: str, file_key: str, output_key: str,
+               head: dict, fields_list,
+               obfuscate_method: str | dict[str, str]) -> dict:
+    header, terminator = _read_header(s3_client, s3_bucket, file_key)
+    if callable(fields_list):
+        columns = [column.strip() for column in
+                   next(csv.reader([strip_bom(header).decode("utf8")]))]
+        fields_list = fields_list(columns)
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=s3_bucket, Key=output_key)["UploadId"]
+    return {
+        "s3_bucket": s3_bucket,
+        "file_key": file_key,
+        "output_key": output_key,
+        "etag": head["ETag"].strip('"'),
+        "size": head["ContentLength"],
+        "fields_list": fields_list,
+        "obfuscate_method": obfuscate_method,
+        "salts": {field: draw_salt() for field in fields_list
+                  if get_field_method(obfuscate_method, field) ==
+                  "random_hash"},
+        "upload_id": upload_id,
+        "header": header.decode("utf8"),
+        "terminator": terminator.decode("utf8"),
+        "offset": len(header) + len(terminator),
+        "parts": [],
+        "rows": 0,
+    }
+
+
+def _upload_part(s3_client, state: dict, body: bytes):
+    part_number = len(state["parts"]) + 1
+    response = s3_client.upload_part(
+        Bucket=state["s3_bucket"], Key=state["output_key"],
+        UploadId=state["upload_id"], PartNumber=part_number, Body=body)
+    state["parts"].append({"PartNumber": part_number,
+                           "ETag": response["ETag"]})
+
+
+def _obfuscate_records(state: dict, records: bytes,
+                       token_vault: TokenVault = None,
+                       pseudonym_map: PseudonymMap = None) -> bytes:
+    header = (state["header"] + state["terminator"]).encode("utf8")
+    output = rewrite_csv_pii_fields(
+        header + records, state["fields_list"],
+        state["obfuscate_method"], salts=state["salts"],
+        token_vault=token_vault, pseudonym_map=pseudonym_map)
+    return output.getbuffer()[len(header):].tobytes()
+
+
+def run_checkpointed_obfuscation(
+    s3_bucket: str,
+    file_key: str,
+    output_key: str,
+    fields_list: list[str] | Callable[[list[str]], list[str]],
+    checkpoint_store: CheckpointStore,
+    obfuscate_method: str | dict[str, str] = "replace",
+    block_size: int = DOWNLOAD_BLOCK_SIZE,
+    part_size: int = UPLOAD_PART_SIZE,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
+) -> dict:
+    """
+    Obfuscate a CSV in S3 into a multipart upload, saving a checkpoint
+    after every uploaded part: the upload id, the ETags of the uploaded
+    parts, the input byte offset they cover and the 'random_hash' salts.
+    A job run again after a failure continues from its last checkpoint,
+    reading the input from that offset with a ranged GET, instead of
+    restarting from byte zero. A checkpoint for an input that has since
+    changed (different ETag), or for other fields or method, is dropped
+    and its upload aborted.
+
+    Fields are rewritten in place with the passthrough CSV rewriter, so
+    parts can be produced independently of each other. Records are
+    rewritten a block at a time and a part is cut once part_size bytes
+    of output are pending, since obfuscated rows can be much shorter
+    than their input.
+
+    Args:
+        s3_bucket (str): bucket of the input and the output
+        file_key (str): key of the csv input (not compressed)
+        output_key (str): key of the obfuscated csv
+        fields_list (list/Callable): fields to be obfuscated, or a function
+            choosing them from the column names of the header
+        checkpoint_store (CheckpointStore): where checkpoints are saved
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact']:
+            how to obfuscate the data, default to be 'replace', or a dict
+            of field to method
+        block_size (int): bytes read from the input and rewritten at
+                          a time, at most part_size
+        part_size (int): output bytes per uploaded part, at least 5 MB
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
+
+    Returns:
+        dict: 'rows', 'parts', 'resumed_from' (input offset the run
+              started at, 0 for a new job) and 'seconds'
+    """
+    file_extension, codec = split_compression_extension(file_key)
+    if file_extension != "csv" or codec is not None:
+        raise ValueError("Checkpointed processing only supports "
+                         f"uncompressed csv input, not {file_key}")
+    start = time.perf_counter()
+    s3_client = get_s3_client()
+    job_id = get_job_id(s3_bucket, file_key, output_key)
+    head = s3_client.head_object(Bucket=s3_bucket, Key=file_key)
+
+    state = checkpoint_store.load(job_id)
+    if state is not None and (
+            state["etag"] != head["ETag"].strip('"')
+            or state["obfuscate_method"] != obfuscate_method
+            or (not callable(fields_list)
+                and state["fields_list"] != fields_list)):
+        logger.info(f"Dropping stale checkpoint of job {job_id}")
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=s3_bucket, Key=output_key,
+                UploadId=state["upload_id"])
+        except Exception as e:
+            logger.warning(f"Could not abort upload: {str(e)}")
+        state = None
+    if state is None:
+        state = _new_state(s3_client, s3_bucket, file_key, output_key,
+                           head, fields_list, obfuscate_method)
+        checkpoint_store.save(job_id, state)
+        logger.info(f"Started checkpointed job {job_id}")
+    else:
+        logger.info(f"Resuming job {job_id} from byte {state['offset']} " +
+                    f"after {len(state['parts'])} parts")
+    resumed_from = state["offset"] if state["parts"] else 0
+
+    pending = io.BytesIO()
+    output = bytearray()
+    if not state["parts"]:
+        output += (state["header"] + state["terminator"]).encode("utf8")
+    consumed = 0
+
+    def rewrite_pending():
+        output.extend(_obfuscate_records(state, pending.getvalue(),
+                                         token_vault, pseudonym_map))
+        pending.seek(0)
+        pending.truncate()
+
+    def flush():
+        _upload_part(s3_client, state, bytes(output))
+        output.clear()
+        state["offset"] += consumed
+        checkpoint_store.save(job_id, state)
+        logger.info(f"Checkpoint: part {len(state['parts'])} uploaded, " +
+                    f"input offset {state['offset']}")
+
+    if state["offset"] < state["size"]:
+        body = s3_client.get_object(
+            Bucket=s3_bucket, Key=file_key,
+            Range=f"bytes={state['offset']}-")["Body"]
+        for record, terminator in _iter_records(body, block_size):
+            pending.write(record + terminator)
+            consumed += len(record) + len(terminator)
+            if record.strip():
+                state["rows"] += 1
+            if pending.tell() >= min(block_size, part_size):
+                rewrite_pending()
+                if len(output) >= part_size:
+                    flush()
+                    consumed = 0
+    rewrite_pending()
+    if consumed or not state["parts"]:
+        flush()
+
+    s3_client.complete_multipart_upload(
+        Bucket=s3_bucket, Key=output_key, UploadId=state["upload_id"],
+        MultipartUpload={"Parts": state["parts"]})
+    checkpoint_store.delete(job_id)
+    stats = {
+        "rows": state["rows"],
+        "parts": len(state["parts"]),
+        "resumed_from": resumed_from,
+        "seconds": time.perf_counter() - start,
+    }
+    logger.info(f"Checkpointed job {job_id} finished: {stats}")
+    return stats
@@ -0,0 +1,158 @@
+import pandas as pd
+import pyarrow as pa
+from typing import Iterator
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+PROBE_ROWS = 100
+SAMPLE_ROWS = 1000
+MIN_CHUNK_ROWS = 100
+MAX_CHUNK_ROWS = 1000000
+
+
+class ChunkSizer:
+    """
+    Number of rows per chunk. With a byte budget (target_bytes), the row
+    width is measured on every chunk read and the next chunk is sized to
+    fill the budget: narrow files get large chunks, files with huge text
+    columns get small ones. Without a budget the size stays chunk_size.
+
+    The first adaptive chunk is a small probe, so that a file with very
+    wide rows does not spike memory before its width is known.
+
+    Args:
+        chunk_size (int): rows per chunk, or the upper bound of the probe
+                          chunk when target_bytes is set
+        target_bytes (int): in-memory bytes per chunk, None for fixed rows
+        min_rows (int): smallest adaptive chunk
+        max_rows (int): largest adaptive chunk
+        smoothing (float): weight of the latest measured row width
+    """
+
+    def __init__(self, chunk_size: int = 5000, target_bytes: int = None,
+                 min_rows: int = MIN_CHUNK_ROWS,
+                 max_rows: int = MAX_CHUNK_ROWS, smoothing: float = 0.5):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if target_bytes is not None and target_bytes <= 0:
+            raise ValueError("target_bytes must be positive")
+        self.target_bytes = target_bytes
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.smoothing = smoothing
+        self.row_bytes = None
+        self.chunk_rows = []
+        self.chunk_bytes = []
+        if target_bytes is None:
+            self.rows = chunk_size
+        else:
+            self.rows = max(1, min(chunk_size, PROBE_ROWS))
+
+    @property
+    def adaptive(self) -> bool:
+        return self.target_bytes is not None
+
+    def observe(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Record a chunk that was read and, with a byte budget, resize
+        the next chunk from the measured row width
+
+        Args:
+            df (pd.DataFrame): chunk just read
+
+        Returns:
+            pd.DataFrame: the same chunk
+        """
+        rows = len(df)
+        self.chunk_rows.append(rows)
+        if not self.adaptive or rows == 0:
+            return df
+        sample = df.iloc[:SAMPLE_ROWS]
+        row_bytes = max(1.0, sample.memory_usage(
+            index=False, deep=True).sum() / len(sample))
+        if self.row_bytes is None:
+            self.row_bytes = row_bytes
+        else:
+            self.row_bytes = (self.smoothing * row_bytes
+                              + (1 - self.smoothing) * self.row_bytes)
+        self.chunk_bytes.append(int(row_bytes * rows))
+        next_rows = int(self.target_bytes // self.row_bytes)
+        self.rows = max(self.min_rows, min(self.max_rows, next_rows))
+        logger.debug(f"Measured {row_bytes:.0f} bytes/row, next chunk " +
+                     f"{self.rows} rows")
+        return df
+
+    def batch_rows(self, row_bytes: float) -> int:
+        """
+        Rows per batch of a reader that knows the row width before
+        reading (e.g. from a Parquet footer), so that batches are not
+        kept at the probe size; batches are regrouped with rebatch
+
+        Args:
+            row_bytes (float): estimated bytes per row
+
+        Returns:
+            int: rows per batch, at least the current chunk size
+        """
+        if not self.adaptive:
+            return self.rows
+        rows = int(self.target_bytes // max(1.0, row_bytes))
+        return max(self.rows, min(self.max_rows, rows))
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: 'chunks', 'rows', 'chunk_rows' (rows of every chunk),
+                  'chunk_bytes' (estimated memory of every chunk when
+                  adaptive), 'target_bytes', 'row_bytes' (smoothed
+                  measured width)
+        """
+        return {
+            "chunks": len(self.chunk_rows),
+            "rows": sum(self.chunk_rows),
+            "chunk_rows": list(self.chunk_rows),
+            "chunk_bytes": list(self.chunk_bytes),
+            "target_bytes": self.target_bytes,
+            "row_bytes": self.row_bytes,
+        }
+
+
+def as_chunk_sizer(chunk_size: "int | ChunkSizer",
+                   chunk_bytes: int = None) -> ChunkSizer:
+    """
+    Build a ChunkSizer from a row count and an optional byte budget,
+    a ChunkSizer is returned unchanged
+
+    Args:
+        chunk_size (int/ChunkSizer): rows per chunk
+        chunk_bytes (int): in-memory bytes per chunk, None for fixed rows
+
+    Returns:
+        ChunkSizer: the chunk sizer
+    """
+    if isinstance(chunk_size, ChunkSizer):
+        return chunk_size
+    return ChunkSizer(chunk_size, chunk_bytes)
+
+
+def rebatch(batches, sizer: ChunkSizer) -> Iterator[pa.Table]:
+    """
+    Regroup arrow record batches into tables of sizer.rows rows,
+    sizer.rows being read again before every table
+    """
+    pending = []
+    pending_rows = 0
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= sizer.rows:
+            rows = sizer.rows
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, rows)
+            remainder = table.slice(rows)
+            pending = remainder.to_batches()
+            pending_rows = remainder.num_rows
+    if pending_rows:
+        yield pa.Table.from_batches(pending)
@@ -0,0 +1,251 @@
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import BinaryIO
+from src.file_formats import FILE_TYPES, get_batch_file_writer
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+def to_arrow_table(chunk: pd.DataFrame,
+                   schema: pa.Schema = None) -> pa.Table:
+    """
+    Arrow table of a chunk written to a file with a single schema.
+    The first chunk (no schema) sets the schema of the file: its
+    columns holding only missing values, whose type is unknown, are
+    typed as strings. Later chunks are cast to the schema, so e.g. the
+    numbers of a column that was empty at first become strings.
+
+    Args:
+        chunk (pd.DataFrame): chunk to write
+        schema (pa.Schema): schema of the file, None for the first chunk
+
+    Returns:
+        pa.Table: the chunk with the schema of the file
+    """
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    if schema is None:
+        for index, field in enumerate(table.schema):
+            column = table.column(index)
+            if column.null_count == len(column) and (
+                    pa.types.is_null(field.type) or
+                    pa.types.is_floating(field.type)):
+                table = table.set_column(
+                    index, field.name,
+                    pa.nulls(len(column), pa.string()))
+        return table
+    table = table.replace_schema_metadata()
+    if table.schema.equals(schema, check_metadata=False):
+        return table
+    columns = []
+    for field in schema:
+        column = table.column(field.name)
+        if column.type != field.type:
+            try:
+                column = column.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                raise ValueError(
+                    f"Column {field.name} holds {column.type} values " +
+                    f"that do not fit its {field.type} type in the " +
+                    f"output, set its type with a csv schema ({e})") from e
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class ChunkWriter:
+    """
+    Append DataFrame chunks to a single output file, one chunk at a time,
+    so that only the current chunk is held as a DataFrame
+
+    Args:
+        output (BinaryIO): Byte system to write the output,
+                           a new io.BytesIO by default
+    """
+
+    def __init__(self, output: BinaryIO = None):
+        self.output = output if output is not None else io.BytesIO()
+        self.rows_written = 0
+
+    def write(self, chunk: pd.DataFrame):
+        self._write(chunk)
+        self.rows_written += len(chunk)
+
+    def _write(self, chunk: pd.DataFrame):
+        raise NotImplementedError
+
+    def close(self) -> BinaryIO:
+        """
+        Finish the output file and rewind it
+
+        Returns:
+            BinaryIO: the output byte system
+        """
+        logger.info(f"{type(self).__name__} wrote {self.rows_written} rows")
+        if self.output.seekable():
+            self.output.seek(0)
+        return self.output
+
+
+class CsvChunkWriter(ChunkWriter):
+    def __init__(self, output: BinaryIO = None):
+        super().__init__(output)
+        self.is_first_chunk = True
+
+    def _write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self.output, index=False, header=self.is_first_chunk)
+        self.is_first_chunk = False
+
+
+class JsonChunkWriter(ChunkWriter):
+    """
+    Streaming JSON writer producing newline-delimited records
+    """
+
+    def _write(self, chunk: pd.DataFrame):
+        chunk.to_json(self.output, orient="records", lines=True)
+
+
+class ParquetChunkWriter(ChunkWriter):
+    """
+    Parquet writer appending every chunk as its own row group, or as
+    row groups of row_group_size rows when given.
+    The schema of the first chunk is used for the whole file, see
+    to_arrow_table.
+
+    Args:
+        output (BinaryIO): Byte system to write the output
+        compression (str): Parquet compression codec, 'snappy' by default
+        compression_level (int): codec compression level, codec default
+                                 when None
+        use_dictionary (bool): If True, dictionary encode columns
+        row_group_size (int): rows per row group, chunks being buffered
+                              as Arrow tables until it is reached;
+                              one row group per chunk when None
+    """
+
+    def __init__(self, output: BinaryIO = None, compression: str = "snappy",
+                 compression_level: int = None, use_dictionary: bool = True,
+                 row_group_size: int = None):
+        super().__init__(output)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.use_dictionary = use_dictionary
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def _write(self, chunk: pd.DataFrame):
+        if self.writer is None:
+            table = to_arrow_table(chunk)
+            self.writer = pq.ParquetWriter(
+                self.output, table.schema,
+                compression=self.compression,
+                compression_level=self.compression_level,
+                use_dictionary=self.use_dictionary,
+            )
+        else:
+            table = to_arrow_table(chunk, self.writer.schema)
+        if self.row_group_size is None:
+            self.writer.write_table(table)
+            return
+        self.pending.append(table)
+        self.pending_rows += len(table)
+        while self.pending_rows >= self.row_group_size:
+            table = pa.concat_tables(self.pending)
+            self.writer.write_table(table.slice(0, self.row_group_size),
+                                    row_group_size=self.row_group_size)
+            rest = table.slice(self.row_group_size)
+            self.pending = [rest] if len(rest) else []
+            self.pending_rows = len(rest)
+
+    def close(self) -> BinaryIO:
+        if self.pending:
+            self.writer.write_table(pa.concat_tables(self.pending),
+                                    row_group_size=self.row_group_size)
+            self.pending = []
+        if self.writer is not None:
+            self.writer.close()
+        return super().close()
+
+
+class BatchFileChunkWriter(ChunkWriter):
+    """
+    ORC, Feather (Arrow IPC) or Avro writer appending every chunk as
+    Arrow record batches, see get_batch_file_writer.
+    The schema of the first chunk is used for the whole file.
+
+    Args:
+        output (BinaryIO): Byte system to write the output
+        compression (str): codec of the format, uncompressed when None
+    """
+
+    file_type = None
+
+    def __init__(self, output: BinaryIO = None, compression: str = None):
+        super().__init__(output)
+        self.compression = compression
+        self.writer = None
+
+    def _write(self, chunk: pd.DataFrame):
+        if self.writer is None:
+            table = to_arrow_table(chunk)
+            self.writer = get_batch_file_writer(
+                self.file_type, self.output, table.schema, self.compression)
+        else:
+            table = to_arrow_table(chunk, self.writer.schema)
+        self.writer.write(table)
+
+    def close(self) -> BinaryIO:
+        if self.writer is not None:
+            self.writer.close()
+        return super().close()
+
+
+class OrcChunkWriter(BatchFileChunkWriter):
+    file_type = "orc"
+
+
+class FeatherChunkWriter(BatchFileChunkWriter):
+    file_type = "feather"
+
+
+class AvroChunkWriter(BatchFileChunkWriter):
+    file_type = "avro"
+
+
+CHUNK_WRITERS = {
+    "csv": CsvChunkWriter,
+    "json": JsonChunkWriter,
+    "parquet": ParquetChunkWriter,
+    "orc": OrcChunkWriter,
+    "feather": FeatherChunkWriter,
+    "avro": AvroChunkWriter,
+}
+
+
+def get_chunk_writer(
+    output_format: str, output: BinaryIO = None, **options
+) -> ChunkWriter:
+    """
+    Build the chunk writer for an output format
+
+    Args:
+        output_format (str): csv/json/parquet/orc/feather/avro
+        output (BinaryIO): Byte system to write the output
+        **options: format specific options, e.g. compression for
+                   parquet, orc, feather and avro
+
+    Returns:
+        ChunkWriter: writer for the output format
+    """
+    if output_format not in CHUNK_WRITERS:
+        logger.error(f"Unsupported output format: {output_format}")
+        raise ValueError(
+            f"Sorry that {output_format} is not supported. "
+            + "This tool currently only support " + "/".join(FILE_TYPES)
+        )
+    return CHUNK_WRITERS[output_format](output, **options)
@@ -0,0 +1,296 @@
+import bz2
+import gzip
+import io
+import queue
+import threading
+from typing import BinaryIO, Iterable, Iterator
+from src.file_formats import FILE_TYPE_ALIASES
+from src.setup_logger import setup_logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = setup_logger(__name__)
+
+COMPRESSION_EXTENSIONS = {"gz": "gzip", "zst": "zstd", "bz2": "bz2"}
+CODEC_EXTENSIONS = {
+    codec: ext for ext, codec in COMPRESSION_EXTENSIONS.items()
+}
+BLOCK_SIZE = 1 << 20
+
+
+def _check_codec(codec: str):
+    if codec not in CODEC_EXTENSIONS:
+        logger.error(f"Unsupported compression codec: {codec}")
+        raise ValueError(
+            f"Unknown compression codec: {codec}. "
+            + "Only 'gzip', 'zstd' or 'bz2' are accepted."
+        )
+    if codec == "zstd" and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+
+
+def split_compression_extension(file_key: str) -> tuple[str, str | None]:
+    """
+    Find the file type and compression codec from a file key,
+    e.g. 'new_data/file.csv.gz' -> ('csv', 'gzip'). Arrow IPC files
+    (.arrow/.ipc) are of the 'feather' type.
+
+    Args:
+        file_key (str): name of the file, e.g filename.csv.gz
+
+    Returns:
+        tuple[str, str | None]: file extension and compression codec,
+                                None when the file is not compressed
+    """
+    parts = file_key.lower().split(".")
+    if len(parts) > 2 and parts[-1] in COMPRESSION_EXTENSIONS:
+        extension, codec = parts[-2], COMPRESSION_EXTENSIONS[parts[-1]]
+    else:
+        extension, codec = parts[-1], None
+    return FILE_TYPE_ALIASES.get(extension, extension), codec
+
+
+def set_compression_extension(file_key: str, codec: str | None) -> str:
+    """
+    Replace the compression extension of a file key
+
+    Args:
+        file_key (str): name of the file, e.g filename.csv.gz
+        codec (str): gzip/zstd/bz2, or None to remove the extension
+
+    Returns:
+        str: file key with the new compression extension
+    """
+    if split_compression_extension(file_key)[1] is not None:
+        file_key = file_key.rsplit(".", 1)[0]
+    if codec is None:
+        return file_key
+    _check_codec(codec)
+    return f"{file_key}.{CODEC_EXTENSIONS[codec]}"
+
+
+def open_decompressed(stream: BinaryIO, codec: str) -> BinaryIO:
+    """
+    Wrap a compressed byte stream so that it is decompressed
+    incrementally while being read
+
+    Args:
+        stream (BinaryIO): compressed byte stream, e.g. an S3 body
+        codec (str): gzip/zstd/bz2
+
+    Returns:
+        BinaryIO: readable stream of decompressed bytes
+    """
+    _check_codec(codec)
+    logger.debug(f"Decompressing {codec} stream")
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    elif codec == "bz2":
+        return bz2.BZ2File(stream, mode="rb")
+    return zstandard.ZstdDecompressor().stream_reader(stream)
+
+
+class ChunkIterReader(io.RawIOBase):
+    """
+    Readable stream over an iterable of byte chunks,
+    e.g. a generator yielding output parts
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not len(self._pending):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk).cast("B")
+        size = min(len(target), len(self._pending))
+        target[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class CompressedBuffer(io.RawIOBase):
+    """
+    Sink of a CompressingWriter holding the compressed bytes until
+    they are drained, written to by the compression thread when
+    compression is threaded
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        with self._lock:
+            self._parts.append(bytes(data))
+            self._size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def drain(self) -> bytes:
+        """
+        Returns:
+            bytes: the compressed bytes written since the last drain
+        """
+        with self._lock:
+            data = b"".join(self._parts)
+            self._parts = []
+        return data
+
+
+class CompressingWriter(io.RawIOBase):
+    """
+    Writable stream compressing everything written to it into a sink.
+    When threaded, compression runs on a worker thread fed through
+    a bounded queue, so the producer is not blocked by the compressor.
+
+    Args:
+        sink (BinaryIO): Byte system receiving the compressed bytes
+        codec (str): gzip/zstd/bz2
+        level (int): compression level, codec default when None
+        threaded (bool): If True, compress on a worker thread
+    """
+
+    def __init__(self, sink: BinaryIO, codec: str, level: int = None,
+                 threaded: bool = False):
+        _check_codec(codec)
+        self.sink = sink
+        self.codec = codec
+        self.bytes_in = 0
+        if codec == "gzip":
+            self._compressor = gzip.GzipFile(
+                fileobj=sink, mode="wb",
+                compresslevel=9 if level is None else level)
+        elif codec == "bz2":
+            self._compressor = bz2.BZ2File(
+                sink, mode="wb",
+                compresslevel=9 if level is None else level)
+        else:
+            self._compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level
+            ).stream_writer(sink, closefd=False)
+        self._queue = None
+        self._error = None
+        if threaded:
+            self._queue = queue.Queue(maxsize=8)
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self._compressor.write(data)
+            except Exception as e:
+                self._error = e
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._error is not None:
+            raise self._error
+        size = len(data)
+        self.bytes_in += size
+        if self._queue is not None:
+            self._queue.put(bytes(data))
+        else:
+            self._compressor.write(data)
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        if self._queue is not None:
+            self._queue.put(None)
+            self._worker.join()
+        self._compressor.close()
+        super().close()
+        if self._error is not None:
+            raise self._error
+
+
+def iter_compressed(
+    source: BinaryIO,
+    codec: str,
+    level: int = None,
+    threaded: bool = False,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Compress a byte stream block by block, yielding the compressed bytes
+    as they are produced
+
+    Args:
+        source (BinaryIO): uncompressed byte stream
+        codec (str): gzip/zstd/bz2
+        level (int): compression level, codec default when None
+        threaded (bool): If True, compress on a worker thread
+        block_size (int): number of bytes read at a time
+
+    Returns:
+        Iterator[bytes]: compressed chunks
+    """
+    sink = CompressedBuffer()
+    writer = CompressingWriter(sink, codec, level, threaded)
+    try:
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            writer.write(block)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+    logger.info(f"Compressed {writer.bytes_in} bytes to " +
+                f"{sink.tell()} bytes with {codec}")
+
+
+def compress_stream(
+    source: BinaryIO,
+    codec: str,
+    level: int = None,
+    threaded: bool = False,
+    block_size: int = BLOCK_SIZE,
+) -> BinaryIO:
+    """
+    Compress a byte stream while it is read: the returned stream
+    compresses the next blocks of the source as it is consumed, e.g.
+    by a streaming upload, so the compressed file is never held whole
+
+    Args:
+        source (BinaryIO): uncompressed byte stream
+        codec (str): gzip/zstd/bz2
+        level (int): compression level, codec default when None
+        threaded (bool): If True, compress on a worker thread
+        block_size (int): number of bytes read at a time
+
+    Returns:
+        BinaryIO: readable stream of the compressed bytes
+    """
+    _check_codec(codec)
+    return io.BufferedReader(ChunkIterReader(
+        iter_compressed(source, codec, level, threaded, block_size)))
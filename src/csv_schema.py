@@ -0,0 +1,335 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import io
+from typing import BinaryIO, Iterator, Literal
+from src.chunk_sizing import ChunkSizer, as_chunk_sizer, rebatch
+from src.arrow_strings import arrow_types_mapper, to_arrow_strings
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+# Pandas dtype names used in a CSV schema and their Arrow equivalents.
+# Nullable integer/boolean dtypes are used so that a value missing in a
+# later chunk does not change the dtype of the column.
+ARROW_TYPES = {
+    "str": pa.string(),
+    "string": pa.string(),
+    "object": pa.string(),
+    "Int64": pa.int64(),
+    "int64": pa.int64(),
+    "float64": pa.float64(),
+    "boolean": pa.bool_(),
+    "bool": pa.bool_(),
+}
+STRING_DTYPES = ["str", "string", "object"]
+
+
+class RewindableReader(io.RawIOBase):
+    """
+    Byte stream that can be rewound once to where it started, for a
+    stream that is not seekable (a pipelined download, a decompressed
+    input): the bytes read until the rewind are kept and replayed, so
+    that a schema can be sampled before the chunks are read
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._head = bytearray()
+        self._replay = memoryview(b"")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR and offset == 0:
+            return self._position
+        if whence != io.SEEK_SET or offset != 0 or self._head is None:
+            raise io.UnsupportedOperation(
+                "the stream can only be rewound once to its start")
+        self._replay = memoryview(bytes(self._head))
+        self._head = None
+        self._position = 0
+        return 0
+
+    def readinto(self, target) -> int:
+        if len(self._replay):
+            size = min(len(target), len(self._replay))
+            target[:size] = self._replay[:size]
+            self._replay = self._replay[size:]
+        else:
+            data = self._stream.read(len(target))
+            size = len(data)
+            target[:size] = data
+            if self._head is not None:
+                self._head += data
+        self._position += size
+        return size
+
+
+def infer_csv_schema(file_content: str | BinaryIO,
+                     sample_rows: int = 1000) -> dict[str, str]:
+    """
+    Infer a CSV schema once from a sample of the file
+
+    Args:
+        file_content (str/BinaryIO): raw CSV data as a string,
+            or a seekable byte stream which is rewound after sampling
+        sample_rows (int): number of rows to sample, 1000 by default
+
+    Returns:
+        dict[str, str]: column name to pandas dtype name,
+                        e.g. {"student_id": "Int64", "name": "str"}
+    """
+    logger.info(f"Inferring CSV schema from the first {sample_rows} rows")
+    if isinstance(file_content, str):
+        sample_df = pd.read_csv(io.StringIO(file_content), nrows=sample_rows)
+    else:
+        position = file_content.tell()
+        sample_df = pd.read_csv(file_content, nrows=sample_rows)
+        file_content.seek(position)
+    schema = {}
+    for column, dtype in sample_df.dtypes.items():
+        if sample_df[column].isna().all():
+            # Nothing to infer from an empty column, text always fits
+            schema[column] = "str"
+        elif pd.api.types.is_bool_dtype(dtype):
+            schema[column] = "boolean"
+        elif pd.api.types.is_integer_dtype(dtype):
+            schema[column] = "Int64"
+        elif pd.api.types.is_float_dtype(dtype):
+            schema[column] = "float64"
+        else:
+            schema[column] = "str"
+    logger.debug(f"Inferred CSV schema: {schema}")
+    return schema
+
+
+def read_csv_columns(file_content: str | BinaryIO) -> list[str]:
+    """
+    Read the column names from the header of a CSV
+
+    Args:
+        file_content (str/BinaryIO): raw CSV data as a string,
+            or a seekable byte stream which is rewound after reading
+
+    Returns:
+        list[str]: the column names
+    """
+    if isinstance(file_content, str):
+        return list(pd.read_csv(io.StringIO(file_content), nrows=0).columns)
+    position = file_content.tell()
+    columns = list(pd.read_csv(file_content, nrows=0).columns)
+    file_content.seek(position)
+    return columns
+
+
+def build_csv_dtype(
+    schema: dict[str, str],
+    fields_list: list[str],
+    raw_non_pii: bool = False,
+) -> dict[str, str]:
+    """
+    Build the dtype mapping used to read every chunk of a CSV
+
+    Args:
+        schema (dict): column name to pandas dtype name
+        fields_list (list): fields to be obfuscated
+        raw_non_pii (bool): If True, non-PII columns are read as raw
+                            strings with no type conversion at all
+
+    Returns:
+        dict[str, str]: column name to pandas dtype name
+    """
+    if not raw_non_pii:
+        return dict(schema)
+    return {
+        column: (dtype if column in fields_list else "str")
+        for column, dtype in schema.items()
+    }
+
+
+def _as_strings(series: pd.Series) -> pd.Series:
+    return series.astype(object).where(series.isna(), series.astype(str))
+
+
+def _misfit_error(column: str, column_dtype: str, error) -> ValueError:
+    logger.error(f"Column {column} does not fit {column_dtype} " +
+                 "after the first chunk")
+    return ValueError(
+        f"Column {column} holds a value that does not fit its " +
+        f"{column_dtype} type after the first chunk ({error}); " +
+        "set its type to 'str' with a csv schema")
+
+
+def cast_csv_chunk(chunk_df: pd.DataFrame, dtype: dict[str, str],
+                   allow_fallback: bool = True) -> pd.DataFrame:
+    """
+    Cast the columns of a chunk to their schema dtypes. In the first
+    chunk, a column with a value that does not fit its dtype (e.g. text
+    in a column sampled as Int64) falls back to str for the whole file.
+    Every chunk of a file has the same column types, so that the output
+    writers see one schema: a value that does not fit in a later chunk
+    raises instead.
+
+    Args:
+        chunk_df (pd.DataFrame): chunk read with its dtypes inferred
+        dtype (dict): column name to pandas dtype name, updated when
+                      a column falls back to str
+        allow_fallback (bool): If True (first chunk), a column that
+            does not fit falls back to str, else ValueError is raised
+
+    Returns:
+        pd.DataFrame: the chunk with the schema dtypes
+    """
+    for column, column_dtype in dtype.items():
+        if column not in chunk_df.columns:
+            continue
+        if column_dtype in STRING_DTYPES:
+            chunk_df[column] = _as_strings(chunk_df[column])
+            continue
+        try:
+            chunk_df[column] = chunk_df[column].astype(column_dtype)
+        except (ValueError, TypeError) as e:
+            if not allow_fallback:
+                raise _misfit_error(column, column_dtype, e) from e
+            logger.warning(f"Column {column} does not fit {column_dtype} " +
+                           f"({e}), reading it as str")
+            dtype[column] = "str"
+            chunk_df[column] = _as_strings(chunk_df[column])
+    return chunk_df
+
+
+def read_csv_chunks(
+    file_content: str | BinaryIO,
+    chunk_size: int | ChunkSizer,
+    dtype: dict[str, str] = None,
+    usecols: list[str] = None,
+    engine: Literal["c", "pyarrow"] = "c",
+    arrow_strings: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV in chunks with a fixed dtype/usecols mapping,
+    so that every chunk has the same column types. Typed columns are
+    parsed per chunk and cast to their dtype, see cast_csv_chunk: a
+    value the schema sample did not cover makes its column str when it
+    is in the first chunk, and raises ValueError after it, so that all
+    chunks have the same column types.
+
+    Args:
+        file_content (str/BinaryIO): raw CSV data as a string
+                                     or a byte stream
+        chunk_size (int/ChunkSizer): number of rows per chunk, or a
+            ChunkSizer adjusting the rows of each chunk to a byte budget
+        dtype (dict): column name to pandas dtype name, None to infer
+        usecols (list): columns to read, None to read every column
+        engine (str) ['c'/'pyarrow']: CSV parser to use, default to be 'c'
+            - 'c': pandas' C parser
+            - 'pyarrow': pyarrow's streaming CSV reader
+        arrow_strings (bool): If True, string columns are read as
+            Arrow-backed ARROW_STRING columns; the pyarrow engine then
+            never builds Python string objects
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks of chunk_size rows
+    """
+    sizer = as_chunk_sizer(chunk_size)
+    logger.info(f"Reading CSV with engine {engine} " +
+                f"and chunk size {sizer.rows}")
+    if dtype is not None:
+        dtype = dict(dtype)
+    if engine == "c":
+        if isinstance(file_content, str):
+            file_content = io.StringIO(file_content)
+        read_dtype = None
+        if dtype is not None:
+            # Strings are read as such, other dtypes are cast per chunk
+            read_dtype = {column: t for column, t in dtype.items()
+                          if t in STRING_DTYPES}
+            dtype = {column: t for column, t in dtype.items()
+                     if t not in STRING_DTYPES}
+        with pd.read_csv(
+            file_content,
+            chunksize=sizer.rows,
+            dtype=read_dtype,
+            usecols=usecols,
+        ) as reader:
+            is_first_chunk = True
+            while True:
+                try:
+                    chunk_df = reader.get_chunk(sizer.rows)
+                except StopIteration:
+                    return
+                if dtype:
+                    chunk_df = cast_csv_chunk(chunk_df, dtype,
+                                              is_first_chunk)
+                is_first_chunk = False
+                if arrow_strings:
+                    chunk_df = to_arrow_strings(chunk_df)
+                yield sizer.observe(chunk_df)
+    elif engine == "pyarrow":
+        column_types = None
+        if dtype is not None:
+            unknown = [t for t in dtype.values() if t not in ARROW_TYPES]
+            if unknown:
+                raise ValueError(f"Unsupported dtype in schema: {unknown}")
+            # Read as text and cast per batch, see _cast_csv_table
+            column_types = {column: pa.string() for column in dtype}
+        if isinstance(file_content, str):
+            file_content = io.BytesIO(file_content.encode("utf8"))
+        reader = pa_csv.open_csv(
+            file_content,
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types,
+                include_columns=usecols,
+                strings_can_be_null=True,
+            ),
+        )
+        types_mapper = arrow_types_mapper if arrow_strings else None
+        is_first_chunk = True
+        for table in rebatch(reader, sizer):
+            if dtype is not None:
+                table = _cast_csv_table(table, dtype, is_first_chunk)
+            is_first_chunk = False
+            chunk_df = table.to_pandas(types_mapper=types_mapper)
+            if dtype is not None:
+                # Text columns are already strings, with nulls kept
+                chunk_df = chunk_df.astype(
+                    {c: t for c, t in dtype.items() if c in chunk_df.columns
+                     and t not in STRING_DTYPES}
+                )
+            yield sizer.observe(chunk_df)
+    else:
+        logger.error(f"Unsupported CSV engine: {engine}")
+        raise ValueError(
+            f"Unknown CSV engine: {engine}. "
+            + "Only 'c' or 'pyarrow' are accepted."
+        )
+
+
+def _cast_csv_table(table: pa.Table, dtype: dict[str, str],
+                    allow_fallback: bool = True) -> pa.Table:
+    # As cast_csv_chunk, on Arrow columns read as text
+    for column, column_dtype in dtype.items():
+        index = table.schema.get_field_index(column)
+        if index < 0 or column_dtype in STRING_DTYPES:
+            continue
+        try:
+            table = table.set_column(
+                index, column,
+                table.column(index).cast(ARROW_TYPES[column_dtype]))
+        except pa.ArrowInvalid as e:
+            if not allow_fallback:
+                raise _misfit_error(column, column_dtype, e) from e
+            logger.warning(f"Column {column} does not fit {column_dtype} " +
+                           f"({e}), reading it as str")
+            dtype[column] = "str"
+    return table
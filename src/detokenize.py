@@ -0,0 +1,153 @@
+import argparse
+import io
+from typing import Iterator
+from src.chunk_writers import get_chunk_writer
+from src.file_formats import FOOTER_FILE_TYPES
+from src.obfuscator import iter_df_chunks, iter_json_chunks
+from src.storage import StorageBackend, get_storage_backend
+from src.tokenization import (
+    TokenVault,
+    get_token_vault,
+    open_token_vault,
+    tokenize_series,
+)
+from src.utils import json_input_handler
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+def iter_detokenized_parts(
+    source: io.IOBase,
+    file_type: str,
+    fields_list: list[str],
+    vault: TokenVault,
+    chunk_size: int = 5000,
+) -> Iterator[bytes]:
+    """
+    Stream a tokenized file back with the values of its tokens, one
+    chunk (and one bulk vault lookup per field) at a time. Values
+    that are not known tokens are kept.
+
+    Args:
+        source (BinaryIO): tokenized csv/json/parquet/orc/feather/avro
+                           content, JSON being JSON Lines
+        file_type (str): csv/json/parquet/orc/feather/avro
+        fields_list (list): tokenized fields
+        vault (TokenVault): vault holding the tokens
+        chunk_size (int): number of rows per chunk
+
+    Returns:
+        Iterator[bytes]: parts of the detokenized file
+    """
+    buffer = io.BytesIO()
+    writer = get_chunk_writer(file_type, buffer)
+    # Obfuscated JSON is written as JSON Lines, not as a JSON array
+    chunks = iter_json_chunks(source, chunk_size, json_lines=True) \
+        if file_type == "json" \
+        else iter_df_chunks(source, file_type, chunk_size)
+    for chunk in chunks:
+        for field in fields_list:
+            if field not in chunk.columns:
+                raise KeyError(f"Field '{field}' not found in the data.")
+            chunk[field] = tokenize_series(chunk[field], vault,
+                                           reverse=True)
+        writer.write(chunk)
+        # Parquet, orc and feather are only complete once their footer
+        # is written
+        if file_type not in FOOTER_FILE_TYPES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    writer.close()
+    if buffer.getbuffer().nbytes:
+        yield buffer.getvalue()
+
+
+def detokenize_file(
+    json_string: str,
+    output_key: str,
+    vault: TokenVault | str = None,
+    storage_backend: StorageBackend | str = "s3",
+    chunk_size: int = 5000,
+) -> str:
+    """
+    Re-identify a file obfuscated with the 'tokenize' method, writing
+    it with the original values of its tokenized fields
+
+    Args:
+        json_string (str): A json string with "file_to_obfuscate", here
+            the tokenized file, and "pii_fields", the tokenized fields
+        output_key (str): key of the detokenized file, in the same bucket
+        vault (TokenVault/str): vault, or path of a SQLite vault opened
+            with the key in OBFUSCATOR_VAULT_KEY; the vault at
+            OBFUSCATOR_VAULT_PATH by default
+        storage_backend (StorageBackend/str): 's3' or 'local'
+        chunk_size (int): number of rows per chunk
+
+    Returns:
+        str: message confirming where the file was written
+    """
+    s3_bucket, file_key, fields_list = json_input_handler(json_string)
+    if isinstance(storage_backend, str):
+        storage_backend = get_storage_backend(storage_backend)
+    if isinstance(vault, str):
+        vault = open_token_vault(vault)
+    vault = vault if vault is not None else get_token_vault()
+    source, file_type = storage_backend.open_stream(s3_bucket, file_key)
+    logger.info(f"Detokenizing {fields_list} of {s3_bucket}/{file_key}")
+    storage_backend.write_file(
+        s3_bucket, output_key,
+        iter_detokenized_parts(source, file_type, fields_list, vault,
+                               chunk_size))
+    return (f"Detokenized file saved to {storage_backend.name}://" +
+            f"{s3_bucket}/{output_key}")
+
+
+def main():
+    parser = argparse.ArgumentParser("Detokenization Tool")
+    parser.add_argument(
+            'json_string',
+            type=str,
+            help='A JSON string specifying the tokenized file as ' +
+                 '"file_to_obfuscate" and its tokenized fields as ' +
+                 '"pii_fields".'
+        )
+    parser.add_argument(
+            'output_key',
+            type=str,
+            help='Key of the detokenized file, in the same bucket.'
+        )
+    parser.add_argument(
+            '--token_vault',
+            type=str,
+            default=None,
+            help='SQLite token vault, its key is read from ' +
+                 'OBFUSCATOR_VAULT_KEY.'
+        )
+    parser.add_argument(
+            '--storage_backend',
+            type=str,
+            choices=["s3", "local"],
+            default="s3",
+            help='Read and write files from s3 or the local filesystem.'
+        )
+    parser.add_argument(
+            '--chunk_size',
+            type=int,
+            default=5000,
+            help='Number of rows to process at a time. Default is 5000.'
+        )
+    try:
+        args = parser.parse_args()
+        print(detokenize_file(args.json_string, args.output_key,
+                              args.token_vault, args.storage_backend,
+                              args.chunk_size))
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        print(f"Error occurred: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Iterator
+import ijson
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from src.arrow_strings import map_valid
+from src.chunk_sizing import as_chunk_sizer, rebatch
+from src.csv_schema import ARROW_TYPES, infer_csv_schema
+from src.json_paths import is_json_path
+from src.obfuscation_methods import (
+    ARRAY_METHODS,
+    draw_salt,
+    get_field_method,
+    make_array_obfuscator,
+    validate_method,
+)
+from src.pseudonym_map import PseudonymMap, get_pseudonym_map
+from src.redaction import Redactor
+from src.tokenization import TokenVault, get_token_vault
+from src.setup_logger import setup_logger
+try:
+    import duckdb
+    from duckdb.typing import VARCHAR
+except ImportError:
+    duckdb = None
+
+
+logger = setup_logger(__name__)
+
+# 'pandas' is the chunked DataFrame path of obfuscate_file itself
+ENGINE_NAMES = ["pandas", "arrow", "duckdb"]
+FILE_FORMATS = ["csv", "json", "parquet"]
+# DuckDB types of the pandas dtype names of infer_csv_schema
+DUCKDB_TYPES = {
+    "str": "VARCHAR",
+    "Int64": "BIGINT",
+    "float64": "DOUBLE",
+    "boolean": "BOOLEAN",
+}
+
+
+def make_column_obfuscator(
+        method: str, token_vault: TokenVault = None,
+        pseudonym_map: PseudonymMap = None
+) -> Callable[[pa.Array], pa.Array]:
+    """
+    Build a function obfuscating a whole Arrow column with one method,
+    once per file: 'random_hash' draws a single salt for the file.
+    The values are the same as those of obfuscate_fields_in_df for
+    Arrow string columns, and nulls are kept, except by 'replace'.
+
+    Args:
+        method (str)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the column, see make_value_obfuscator
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
+
+    Returns:
+        Callable[[pa.Array], pa.Array]: function obfuscating a column
+    """
+    if method in ARRAY_METHODS:
+        obfuscate_array = make_array_obfuscator(method)
+    elif method == "redact":
+        redactor = Redactor()
+
+        def obfuscate_array(array):
+            # Cells other than text are left unchanged
+            if not pa.types.is_string(array.type):
+                return array
+            return redactor.redact_array(array)
+    elif method == "tokenize":
+        vault = get_token_vault() if token_vault is None else token_vault
+
+        def obfuscate_array(array):
+            return map_valid(array.cast(pa.string()), vault.tokenize)
+    elif method == "pseudonymize":
+        if pseudonym_map is None:
+            pseudonym_map = get_pseudonym_map()
+
+        def obfuscate_array(array):
+            return map_valid(array.cast(pa.string()),
+                             pseudonym_map.pseudonymize)
+    else:
+        validate_method(method)
+
+    def obfuscate_column(array: pa.Array | pa.ChunkedArray) -> pa.Array:
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        if pa.types.is_large_string(array.type):
+            array = array.cast(pa.string())
+        return obfuscate_array(array)
+    return obfuscate_column
+
+
+def obfuscate_fields_in_table(
+    table: pa.Table, fields_list: list[str],
+    obfuscators: dict[str, Callable[[pa.Array], pa.Array]],
+) -> pa.Table:
+    """
+    Obfuscate the specified fields of an Arrow table. As in
+    obfuscate_fields_in_df, a field that cannot be obfuscated with its
+    method (e.g. masking numbers) is replaced with '***'.
+
+    Args:
+        table (pa.Table): chunk of the file
+        fields_list (list): fields to be obfuscated
+        obfuscators (dict): field to column function,
+            see make_column_obfuscator
+
+    Returns:
+        pa.Table: table with the fields obfuscated
+    """
+    for field in fields_list:
+        index = table.schema.get_field_index(field)
+        if index == -1:
+            logger.warning(f"Field '{field}' not found in the table.")
+            raise KeyError(f"Field '{field}' not found in the data.")
+        try:
+            column = obfuscators[field](table.column(index))
+        except Exception as e:
+            logger.error(
+                "Unexpected error occurred while processing field: " +
+                f"{field} - {str(e)}"
+            )
+            column = make_array_obfuscator("replace")(table.column(index))
+        table = table.set_column(index, field, column)
+    return table
+
+
+class ObfuscationEngine:
+    """
+    Engine obfuscating a whole file, from its content to the output
+    file. Engines give the same output values for the same input; they
+    differ in how the data are read, held and written.
+    """
+
+    name = None
+
+    def obfuscate_file(
+        self,
+        file_content: str | BinaryIO,
+        fields_list: list[str],
+        file_type: str = "csv",
+        output_format: str = None,
+        obfuscate_method: str | dict[str, str] = "replace",
+        chunk_size: int = 5000,
+        parquet_compression: str = "snappy",
+        parquet_compression_level: int = None,
+        parquet_use_dictionary: bool = True,
+        token_vault: TokenVault = None,
+        pseudonym_map: PseudonymMap = None,
+    ) -> io.BytesIO:
+        """
+        Obfuscate the specified fields of a file
+
+        Args:
+            file_content (str/BinaryIO): raw data as a string,
+                or a binary stream (e.g. a memory-mapped file)
+            fields_list (list): fields to be obfuscated
+            file_type (str): csv/json/parquet
+            output_format (str): csv/json/parquet, file_type by default
+            obfuscate_method (str/dict): a method, or a dict of field to
+                method, see obfuscate_fields_in_df
+            chunk_size (int): rows read at a time, where the engine
+                reads chunks
+            parquet_compression (str): Parquet compression codec
+            parquet_compression_level (int): Parquet codec level,
+                codec default when None
+            parquet_use_dictionary (bool): If True, dictionary encode
+                parquet columns
+            token_vault (TokenVault): vault of 'tokenize',
+                get_token_vault() when None
+            pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                get_pseudonym_map() when None
+
+        Returns:
+            io.BytesIO: Obfuscated file in output_format
+        """
+        file_type = file_type.lower()
+        output_format = output_format or file_type
+        for file_format in [file_type, output_format]:
+            if file_format not in FILE_FORMATS:
+                logger.error(f"Unsupported file type: {file_format}")
+                raise ValueError(
+                    f"Sorry that {file_format} is not supported. "
+                    + "This tool currently only support csv/json/parquet"
+                )
+        validate_method(obfuscate_method)
+        json_paths = [field for field in fields_list if is_json_path(field)]
+        if json_paths:
+            raise ValueError(f"JSON paths {json_paths} are only " +
+                             "supported by the pandas engine")
+        logger.info(f"Obfuscating {file_type} file to {output_format} " +
+                    f"with the {self.name} engine")
+        return self._obfuscate_file(
+            file_content, fields_list, file_type, output_format,
+            obfuscate_method, chunk_size, {
+                "compression": parquet_compression,
+                "compression_level": parquet_compression_level,
+                "use_dictionary": parquet_use_dictionary,
+            }, token_vault, pseudonym_map)
+
+    def _obfuscate_file(self, file_content, fields_list, file_type,
+                        output_format, obfuscate_method, chunk_size,
+                        parquet_options, token_vault=None,
+                        pseudonym_map=None) -> io.BytesIO:
+        raise NotImplementedError
+
+
+class ArrowEngine(ObfuscationEngine):
+    """
+    Engine holding chunks as Arrow tables from read to write: the file
+    is read with pyarrow's streaming readers, obfuscated with
+    pyarrow.compute kernels and written with pyarrow's writers, without
+    pandas or a Python object per cell.
+    """
+
+    name = "arrow"
+
+    def _obfuscate_file(self, file_content, fields_list, file_type,
+                        output_format, obfuscate_method, chunk_size,
+                        parquet_options, token_vault=None,
+                        pseudonym_map=None) -> io.BytesIO:
+        obfuscators = {
+            field: make_column_obfuscator(
+                get_field_method(obfuscate_method, field), token_vault,
+                pseudonym_map)
+            for field in fields_list
+        }
+        output = io.BytesIO()
+        writer = None
+        for table in iter_arrow_tables(file_content, file_type, chunk_size):
+            table = obfuscate_fields_in_table(table, fields_list,
+                                              obfuscators)
+            if writer is None:
+                writer = ArrowTableWriter(output_format, output,
+                                          table.schema, parquet_options)
+            writer.write(table)
+        if writer is not None:
+            writer.close()
+        output.seek(0)
+        return output
+
+
+def iter_arrow_tables(file_content: str | BinaryIO, file_type: str,
+                      chunk_size: int) -> Iterator[pa.Table]:
+    """
+    Read a file as Arrow tables of chunk_size rows, every table having
+    the schema of the first one
+
+    Args:
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        file_type (str): csv/json/parquet
+        chunk_size (int): rows per table
+
+    Returns:
+        Iterator[pa.Table]: tables of the file
+    """
+    sizer = as_chunk_sizer(chunk_size)
+    if isinstance(file_content, str):
+        file_content = io.BytesIO(file_content.encode("utf8"))
+    if file_type == "csv":
+        # The types pandas would infer, fixed for every block
+        schema = infer_csv_schema(file_content)
+        batches = pa_csv.open_csv(
+            file_content,
+            convert_options=pa_csv.ConvertOptions(column_types={
+                column: ARROW_TYPES[dtype]
+                for column, dtype in schema.items()}))
+    elif file_type == "json":
+        batches = _iter_json_batches(file_content, sizer.rows)
+    else:
+        batches = pq.ParquetFile(file_content).iter_batches(
+            batch_size=sizer.rows)
+    yield from rebatch(batches, sizer)
+
+
+def _iter_json_batches(file_content: BinaryIO,
+                       rows: int) -> Iterator[pa.RecordBatch]:
+    schema = None
+    records = []
+    for record in ijson.items(file_content, "item", use_float=True):
+        records.append(record)
+        if len(records) >= rows:
+            batch = pa.RecordBatch.from_pylist(records, schema=schema)
+            schema = batch.schema
+            records = []
+            yield batch
+    if records:
+        yield pa.RecordBatch.from_pylist(records, schema=schema)
+
+
+class ArrowTableWriter:
+    """
+    Append Arrow tables to a csv, newline-delimited json or parquet
+    output. The schema of the first table is used for the whole file.
+
+    Args:
+        output_format (str): csv/json/parquet
+        output (BinaryIO): Byte system to write the output
+        schema (pa.Schema): schema of the tables
+        parquet_options (dict): compression, compression_level and
+                                use_dictionary of the parquet writer
+    """
+
+    def __init__(self, output_format: str, output: BinaryIO,
+                 schema: pa.Schema, parquet_options: dict = None):
+        self.output_format = output_format
+        self.output = output
+        self.schema = schema
+        self.writer = None
+        if output_format == "csv":
+            self.writer = pa_csv.CSVWriter(
+                output, schema,
+                write_options=pa_csv.WriteOptions(quoting_style="needed"))
+        elif output_format == "parquet":
+            self.writer = pq.ParquetWriter(output, schema,
+                                           **(parquet_options or {}))
+
+    def write(self, table: pa.Table):
+        table = table.cast(self.schema)
+        if self.output_format == "json":
+            for record in table.to_pylist():
+                self.output.write(json.dumps(record, default=str).encode())
+                self.output.write(b"\n")
+        else:
+            self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class DuckDBEngine(ObfuscationEngine):
+    """
+    Engine running the whole job as one in-process DuckDB query: a
+    parallel, streaming scan of the input, SQL expressions for 'replace',
+    'mask' and 'hash', vectorized Arrow functions for the other methods,
+    and a streaming COPY to the output file. The input is spooled to a
+    temporary file for the scan.
+    """
+
+    name = "duckdb"
+
+    def __init__(self):
+        if duckdb is None:
+            raise ImportError("The duckdb engine requires the duckdb "
+                              "package")
+
+    def _obfuscate_file(self, file_content, fields_list, file_type,
+                        output_format, obfuscate_method, chunk_size,
+                        parquet_options, token_vault=None,
+                        pseudonym_map=None) -> io.BytesIO:
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, f"input.{file_type}")
+            output_path = os.path.join(directory, f"output.{output_format}")
+            with open(input_path, "wb") as input_file:
+                if isinstance(file_content, str):
+                    input_file.write(file_content.encode("utf8"))
+                else:
+                    shutil.copyfileobj(file_content, input_file)
+            connection = duckdb.connect()
+            try:
+                scan = self._scan(input_path, file_type)
+                columns = connection.execute(
+                    f"DESCRIBE SELECT * FROM {scan}").fetchall()
+                names = [column[0] for column in columns]
+                missing = [f for f in fields_list if f not in names]
+                if missing:
+                    logger.warning(f"Fields {missing} not found in the data.")
+                    raise KeyError(f"Field '{missing[0]}' not found in " +
+                                   "the data.")
+                select = ", ".join(
+                    self._expression(connection, index, name, column_type,
+                                     get_field_method(obfuscate_method,
+                                                      name),
+                                     token_vault, pseudonym_map)
+                    if name in fields_list else _quote_name(name)
+                    for index, (name, column_type, *_) in enumerate(columns))
+                connection.execute(
+                    f"COPY (SELECT {select} FROM {scan}) TO " +
+                    f"{_quote_literal(output_path)} " +
+                    self._copy_options(output_format, parquet_options))
+            finally:
+                connection.close()
+            with open(output_path, "rb") as output_file:
+                return io.BytesIO(output_file.read())
+
+    @staticmethod
+    def _scan(path: str, file_type: str) -> str:
+        if file_type == "csv":
+            # The types pandas would infer, as for the other engines
+            with open(path, "rb") as csv_file:
+                schema = infer_csv_schema(csv_file)
+            types = ", ".join(
+                f"{_quote_literal(column)}: " +
+                _quote_literal(DUCKDB_TYPES[dtype])
+                for column, dtype in schema.items())
+            return f"read_csv({_quote_literal(path)}, header = true, " + \
+                f"types = {{{types}}})"
+        elif file_type == "json":
+            return f"read_json_auto({_quote_literal(path)})"
+        return f"read_parquet({_quote_literal(path)})"
+
+    @staticmethod
+    def _expression(connection, index: int, name: str, column_type: str,
+                    method: str, token_vault: TokenVault = None,
+                    pseudonym_map: PseudonymMap = None) -> str:
+        column = _quote_name(name)
+        is_text = column_type == "VARCHAR"
+        if method == "replace" or \
+                (method in ARRAY_METHODS and not is_text):
+            # As with the other engines, values that cannot be masked
+            # or hashed are replaced
+            expression = "'***'"
+        elif method == "mask":
+            expression = (
+                f"CASE WHEN length({column}) > 2 THEN left({column}, 1) " +
+                f"|| repeat('*', length({column}) - 2) || " +
+                f"right({column}, 1) ELSE repeat('*', length({column})) END")
+        elif method == "hash":
+            expression = f"sha256({column})"
+        elif method == "random_hash":
+            expression = f"sha256({column} || " + \
+                f"{_quote_literal(draw_salt())})"
+        elif method == "redact" and not is_text:
+            expression = column
+        else:
+            # redact/tokenize/pseudonymize run in Python on whole
+            # Arrow vectors of the scan
+            function = f"obfuscate_{index}"
+            connection.create_function(
+                function,
+                make_column_obfuscator(method, token_vault, pseudonym_map),
+                [VARCHAR],
+                VARCHAR, type="arrow", side_effects=True)
+            expression = f"{function}(CAST({column} AS VARCHAR))"
+        return f"{expression} AS {column}"
+
+    @staticmethod
+    def _copy_options(output_format: str, parquet_options: dict) -> str:
+        if output_format == "csv":
+            return "(FORMAT CSV, HEADER)"
+        elif output_format == "json":
+            return "(FORMAT JSON)"
+        options = ["FORMAT PARQUET, COMPRESSION " +
+                   _quote_literal(parquet_options["compression"])]
+        if parquet_options["compression_level"] is not None:
+            options.append("COMPRESSION_LEVEL " +
+                           str(int(parquet_options["compression_level"])))
+        return f"({', '.join(options)})"
+
+
+def _quote_name(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+ENGINES = {
+    "arrow": ArrowEngine,
+    "duckdb": DuckDBEngine,
+}
+
+
+def get_engine(name: str) -> ObfuscationEngine:
+    """
+    Build an obfuscation engine
+
+    Args:
+        name (str) ['arrow'/'duckdb']: engine name. The 'pandas' engine
+            is the DataFrame path of obfuscate_file.
+
+    Returns:
+        ObfuscationEngine: the engine
+    """
+    if name not in ENGINES:
+        logger.error(f"Unsupported engine: {name}")
+        raise ValueError(
+            f"Unknown engine: {name}. " +
+            "Only 'pandas', 'arrow' or 'duckdb' are accepted."
+        )
+    return ENGINES[name]()
@@ -0,0 +1,272 @@
+import io
+from typing import BinaryIO, Iterator
+import pyarrow as pa
+from src.chunk_sizing import ChunkSizer, as_chunk_sizer
+from src.setup_logger import setup_logger
+try:
+    import pyarrow.orc as pa_orc
+except ImportError:
+    pa_orc = None
+try:
+    import fastavro
+except ImportError:
+    fastavro = None
+
+
+logger = setup_logger(__name__)
+
+# File types read and written, as found from the file extension by
+# split_compression_extension
+FILE_TYPES = ["csv", "json", "parquet", "orc", "feather", "avro"]
+# Text formats, which can be compressed (.gz/.zst/.bz2)
+TEXT_FILE_TYPES = ["csv", "json"]
+# Binary formats read as record batches and written from Arrow tables
+# by this module
+BATCH_FILE_TYPES = ["orc", "feather", "avro"]
+# Formats whose metadata is in a footer: they are read with random
+# access instead of streamed, and only complete once closed
+FOOTER_FILE_TYPES = ["parquet", "orc", "feather"]
+# Other extensions of a file type, e.g. Arrow IPC files
+FILE_TYPE_ALIASES = {"arrow": "feather", "ipc": "feather"}
+
+# Avro types of Arrow types, other types are written as strings
+AVRO_TYPES = {
+    pa.bool_(): "boolean",
+    pa.int8(): "int",
+    pa.int16(): "int",
+    pa.int32(): "int",
+    pa.int64(): "long",
+    pa.float32(): "float",
+    pa.float64(): "double",
+    pa.string(): "string",
+    pa.large_string(): "string",
+    pa.binary(): "bytes",
+}
+
+
+def as_arrow_file(file_content: BinaryIO | bytes) -> pa.NativeFile:
+    """
+    Readable Arrow file over file content. Buffers (pyarrow buffers,
+    memory-mapped files, io.BytesIO) are wrapped without copying them,
+    so Arrow IPC batches read from them reference their memory.
+
+    Args:
+        file_content (BinaryIO/bytes): binary stream or bytes-like object
+
+    Returns:
+        pa.NativeFile: Arrow file positioned at the start of the content
+    """
+    if isinstance(file_content, pa.NativeFile):
+        file_content.seek(0)
+        return file_content
+    if isinstance(file_content, (bytes, bytearray, memoryview, pa.Buffer)):
+        return pa.BufferReader(file_content)
+    if isinstance(file_content, io.BytesIO):
+        return pa.BufferReader(file_content.getbuffer())
+    return pa.PythonFile(file_content, mode="r")
+
+
+def iter_record_batches(
+    file_content: BinaryIO | bytes, file_type: str,
+    batch_rows: int | ChunkSizer,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read an ORC, Feather (Arrow IPC) or Avro file as record batches
+
+    Args:
+        file_content (BinaryIO/bytes): the file as a binary stream,
+            e.g. a memory-mapped file, or a bytes-like object
+        file_type (str): orc/feather/avro
+        batch_rows (int/ChunkSizer): rows per batch for Avro, read
+            again before every batch from a ChunkSizer so that batches
+            follow the adapted chunk size; ORC is read one stripe and
+            Arrow IPC one stored batch at a time
+
+    Returns:
+        Iterator[pa.RecordBatch]: batches of the file
+    """
+    if file_type == "orc":
+        _check_orc()
+        orc_file = pa_orc.ORCFile(as_arrow_file(file_content))
+        for stripe in range(orc_file.nstripes):
+            yield orc_file.read_stripe(stripe)
+    elif file_type == "feather":
+        source = as_arrow_file(file_content)
+        try:
+            reader = pa.ipc.open_file(source)
+        except pa.ArrowInvalid:
+            # The IPC stream format has no footer
+            source.seek(0)
+            yield from pa.ipc.open_stream(source)
+            return
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+    elif file_type == "avro":
+        _check_avro()
+        if isinstance(file_content, (bytes, bytearray, memoryview)):
+            file_content = io.BytesIO(file_content)
+        sizer = as_chunk_sizer(batch_rows)
+        schema = None
+        records = []
+        for record in fastavro.reader(file_content):
+            records.append(record)
+            if len(records) >= sizer.rows:
+                batch = pa.RecordBatch.from_pylist(records, schema=schema)
+                schema = batch.schema
+                records = []
+                yield batch
+        if records:
+            yield pa.RecordBatch.from_pylist(records, schema=schema)
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+
+class BatchFileWriter:
+    """
+    Append Arrow tables to an ORC, Feather (Arrow IPC) or Avro output.
+    The schema of the first table is used for the whole file.
+
+    Args:
+        output (BinaryIO): Byte system to write the output
+        schema (pa.Schema): schema of the tables
+        compression (str): codec of the format, None for none
+    """
+
+    def __init__(self, output: BinaryIO, schema: pa.Schema,
+                 compression: str = None):
+        self.output = output
+        self.schema = schema.remove_metadata()
+        self.compression = compression
+
+    def write(self, table: pa.Table):
+        self._write(table.replace_schema_metadata().cast(self.schema))
+
+    def _write(self, table: pa.Table):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OrcFileWriter(BatchFileWriter):
+    def __init__(self, output: BinaryIO, schema: pa.Schema,
+                 compression: str = None):
+        _check_orc()
+        super().__init__(output, schema, compression)
+        self.writer = pa_orc.ORCWriter(
+            output, compression=compression or "uncompressed")
+
+    def _write(self, table: pa.Table):
+        self.writer.write(table)
+
+    def close(self):
+        self.writer.close()
+
+
+class FeatherFileWriter(BatchFileWriter):
+    """
+    Arrow IPC file (Feather v2) writer, uncompressed by default so that
+    the output can be read back without copies
+    """
+
+    def __init__(self, output: BinaryIO, schema: pa.Schema,
+                 compression: str = None):
+        super().__init__(output, schema, compression)
+        self.writer = pa.ipc.new_file(
+            output, self.schema,
+            options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def _write(self, table: pa.Table):
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+class AvroFileWriter(BatchFileWriter):
+    """
+    Avro object container writer, every table written as data blocks.
+    Columns are nullable; types without an Avro equivalent are written
+    as strings.
+    """
+
+    def __init__(self, output: BinaryIO, schema: pa.Schema,
+                 compression: str = None):
+        _check_avro()
+        super().__init__(output, schema, compression)
+        self.writer = fastavro.write.Writer(
+            output, avro_schema(self.schema),
+            codec=compression or "null")
+
+    def _write(self, table: pa.Table):
+        as_strings = [field.name for field in self.schema
+                      if field.type not in AVRO_TYPES]
+        for name in as_strings:
+            table = table.set_column(
+                table.schema.get_field_index(name), name,
+                table.column(name).cast(pa.string()))
+        for record in table.to_pylist():
+            self.writer.write(record)
+        self.writer.flush()
+
+    def close(self):
+        self.writer.flush()
+
+
+BATCH_FILE_WRITERS = {
+    "orc": OrcFileWriter,
+    "feather": FeatherFileWriter,
+    "avro": AvroFileWriter,
+}
+
+
+def get_batch_file_writer(file_type: str, output: BinaryIO,
+                          schema: pa.Schema,
+                          compression: str = None) -> BatchFileWriter:
+    """
+    Build the writer of an ORC, Feather (Arrow IPC) or Avro output
+
+    Args:
+        file_type (str): orc/feather/avro
+        output (BinaryIO): Byte system to write the output
+        schema (pa.Schema): schema of the tables
+        compression (str): codec of the format, e.g 'zstd' for ORC and
+            Feather or 'deflate' for Avro, uncompressed when None
+
+    Returns:
+        BatchFileWriter: writer of the format
+    """
+    if file_type not in BATCH_FILE_WRITERS:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    return BATCH_FILE_WRITERS[file_type](output, schema, compression)
+
+
+def avro_schema(schema: pa.Schema, name: str = "Record") -> dict:
+    """
+    Avro record schema of an Arrow schema, every field nullable
+
+    Args:
+        schema (pa.Schema): Arrow schema
+        name (str): name of the record type
+
+    Returns:
+        dict: Avro schema
+    """
+    return {
+        "type": "record",
+        "name": name,
+        "fields": [{"name": field.name,
+                    "type": ["null", AVRO_TYPES.get(field.type, "string")],
+                    "default": None}
+                   for field in schema],
+    }
+
+
+def _check_orc():
+    if pa_orc is None:
+        raise ImportError("ORC files require pyarrow built with ORC")
+
+
+def _check_avro():
+    if fastavro is None:
+        raise ImportError("Avro files require the fastavro package")
@@ -0,0 +1,300 @@
+import io
+import json
+import re
+import ijson
+from typing import BinaryIO, Callable
+from src.obfuscation_methods import get_field_method, make_batch_obfuscator
+from src.tokenization import TokenVault
+from src.pseudonym_map import PseudonymMap
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+WILDCARD = "*"
+_PATH_TOKEN = re.compile(r"([^.\[\]]+)|\[(\*|\d+)\]|(\.)")
+# Built once: json.dumps with options builds a new encoder per call
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+# Records obfuscated together, one obfuscator call per field and batch
+BATCH_RECORDS = 1000
+
+
+def is_json_path(field: str) -> bool:
+    """
+    Whether a PII field is a path into nested objects
+    (e.g customer.contact.email or orders[*].card) rather than
+    a top level key
+
+    Args:
+        field (str): PII field
+
+    Returns:
+        bool: True for a nested path
+    """
+    return "." in field or "[" in field
+
+
+def parse_json_path(path: str) -> list[str | int]:
+    """
+    Split a JSON path into its steps: object keys, list indexes and
+    '*' for every element of a list
+
+    Args:
+        path (str): e.g orders[*].card or customer.contact.email
+
+    Returns:
+        list: steps, e.g ['orders', '*', 'card']
+    """
+    steps = []
+    position = 0
+    expect_key = True
+    while position < len(path):
+        match = _PATH_TOKEN.match(path, position)
+        if match is None:
+            break
+        key, index, dot = match.groups()
+        if key is not None:
+            if not expect_key:
+                break
+            steps.append(key)
+            expect_key = False
+        elif index is not None:
+            if not steps:
+                break
+            steps.append(WILDCARD if index == WILDCARD else int(index))
+        elif expect_key:
+            break
+        else:
+            expect_key = True
+        position = match.end()
+    if position != len(path) or expect_key:
+        raise ValueError(f"Invalid JSON path: {path}")
+    return steps
+
+
+def _obfuscate_tree(value, obfuscate_value: Callable[[str], str]):
+    if isinstance(value, dict):
+        return {key: _obfuscate_tree(item, obfuscate_value)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_obfuscate_tree(item, obfuscate_value) for item in value]
+    if value is None:
+        return None
+    return obfuscate_value(value if isinstance(value, str) else str(value))
+
+
+def _collect_tree(container, key, slots: list[tuple]):
+    # As _obfuscate_tree, collecting the slots of the values instead
+    value = container[key]
+    if isinstance(value, dict):
+        for item_key in value:
+            _collect_tree(value, item_key, slots)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            _collect_tree(value, index, slots)
+    elif value is not None:
+        slots.append((container, key))
+
+
+def compile_json_path(
+    path: str, obfuscate_value: Callable[[str], str]
+) -> Callable[[dict], int]:
+    """
+    Compile a JSON path into an accessor that obfuscates, in place,
+    the values it reaches in a record. A path ending on an object or
+    list obfuscates every value inside it. Records missing part of the
+    path are left unchanged.
+
+    Args:
+        path (str): JSON path, see parse_json_path
+        obfuscate_value (Callable): obfuscates one string value
+
+    Returns:
+        Callable[[dict], int]: accessor returning the number of values
+                               it obfuscated in the record
+    """
+    def leaf(container, key) -> int:
+        container[key] = _obfuscate_tree(container[key], obfuscate_value)
+        return 1
+
+    return _compile_path(path, leaf)
+
+
+def _compile_path(path: str, leaf: Callable) -> Callable[[dict], int]:
+    steps = parse_json_path(path)
+    accessor = None
+    for step in reversed(steps):
+        accessor = _compile_step(step, accessor or leaf,
+                                 is_last=accessor is None)
+    return accessor
+
+
+def _compile_step(step, next_accessor, is_last: bool):
+    if step == WILDCARD:
+        if is_last:
+            def accessor(node) -> int:
+                if not isinstance(node, list):
+                    return 0
+                return sum(next_accessor(node, i) for i in range(len(node)))
+        else:
+            def accessor(node) -> int:
+                if not isinstance(node, list):
+                    return 0
+                return sum(next_accessor(item) for item in node)
+        return accessor
+
+    if isinstance(step, int):
+        def has_step(node) -> bool:
+            return isinstance(node, list) and -len(node) <= step < len(node)
+    else:
+        def has_step(node) -> bool:
+            return isinstance(node, dict) and step in node
+
+    if is_last:
+        def accessor(node) -> int:
+            return next_accessor(node, step) if has_step(node) else 0
+    else:
+        def accessor(node) -> int:
+            return next_accessor(node[step]) if has_step(node) else 0
+    return accessor
+
+
+class JsonRecordTransformer:
+    """
+    Obfuscate the PII fields of JSON records in place, each field
+    (a top level key or a nested path) compiled once into an accessor
+
+    Args:
+        fields_list (list): top level keys or JSON paths to obfuscate
+        method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact']:
+            how to obfuscate the values, default to be 'replace', or a
+            dict of field to method
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
+    """
+
+    def __init__(self, fields_list: list[str],
+                 method: str | dict[str, str] = "replace",
+                 token_vault: TokenVault = None,
+                 pseudonym_map: PseudonymMap = None):
+        self.fields_list = list(fields_list)
+        self._slots = []
+
+        def collect(container, key) -> int:
+            _collect_tree(container, key, self._slots)
+            return 1
+
+        self._accessors = [_compile_path(field, collect)
+                           for field in self.fields_list]
+        # One obfuscator per field, so 'random_hash' draws a salt per field
+        self._obfuscators = [
+            make_batch_obfuscator(get_field_method(method, field),
+                                  token_vault=token_vault,
+                                  pseudonym_map=pseudonym_map)
+            for field in self.fields_list
+        ]
+        self.matches = dict.fromkeys(self.fields_list, 0)
+
+    def transform_records(self, records: list[dict]) -> list[dict]:
+        """
+        Obfuscate the PII fields of a batch of records in place, the
+        values of each field obfuscated in one call
+
+        Args:
+            records (list): JSON records
+
+        Returns:
+            list: the same records
+        """
+        for field, accessor, obfuscate in zip(
+                self.fields_list, self._accessors, self._obfuscators):
+            self._slots.clear()
+            for record in records:
+                self.matches[field] += accessor(record)
+            if not self._slots:
+                continue
+            values = [
+                value if isinstance(value, str) else str(value)
+                for value in (container[key]
+                              for container, key in self._slots)
+            ]
+            for (container, key), value in zip(self._slots,
+                                               obfuscate(values)):
+                container[key] = value
+        self._slots.clear()
+        return records
+
+    def __call__(self, record: dict) -> dict:
+        return self.transform_records([record])[0]
+
+    def check_matched(self):
+        """
+        Raise KeyError for a field that matched no value in any record,
+        as a DataFrame column that does not exist would
+        """
+        for field, count in self.matches.items():
+            if count == 0:
+                logger.warning(f"Field '{field}' not found in the data.")
+                raise KeyError(f"Field '{field}' not found in the data.")
+
+
+def obfuscate_json_records(
+    file_content: str | BinaryIO,
+    fields_list: list[str],
+    method: str | dict[str, str] = "replace",
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
+) -> io.BytesIO:
+    """
+    Stream the objects of a JSON array and write them back as
+    newline-delimited JSON with their PII fields obfuscated, a batch of
+    BATCH_RECORDS records at a time and without building DataFrames.
+    Nested values keep their structure and types; only the values
+    reached by the fields change.
+
+    Args:
+        file_content (str/BinaryIO): JSON array as a string,
+            or a binary stream
+        fields_list (list): top level keys or JSON paths to obfuscate,
+            e.g ['name', 'customer.contact.email', 'orders[*].card']
+        method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact']:
+            how to obfuscate the values, default to be 'replace', or a
+            dict of field to method
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
+
+    Returns:
+        io.BytesIO: newline-delimited JSON records in a byte system
+    """
+    logger.info(f"Transforming JSON records, obfuscating {fields_list}")
+    if isinstance(file_content, str):
+        file_content = file_content.encode("utf8")
+    transformer = JsonRecordTransformer(fields_list, method, token_vault,
+                                        pseudonym_map)
+    output = io.BytesIO()
+
+    def write_batch(batch: list[dict]):
+        for record in transformer.transform_records(batch):
+            output.write(_ENCODER.encode(record).encode("utf8"))
+            output.write(b"\n")
+
+    records = 0
+    batch = []
+    for record in ijson.items(file_content, "item", use_float=True):
+        batch.append(record)
+        records += 1
+        if len(batch) >= BATCH_RECORDS:
+            write_batch(batch)
+            batch = []
+    write_batch(batch)
+    if records:
+        transformer.check_matched()
+    logger.info(f"Transformed {records} JSON records.")
+    output.seek(0)
+    return output
@@ -0,0 +1,262 @@
+import json
+import os
+import time
+import urllib.parse
+from src.service import ObfuscationService
+from src.utils import get_s3_client
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_MEMORY_MB = 1024
+# Lambda allocates one full vCPU per 1769 MB of memory
+MB_PER_VCPU = 1769
+MAX_WORKERS = 6
+# Fraction of the function memory given to the rows of one chunk,
+# and bytes of pandas memory per byte of csv/json
+MEMORY_FRACTION = 0.25
+DATAFRAME_EXPANSION = 10
+DEFAULT_ROW_BYTES = 256
+MIN_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 500000
+PLAN_CACHE_SIZE = 256
+
+# Kept in module scope, so warm invocations of the same container
+# reuse the worker pool, the s3 client and the job plans
+_warm_state = {"service": None, "plans": {}, "invocations": 0}
+
+
+def plan_job(object_size: int | None, memory_mb: int,
+             row_bytes: int = DEFAULT_ROW_BYTES) -> dict:
+    """
+    Choose the chunk size and the number of workers of a job from the
+    function memory and the size of the object. The chunk memory budget
+    is shared by the workers, as they hold one chunk each. Objects whose
+    rows would not fit in memory are streamed with download, obfuscation
+    and upload pipelined.
+
+    Args:
+        object_size (int): size of the object in bytes, unknown if None
+        memory_mb (int): memory of the function in MB
+        row_bytes (int): estimated bytes per input row
+
+    Returns:
+        dict: 'workers' and handle_file_obfuscation options
+              ('chunk_size', 'chunk_bytes', 'pipelined'); chunk_bytes
+              lets the chunks adapt to the measured row width,
+              chunk_size is the estimate from row_bytes
+    """
+    workers = max(1, min(MAX_WORKERS, round(memory_mb / MB_PER_VCPU)))
+    budget = memory_mb * MB * MEMORY_FRACTION / workers
+    chunk_size = int(budget // (row_bytes * DATAFRAME_EXPANSION))
+    chunk_size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+    large = (object_size is None
+             or object_size * DATAFRAME_EXPANSION > memory_mb * MB / 2)
+    return {
+        "workers": workers,
+        "options": {
+            "chunk_size": chunk_size,
+            "chunk_bytes": int(budget),
+            "pipelined": large,
+        },
+    }
+
+
+def get_memory_mb(context=None) -> int:
+    """
+    Memory of the function, from the context or the Lambda environment
+
+    Returns:
+        int: memory in MB
+    """
+    if context is not None and hasattr(context, "memory_limit_in_mb"):
+        return int(context.memory_limit_in_mb)
+    return int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE",
+                              DEFAULT_MEMORY_MB))
+
+
+def _get_plan(bucket: str, file_key: str, memory_mb: int,
+              object_size: int = None) -> dict:
+    plans = _warm_state["plans"]
+    if object_size is None:
+        head = get_s3_client().head_object(Bucket=bucket, Key=file_key)
+        object_size = head["ContentLength"]
+        cache_key = (bucket, file_key, head.get("ETag"), memory_mb)
+    else:
+        cache_key = (bucket, file_key, object_size, memory_mb)
+    if cache_key not in plans:
+        if len(plans) >= PLAN_CACHE_SIZE:
+            plans.pop(next(iter(plans)))
+        plans[cache_key] = plan_job(object_size, memory_mb)
+        logger.info(f"Plan for {bucket}/{file_key} ({object_size} bytes): " +
+                    f"{plans[cache_key]}")
+    return plans[cache_key]
+
+
+def _get_service(workers: int) -> ObfuscationService:
+    service = _warm_state["service"]
+    if service is None or service.max_workers < workers:
+        if service is not None:
+            service.shutdown()
+        service = ObfuscationService(max_workers=workers)
+        _warm_state["service"] = service
+    return service
+
+
+def _default_pii_fields() -> list[str]:
+    fields = os.environ.get("PII_FIELDS", "")
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def _jobs_from_record(record: dict) -> list[dict]:
+    if record.get("eventSource") == "aws:sqs":
+        body = json.loads(record["body"])
+        if "Records" in body:
+            jobs = [job for inner in body["Records"]
+                    for job in _jobs_from_record(inner)]
+        else:
+            jobs = [body]
+        for job in jobs:
+            job["message_id"] = record["messageId"]
+        return jobs
+    if record.get("eventSource") != "aws:s3":
+        raise ValueError(f"Unsupported event source: "
+                         f"{record.get('eventSource')}")
+    bucket = record["s3"]["bucket"]["name"]
+    file_key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+    if file_key.startswith("processed_data/"):
+        # Our own output, obfuscating it again would loop forever
+        logger.info(f"Skipping obfuscated file {bucket}/{file_key}")
+        return []
+    pii_fields = _default_pii_fields()
+    return [{
+        "file_to_obfuscate": f"s3://{bucket}/{file_key}",
+        "pii_fields": pii_fields,
+        "object_size": record["s3"]["object"].get("size"),
+        "options": {} if pii_fields else {"auto_detect_pii": True},
+    }]
+
+
+def lambda_handler(event: dict, context=None) -> dict:
+    """
+    AWS Lambda entry point. The event is either a job
+    ({"file_to_obfuscate", "pii_fields", "options"}), an S3 event
+    notification, or an SQS batch whose bodies are jobs or S3 events.
+    For S3 events, the fields come from the PII_FIELDS environment
+    variable (comma-separated), or are auto-detected when it is unset.
+
+    Chunk size, pipelining and the number of jobs run concurrently are
+    chosen from the function memory and the object size (from the event
+    or HeadObject), unless the job options set them.
+
+    Args:
+        event (dict): Lambda event
+        context: Lambda context, for memory_limit_in_mb
+
+    Returns:
+        dict: 'statusCode', 'cold_start' and the job 'results', plus
+              'batchItemFailures' for SQS batches so that only the
+              failed messages are retried
+    """
+    start = time.perf_counter()
+    cold_start = _warm_state["service"] is None
+    _warm_state["invocations"] += 1
+    memory_mb = get_memory_mb(context)
+
+    if "Records" in event:
+        jobs = [job for record in event["Records"]
+                for job in _jobs_from_record(record)]
+    else:
+        jobs = [event]
+
+    workers = 1
+    for job in jobs:
+        object_size = job.pop("object_size", None)
+        try:
+            bucket, file_key = job["file_to_obfuscate"].split(
+                "://", 1)[-1].split("/", 1)
+            plan = _get_plan(bucket, file_key, memory_mb, object_size)
+        except Exception as e:
+            # The job itself reports the error when it runs
+            logger.warning(f"Could not plan job: {str(e)}")
+            plan = plan_job(object_size, memory_mb)
+        job["options"] = {**plan["options"], **job.get("options", {})}
+        workers = max(workers, plan["workers"])
+    service = _get_service(max(1, min(workers, len(jobs))))
+
+    futures = [service.submit(job) for job in jobs]
+    results = [future.result() for future in futures]
+    failed_messages = []
+    for job, result in zip(jobs, results):
+        result.pop("output", None)
+        if result["status"] == "failed" and "message_id" in job:
+            failed_messages.append(job["message_id"])
+
+    response = {
+        "statusCode": 500 if any(r["status"] == "failed"
+                                 for r in results) else 200,
+        "cold_start": cold_start,
+        "results": results,
+    }
+    if any(record.get("eventSource") == "aws:sqs"
+           for record in event.get("Records", [])):
+        response["batchItemFailures"] = [
+            {"itemIdentifier": message_id}
+            for message_id in dict.fromkeys(failed_messages)]
+    logger.info(f"Invocation {_warm_state['invocations']} " +
+                f"({'cold' if cold_start else 'warm'}) ran {len(jobs)} " +
+                f"jobs in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return response
+
+
+def reset_warm_state():
+    """
+    Drop the cached worker pool and plans, as a new container would
+    """
+    if _warm_state["service"] is not None:
+        _warm_state["service"].shutdown()
+    _warm_state.update({"service": None, "plans": {}, "invocations": 0})
+
+
+class LocalLambdaContext:
+    """
+    Minimal stand-in for the Lambda context object
+
+    Args:
+        memory_limit_in_mb (int): memory of the emulated function
+        function_name (str): name of the emulated function
+    """
+
+    def __init__(self, memory_limit_in_mb: int = DEFAULT_MEMORY_MB,
+                 function_name: str = "gdpr-obfuscator"):
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.function_name = function_name
+        self.aws_request_id = None
+
+
+def invoke_locally(events: list[dict],
+                   memory_mb: int = DEFAULT_MEMORY_MB) -> list[dict]:
+    """
+    Emulate a Lambda container locally: the first event is a cold start,
+    the next ones reuse the warm state, as consecutive invocations of the
+    same container would
+
+    Args:
+        events (list[dict]): events to invoke the handler with, in order
+        memory_mb (int): memory of the emulated function
+
+    Returns:
+        list[dict]: handler responses, each with its 'duration_ms'
+    """
+    reset_warm_state()
+    context = LocalLambdaContext(memory_mb)
+    responses = []
+    for i, event in enumerate(events):
+        context.aws_request_id = f"local-{i}"
+        start = time.perf_counter()
+        response = lambda_handler(event, context)
+        response["duration_ms"] = (time.perf_counter() - start) * 1000
+        responses.append(response)
+    return responses
@@ -1,10 +1,42 @@
 from src.obfuscator import obfuscate_file
 from src.utils import read_s3_file, write_s3_file, json_input_handler
-from src.pii_detection import detect_if_pii
+from src.compression import (
+    set_compression_extension,
+    split_compression_extension,
+)
+from src.storage import StorageBackend, S3Backend, get_storage_backend
+from src.manifest import (
+    ManifestStore,
+    get_manifest_store,
+    make_manifest_record,
+    is_unchanged,
+)
+from src.pipeline import (
+    run_pipelined_obfuscation,
+    run_fan_out_obfuscation,
+    check_pipelined_fields,
+)
+from src.partitioning import get_partition_prefix, write_partitioned_output
+from src.obfuscator import iter_df_chunks, obfuscate_fields_in_df
+from src.chunk_sizing import as_chunk_sizer
+from src.pushdown import read_projected_file, parse_row_filter
+from src.checkpoint import (
+    CheckpointStore,
+    get_checkpoint_store,
+    run_checkpointed_obfuscation,
+)
+from functools import partial
+from src.pii_detection import detect_pii_tiered
 from src.pii_detection_ai import detect_if_pii_with_gpt
+from src.pii_detection_ner import detect_if_pii_with_ner
+from src.tokenization import TokenVault, open_token_vault
+from src.pseudonym_map import PseudonymMap
+from src.engines import ENGINE_NAMES
+from src.file_formats import FILE_TYPES, TEXT_FILE_TYPES
 from typing import Literal
 import pandas as pd
 import io
+import json
 from src.setup_logger import setup_logger
 import argparse
 
@@ -12,14 +44,466 @@ import argparse
 logger = setup_logger(__name__)
 
 
+def _detect_with_gpt(column_names: list[str]) -> list[dict]:
+    return [{**item, "is_pii": item["score"] > 0.6}
+            for item in detect_if_pii_with_gpt(column_names)]
+
+
+def _detect_with_ner(column_names: list[str],
+                     sample: pd.DataFrame) -> list[dict]:
+    return detect_if_pii_with_ner(sample[column_names])
+
+
+def detect_pii_report(column_names: list[str],
+                      use_gpt: bool = False,
+                      sample: pd.DataFrame = None) -> list[dict]:
+    """
+    Detect which columns contain PII with the tiered detector: columns
+    are decided by the PII dictionary, then by the heuristic when it
+    is confident, and only the ambiguous ones are sent to GPT or to
+    the local NER model
+
+    Args:
+        column_names (list): the column names of the dataset
+        use_gpt (bool): If True, escalate ambiguous columns to GPT
+        sample (pd.DataFrame): If given, escalate ambiguous columns to
+            the local NER model run on these sampled rows instead
+
+    Returns:
+        list[dict]: for each column, 'column_name', 'is_pii', 'score'
+                    and the 'tier' that decided it
+    """
+    escalate = None
+    if sample is not None:
+        escalate = partial(_detect_with_ner, sample=sample)
+    elif use_gpt:
+        escalate = _detect_with_gpt
+    return detect_pii_tiered(column_names, escalate)
+
+
+def detect_pii_fields(column_names: list[str],
+                      use_gpt: bool = False,
+                      obfuscate_method: str | dict = "replace",
+                      sample: pd.DataFrame = None) -> list[str]:
+    """
+    Detect which columns contain PII, see detect_pii_report
+
+    Args:
+        column_names (list): the column names of the dataset
+        use_gpt (bool): If True, ambiguous columns are detected
+                        with GPT, otherwise with the heuristic model
+        obfuscate_method (str/dict): see get_obfuscate_method, the
+            fields given another method are always added to the
+            detected ones
+        sample (pd.DataFrame): If given, ambiguous columns are detected
+            from these sampled rows with the local NER model instead
+
+    Returns:
+        list[str]: the columns detected as PII
+    """
+    report = detect_pii_report(column_names, use_gpt, sample)
+    logger.info(f"PII detection report: {report}")
+    fields_list = [item['column_name'] for item in report
+                   if item['is_pii']]
+    logger.info(f"Detected PII fields: {fields_list}")
+    return add_method_fields(fields_list, obfuscate_method)
+
+
+def add_method_fields(fields_list: list[str],
+                      obfuscate_method: str | dict) -> list[str]:
+    """
+    Add the fields given their own method (e.g free-text columns to
+    redact) to the PII fields
+
+    Args:
+        fields_list (list): PII fields
+        obfuscate_method (str/dict): see get_obfuscate_method
+
+    Returns:
+        list[str]: PII fields followed by the fields of the method
+                   dict not in it
+    """
+    if not isinstance(obfuscate_method, dict):
+        return fields_list
+    return fields_list + [field for field in obfuscate_method
+                          if field not in fields_list]
+
+
+def get_obfuscate_method(redact_fields: list[str] = None,
+                         tokenize_fields: list[str] = None,
+                         pseudonymize_fields: list[str] = None
+                         ) -> str | dict:
+    """
+    Obfuscation method of handle_file_obfuscation: PII fields are
+    replaced with '***', except the free-text columns to redact and
+    the fields to tokenize or pseudonymize
+
+    Args:
+        redact_fields (list): free-text columns to redact
+        tokenize_fields (list): fields replaced by reversible tokens
+        pseudonymize_fields (list): fields replaced by shared pseudonyms
+
+    Returns:
+        str/dict: 'replace', or a dict of field to method
+    """
+    if not redact_fields and not tokenize_fields and \
+            not pseudonymize_fields:
+        return "replace"
+    return {**{field: "redact" for field in redact_fields or []},
+            **{field: "tokenize" for field in tokenize_fields or []},
+            **{field: "pseudonymize"
+               for field in pseudonymize_fields or []}}
+
+
+def read_sample(file_content, file_extension: str,
+                rows: int = 100) -> pd.DataFrame:
+    """
+    Read the first rows of file content with the reader of its file
+    type, e.g. to detect PII fields, rewinding binary streams after
+
+    Args:
+        file_content (str/BinaryIO): content as returned by read_file
+        file_extension (str): csv/json/parquet/orc/feather/avro
+        rows (int): number of rows to read, 100 by default
+
+    Returns:
+        pd.DataFrame: the first rows, empty when the file has none
+    """
+    if isinstance(file_content, str) and \
+            file_extension not in TEXT_FILE_TYPES:
+        # read_s3_file returns parquet content as csv text
+        file_extension = "csv"
+    position = None if isinstance(file_content, str) \
+        else file_content.tell()
+    sample = next(iter(iter_df_chunks(file_content, file_extension, rows)),
+                  pd.DataFrame())
+    if position is not None:
+        file_content.seek(position)
+    return sample
+
+
+def get_output_file_key(file_key: str,
+                        output_compression: str = None) -> str:
+    """
+    Build the key of the obfuscated file: the top level folder of the
+    input key is replaced by processed_data
+
+    Args:
+        file_key (str): key of the input file, e.g new_data/file.csv
+        output_compression (str): gzip/zstd/bz2 to set the compression
+                                  extension of the output key
+
+    Returns:
+        str: key of the output file, e.g processed_data/file.csv
+    """
+    input_folder_name = file_key.split('/')[0]
+    output_file_key = file_key.replace(input_folder_name, "processed_data")
+    if output_compression is not None:
+        output_file_key = set_compression_extension(
+            output_file_key, output_compression)
+    return output_file_key
+
+
+def get_fan_out_file_keys(file_key: str, output_formats: list[str],
+                          output_compression: str = None) -> dict[str, str]:
+    """
+    Build the keys of the obfuscated files of a fan-out job: as
+    get_output_file_key, with the extension of each output format.
+    csv/json outputs keep the codec of a compressed input unless
+    output_compression is given.
+
+    Args:
+        file_key (str): key of the input file, e.g new_data/file.csv.gz
+        output_formats (list): formats to output, e.g ['parquet', 'csv']
+        output_compression (str): gzip/zstd/bz2 for csv/json outputs
+
+    Returns:
+        dict[str, str]: output format to the key of its file, e.g
+            {'parquet': 'processed_data/file.parquet',
+             'csv': 'processed_data/file.csv.gz'}
+    """
+    input_format, codec = split_compression_extension(file_key)
+    output_file_key = set_compression_extension(
+        get_output_file_key(file_key), None)
+    stem = output_file_key.rsplit(".", 1)[0]
+    output_keys = {}
+    for output_format in output_formats:
+        output_key = f"{stem}.{output_format}"
+        if output_format in TEXT_FILE_TYPES:
+            output_key = set_compression_extension(
+                output_key, output_compression or codec)
+        output_keys[output_format] = output_key
+    return output_keys
+
+
+def _handle_fan_out_obfuscation(
+    storage_backend: StorageBackend | str | None,
+    s3_bucket: str,
+    file_key: str,
+    fields_list: list[str],
+    output_formats: list[str],
+    chunk_size: int,
+    chunk_bytes: int | None,
+    if_save_to_s3: bool,
+    auto_detect_pii: bool,
+    auto_detect_pii_gpt: bool,
+    output_compression: str | None,
+    compression_level: int | None,
+    compress_in_thread: bool,
+    parquet_compression: str,
+    parquet_compression_level: int | None,
+    parquet_use_dictionary: bool,
+    obfuscate_method: str | dict,
+    max_memory_mb: int | None = None,
+    spill_dir: str | None = None,
+    token_vault: TokenVault | None = None,
+    pseudonym_map: PseudonymMap | None = None,
+    **csv_options,
+):
+    """
+    Run handle_file_obfuscation writing every output format from one
+    read and obfuscation of the file, see run_fan_out_obfuscation
+    """
+    if storage_backend is None:
+        storage_backend = "s3"
+    if isinstance(storage_backend, str):
+        storage_backend = get_storage_backend(storage_backend)
+    source, file_extension = storage_backend.open_stream(s3_bucket, file_key)
+    if auto_detect_pii:
+        fields_list = partial(detect_pii_fields,
+                              use_gpt=auto_detect_pii_gpt,
+                              obfuscate_method=obfuscate_method)
+    output_keys = get_fan_out_file_keys(file_key, output_formats,
+                                        output_compression)
+    outputs = {}
+
+    def make_write_output(output_format):
+        if if_save_to_s3:
+            def write_output(parts):
+                storage_backend.write_file(
+                    s3_bucket, output_keys[output_format], parts,
+                    compression_level=compression_level,
+                    compress_in_thread=compress_in_thread)
+        else:
+            outputs[output_format] = io.BytesIO()
+
+            def write_output(parts):
+                for part in parts:
+                    outputs[output_format].write(part)
+        return write_output
+
+    stats = run_fan_out_obfuscation(
+        source, file_extension, fields_list,
+        {output_format: make_write_output(output_format)
+         for output_format in output_formats},
+        chunk_size=chunk_size, obfuscate_method=obfuscate_method,
+        chunk_bytes=chunk_bytes,
+        writer_options={"parquet": {
+            "compression": parquet_compression,
+            "compression_level": parquet_compression_level,
+            "use_dictionary": parquet_use_dictionary}},
+        max_memory_mb=max_memory_mb, spill_dir=spill_dir,
+        token_vault=token_vault, pseudonym_map=pseudonym_map,
+        **csv_options)
+    logger.info(f"Fan-out stage timings: {stats}")
+    if not if_save_to_s3:
+        for output in outputs.values():
+            output.seek(0)
+        return outputs
+    return ('Obfuscated files saved to ' + ", ".join(
+        f'{storage_backend.name}://{s3_bucket}/{output_key}'
+        for output_key in output_keys.values()))
+
+
+def _handle_pipelined_obfuscation(
+    storage_backend: StorageBackend | str | None,
+    s3_bucket: str,
+    file_key: str,
+    fields_list: list[str],
+    output_format: str | None,
+    chunk_size: int,
+    chunk_bytes: int | None,
+    if_save_to_s3: bool,
+    auto_detect_pii: bool,
+    auto_detect_pii_gpt: bool,
+    output_compression: str | None,
+    compression_level: int | None,
+    compress_in_thread: bool,
+    parquet_compression: str,
+    parquet_compression_level: int | None,
+    parquet_use_dictionary: bool,
+    obfuscate_method: str | dict,
+    max_memory_mb: int | None = None,
+    spill_dir: str | None = None,
+    token_vault: TokenVault | None = None,
+    pseudonym_map: PseudonymMap | None = None,
+    **csv_options,
+):
+    """
+    Run handle_file_obfuscation with download, obfuscation and upload
+    overlapped, see run_pipelined_obfuscation
+    """
+    if storage_backend is None:
+        storage_backend = "s3"
+    if isinstance(storage_backend, str):
+        storage_backend = get_storage_backend(storage_backend)
+    source, file_extension = storage_backend.open_stream(s3_bucket, file_key)
+    if auto_detect_pii:
+        fields_list = partial(detect_pii_fields,
+                              use_gpt=auto_detect_pii_gpt,
+                              obfuscate_method=obfuscate_method)
+
+    if if_save_to_s3:
+        output_file_key = get_output_file_key(file_key, output_compression)
+
+        def write_output(parts):
+            storage_backend.write_file(
+                s3_bucket, output_file_key, parts,
+                compression_level=compression_level,
+                compress_in_thread=compress_in_thread)
+    else:
+        output = io.BytesIO()
+
+        def write_output(parts):
+            for part in parts:
+                output.write(part)
+
+    writer_options = {}
+    if (output_format or file_extension) == "parquet":
+        writer_options = {"compression": parquet_compression,
+                          "compression_level": parquet_compression_level,
+                          "use_dictionary": parquet_use_dictionary}
+    stats = run_pipelined_obfuscation(
+        source, file_extension, fields_list, write_output,
+        output_format=output_format, chunk_size=chunk_size,
+        obfuscate_method=obfuscate_method,
+        chunk_bytes=chunk_bytes, max_memory_mb=max_memory_mb,
+        spill_dir=spill_dir, writer_options=writer_options,
+        token_vault=token_vault, pseudonym_map=pseudonym_map,
+        **csv_options)
+    logger.info(f"Pipeline stage timings: {stats}")
+    if not if_save_to_s3:
+        output.seek(0)
+        return output
+    return (f'Obfuscated file saved to {storage_backend.name}://' +
+            f'{s3_bucket}/{output_file_key}')
+
+
+def _handle_partitioned_obfuscation(
+    storage_backend: StorageBackend | str | None,
+    s3_bucket: str,
+    file_key: str,
+    fields_list: list[str],
+    output_format: str | None,
+    chunk_size: int,
+    chunk_bytes: int | None,
+    auto_detect_pii: bool,
+    auto_detect_pii_gpt: bool,
+    output_compression: str | None,
+    compression_level: int | None,
+    compress_in_thread: bool,
+    parquet_compression: str,
+    parquet_compression_level: int | None,
+    parquet_use_dictionary: bool,
+    partition_rows: int | None,
+    partition_bytes: int | None,
+    partition_by: str | None,
+    obfuscate_method: str | dict,
+    auto_detect_pii_ner: bool,
+    token_vault: TokenVault | None = None,
+    pseudonym_map: PseudonymMap | None = None,
+    **csv_options,
+):
+    """
+    Run handle_file_obfuscation writing the output as part files,
+    see write_partitioned_output
+    """
+    if storage_backend is None:
+        storage_backend = "s3"
+    if isinstance(storage_backend, str):
+        storage_backend = get_storage_backend(storage_backend)
+    source, file_extension = storage_backend.open_stream(s3_bucket, file_key)
+    output_format = output_format or file_extension
+    sizer = as_chunk_sizer(chunk_size, chunk_bytes)
+
+    def iter_obfuscated_chunks():
+        fields = None if auto_detect_pii else fields_list
+        for chunk in iter_df_chunks(source, file_extension, sizer,
+                                    fields, **csv_options):
+            if fields is None:
+                # Detected once, from the columns of the first chunk
+                fields = detect_pii_fields(
+                    list(chunk.columns), auto_detect_pii_gpt,
+                    obfuscate_method,
+                    chunk if auto_detect_pii_ner else None)
+            yield obfuscate_fields_in_df(chunk, fields, obfuscate_method,
+                                         token_vault, pseudonym_map)
+
+    def write_part(key, body):
+        storage_backend.write_file(s3_bucket, key, body,
+                                   compression_level=compression_level,
+                                   compress_in_thread=compress_in_thread)
+
+    writer_options = {}
+    if output_format == "parquet":
+        writer_options = {"compression": parquet_compression,
+                          "compression_level": parquet_compression_level,
+                          "use_dictionary": parquet_use_dictionary}
+    output_prefix = get_partition_prefix(get_output_file_key(file_key))
+    manifest = write_partitioned_output(
+        iter_obfuscated_chunks(), write_part, output_prefix, output_format,
+        rows_per_part=partition_rows, bytes_per_part=partition_bytes,
+        partition_by=partition_by,
+        file_extension=set_compression_extension(output_format,
+                                                 output_compression),
+        **writer_options)
+    return (f'Obfuscated file saved to {storage_backend.name}://' +
+            f'{s3_bucket}/{output_prefix} in {len(manifest["parts"])} parts')
+
+
 def handle_file_obfuscation(
     json_string: str,
     if_output_different_format: bool = False,
-    output_format: Literal["csv", "json", "parquet", None] = None,
+    output_format: Literal["csv", "json", "parquet", "orc", "feather",
+                           "avro", None] = None,
     chunk_size: int = 5000,
     if_save_to_s3: bool = True,
     auto_detect_pii: bool = False,
-    auto_detect_pii_gpt: bool = False
+    auto_detect_pii_gpt: bool = False,
+    infer_schema: bool = False,
+    raw_non_pii: bool = False,
+    csv_engine: Literal["c", "pyarrow"] = "c",
+    csv_passthrough: bool = False,
+    chunked_conversion: bool = False,
+    row_group_size: int = 100000,
+    output_compression: Literal["gzip", "zstd", "bz2", None] = None,
+    parquet_compression: str = "snappy",
+    compression_level: int = None,
+    compress_in_thread: bool = False,
+    storage_backend: StorageBackend | str = None,
+    pipelined: bool = False,
+    chunk_bytes: int = None,
+    manifest: ManifestStore | str = None,
+    checkpoint: CheckpointStore | str = None,
+    partition_rows: int = None,
+    partition_bytes: int = None,
+    partition_by: str = None,
+    columns: list[str] = None,
+    row_filter: list = None,
+    redact_fields: list[str] = None,
+    auto_detect_pii_ner: bool = False,
+    tokenize_fields: list[str] = None,
+    token_vault: TokenVault | str = None,
+    pseudonymize_fields: list[str] = None,
+    pseudonym_map: PseudonymMap | str = None,
+    arrow_strings: bool = False,
+    engine: Literal["pandas", "arrow", "duckdb"] = "pandas",
+    output_formats: list[str] = None,
+    max_memory_mb: int = None,
+    spill_dir: str = None,
+    csv_schema: dict[str, str] = None,
+    parquet_compression_level: int = None,
+    parquet_use_dictionary: bool = True,
 ):
     """
     Process the file obfuscation
@@ -50,50 +534,509 @@ def handle_file_obfuscation(
         auto_detect_pii_gpt (bool):
             If True, automatically detect PII fields in the dataset using GPT.
             If False, detect PII fields using heuristic model.
+
+        infer_schema (bool):
+            If True, infer the csv schema once from a sample and read
+            every chunk with the same dtypes.
+
+        raw_non_pii (bool):
+            If True, non-PII csv columns are passed through as raw strings.
+
+        csv_engine (str): csv parser, 'c' (default) or 'pyarrow'
+
+        csv_passthrough (bool):
+            If True, csv-to-csv jobs only rewrite the PII fields
+            and copy every other byte unchanged. Not available for
+            pipelined, memory-limited, multiple format or partitioned
+            processing, which parse the file into chunks.
+
+        chunked_conversion (bool):
+            If True, json/parquet/orc/feather/avro output is written
+            chunk by chunk as it is obfuscated, with no intermediate
+            csv, and spooled to a temporary file once it is large.
+
+        row_group_size (int): rows per parquet row group, 100000 by
+            default
+
+        output_compression (str):
+            gzip/zstd/bz2 to compress csv/json output, adding the
+            matching extension (.gz/.zst/.bz2) to the output key.
+            Compressed inputs such as file.csv.gz keep their codec
+            unless another one is given.
+
+        parquet_compression (str): Parquet codec, 'snappy' by default
+
+        compression_level (int): level of the output_compression codec
+
+        compress_in_thread (bool):
+            If True, csv/json output is compressed on a worker thread.
+
+        storage_backend (StorageBackend/str):
+            Where to read and write files: a StorageBackend instance or
+            's3'/'local'/'memory'. S3 is used by default. For 'local',
+            "file_to_obfuscate" is "file://<directory>/<file_key>".
+
+        pipelined (bool):
+            If True, the next input block downloads while the current
+            chunk is obfuscated and the previous output part uploads,
+            with bounded queues between the stages.
+
+        chunk_bytes (int):
+            If given, rows per chunk adapt to the measured row width so
+            that each chunk holds about chunk_bytes bytes in memory;
+            chunk_size then only bounds the first chunk.
+
+        manifest (ManifestStore/str):
+            Manifest of processed inputs: a ManifestStore, the path of a
+            SQLite file or "s3://<bucket>/<key>" for a JSON object in S3.
+            An input whose version (ETag/VersionId/size), fields and
+            output are unchanged since it was recorded is skipped
+            without being downloaded.
+
+        checkpoint (CheckpointStore/str):
+            Checkpoint store (or a local directory / "s3://<bucket>/
+            <prefix>") for resumable csv-to-csv jobs on S3: progress is
+            saved after every multipart part, and a job run again after
+            a failure continues from its last checkpoint.
+
+        partition_rows (int):
+            If given, the output is written as part files of at most
+            partition_rows rows under processed_data/<file name>/,
+            uploaded concurrently, with a _manifest.json listing them.
+
+        partition_bytes (int):
+            If given, output part files are rolled over at about
+            partition_bytes bytes.
+
+        partition_by (str):
+            If given, output part files are split by the value of this
+            column into Hive-style <column>=<value>/ prefixes.
+
+        columns (list):
+            If given, only these columns are read and output. Parquet
+            reads only their column chunks, csv/json use S3 Select.
+
+        row_filter (list):
+            If given, only rows matching every (column, operator, value)
+            predicate are read and output, e.g [("cohort", "=", "2024")].
+            Parquet skips row groups using their statistics.
+
+        redact_fields (list):
+            Free-text columns (e.g customer_feedback) in which only the
+            PII found inside the text (emails, phone numbers, card
+            numbers, ...) is replaced, e.g "call [PHONE]", instead of
+            the whole value. They are obfuscated in addition to the
+            PII fields.
+
+        auto_detect_pii_ner (bool):
+            If True, with auto_detect_pii, detect PII fields from sampled
+            values with a local NER model on CPU, with no network call.
+            Not available for pipelined or checkpointed processing,
+            which detect fields from column names only.
+
+        tokenize_fields (list):
+            Fields whose values are replaced by reversible tokens, the
+            token-to-value mapping being kept in an encrypted vault
+            (see TokenVault and src/detokenize.py). They are obfuscated
+            in addition to the PII fields.
+
+        token_vault (TokenVault/str):
+            Vault of tokenize_fields, or the path of a SQLite vault
+            opened with the key in OBFUSCATOR_VAULT_KEY for this job
+            and closed after it. The vault at OBFUSCATOR_VAULT_PATH is
+            used by default.
+
+        pseudonymize_fields (list):
+            Fields whose values are replaced by random pseudonyms kept
+            in a persistent map, so that a value gets the same
+            pseudonym in every file of a batch (see PseudonymMap). They
+            are obfuscated in addition to the PII fields.
+
+        pseudonym_map (PseudonymMap/str):
+            Map of pseudonymize_fields, or the path of a SQLite map,
+            shared by the jobs of a batch, opened for this job and
+            closed after it. The map at OBFUSCATOR_PSEUDONYM_MAP is used
+            by default.
+
+        arrow_strings (bool):
+            If True, string columns are kept in Arrow buffers
+            (pd.ArrowDtype(pa.string())) from read through obfuscation
+            and write, instead of one Python object per cell, so chunks
+            take less memory.
+
+        engine (str):
+            Engine running whole-file jobs: 'pandas' (default), 'arrow'
+            (pyarrow.compute from read to write) or 'duckdb' (one
+            in-process DuckDB query). Not available for pipelined,
+            checkpointed or partitioned processing.
+
+        output_formats (list):
+            If given, the file is read and obfuscated once and written
+            in each of these formats (e.g ['parquet', 'csv']), to
+            processed_data/<file name>.<format>, with the writers of the
+            formats running concurrently. Replaces output_format. When
+            not saved to S3, a dict of format to byte stream is returned.
+            Not available with the other engines or with checkpointed,
+            partitioned or projected processing.
+
+        max_memory_mb (int):
+            If given, the job is kept under this many MB of memory by a
+            MemoryGovernor watching the RSS of the process: as the limit
+            nears, chunks shrink, output parts are spilled to spill_dir
+            until they are uploaded, and reading waits for the buffers
+            in flight to drain. The job is run pipelined (or fanned
+            out with output_formats), whose writers already write the
+            output chunk by chunk as chunked_conversion does. Not
+            available with csv_passthrough, the other engines or with
+            checkpointed, partitioned or projected processing.
+
+        spill_dir (str):
+            Local directory of the parts spilled under max_memory_mb,
+            the system temp directory by default.
+
+        csv_schema (dict):
+            Column name to pandas dtype name (e.g {"student_id": "Int64",
+            "name": "str"}) used to read every csv chunk instead of an
+            inferred schema; only these columns are read. A value that
+            does not fit its dtype falls back to str.
+
+        parquet_compression_level (int): level of the Parquet codec,
+            codec default when None
+
+        parquet_use_dictionary (bool): If True (default), Parquet
+            columns are dictionary encoded
     """
+    # Vaults, maps and manifests opened from a path here, closed after
+    # the job
+    opened = []
     try:
         s3_bucket, file_key, fields_list = json_input_handler(json_string)
-        logger.info(f"Processing file: s3://{s3_bucket}/{file_key}")
+        obfuscate_method = get_obfuscate_method(
+            redact_fields, tokenize_fields, pseudonymize_fields)
+        fields_list = add_method_fields(fields_list, obfuscate_method)
+        record_vault = getattr(token_vault, "path", token_vault)
+        record_map = getattr(pseudonym_map, "path", pseudonym_map)
+        if not tokenize_fields:
+            token_vault = None
+        elif isinstance(token_vault, str):
+            token_vault = open_token_vault(token_vault)
+            opened.append(token_vault)
+        if not pseudonymize_fields:
+            pseudonym_map = None
+        elif isinstance(pseudonym_map, str):
+            pseudonym_map = PseudonymMap(pseudonym_map)
+            opened.append(pseudonym_map)
+        logger.info(f"Processing file: {s3_bucket}/{file_key}")
 
-        content_str, file_extension = read_s3_file(s3_bucket, file_key)
+        if storage_backend is None or storage_backend == "s3":
+            read_file, write_file = read_s3_file, write_s3_file
+        else:
+            if isinstance(storage_backend, str):
+                storage_backend = get_storage_backend(storage_backend)
+            read_file = storage_backend.read_file
+            write_file = storage_backend.write_file
 
-        if auto_detect_pii:
-            df_step = pd.read_csv(io.StringIO(content_str))
-            if auto_detect_pii_gpt:
-                gpt_result = detect_if_pii_with_gpt(list(df_step.columns))
-                fields_list = [item['column_name'] for item in gpt_result
-                               if item['score'] > 0.6]
-                logger.info(f"Detected PII fields (GPT): {fields_list}")
+        if output_formats is not None:
+            unsupported = [output_format for output_format in output_formats
+                           if output_format not in FILE_TYPES]
+            if unsupported or not output_formats:
+                raise ValueError(
+                    f"Sorry that {', '.join(unsupported)} is not " +
+                    "supported. This tool currently only support " +
+                    "/".join(FILE_TYPES))
+            if engine != "pandas" or checkpoint is not None or \
+                    partition_rows is not None or \
+                    partition_bytes is not None or \
+                    partition_by is not None or \
+                    columns is not None or row_filter is not None:
+                raise ValueError("Multiple output formats are not " +
+                                 "available for other engines or for " +
+                                 "checkpointed, partitioned or " +
+                                 "projected processing")
+
+        manifest_record = None
+        if manifest is not None and if_save_to_s3:
+            if isinstance(manifest, str):
+                manifest = get_manifest_store(manifest)
+                opened.append(manifest)
+            head_backend = S3Backend() if read_file is read_s3_file \
+                else storage_backend
+            if output_formats is not None:
+                output_file_key = ",".join(get_fan_out_file_keys(
+                    file_key, output_formats, output_compression).values())
+            else:
+                output_file_key = get_output_file_key(file_key,
+                                                      output_compression)
+            if auto_detect_pii:
+                fields = "auto_ner" if auto_detect_pii_ner else \
+                    "auto_gpt" if auto_detect_pii_gpt else "auto"
             else:
-                fields_list = [col_name for col_name in
-                               df_step.columns if detect_if_pii(col_name)]
-                logger.info(f"Detected PII fields (heuristic): {fields_list}")
+                fields = fields_list
+            if output_formats is not None:
+                record_format = ",".join(output_formats)
+            elif if_output_different_format:
+                record_format = output_format
+            else:
+                record_format = None
+            # Settings the output bytes depend on, so that changing one
+            # reprocesses the input
+            record_options = {
+                "compression_level": compression_level,
+                "engine": engine,
+                "csv_engine": csv_engine,
+                "csv_schema": csv_schema,
+                "infer_schema": infer_schema,
+                "raw_non_pii": raw_non_pii,
+                "csv_passthrough": csv_passthrough,
+                "chunked_conversion": chunked_conversion,
+                "partition_by": partition_by,
+                "partition_rows": partition_rows,
+                "partition_bytes": partition_bytes,
+                "columns": columns,
+                # As stored, with tuples as lists
+                "row_filter": json.loads(json.dumps(row_filter)),
+                "token_vault": record_vault if tokenize_fields else None,
+                "pseudonym_map": record_map
+                if pseudonymize_fields else None,
+            }
+            if "parquet" in (record_format or split_compression_extension(
+                    file_key)[0]).split(","):
+                record_options.update({
+                    "parquet_compression": parquet_compression,
+                    "parquet_compression_level": parquet_compression_level,
+                    "parquet_use_dictionary": parquet_use_dictionary,
+                    "row_group_size": row_group_size,
+                })
+            manifest_record = make_manifest_record(
+                s3_bucket, file_key, head_backend.head(s3_bucket, file_key),
+                fields, obfuscate_method, output_file_key, record_format,
+                record_options)
+            if is_unchanged(manifest.get(s3_bucket, file_key),
+                            manifest_record):
+                logger.info(f"Skipping unchanged file {s3_bucket}/{file_key}")
+                return ("Unchanged file, obfuscated file already saved to " +
+                        f"{head_backend.name}://{s3_bucket}/{output_file_key}")
+
+        if max_memory_mb is not None and output_formats is None:
+            if engine != "pandas" or checkpoint is not None or \
+                    partition_rows is not None or \
+                    partition_bytes is not None or \
+                    partition_by is not None or \
+                    columns is not None or row_filter is not None:
+                raise ValueError("max_memory_mb is not available for " +
+                                 "other engines or for checkpointed, " +
+                                 "partitioned or projected processing")
+            # The governor bounds the buffers of the pipelined stages
+            pipelined = True
+
+        if (columns is not None or row_filter is not None) and \
+                (pipelined or checkpoint is not None or
+                 partition_rows is not None or partition_bytes is not None
+                 or partition_by is not None):
+            raise ValueError("columns and row_filter are not available " +
+                             "for pipelined, checkpointed or partitioned " +
+                             "processing")
+
+        if pipelined or output_formats is not None or \
+                partition_rows is not None or partition_bytes is not None \
+                or partition_by is not None:
+            if csv_passthrough:
+                raise ValueError("csv_passthrough is not available for " +
+                                 "pipelined, memory-limited, multiple " +
+                                 "format or partitioned processing")
+            check_pipelined_fields(
+                fields_list, split_compression_extension(file_key)[0])
+
+        if auto_detect_pii and auto_detect_pii_ner and \
+                (pipelined or checkpoint is not None or
+                 output_formats is not None):
+            raise ValueError("NER detection is not available for " +
+                             "pipelined, checkpointed or multiple " +
+                             "format processing")
+
+        if engine != "pandas" and (pipelined or checkpoint is not None or
+                                   partition_rows is not None or
+                                   partition_bytes is not None or
+                                   partition_by is not None):
+            raise ValueError(f"The {engine} engine is not available for " +
+                             "pipelined, checkpointed or partitioned " +
+                             "processing")
+
+        if checkpoint is not None:
+            if read_file is not read_s3_file or not if_save_to_s3 or \
+                    output_compression is not None or \
+                    (if_output_different_format
+                     and output_format not in [None, "csv"]):
+                raise ValueError("Checkpointed processing only supports " +
+                                 "csv output saved to s3")
+            if isinstance(checkpoint, str):
+                checkpoint = get_checkpoint_store(checkpoint)
+            output_file_key = get_output_file_key(file_key)
+            if auto_detect_pii:
+                fields_list = partial(detect_pii_fields,
+                                      use_gpt=auto_detect_pii_gpt,
+                                      obfuscate_method=obfuscate_method)
+            stats = run_checkpointed_obfuscation(
+                s3_bucket, file_key, output_file_key, fields_list,
+                checkpoint, obfuscate_method, token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
+            logger.info(f"Checkpointed job stats: {stats}")
+            if manifest_record is not None:
+                manifest.put(manifest_record)
+            return ('Obfuscated file saved to s3://' +
+                    f'{s3_bucket}/{output_file_key}')
+
+        if partition_rows is not None or partition_bytes is not None or \
+                partition_by is not None:
+            if not if_save_to_s3:
+                raise ValueError("Partitioned output must be saved to " +
+                                 "storage")
+            message = _handle_partitioned_obfuscation(
+                storage_backend, s3_bucket, file_key, fields_list,
+                output_format if if_output_different_format else None,
+                chunk_size, chunk_bytes, auto_detect_pii,
+                auto_detect_pii_gpt, output_compression,
+                compression_level, compress_in_thread, parquet_compression,
+                parquet_compression_level, parquet_use_dictionary,
+                partition_rows, partition_bytes, partition_by,
+                obfuscate_method,
+                auto_detect_pii_ner,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+                arrow_strings=arrow_strings,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
+            if manifest_record is not None:
+                manifest.put(manifest_record)
+            return message
+
+        if output_formats is not None:
+            message = _handle_fan_out_obfuscation(
+                storage_backend, s3_bucket, file_key, fields_list,
+                output_formats, chunk_size, chunk_bytes, if_save_to_s3,
+                auto_detect_pii, auto_detect_pii_gpt, output_compression,
+                compression_level, compress_in_thread, parquet_compression,
+                parquet_compression_level, parquet_use_dictionary,
+                obfuscate_method,
+                max_memory_mb=max_memory_mb,
+                spill_dir=spill_dir,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+                arrow_strings=arrow_strings,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
+            if manifest_record is not None:
+                manifest.put(manifest_record)
+            return message
+
+        if pipelined:
+            message = _handle_pipelined_obfuscation(
+                storage_backend, s3_bucket, file_key, fields_list,
+                output_format if if_output_different_format else None,
+                chunk_size, chunk_bytes, if_save_to_s3, auto_detect_pii,
+                auto_detect_pii_gpt, output_compression,
+                compression_level, compress_in_thread, parquet_compression,
+                parquet_compression_level, parquet_use_dictionary,
+                obfuscate_method,
+                max_memory_mb=max_memory_mb,
+                spill_dir=spill_dir,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+                arrow_strings=arrow_strings,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
+            if manifest_record is not None:
+                manifest.put(manifest_record)
+            return message
+
+        if columns is not None or row_filter is not None:
+            content_str, file_extension, _ = read_projected_file(
+                s3_bucket, file_key, columns, row_filter,
+                None if read_file is read_s3_file else storage_backend)
+            if columns is not None and not auto_detect_pii:
+                # PII columns left out of the projection are not output
+                fields_list = [f for f in fields_list if f in columns]
+        else:
+            content_str, file_extension = read_file(s3_bucket, file_key)
+
+        if auto_detect_pii:
+            df_step = read_sample(content_str, file_extension)
+            fields_list = detect_pii_fields(
+                list(df_step.columns), auto_detect_pii_gpt,
+                obfuscate_method,
+                df_step if auto_detect_pii_ner else None)
 
         if if_output_different_format:
             logger.info(f"Obfuscating file to {output_format} format")
             content_BytesIO = obfuscate_file(
                 content_str, fields_list, file_extension,
-                output_format, chunk_size)
+                output_format, chunk_size, obfuscate_method,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+                csv_passthrough=csv_passthrough,
+                chunked_conversion=chunked_conversion,
+                row_group_size=row_group_size,
+                parquet_compression=parquet_compression,
+                parquet_compression_level=parquet_compression_level,
+                parquet_use_dictionary=parquet_use_dictionary,
+                chunk_bytes=chunk_bytes,
+                arrow_strings=arrow_strings,
+                engine=engine,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
         else:
             logger.info("Obfuscating file in original format")
             content_BytesIO = obfuscate_file(
                 content_str, fields_list, file_extension,
-                chunk_size=chunk_size)
+                chunk_size=chunk_size,
+                obfuscate_method=obfuscate_method,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+                csv_passthrough=csv_passthrough,
+                chunked_conversion=chunked_conversion,
+                row_group_size=row_group_size,
+                parquet_compression=parquet_compression,
+                parquet_compression_level=parquet_compression_level,
+                parquet_use_dictionary=parquet_use_dictionary,
+                chunk_bytes=chunk_bytes,
+                arrow_strings=arrow_strings,
+                engine=engine,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map)
 
         if if_save_to_s3:
-            input_folder_name = file_key.split('/')[0]
-            output_file_key = file_key.replace(input_folder_name,
-                                               "processed_data")
-            write_s3_file(s3_bucket, output_file_key, content_BytesIO)
-            logger.info("Saving obfuscated file to s3:" +
-                        f"//{s3_bucket}/{output_file_key}")
-            return ('Obfuscated file saved to s3://' +
+            output_file_key = get_output_file_key(file_key,
+                                                  output_compression)
+            write_file(s3_bucket, output_file_key, content_BytesIO,
+                       compression_level=compression_level,
+                       compress_in_thread=compress_in_thread)
+            logger.info("Saving obfuscated file to " +
+                        f"{s3_bucket}/{output_file_key}")
+            if manifest_record is not None:
+                manifest.put(manifest_record)
+            if read_file is read_s3_file:
+                return ('Obfuscated file saved to s3://' +
+                        f'{s3_bucket}/{output_file_key}')
+            return (f'Obfuscated file saved to {storage_backend.name}://' +
                     f'{s3_bucket}/{output_file_key}')
         else:
             return content_BytesIO
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise Exception(str(e))
+    finally:
+        for resource in opened:
+            resource.close()
 
 
 def main():
@@ -115,9 +1058,17 @@ def main():
     parser.add_argument(
             "--output_format",
             type=str,
-            choices=["csv", "json", "parquet"],
+            choices=FILE_TYPES,
+            default=None,
+            help="Output file format. Choose from " + ", ".join(FILE_TYPES)
+            + "."
+        )
+    parser.add_argument(
+            '--output_formats',
+            type=lambda value: value.split(","),
             default=None,
-            help="Output file format. Choose from csv, json, parquet."
+            help='Comma-separated output formats, e.g. parquet,csv, ' +
+                 'all written from one read of the file.'
         )
     parser.add_argument(
             '--chunk_size',
@@ -140,6 +1091,215 @@ def main():
             action='store_true',
             help='Automatically detect PII fields using GPT model.'
         )
+    parser.add_argument(
+            '--auto_detect_pii_ner',
+            action='store_true',
+            help='Automatically detect PII fields from sampled values ' +
+                 'using a local NER model.'
+        )
+    parser.add_argument(
+            '--csv_schema',
+            type=json.loads,
+            default=None,
+            help='JSON object of csv column to pandas dtype, e.g. ' +
+                 '\'{"student_id": "Int64", "name": "str"}\', used to ' +
+                 'read every chunk.'
+        )
+    parser.add_argument(
+            '--infer_schema',
+            action='store_true',
+            help='Infer the csv schema once and read every chunk with it.'
+        )
+    parser.add_argument(
+            '--raw_non_pii',
+            action='store_true',
+            help='Pass non-PII csv columns through as raw strings.'
+        )
+    parser.add_argument(
+            '--csv_engine',
+            type=str,
+            choices=["c", "pyarrow"],
+            default="c",
+            help='CSV parser to use. Default is c.'
+        )
+    parser.add_argument(
+            '--csv_passthrough',
+            action='store_true',
+            help='For csv to csv, only rewrite the PII fields.'
+        )
+    parser.add_argument(
+            '--chunked_conversion',
+            action='store_true',
+            help='Convert to json/parquet in row groups.'
+        )
+    parser.add_argument(
+            '--row_group_size',
+            type=int,
+            default=100000,
+            help='Rows per row group. Default is 100000.'
+        )
+    parser.add_argument(
+            '--output_compression',
+            type=str,
+            choices=["gzip", "zstd", "bz2"],
+            default=None,
+            help='Compress csv/json output with gzip, zstd or bz2.'
+        )
+    parser.add_argument(
+            '--parquet_compression',
+            type=str,
+            default="snappy",
+            help='Parquet compression codec. Default is snappy.'
+        )
+    parser.add_argument(
+            '--compression_level',
+            type=int,
+            default=None,
+            help='Compression level of the --output_compression codec.'
+        )
+    parser.add_argument(
+            '--parquet_compression_level',
+            type=int,
+            default=None,
+            help='Compression level of the Parquet codec.'
+        )
+    parser.add_argument(
+            '--no_parquet_dictionary',
+            dest='parquet_use_dictionary',
+            action='store_false',
+            help='If set, Parquet columns are not dictionary encoded.'
+        )
+    parser.add_argument(
+            '--compress_in_thread',
+            action='store_true',
+            help='Compress csv/json output on a worker thread.'
+        )
+    parser.add_argument(
+            '--storage_backend',
+            type=str,
+            choices=["s3", "local"],
+            default="s3",
+            help='Read and write files from s3 or the local filesystem.'
+        )
+    parser.add_argument(
+            '--pipelined',
+            action='store_true',
+            help='Overlap download, obfuscation and upload.'
+        )
+    parser.add_argument(
+            '--manifest',
+            type=str,
+            default=None,
+            help='SQLite file or s3://bucket/key recording processed ' +
+                 'inputs; unchanged inputs are skipped.'
+        )
+    parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=None,
+            help='Directory or s3://bucket/prefix for checkpoints of ' +
+                 'resumable csv jobs.'
+        )
+    parser.add_argument(
+            '--chunk_bytes',
+            type=int,
+            default=None,
+            help='Size chunks to this many bytes in memory instead of ' +
+                 'a fixed number of rows.'
+        )
+    parser.add_argument(
+            '--columns',
+            type=lambda value: value.split(","),
+            default=None,
+            help='Comma-separated columns to read and output.'
+        )
+    parser.add_argument(
+            '--row_filter',
+            type=parse_row_filter,
+            default=None,
+            help='JSON list of [column, operator, value] predicates ' +
+                 'rows must match to be read and output.'
+        )
+    parser.add_argument(
+            '--partition_rows',
+            type=int,
+            default=None,
+            help='Write the output as part files of at most this many rows.'
+        )
+    parser.add_argument(
+            '--partition_bytes',
+            type=int,
+            default=None,
+            help='Write the output as part files of about this many bytes.'
+        )
+    parser.add_argument(
+            '--partition_by',
+            type=str,
+            default=None,
+            help='Split the output part files by the value of this column.'
+        )
+    parser.add_argument(
+            '--redact_fields',
+            type=lambda value: value.split(","),
+            default=None,
+            help='Comma-separated free-text columns in which only the ' +
+                 'PII found inside the text is replaced.'
+        )
+    parser.add_argument(
+            '--tokenize_fields',
+            type=lambda value: value.split(","),
+            default=None,
+            help='Comma-separated fields replaced by reversible tokens ' +
+                 'kept in the encrypted token vault.'
+        )
+    parser.add_argument(
+            '--token_vault',
+            type=str,
+            default=None,
+            help='SQLite token vault, its key is read from ' +
+                 'OBFUSCATOR_VAULT_KEY.'
+        )
+    parser.add_argument(
+            '--pseudonymize_fields',
+            type=lambda value: value.split(","),
+            default=None,
+            help='Comma-separated fields replaced by pseudonyms that ' +
+                 'are the same in every file sharing the pseudonym map.'
+        )
+    parser.add_argument(
+            '--pseudonym_map',
+            type=str,
+            default=None,
+            help='SQLite pseudonym map shared by the jobs of a batch.'
+        )
+    parser.add_argument(
+            '--max_memory_mb',
+            type=int,
+            default=None,
+            help='Keep the job under this many MB of memory, shrinking ' +
+                 'chunks and spilling output parts to disk as needed.'
+        )
+    parser.add_argument(
+            '--spill_dir',
+            type=str,
+            default=None,
+            help='Directory of the output parts spilled under ' +
+                 '--max_memory_mb, the system temp directory by default.'
+        )
+    parser.add_argument(
+            '--arrow_strings',
+            action='store_true',
+            help='Keep string columns in Arrow buffers instead of ' +
+                 'Python objects, to cut the memory of each chunk.'
+        )
+    parser.add_argument(
+            '--engine',
+            type=str,
+            choices=ENGINE_NAMES,
+            default="pandas",
+            help='Engine running the job: pandas, arrow ' +
+                 '(pyarrow.compute) or duckdb.'
+        )
 
     try:
         args = parser.parse_args()
@@ -151,7 +1311,41 @@ def main():
                 chunk_size=args.chunk_size,
                 if_save_to_s3=args.if_not_save_to_s3,
                 auto_detect_pii=args.auto_detect_pii,
-                auto_detect_pii_gpt=args.auto_detect_pii_gpt
+                auto_detect_pii_gpt=args.auto_detect_pii_gpt,
+                infer_schema=args.infer_schema,
+                raw_non_pii=args.raw_non_pii,
+                csv_engine=args.csv_engine,
+                csv_passthrough=args.csv_passthrough,
+                chunked_conversion=args.chunked_conversion,
+                row_group_size=args.row_group_size,
+                output_compression=args.output_compression,
+                parquet_compression=args.parquet_compression,
+                compression_level=args.compression_level,
+                compress_in_thread=args.compress_in_thread,
+                storage_backend=args.storage_backend,
+                pipelined=args.pipelined,
+                chunk_bytes=args.chunk_bytes,
+                manifest=args.manifest,
+                checkpoint=args.checkpoint,
+                partition_rows=args.partition_rows,
+                partition_bytes=args.partition_bytes,
+                partition_by=args.partition_by,
+                columns=args.columns,
+                row_filter=args.row_filter,
+                redact_fields=args.redact_fields,
+                auto_detect_pii_ner=args.auto_detect_pii_ner,
+                tokenize_fields=args.tokenize_fields,
+                token_vault=args.token_vault,
+                pseudonymize_fields=args.pseudonymize_fields,
+                pseudonym_map=args.pseudonym_map,
+                arrow_strings=args.arrow_strings,
+                engine=args.engine,
+                output_formats=args.output_formats,
+                max_memory_mb=args.max_memory_mb,
+                spill_dir=args.spill_dir,
+                csv_schema=args.csv_schema,
+                parquet_compression_level=args.parquet_compression_level,
+                parquet_use_dictionary=args.parquet_use_dictionary
             )
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+import time
+from botocore.exceptions import ClientError
+from src.utils import get_s3_client
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+DEFAULT_S3_MANIFEST_KEY = "_manifest/obfuscation_manifest.json"
+# Conditional writes of the S3 manifest retried after a concurrent write
+MAX_PUT_ATTEMPTS = 5
+CONFLICT_ERROR_CODES = ["PreconditionFailed", "ConditionalRequestConflict"]
+
+
+def make_manifest_record(bucket: str, file_key: str, head: dict,
+                         fields: list[str] | str, method: str,
+                         output_key: str, output_format: str = None,
+                         options: dict = None) -> dict:
+    """
+    Build the manifest record of a processed input
+
+    Args:
+        bucket (str): bucket of the input
+        file_key (str): key of the input
+        head (dict): 'etag', 'version_id' and 'size' of the input,
+                     see StorageBackend.head
+        fields (list/str): obfuscated fields, or how they were detected
+                           ('auto'/'auto_gpt')
+        method (str): obfuscation method
+        output_key (str): key of the obfuscated file
+        output_format (str): format of the obfuscated file,
+                             None for the input format
+        options (dict): other settings the output depends on (codecs,
+                        engines, schema...), JSON serializable
+
+    Returns:
+        dict: manifest record
+    """
+    return {
+        "bucket": bucket,
+        "file_key": file_key,
+        "etag": head.get("etag"),
+        "version_id": head.get("version_id"),
+        "size": head.get("size"),
+        "fields": sorted(fields) if isinstance(fields, list) else fields,
+        "method": method,
+        "output_key": output_key,
+        "output_format": output_format,
+        "options": options or {},
+        "processed_at": time.time(),
+    }
+
+
+def is_unchanged(record: dict | None, candidate: dict) -> bool:
+    """
+    Whether a stored record matches the record a new run would write,
+    i.e. same input version and same obfuscation settings
+
+    Args:
+        record (dict): stored record, None if the input was never processed
+        candidate (dict): record of the new run
+
+    Returns:
+        bool: True if the input can be skipped
+    """
+    if record is None:
+        return False
+    return all(record.get(field) == candidate.get(field) for field in
+               ["etag", "version_id", "size", "fields", "method",
+                "output_key", "output_format", "options"])
+
+
+class ManifestStore:
+    """
+    Records which inputs were already obfuscated, so that re-runs skip
+    unchanged inputs without downloading them
+    """
+
+    def get(self, bucket: str, file_key: str) -> dict | None:
+        """
+        Returns:
+            dict: stored record of the input, None if never processed
+        """
+        raise NotImplementedError
+
+    def put(self, record: dict):
+        """
+        Store the record of a processed input, replacing any older one
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release the resources of the store
+        """
+
+
+class SQLiteManifestStore(ManifestStore):
+    """
+    Manifest in a local SQLite database
+
+    Args:
+        path (str): path of the database file, ':memory:' for tests
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS manifest ("
+                "bucket TEXT, file_key TEXT, record TEXT, "
+                "PRIMARY KEY (bucket, file_key))")
+
+    def get(self, bucket: str, file_key: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM manifest WHERE bucket = ? "
+                "AND file_key = ?", (bucket, file_key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, record: dict):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?)",
+                (record["bucket"], record["file_key"], json.dumps(record)))
+
+    def close(self):
+        self._connection.close()
+
+
+class S3ManifestStore(ManifestStore):
+    """
+    Manifest kept as one JSON object in S3, loaded once and written
+    back after every put. Writes are conditional on the ETag of the
+    object loaded, so that a job writing the manifest concurrently is
+    not overwritten: the manifest is then reloaded and the put retried.
+
+    Args:
+        bucket (str): bucket of the manifest object
+        key (str): key of the manifest object
+    """
+
+    def __init__(self, bucket: str, key: str = DEFAULT_S3_MANIFEST_KEY):
+        self.bucket = bucket
+        self.key = key
+        self._lock = threading.Lock()
+        self._records = None
+        self._etag = None
+
+    def _load(self) -> dict:
+        if self._records is None:
+            s3_client = get_s3_client()
+            try:
+                response = s3_client.get_object(Bucket=self.bucket,
+                                                Key=self.key)
+                self._records = json.loads(response["Body"].read())
+                self._etag = response["ETag"]
+            except s3_client.exceptions.NoSuchKey:
+                logger.info(f"No manifest at {self.bucket}/{self.key}, " +
+                            "starting a new one")
+                self._records = {}
+                self._etag = None
+        return self._records
+
+    def get(self, bucket: str, file_key: str) -> dict | None:
+        with self._lock:
+            return self._load().get(f"{bucket}/{file_key}")
+
+    def put(self, record: dict):
+        with self._lock:
+            for attempt in range(1, MAX_PUT_ATTEMPTS + 1):
+                records = self._load()
+                records[f"{record['bucket']}/{record['file_key']}"] = record
+                # Only written over the version loaded, or created
+                condition = {"IfMatch": self._etag} if self._etag \
+                    else {"IfNoneMatch": "*"}
+                try:
+                    response = get_s3_client().put_object(
+                        Bucket=self.bucket, Key=self.key,
+                        Body=json.dumps(records).encode("utf8"),
+                        **condition)
+                except ClientError as e:
+                    code = e.response["Error"]["Code"]
+                    if code not in CONFLICT_ERROR_CODES or \
+                            attempt == MAX_PUT_ATTEMPTS:
+                        raise
+                    logger.warning(f"Manifest {self.bucket}/{self.key} " +
+                                   "was written concurrently, reloading " +
+                                   f"it (attempt {attempt})")
+                    self._records = None
+                    continue
+                self._etag = response["ETag"]
+                return
+
+
+def get_manifest_store(location: str) -> ManifestStore:
+    """
+    Build a manifest store from its location:
+    "s3://<bucket>/<key>" for S3, otherwise the path of a SQLite file
+
+    Args:
+        location (str): where the manifest is kept
+
+    Returns:
+        ManifestStore: the manifest store
+    """
+    if location.startswith("s3://"):
+        bucket, _, key = location[5:].partition("/")
+        return S3ManifestStore(bucket, key or DEFAULT_S3_MANIFEST_KEY)
+    return SQLiteManifestStore(location)
@@ -0,0 +1,289 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import pandas as pd
+from src.chunk_sizing import ChunkSizer, MIN_CHUNK_ROWS, SAMPLE_ROWS
+from src.setup_logger import setup_logger
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+logger = setup_logger(__name__)
+
+MB = 1024 * 1024
+# Share of max_memory_mb above which chunks shrink and output parts
+# are spilled to disk; above max_memory_mb the obfuscation waits
+SOFT_LIMIT_FRACTION = 0.8
+# The RSS seldom drops once memory is freed, so over the soft limit
+# chunks are only halved again once the RSS has grown by this share of
+# the limit since they were last halved
+SHRINK_STEP_FRACTION = 0.05
+POLL_SECONDS = 0.05
+MAX_WAIT_SECONDS = 5.0
+
+
+class SpilledPart:
+    """
+    Output part written to a file of the spill directory instead of
+    being held in memory until it is uploaded
+
+    Args:
+        path (str): file holding the part
+        size (int): bytes of the part
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+    def read(self) -> bytes:
+        """
+        Read the part back and delete its file
+
+        Returns:
+            bytes: the part
+        """
+        with open(self.path, "rb") as part_file:
+            data = part_file.read()
+        os.remove(self.path)
+        return data
+
+
+def estimate_bytes(item) -> int:
+    """
+    Memory held by a pipeline buffer: the length of bytes, the
+    estimated deep memory of a DataFrame (measured on a sample)
+
+    Args:
+        item: bytes, pd.DataFrame or SpilledPart
+
+    Returns:
+        int: estimated bytes in memory
+    """
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return len(item)
+    if isinstance(item, pd.DataFrame):
+        if len(item) == 0:
+            return 0
+        sample = item.iloc[:SAMPLE_ROWS]
+        return int(sample.memory_usage(index=False, deep=True).sum()
+                   * len(item) / len(sample))
+    return 0
+
+
+class MemoryGovernor:
+    """
+    Keep a job under a memory limit. The RSS of the process is measured
+    with psutil, and the buffers in flight between the pipeline stages
+    (downloaded blocks, obfuscated chunks, output parts) are tracked
+    per stage. Above the soft limit, the next chunks are made smaller
+    and output parts are spilled to a local temp directory until they
+    are uploaded; above the limit, the obfuscation waits for the
+    buffers in flight to drain (backpressure). Chunks are halved when
+    the RSS crosses the soft limit, and again only as it keeps growing.
+    A DataFrame sent to
+    several channels (the chunk shared by the writers of a fan-out) is
+    counted once, until the last channel releases it.
+
+    Args:
+        max_memory_mb (int): memory limit of the process in MB
+        spill_dir (str): directory of the spilled parts, the system
+                         temp directory by default
+        soft_limit_fraction (float): share of the limit above which
+                                     chunks shrink and parts spill
+        shrink_step_fraction (float): share of the limit the RSS must
+            grow by before chunks are halved again
+        max_wait_seconds (float): longest wait for buffers to drain
+                                  per chunk, so a job never stalls
+    """
+
+    def __init__(self, max_memory_mb: int, spill_dir: str = None,
+                 soft_limit_fraction: float = SOFT_LIMIT_FRACTION,
+                 max_wait_seconds: float = MAX_WAIT_SECONDS,
+                 shrink_step_fraction: float = SHRINK_STEP_FRACTION):
+        if psutil is None:
+            raise ImportError("The memory governor requires the " +
+                              "psutil package")
+        if max_memory_mb <= 0:
+            raise ValueError("max_memory_mb must be positive")
+        self.max_bytes = max_memory_mb * MB
+        self.soft_bytes = int(self.max_bytes * soft_limit_fraction)
+        self.shrink_step_bytes = int(self.max_bytes * shrink_step_fraction)
+        # RSS at the last shrink, None while under the soft limit
+        self._shrink_rss = None
+        self.spill_dir = spill_dir
+        self.max_wait_seconds = max_wait_seconds
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._spill_path = None
+        self._spill_count = 0
+        self.in_flight = {}
+        # id of a DataFrame in flight -> [stage counted, bytes, channels]
+        self._shared = {}
+        self.stats = {"peak_rss_mb": 0.0, "peak_in_flight_mb": 0.0,
+                      "shrinks": 0, "spilled_parts": 0,
+                      "spilled_mb": 0.0, "wait_seconds": 0.0}
+
+    def rss_bytes(self) -> int:
+        """
+        Returns:
+            int: resident memory of the process in bytes
+        """
+        rss = self._process.memory_info().rss
+        self.stats["peak_rss_mb"] = max(self.stats["peak_rss_mb"],
+                                        rss / MB)
+        return rss
+
+    def in_flight_bytes(self, exclude: str = None) -> int:
+        """
+        Args:
+            exclude (str): stage whose buffers are not counted
+
+        Returns:
+            int: bytes of the buffers in flight
+        """
+        with self._lock:
+            return sum(size for stage, size in self.in_flight.items()
+                       if stage != exclude)
+
+    def over_soft_limit(self) -> bool:
+        return self.rss_bytes() > self.soft_bytes
+
+    def admit(self, stage: str, item, spill: bool = False):
+        """
+        Track a buffer entering a channel. An output part is spilled to
+        disk instead, when spill is set and memory is over the soft
+        limit.
+
+        Args:
+            stage (str): stage the buffer is sent to, e.g 'upload'
+            item: bytes or pd.DataFrame
+            spill (bool): If True, bytes may be spilled to disk
+
+        Returns:
+            the item, or a SpilledPart holding it
+        """
+        if spill and isinstance(item, bytes) and self.over_soft_limit():
+            return self._spill(item)
+        key = id(item) if isinstance(item, pd.DataFrame) else None
+        with self._lock:
+            shared = self._shared.get(key)
+            if shared is not None:
+                shared[2] += 1
+                return item
+        size = estimate_bytes(item)
+        with self._lock:
+            self.in_flight[stage] = self.in_flight.get(stage, 0) + size
+            if key is not None:
+                self._shared[key] = [stage, size, 1]
+            total = sum(self.in_flight.values())
+        self.stats["peak_in_flight_mb"] = max(
+            self.stats["peak_in_flight_mb"], total / MB)
+        return item
+
+    def release(self, stage: str, item):
+        """
+        Untrack a buffer leaving a channel, reading back spilled parts
+
+        Args:
+            stage (str): stage the buffer was sent to
+            item: the item returned by admit
+
+        Returns:
+            the original item
+        """
+        if isinstance(item, SpilledPart):
+            return item.read()
+        key = id(item) if isinstance(item, pd.DataFrame) else None
+        with self._lock:
+            shared = self._shared.get(key)
+            if shared is None:
+                size = estimate_bytes(item)
+            else:
+                shared[2] -= 1
+                if shared[2]:
+                    return item
+                del self._shared[key]
+                stage, size = shared[0], shared[1]
+            self.in_flight[stage] = self.in_flight.get(stage, 0) - size
+        return item
+
+    def throttle(self, sizer: ChunkSizer, stage: str = "obfuscate"):
+        """
+        Called by the obfuscation stage before reading the next chunk:
+        crossing the soft limit halves the next chunks, and so does
+        every further shrink_step_bytes of RSS growth; over the limit
+        it waits while the buffers of the later stages drain
+
+        Args:
+            sizer (ChunkSizer): sizer of the chunks being read
+            stage (str): the calling stage, its own input buffers cannot
+                         drain while it waits
+        """
+        rss = self.rss_bytes()
+        if rss <= self.soft_bytes:
+            self._shrink_rss = None
+            return
+        if self._shrink_rss is None or \
+                rss > self._shrink_rss + self.shrink_step_bytes:
+            self._shrink_rss = rss
+            self._shrink(sizer, rss)
+        start = time.perf_counter()
+        while rss > self.max_bytes and self.in_flight_bytes(stage) > 0 and \
+                time.perf_counter() - start < self.max_wait_seconds:
+            time.sleep(POLL_SECONDS)
+            rss = self.rss_bytes()
+        waited = time.perf_counter() - start
+        if waited >= POLL_SECONDS:
+            self.stats["wait_seconds"] += waited
+            logger.warning(f"Waited {waited:.2f}s for buffers in flight, " +
+                           f"RSS {rss / MB:.0f} MB")
+
+    def _shrink(self, sizer: ChunkSizer, rss: int):
+        if sizer.rows <= MIN_CHUNK_ROWS and not sizer.adaptive:
+            return
+        sizer.rows = max(MIN_CHUNK_ROWS, sizer.rows // 2)
+        if sizer.adaptive:
+            # The next rows are sized from the byte budget
+            sizer.target_bytes = max(1, sizer.target_bytes // 2)
+        self.stats["shrinks"] += 1
+        logger.warning(f"RSS {rss / MB:.0f} MB over the soft limit, " +
+                       f"next chunks {sizer.rows} rows")
+
+    def _spill(self, data: bytes) -> SpilledPart:
+        with self._lock:
+            if self._spill_path is None:
+                self._spill_path = tempfile.mkdtemp(
+                    prefix="obfuscator-spill-", dir=self.spill_dir)
+            self._spill_count += 1
+            path = os.path.join(self._spill_path,
+                                f"part-{self._spill_count:06d}")
+        with open(path, "wb") as part_file:
+            part_file.write(data)
+        self.stats["spilled_parts"] += 1
+        self.stats["spilled_mb"] += len(data) / MB
+        logger.debug(f"Spilled {len(data)} bytes to {path}")
+        return SpilledPart(path, len(data))
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: 'max_memory_mb', 'peak_rss_mb', 'peak_in_flight_mb',
+                  'shrinks' (times chunks were halved), 'spilled_parts',
+                  'spilled_mb' and 'wait_seconds' (backpressure)
+        """
+        return {"max_memory_mb": self.max_bytes / MB,
+                **{name: round(value, 3) if isinstance(value, float)
+                   else value for name, value in self.stats.items()}}
+
+    def close(self):
+        """
+        Remove the spill directory and any part left in it
+        """
+        if self._spill_path is not None:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
@@ -0,0 +1,204 @@
+import hashlib
+import random
+from typing import Callable
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from src.arrow_strings import map_valid
+from src.redaction import Redactor
+from src.tokenization import TokenVault, get_token_vault
+from src.pseudonym_map import PseudonymMap, get_pseudonym_map
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+VALID_METHODS = ["mask", "hash", "random_hash", "replace", "redact",
+                 "tokenize", "pseudonymize"]
+# Methods of make_array_obfuscator, the others have column functions
+# (redact_series, tokenize_series, pseudonymize_series)
+ARRAY_METHODS = ["mask", "hash", "random_hash", "replace"]
+
+
+def draw_salt() -> str:
+    """
+    Draw a random salt for the 'random_hash' method
+
+    Returns:
+        str: the salt
+    """
+    return str(random.randint(0, 99999))
+
+
+def validate_method(obfuscate_method: str | dict[str, str]):
+    """
+    Raise ValueError for an unknown obfuscation method
+
+    Args:
+        obfuscate_method (str/dict): a method, or a dict of field to
+            method, see get_field_method
+    """
+    methods = obfuscate_method.values() \
+        if isinstance(obfuscate_method, dict) else [obfuscate_method]
+    for method in methods:
+        if method not in VALID_METHODS:
+            logger.error(f"Invalid method: {method}. " +
+                         f"Accepted methods are {VALID_METHODS}.")
+            raise ValueError(
+                f"Unknown method: {method}. " +
+                "Only 'mask', 'hash', 'random_hash', 'replace', " +
+                "'redact', 'tokenize' or 'pseudonymize' are accepted."
+            )
+
+
+def get_field_method(obfuscate_method: str | dict[str, str],
+                     field: str) -> str:
+    """
+    Method obfuscating a field. A dict gives the method of each field,
+    e.g. {"notes": "redact"}; fields missing from it are replaced.
+
+    Args:
+        obfuscate_method (str/dict): a method for every field, or a
+            dict of field to method
+        field (str): PII field
+
+    Returns:
+        str: method of the field
+    """
+    if isinstance(obfuscate_method, dict):
+        return obfuscate_method.get(field, "replace")
+    return obfuscate_method
+
+
+def make_value_obfuscator(method: str = "replace", salt: str = None,
+                          token_vault: TokenVault = None,
+                          pseudonym_map: PseudonymMap = None
+                          ) -> Callable[[str], str]:
+    """
+    Build a function that obfuscates a single string value
+
+    Args:
+        method (str)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/'tokenize'/
+            'pseudonymize']:
+            how to obfuscate the value, default to be 'replace'.
+            'redact' only replaces the PII found inside free text,
+            see Redactor. 'tokenize' replaces values by reversible
+            tokens kept in the token vault, see TokenVault.
+            'pseudonymize' replaces values by random pseudonyms shared
+            across files, see PseudonymMap.
+            For 'random_hash' a new salt is drawn each time this
+            function is called, so one obfuscator should be built
+            per field.
+        salt (str): salt for 'random_hash', drawn when None. Passing
+            the same salt again reproduces the same hashes, e.g. when
+            a job is resumed.
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
+
+    Returns:
+        Callable[[str], str]: function obfuscating one value
+    """
+    if method == "mask":
+        return lambda x: (
+            x[0] + "*" * (len(x) - 2) + x[-1]
+            if len(x) > 2
+            else "*" * len(x)
+        )
+    elif method == "hash":
+        return lambda x: hashlib.sha256(x.encode('utf-8')).hexdigest()
+    elif method == "random_hash":
+        if salt is None:
+            salt = draw_salt()
+        logger.debug(f"Random hashing with salt {salt}")
+        return lambda x: hashlib.sha256(
+            (x + salt).encode('utf-8')).hexdigest()
+    elif method == "replace":
+        return lambda x: "***"
+    elif method == "redact":
+        return Redactor().redact
+    elif method == "tokenize":
+        if token_vault is None:
+            token_vault = get_token_vault()
+        return token_vault.tokenize_value
+    elif method == "pseudonymize":
+        if pseudonym_map is None:
+            pseudonym_map = get_pseudonym_map()
+        return pseudonym_map.pseudonymize_value
+    validate_method(method)
+
+
+def make_batch_obfuscator(method: str = "replace", salt: str = None,
+                          token_vault: TokenVault = None,
+                          pseudonym_map: PseudonymMap = None
+                          ) -> Callable[[list[str]], list[str]]:
+    """
+    Build a function obfuscating a list of string values at once, for
+    callers collecting the values of a batch of records: 'tokenize' and
+    'pseudonymize' then cost one vault or map call per batch instead of
+    one per value
+
+    Args:
+        method (str): how to obfuscate the values,
+                      see make_value_obfuscator
+        salt (str): salt for 'random_hash', drawn when None
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
+
+    Returns:
+        Callable[[list[str]], list[str]]: function obfuscating values
+    """
+    if method == "tokenize":
+        if token_vault is None:
+            token_vault = get_token_vault()
+        return token_vault.tokenize
+    elif method == "pseudonymize":
+        if pseudonym_map is None:
+            pseudonym_map = get_pseudonym_map()
+        return pseudonym_map.pseudonymize
+    obfuscate_value = make_value_obfuscator(method, salt)
+    return lambda values: [obfuscate_value(value) for value in values]
+
+
+def make_array_obfuscator(method: str = "replace",
+                          salt: str = None) -> Callable[[pa.Array], pa.Array]:
+    """
+    Build a function obfuscating a whole Arrow string array, giving the
+    same values as make_value_obfuscator without a Python object per
+    cell: 'replace' and 'mask' run as pyarrow.compute kernels over the
+    string buffer. Nulls are kept, except by 'replace'.
+
+    Args:
+        method (str) ['mask'/'hash'/'random_hash'/'replace']:
+            how to obfuscate the values, see make_value_obfuscator
+        salt (str): salt for 'random_hash', drawn when None
+
+    Returns:
+        Callable[[pa.Array], pa.Array]: function obfuscating an array
+    """
+    if method == "replace":
+        return lambda array: pa.array(["***"], type=pa.string()).take(
+            np.zeros(len(array), dtype=np.int32))
+    elif method == "mask":
+        return _mask_array
+    elif method in ["hash", "random_hash"]:
+        hash_value = make_value_obfuscator(method, salt)
+        return lambda array: map_valid(
+            array, lambda values: [hash_value(value) for value in values])
+    validate_method(method)
+    raise ValueError(f"No array function for method: {method}")
+
+
+def _mask_array(array: pa.Array) -> pa.Array:
+    length = pc.utf8_length(array)
+    is_long = pc.greater(length, 2)
+    stars = pc.binary_repeat(
+        "*", pc.if_else(is_long, pc.subtract(length, 2), length))
+    first = pc.if_else(is_long, pc.utf8_slice_codeunits(array, 0, 1), "")
+    last = pc.if_else(is_long, pc.utf8_slice_codeunits(array, -1), "")
+    return pc.binary_join_element_wise(first, stars, last, "")
@@ -1,18 +1,60 @@
 import pandas as pd
 import io
 import ijson
-from typing import Literal
+import tempfile
+from typing import BinaryIO, Callable, Iterator, Literal
 import pyarrow.parquet as pq
-import hashlib
-import random
 from src.setup_logger import setup_logger
+from src.csv_schema import (
+    infer_csv_schema,
+    build_csv_dtype,
+    read_csv_chunks,
+    read_csv_columns,
+    RewindableReader,
+)
+from src.obfuscation_methods import (
+    validate_method,
+    get_field_method,
+    make_value_obfuscator,
+    make_array_obfuscator,
+    ARRAY_METHODS,
+)
+from src.arrow_strings import (
+    arrow_types_mapper,
+    is_arrow_string,
+    string_array,
+    string_series,
+    to_arrow_strings,
+)
+from src.redaction import redact_series
+from src.tokenization import TokenVault, tokenize_series
+from src.pseudonym_map import PseudonymMap, pseudonymize_series
+from src.csv_passthrough import rewrite_csv_pii_fields
+from src.engines import get_engine
+from src.file_formats import (
+    FILE_TYPES,
+    BATCH_FILE_TYPES,
+    iter_record_batches,
+)
+from src.chunk_writers import get_chunk_writer
+from src.chunk_sizing import ChunkSizer, as_chunk_sizer, rebatch
+from src.json_paths import (
+    is_json_path,
+    JsonRecordTransformer,
+    obfuscate_json_records,
+)
 
 
 logger = setup_logger(__name__)
 
+# Output of a chunked conversion held in memory up to this size before
+# it is spooled to a temporary file
+SPOOL_BYTES = 64 * 1024 * 1024
+
 
 def obfuscate_fields_in_df(
-    df: pd.DataFrame, fields_list: list, method: str = "replace"
+    df: pd.DataFrame, fields_list: list, method: str | dict = "replace",
+    token_vault: TokenVault = None, pseudonym_map: PseudonymMap = None,
 ) -> pd.DataFrame:
     """
     Obfuscates the specified fields in the provided Dataframe
@@ -20,8 +62,10 @@ def obfuscate_fields_in_df(
     Args:
         df (pd.DataFrame): Dataframe to obfuscate
         fields_list (list): fields to be obfuscated
-        method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'replace'
+        method (str/dict) ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'replace', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                       (e.g., "j********e").
@@ -31,48 +75,51 @@ def obfuscate_fields_in_df(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                          with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                        (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                          in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                              the same in every file, see PseudonymMap.
+        token_vault (TokenVault): vault of 'tokenize',
+                                  get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+                                      get_pseudonym_map() when None
 
     Returns:
         pd.DataFrame: Dataframe with specified fields obfuscated
     """
     logger.info(f"Obfuscating fields: {fields_list} with method: {method}")
-    valid_methods = ["mask", "hash", "random_hash", "replace"]
-    if method not in valid_methods:
-        logger.error(f"Invalid method: {method}. " +
-                     f"Accepted methods are {valid_methods}.")
-        raise ValueError(
-            f"Unknown method: {method}. "
-            + "Only 'mask', 'hash', 'random_hash', or 'replace' are accepted."
-        )
+    validate_method(method)
     for field in fields_list:
         if field in df.columns:
+            field_method = get_field_method(method, field)
             try:
-                if method == "mask":
-                    logger.debug(f"Masking field: {field}")
-                    df[field] = df[field].apply(
-                        lambda x: (
-                            x[0] + "*" * (len(x) - 2) + x[-1]
-                            if len(x) > 2
-                            else "*" * len(x)
-                        )
-                    )
-                elif method == "hash":
-                    logger.debug(f"Hashing field: {field}")
-                    df[field] = df[field].apply(
-                            lambda x: hashlib.sha256(
-                                x.encode('utf-8')).hexdigest()
-                        )
-                elif method == 'random_hash':
-                    salt = str(random.randint(0, 99999))
-                    logger.debug("Random hashing field: " +
-                                 f"{field} with salt {salt}")
-                    df[field] = df[field].apply(
-                            lambda x: hashlib.sha256(
-                                (x+salt).encode('utf-8')).hexdigest()
-                        )
-                elif method == 'replace':
+                if field_method in ARRAY_METHODS and \
+                        is_arrow_string(df[field]):
+                    logger.debug(f"Applying {field_method} to Arrow " +
+                                 f"field: {field}")
+                    df[field] = string_series(
+                        make_array_obfuscator(field_method)(
+                            string_array(df[field])), df[field])
+                elif field_method == 'replace':
                     logger.debug(f"Replacing field: {field} with '***'")
                     df[field] = "***"
+                elif field_method == 'redact':
+                    logger.debug(f"Redacting PII in field: {field}")
+                    df[field] = redact_series(df[field])
+                elif field_method == 'tokenize':
+                    logger.debug(f"Tokenizing field: {field}")
+                    df[field] = tokenize_series(df[field], token_vault)
+                elif field_method == 'pseudonymize':
+                    logger.debug(f"Pseudonymizing field: {field}")
+                    df[field] = pseudonymize_series(df[field],
+                                                    pseudonym_map)
+                else:
+                    logger.debug(f"Applying {field_method} to field: " +
+                                 f"{field}")
+                    df[field] = df[field].apply(
+                        make_value_obfuscator(field_method))
             except Exception as e:
                 logger.error(
                     "Unexpected error occurred while processing field: " +
@@ -90,7 +137,9 @@ def process_df_chunk(
     fields_list: list[str],
     output: io.BytesIO,
     is_first_chunk: bool,
-    obfuscate_method: str = "replace",
+    obfuscate_method: str | dict[str, str] = "replace",
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
 ):
     """
     Process df, obfuscating the specified fields
@@ -102,8 +151,11 @@ def process_df_chunk(
         fields_list (list): fields to be obfuscated
         output (io.BytesIO): Byte system to write the output
         is_first_chunk (bool): Whether this is the first chunk
-        obfuscate_method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'repalce'
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'repalce', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                 (e.g., "j********e").
@@ -113,13 +165,25 @@ def process_df_chunk(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                 with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                the same in every file, see PseudonymMap.
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
     """
     logger.info(f"Processing chunk of size {len(chunk)}")
     try:
         obfuscated_df = obfuscate_fields_in_df(
                                                 chunk,
                                                 fields_list,
-                                                obfuscate_method)
+                                                obfuscate_method,
+                                                token_vault,
+                                                pseudonym_map)
         obfuscated_df.to_csv(output, index=False, header=is_first_chunk)
         logger.info("Chunk processed and written to output.")
     except Exception as e:
@@ -127,12 +191,225 @@ def process_df_chunk(
         raise
 
 
+def iter_csv_chunks(
+    file_content: str | BinaryIO,
+    fields_list: list[str],
+    chunk_size: int | ChunkSizer,
+    csv_schema: dict[str, str] = None,
+    infer_schema: bool = False,
+    raw_non_pii: bool = False,
+    csv_engine: Literal["c", "pyarrow"] = "c",
+    arrow_strings: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read CSV data as DataFrame chunks, with a fixed schema when one is
+    given or inferred
+
+    Args:
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        fields_list (list): fields to be obfuscated
+        chunk_size (int/ChunkSizer): number of rows per chunk,
+            or a ChunkSizer sizing chunks to a byte budget
+        csv_schema (dict): column name to pandas dtype name used to read
+            every chunk; only these columns are read. None by default
+        infer_schema (bool): If True and no csv_schema is given, infer
+            the schema once from a sample instead of per chunk; a value
+            that does not fit makes its column str in the first chunk
+            and raises after it, see cast_csv_chunk
+        raw_non_pii (bool): If True, non-PII columns are read as raw
+            strings with no type conversion
+        csv_engine (str) ['c'/'pyarrow']: csv parser, default to be 'c';
+            'pyarrow' always reads with a sampled schema
+        arrow_strings (bool): If True, string columns are Arrow-backed
+                              (ARROW_STRING) instead of object columns
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks of the CSV
+    """
+    usecols = list(csv_schema) if csv_schema is not None else None
+    samples = csv_schema is None and (
+        infer_schema or raw_non_pii or csv_engine == "pyarrow")
+    if samples and not isinstance(file_content, str) and \
+            not file_content.seekable():
+        # Sampling rewinds the stream, the bytes it read are replayed
+        file_content = io.BufferedReader(RewindableReader(file_content))
+    # The pyarrow reader fixes types from its first block, so it is
+    # given a schema sampled from the file
+    if csv_schema is None and (infer_schema or csv_engine == "pyarrow"):
+        csv_schema = infer_csv_schema(file_content)
+    dtype = None
+    if csv_schema is not None:
+        dtype = build_csv_dtype(csv_schema, fields_list, raw_non_pii)
+    elif raw_non_pii:
+        # Only the non-PII columns need a dtype, the header is enough
+        dtype = {column: "str" for column in read_csv_columns(file_content)
+                 if column not in fields_list}
+    return read_csv_chunks(file_content, chunk_size, dtype=dtype,
+                           usecols=usecols, engine=csv_engine,
+                           arrow_strings=arrow_strings)
+
+
+def iter_json_chunks(
+    file_content: str | BinaryIO, chunk_size: int | ChunkSizer,
+    transform: Callable[[list[dict]], list[dict]] = None,
+    arrow_strings: bool = False,
+    json_lines: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the objects of a JSON array (or of JSON Lines, as written by
+    the json chunk writer) as DataFrame chunks
+
+    Args:
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        chunk_size (int/ChunkSizer): number of objects per chunk,
+            or a ChunkSizer sizing chunks to a byte budget
+        transform (Callable): applied to the objects of each chunk
+            before they become a DataFrame,
+            e.g. JsonRecordTransformer.transform_records
+        arrow_strings (bool): If True, string columns are Arrow-backed
+                              (ARROW_STRING) instead of object columns
+        json_lines (bool): If True, the content is one object per line
+                           instead of a JSON array
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks of the JSON array
+    """
+    sizer = as_chunk_sizer(chunk_size)
+    if isinstance(file_content, str):
+        file_content = file_content.encode("utf8")
+    to_df = (lambda objs: to_arrow_strings(pd.DataFrame(objs))) \
+        if arrow_strings else pd.DataFrame
+    chunk = []
+    if transform is not None:
+        build_df = to_df
+        to_df = (lambda objs: build_df(transform(objs)))
+    objs = ijson.items(file_content, "", multiple_values=True) \
+        if json_lines else ijson.items(file_content, "item")
+    for obj in objs:
+        chunk.append(obj)
+        if len(chunk) >= sizer.rows:
+            yield sizer.observe(to_df(chunk))
+            chunk = []
+    if chunk:
+        logger.info("Processed remaining JSON objects.")
+        yield sizer.observe(to_df(chunk))
+
+
+def iter_parquet_chunks(
+    file_content: BinaryIO, chunk_size: int | ChunkSizer,
+    arrow_strings: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a parquet file as DataFrame chunks
+
+    Args:
+        file_content (BinaryIO): parquet data as a binary stream
+        chunk_size (int/ChunkSizer): number of rows per chunk,
+            or a ChunkSizer sizing chunks to a byte budget
+        arrow_strings (bool): If True, string columns keep their Arrow
+            buffers (ARROW_STRING) instead of becoming object columns
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks of the parquet file
+    """
+    sizer = as_chunk_sizer(chunk_size)
+    parquet_file = pq.ParquetFile(file_content)
+    # Batches are sized to the byte budget from the row width of the
+    # footer rather than to the probe chunk, and regrouped into chunks
+    batch_rows = sizer.rows
+    if parquet_file.metadata.num_row_groups:
+        row_group = parquet_file.metadata.row_group(0)
+        batch_rows = sizer.batch_rows(
+            row_group.total_byte_size / max(1, row_group.num_rows))
+    batches = parquet_file.iter_batches(batch_size=batch_rows)
+    types_mapper = arrow_types_mapper if arrow_strings else None
+    for table in rebatch(batches, sizer):
+        yield sizer.observe(table.to_pandas(types_mapper=types_mapper))
+
+
+def iter_batch_file_chunks(
+    file_content: BinaryIO, file_type: str, chunk_size: int | ChunkSizer,
+    arrow_strings: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read an ORC, Feather (Arrow IPC) or Avro file as DataFrame chunks
+
+    Args:
+        file_content (BinaryIO): the file as a binary stream, e.g. a
+            memory-mapped file, whose Arrow IPC batches are not copied
+        file_type (str): orc/feather/avro
+        chunk_size (int/ChunkSizer): number of rows per chunk,
+            or a ChunkSizer sizing chunks to a byte budget
+        arrow_strings (bool): If True, string columns keep their Arrow
+            buffers (ARROW_STRING) instead of becoming object columns
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks of the file
+    """
+    sizer = as_chunk_sizer(chunk_size)
+    batches = iter_record_batches(file_content, file_type, sizer)
+    types_mapper = arrow_types_mapper if arrow_strings else None
+    for table in rebatch(batches, sizer):
+        yield sizer.observe(table.to_pandas(types_mapper=types_mapper))
+
+
+def iter_df_chunks(
+    file_content: str | BinaryIO,
+    file_type: Literal["csv", "json", "parquet", "orc", "feather", "avro"],
+    chunk_size: int | ChunkSizer,
+    fields_list: list[str] = None,
+    arrow_strings: bool = False,
+    **csv_options,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read file content of any supported type as DataFrame chunks
+
+    Args:
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        file_type (str): csv/json/parquet/orc/feather/avro
+        chunk_size (int/ChunkSizer): number of rows per chunk,
+            or a ChunkSizer sizing chunks to a byte budget
+        fields_list (list): fields to be obfuscated (used by the csv
+                            raw_non_pii option)
+        arrow_strings (bool): If True, string columns are Arrow-backed
+                              (ARROW_STRING) instead of object columns
+        **csv_options: csv_schema/infer_schema/raw_non_pii/csv_engine,
+                       see iter_csv_chunks
+
+    Returns:
+        Iterator[pd.DataFrame]: DataFrame chunks
+    """
+    if file_type == "csv":
+        return iter_csv_chunks(file_content, fields_list or [],
+                               chunk_size, arrow_strings=arrow_strings,
+                               **csv_options)
+    elif file_type == "json":
+        return iter_json_chunks(file_content, chunk_size,
+                                arrow_strings=arrow_strings)
+    elif file_type == "parquet":
+        return iter_parquet_chunks(file_content, chunk_size, arrow_strings)
+    elif file_type in BATCH_FILE_TYPES:
+        return iter_batch_file_chunks(file_content, file_type, chunk_size,
+                                      arrow_strings)
+    logger.error(f"Unsupported file type: {file_type}")
+    raise ValueError(
+        f"Sorry that {file_type} is not supported. "
+        + "This tool currently only support " + "/".join(FILE_TYPES)
+    )
+
+
 def process_json_chunk(
-    file_content: str,
+    file_content: str | BinaryIO,
     fields_list: list[str],
     output: io.BytesIO,
-    chunk_size: int,
-    obfuscate_method: str = "replace",
+    chunk_size: int | ChunkSizer,
+    obfuscate_method: str | dict[str, str] = "replace",
+    arrow_strings: bool = False,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
 ):
     """
     Process JSON data in chunk, obfuscating the specified fields
@@ -140,12 +417,17 @@ def process_json_chunk(
     just save the processed data as csv in the byte system (output)
 
     Args:
-        file_content (str): raw data as a string
-        fields_list (list): fields to be obfuscated
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        fields_list (list): fields to be obfuscated, top level keys or
+            JSON paths such as customer.contact.email or orders[*].card
         output (io.BytesIO): Byte system to write the output
-        chunk_size (int): number of rows to process at a time
-        obfuscate_method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'repalce'
+        chunk_size (int/ChunkSizer): number of rows to process at a time
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'repalce', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                 (e.g., "j********e").
@@ -155,37 +437,49 @@ def process_json_chunk(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                 with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                the same in every file, see PseudonymMap.
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) instead of object columns
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
     """
     logger.info(f"Processing JSON data with chunk size {chunk_size}")
-    json_objects = ijson.items(file_content.encode("utf8"), "item")
-    chunk = []
+    # Nested paths are obfuscated on the records, before nested
+    # objects become opaque DataFrame cells
+    path_fields = [field for field in fields_list if is_json_path(field)]
+    transformer = JsonRecordTransformer(
+        path_fields, obfuscate_method, token_vault, pseudonym_map) \
+        if path_fields else None
+    fields_list = [field for field in fields_list
+                   if not is_json_path(field)]
     is_first_chunk = True
-    for obj in json_objects:
-        chunk.append(obj)
-        if len(chunk) == chunk_size:
-            step_df = pd.DataFrame(chunk)
-            process_df_chunk(step_df, fields_list,
-                             output, is_first_chunk, obfuscate_method)
-            is_first_chunk = False
-            chunk = []
-    if chunk:
-        step_df = pd.DataFrame(chunk)
-        process_df_chunk(
-                         step_df,
-                         fields_list,
-                         output,
-                         is_first_chunk,
-                         obfuscate_method
-                         )
-        logger.info("Processed remaining JSON objects.")
+    for step_df in iter_json_chunks(
+            file_content, chunk_size,
+            transformer.transform_records if transformer else None,
+            arrow_strings):
+        process_df_chunk(step_df, fields_list, output, is_first_chunk,
+                         obfuscate_method, token_vault, pseudonym_map)
+        is_first_chunk = False
+    if transformer is not None and not is_first_chunk:
+        transformer.check_matched()
 
 
 def process_parquet_chunk(
-    file_content: str,
+    file_content: BinaryIO,
     fields_list: list[str],
     output: io.BytesIO,
-    chunk_size: int,
-    obfuscate_method: str = "replace",
+    chunk_size: int | ChunkSizer,
+    obfuscate_method: str | dict[str, str] = "replace",
+    arrow_strings: bool = False,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
 ):
     """
     Process a parquet data in chunk, obfuscating the specified fields
@@ -193,12 +487,16 @@ def process_parquet_chunk(
     just save the processed data as csv in the byte system (output)
 
     Args:
-        file_content (str): raw data as a string
+        file_content (BinaryIO): parquet data as a binary stream
+            (e.g. a memory-mapped file)
         fields_list (list): fields to be obfuscated
         output (io.BytesIO): Byte system to write the output
-        chunk_size (int): number of rows to process at a time
-        obfuscate_method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'repalce'
+        chunk_size (int/ChunkSizer): number of rows to process at a time
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'repalce', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                 (e.g., "j********e").
@@ -208,36 +506,62 @@ def process_parquet_chunk(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                 with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                the same in every file, see PseudonymMap.
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) instead of object columns
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
     """
     logger.info(f"Processing Parquet data with chunk size {chunk_size}")
-    parquet_file = pq.ParquetFile(file_content)
     is_first_chunk = True
 
-    for batch in parquet_file.iter_batches(batch_size=chunk_size):
-        chunk_df = batch.to_pandas()
+    for chunk_df in iter_parquet_chunks(file_content, chunk_size,
+                                        arrow_strings):
         process_df_chunk(chunk_df, fields_list, output,
-                         is_first_chunk, obfuscate_method)
+                         is_first_chunk, obfuscate_method,
+                         token_vault, pseudonym_map)
         is_first_chunk = False
     logger.info("Finished processing Parquet chunks.")
 
 
 def convert_str_file_content_to_obfuscated_csv(
-    file_content: str,
+    file_content: str | BinaryIO,
     fields_list: list[str],
-    file_type: Literal["csv", "json", "parquet"] = "csv",
-    chunk_size: int = 5000,
-    obfuscate_method: str = "replace",
+    file_type: Literal["csv", "json", "parquet", "orc", "feather",
+                       "avro"] = "csv",
+    chunk_size: int | ChunkSizer = 5000,
+    obfuscate_method: str | dict[str, str] = "replace",
+    csv_schema: dict[str, str] = None,
+    infer_schema: bool = False,
+    raw_non_pii: bool = False,
+    csv_engine: Literal["c", "pyarrow"] = "c",
+    arrow_strings: bool = False,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
 ) -> io.BytesIO:
     """
     Obfuscate the specified field in the file content
 
     Args:
-        file_content (str): raw data as a string
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
         fields_list (list): fields to be obfuscated
-        file_type (str): file type (csv/json/parquet) in the output byte system
-        chunk_size (int): number of rows to process at a time, 5000 by default
-        obfuscate_method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'repalce'
+        file_type (str): file type (csv/json/parquet/orc/feather/avro)
+                         in the output byte system
+        chunk_size (int/ChunkSizer): number of rows to process at a time,
+            5000 by default, or a ChunkSizer sizing chunks to a byte budget
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'repalce', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                 (e.g., "j********e").
@@ -247,37 +571,69 @@ def convert_str_file_content_to_obfuscated_csv(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                 with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                the same in every file, see PseudonymMap.
+        csv_schema (dict): column name to pandas dtype name used to read
+            every csv chunk; only these columns are read. None by default
+        infer_schema (bool): If True and no csv_schema is given, infer
+            the schema once from a sample instead of per chunk
+        raw_non_pii (bool): If True, non-PII csv columns are read as raw
+            strings with no type conversion
+        csv_engine (str) ['c'/'pyarrow']: parser for csv input,
+            default to be 'c'
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) instead of object columns
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
 
     Returns:
         io.BytesIO: Obfuscated file as csv in a byte system
     """
     logger.info(f"Converting file of type {file_type} " +
                 "with chunk size {chunk_size}")
-    if file_type not in ["csv", "json", "parquet"]:
+    if file_type not in FILE_TYPES:
         logger.error(f"Unsupported file type: {file_type}")
         raise ValueError(
             f"Sorry that {file_type} is not supported. "
-            + "This tool currently only support csv/json/parquet"
+            + "This tool currently only support " + "/".join(FILE_TYPES)
         )
     output = io.BytesIO()
     is_first_chunk = True
     if file_type == "csv":
-        chunk_iter = pd.read_csv(
-                                 io.StringIO(file_content),
-                                 chunksize=chunk_size)
+        chunk_iter = iter_csv_chunks(
+            file_content, fields_list, chunk_size,
+            csv_schema, infer_schema, raw_non_pii, csv_engine, arrow_strings
+        )
         for chunk in chunk_iter:
             process_df_chunk(
-                chunk, fields_list, output, is_first_chunk, obfuscate_method
+                chunk, fields_list, output, is_first_chunk, obfuscate_method,
+                token_vault, pseudonym_map
             )
             is_first_chunk = False
     elif file_type == "json":
         process_json_chunk(
-            file_content, fields_list, output, chunk_size, obfuscate_method
+            file_content, fields_list, output, chunk_size, obfuscate_method,
+            arrow_strings, token_vault, pseudonym_map
         )
     elif file_type == "parquet":
         process_parquet_chunk(
-            file_content, fields_list, output, chunk_size, obfuscate_method
+            file_content, fields_list, output, chunk_size, obfuscate_method,
+            arrow_strings, token_vault, pseudonym_map
         )
+    elif file_type in BATCH_FILE_TYPES:
+        for chunk in iter_batch_file_chunks(file_content, file_type,
+                                            chunk_size, arrow_strings):
+            process_df_chunk(
+                chunk, fields_list, output, is_first_chunk, obfuscate_method,
+                token_vault, pseudonym_map
+            )
+            is_first_chunk = False
 
     output.seek(0)
     logger.info("File successfully converted and obfuscated.")
@@ -285,57 +641,191 @@ def convert_str_file_content_to_obfuscated_csv(
 
 
 def convert_csv_to_output_format(
-    csv_bytes: io.BytesIO, output_format: Literal["json", "parquet"]
+    csv_bytes: io.BytesIO,
+    output_format: Literal["json", "parquet", "orc", "feather", "avro"],
+    chunked: bool = False,
+    row_group_size: int = 100000,
+    compression: str = "snappy",
+    compression_level: int = None,
+    use_dictionary: bool = True,
+    arrow_strings: bool = False,
 ) -> io.BytesIO:
     """
-    Convert an obfuscated CSV stored in io.BytesIO to JSON or PARQUET format
+    Convert an obfuscated CSV stored in io.BytesIO to JSON, PARQUET,
+    ORC, Feather (Arrow IPC) or Avro format
 
     Args:
         csv_bytes (io.BytesIO): Obfuscated CSV file in bytes
-        output_format (str): Desired output format ('json' or 'parquet')
+        output_format (str): Desired output format
+                             ('json'/'parquet'/'orc'/'feather'/'avro')
+        chunked (bool): If True, convert row_group_size rows at a time
+            instead of loading the whole CSV as one DataFrame, so only
+            one row group is held as a DataFrame
+        row_group_size (int): number of rows per chunk (and per parquet
+            row group) when chunked, 100000 by default
+        compression (str): Parquet compression codec, 'snappy' by default
+        compression_level (int): Parquet codec level, default if None
+        use_dictionary (bool): If True, dictionary encode parquet columns
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) instead of object columns
 
     Returns:
-        io.BytesIO: Converted file in json or parquet in a byte system
+        io.BytesIO: Converted file in the output format in a byte system
     """
     logger.info(f"Converting CSV to {output_format} format.")
-    csv_bytes.seek(0)
-    df = pd.read_csv(csv_bytes)
-    output = io.BytesIO()
-    if output_format == "json":
-        df.to_json(output, orient="records", lines=True)
-    elif output_format == "parquet":
-        df.to_parquet(output, index=False, engine="pyarrow")
-    else:
+    if output_format == "csv" or output_format not in FILE_TYPES:
         logger.error(f"Unsupported output format: {output_format}")
         raise ValueError(
-            "Unsupported format." + " Only 'json' and 'parquet' are allowed."
+            "Unsupported format." + " Only 'json', 'parquet', 'orc', "
+            + "'feather' and 'avro' are allowed."
         )
-    output.seek(0)
+    csv_bytes.seek(0)
+    options = {}
+    if output_format == "parquet":
+        options = {
+            "compression": compression,
+            "compression_level": compression_level,
+            "use_dictionary": use_dictionary,
+        }
+    writer = get_chunk_writer(output_format, **options)
+    if chunked:
+        logger.info(f"Converting in row groups of {row_group_size} rows.")
+        schema = infer_csv_schema(csv_bytes, sample_rows=row_group_size)
+        for chunk in read_csv_chunks(csv_bytes, row_group_size,
+                                     dtype=schema,
+                                     arrow_strings=arrow_strings):
+            writer.write(chunk)
+    elif arrow_strings:
+        writer.write(to_arrow_strings(pd.read_csv(csv_bytes)))
+    else:
+        writer.write(pd.read_csv(csv_bytes))
+    output = writer.close()
     logger.info(f"Conversion to {output_format} completed.")
     return output
 
 
+def obfuscate_file_in_chunks(
+    file_content: str | BinaryIO,
+    fields_list: list[str],
+    file_type: str,
+    output_format: str,
+    chunk_size: int | ChunkSizer,
+    obfuscate_method: str | dict[str, str] = "replace",
+    row_group_size: int = 100000,
+    writer_options: dict = None,
+    arrow_strings: bool = False,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
+    **csv_options,
+) -> BinaryIO:
+    """
+    Obfuscate file content chunk by chunk straight into the writer of
+    the output format, with no intermediate csv: only the current chunk
+    (and one pending Parquet row group) is held in memory, and the
+    output is spooled to a temporary file past SPOOL_BYTES
+
+    Args:
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        fields_list (list): fields to be obfuscated; for json input,
+            also JSON paths such as customer.contact.email
+        file_type (str): csv/json/parquet/orc/feather/avro
+        output_format (str): json/parquet/orc/feather/avro
+        chunk_size (int/ChunkSizer): number of rows to process at a time,
+            or a ChunkSizer sizing chunks to a byte budget
+        obfuscate_method (str/dict): see obfuscate_fields_in_df
+        row_group_size (int): rows per Parquet row group
+        writer_options (dict): options of the output format writer,
+            e.g. compression, see get_chunk_writer
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) instead of object columns
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
+        **csv_options: csv_schema/infer_schema/raw_non_pii/csv_engine,
+                       see iter_csv_chunks
+
+    Returns:
+        BinaryIO: Obfuscated file in the output format, rewound
+    """
+    logger.info(f"Obfuscating {file_type} to {output_format} in chunks")
+    writer_options = dict(writer_options or {})
+    if output_format == "parquet":
+        writer_options["row_group_size"] = row_group_size
+    writer = get_chunk_writer(
+        output_format, tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES),
+        **writer_options)
+    transformer = None
+    if file_type == "json":
+        path_fields = [field for field in fields_list if is_json_path(field)]
+        if path_fields:
+            transformer = JsonRecordTransformer(
+                path_fields, obfuscate_method, token_vault, pseudonym_map)
+            fields_list = [field for field in fields_list
+                           if not is_json_path(field)]
+        chunks = iter_json_chunks(
+            file_content, chunk_size,
+            transformer.transform_records if transformer else None,
+            arrow_strings)
+    else:
+        chunks = iter_df_chunks(file_content, file_type, chunk_size,
+                                fields_list, arrow_strings, **csv_options)
+    for chunk in chunks:
+        writer.write(obfuscate_fields_in_df(chunk, fields_list,
+                                            obfuscate_method, token_vault,
+                                            pseudonym_map))
+    if transformer is not None and writer.rows_written:
+        transformer.check_matched()
+    return writer.close()
+
+
 def obfuscate_file(
-    file_content: str,
+    file_content: str | BinaryIO,
     fields_list: list,
     file_type: str = "csv",
     output_format: str = None,
-    chunk_size: int = 5000,
-    obfuscate_method: str = "replace",
+    chunk_size: int | ChunkSizer = 5000,
+    obfuscate_method: str | dict[str, str] = "replace",
+    csv_schema: dict[str, str] = None,
+    infer_schema: bool = False,
+    raw_non_pii: bool = False,
+    csv_engine: Literal["c", "pyarrow"] = "c",
+    csv_passthrough: bool = False,
+    chunked_conversion: bool = False,
+    row_group_size: int = 100000,
+    parquet_compression: str = "snappy",
+    parquet_compression_level: int = None,
+    parquet_use_dictionary: bool = True,
+    chunk_bytes: int = None,
+    arrow_strings: bool = False,
+    engine: Literal["pandas", "arrow", "duckdb"] = "pandas",
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
 ) -> io.BytesIO:
     """
     Obfuscate the specified field in the file content.
-    Integrate the above functions
+    Integrate the above functions. JSON-to-JSON jobs with nested JSON
+    path fields are streamed record by record without DataFrames, see
+    obfuscate_json_records.
 
     Args:
-        file_content (str): raw data as a string
-        fields_list (list): fields to be obfuscated
+        file_content (str/BinaryIO): raw data as a string,
+            or a binary stream (e.g. a memory-mapped file)
+        fields_list (list): fields to be obfuscated; for json input,
+            also JSON paths such as customer.contact.email or
+            orders[*].card
         file_type (str): file type (e.g. csv) in the input
-        output_format (str): Desired ourput format (csv/json/parquet)
+        output_format (str): Desired ourput format
+                             (csv/json/parquet/orc/feather/avro)
                              ,same as file_type by default
-        chunk_size (int): number of rows to process at a time, 5000 by default
-        obfuscate_method (str) ['mask'/'hash'/'random_hash'/'replace']:
-            how to obfuscate the data, default to be 'repalce'
+        chunk_size (int/ChunkSizer): number of rows to process at a time,
+            5000 by default, or a ChunkSizer sizing chunks to a byte budget
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact'/
+            'tokenize'/'pseudonymize']:
+            how to obfuscate the data, default to be 'repalce', or a dict
+            of field to method (fields missing from it are replaced)
             Available methods:
             - 'mask': Masks all characters except the first and last
                 (e.g., "j********e").
@@ -345,6 +835,52 @@ def obfuscate_file(
                producing different hashes on each run.
             - 'replace': Replaces all values in the specified fields
                 with '***'.
+            - 'redact': Replaces only the PII found inside free text
+                (e.g., "call [PHONE]"), see Redactor.
+            - 'tokenize': Replaces values with reversible tokens kept
+                in the encrypted token vault, see TokenVault.
+            - 'pseudonymize': Replaces values with random pseudonyms,
+                the same in every file, see PseudonymMap.
+        csv_schema (dict): column name to pandas dtype name used to read
+            every csv chunk; only these columns are read. None by default
+        infer_schema (bool): If True and no csv_schema is given, infer
+            the csv schema once from a sample instead of per chunk
+        raw_non_pii (bool): If True, non-PII csv columns are read as raw
+            strings with no type conversion
+        csv_engine (str) ['c'/'pyarrow']: parser for csv input,
+            default to be 'c'
+        csv_passthrough (bool): If True and both input and output are csv,
+            only the PII field slices are rewritten and every other byte
+            is copied unchanged, without building DataFrames
+        chunked_conversion (bool): If True, json/parquet/orc/feather/avro
+            output is written chunk by chunk as it is obfuscated, with no
+            intermediate csv, see obfuscate_file_in_chunks
+        row_group_size (int): rows per parquet row group for chunked
+            conversion, 100000 by default
+        parquet_compression (str): Parquet compression codec,
+            'snappy' by default
+        parquet_compression_level (int): Parquet codec level,
+            codec default when None
+        parquet_use_dictionary (bool): If True, dictionary encode
+            parquet columns
+        chunk_bytes (int): If given, chunks are sized to hold about this
+            many bytes in memory, from the measured row width, and
+            chunk_size only bounds the first (probe) chunk
+        arrow_strings (bool): If True, string columns are Arrow-backed
+            (ARROW_STRING) from read through obfuscation and write,
+            instead of holding a Python object per cell
+        engine (str) ['pandas'/'arrow'/'duckdb']: engine running the job,
+            default to be 'pandas'
+            - 'pandas': DataFrame chunks, with every option above
+            - 'arrow': Arrow tables from read to write, obfuscated with
+                       pyarrow.compute kernels, see ArrowEngine
+            - 'duckdb': one in-process DuckDB query, see DuckDBEngine
+            The csv reading, passthrough, conversion and chunk_bytes
+            options only apply to the pandas engine.
+        token_vault (TokenVault): vault of 'tokenize' for this job,
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize' for this job,
+            get_pseudonym_map() when None
 
     Returns:
         io.BytesIO: Obfuscated file (file type as specified in output_format,
@@ -356,20 +892,82 @@ def obfuscate_file(
     )
     try:
         file_type = file_type.lower()
-        output = convert_str_file_content_to_obfuscated_csv(
-            file_content, fields_list, file_type, chunk_size, obfuscate_method
-        )
-        if output_format is None:
-            output_format = file_type
-        elif output_format not in ["csv", "json", "parquet"]:
+        if engine != "pandas":
+            return get_engine(engine).obfuscate_file(
+                file_content, fields_list, file_type, output_format,
+                obfuscate_method, chunk_size,
+                parquet_compression=parquet_compression,
+                parquet_compression_level=parquet_compression_level,
+                parquet_use_dictionary=parquet_use_dictionary,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map,
+            )
+        if csv_passthrough and file_type == "csv" and \
+                output_format in [None, "csv"]:
+            logger.info("Using passthrough CSV rewriter.")
+            return rewrite_csv_pii_fields(
+                file_content, fields_list, obfuscate_method,
+                token_vault=token_vault, pseudonym_map=pseudonym_map)
+        if file_type == "json" and output_format in [None, "json"] and \
+                any(is_json_path(field) for field in fields_list):
+            logger.info("Using streaming JSON record transformer.")
+            return obfuscate_json_records(
+                file_content, fields_list, obfuscate_method,
+                token_vault, pseudonym_map)
+        sizer = as_chunk_sizer(chunk_size, chunk_bytes)
+        if output_format is not None and output_format not in FILE_TYPES:
             logger.error(f"Unsupported output format: {output_format}")
             raise ValueError(
                 f"Sorry that {output_format} is not supported. "
                 + "This tool currently only support "
-                + "csv/json/parquet"
+                + "/".join(FILE_TYPES)
             )
+        if chunked_conversion and (output_format or file_type) != "csv":
+            writer_options = {}
+            if (output_format or file_type) == "parquet":
+                writer_options = {
+                    "compression": parquet_compression,
+                    "compression_level": parquet_compression_level,
+                    "use_dictionary": parquet_use_dictionary,
+                }
+            output = obfuscate_file_in_chunks(
+                file_content, fields_list, file_type,
+                output_format or file_type, sizer, obfuscate_method,
+                row_group_size=row_group_size,
+                writer_options=writer_options,
+                arrow_strings=arrow_strings,
+                token_vault=token_vault,
+                pseudonym_map=pseudonym_map,
+                csv_schema=csv_schema,
+                infer_schema=infer_schema,
+                raw_non_pii=raw_non_pii,
+                csv_engine=csv_engine,
+            )
+            logger.info(f"Chunk sizes: {sizer.metrics()}")
+            return output
+        output = convert_str_file_content_to_obfuscated_csv(
+            file_content, fields_list, file_type, sizer, obfuscate_method,
+            csv_schema=csv_schema,
+            infer_schema=infer_schema,
+            raw_non_pii=raw_non_pii,
+            csv_engine=csv_engine,
+            arrow_strings=arrow_strings,
+            token_vault=token_vault,
+            pseudonym_map=pseudonym_map,
+        )
+        logger.info(f"Chunk sizes: {sizer.metrics()}")
+        if output_format is None:
+            output_format = file_type
         if output_format != "csv":
-            output = convert_csv_to_output_format(output, output_format)
+            output = convert_csv_to_output_format(
+                output, output_format,
+                chunked=False,
+                row_group_size=row_group_size,
+                compression=parquet_compression,
+                compression_level=parquet_compression_level,
+                use_dictionary=parquet_use_dictionary,
+                arrow_strings=arrow_strings,
+            )
         logger.info("File obfuscation completed successfully.")
         return output
     except KeyError as ke:
@@ -0,0 +1,236 @@
+import io
+import json
+import posixpath
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator
+import pandas as pd
+from src.chunk_writers import get_chunk_writer
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+# Leading underscore: Spark, Hive and Athena skip the file when
+# reading the part files of the prefix
+MANIFEST_NAME = "_manifest.json"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# Rows written before the row width is known when sizing parts in bytes
+PROBE_ROWS = 10
+# Partitions with a part open at the same time with partition_by
+MAX_OPEN_PARTITIONS = 64
+
+
+def get_partition_prefix(output_file_key: str) -> str:
+    """
+    Directory of the part files of an output,
+    e.g processed_data/file.csv -> processed_data/file/
+
+    Args:
+        output_file_key (str): key the single output file would have
+
+    Returns:
+        str: prefix of the part files, ending with '/'
+    """
+    directory, name = posixpath.split(output_file_key)
+    stem = name.split(".")[0]
+    return posixpath.join(directory, stem) + "/"
+
+
+def _partition_value(value) -> str:
+    if pd.isna(value):
+        return NULL_PARTITION
+    return urllib.parse.quote(str(value), safe="")
+
+
+class _PartSet:
+    """
+    Part files of one partition, rolled over once a part reaches
+    rows_per_part rows or bytes_per_part bytes
+    """
+
+    def __init__(self, prefix: str, output_format: str, file_extension: str,
+                 writer_options: dict, partition: dict | None):
+        self.prefix = prefix
+        self.output_format = output_format
+        self.file_extension = file_extension
+        self.writer_options = writer_options
+        self.partition = partition
+        self.part_number = 0
+        self.writer = None
+
+    def open(self):
+        self.writer = get_chunk_writer(self.output_format,
+                                       **self.writer_options)
+
+    def key(self) -> str:
+        return f"{self.prefix}part-{self.part_number:05d}." + \
+            self.file_extension
+
+    def size(self) -> int:
+        return self.writer.output.tell()
+
+    def close(self) -> tuple[str, io.BytesIO, int]:
+        rows = self.writer.rows_written
+        key = self.key()
+        body = self.writer.close()
+        self.writer = None
+        self.part_number += 1
+        return key, body, rows
+
+
+def write_partitioned_output(
+    chunks: Iterator[pd.DataFrame],
+    write_part: Callable[[str, io.BytesIO], object],
+    output_prefix: str,
+    output_format: str = "csv",
+    rows_per_part: int = None,
+    bytes_per_part: int = None,
+    partition_by: str = None,
+    max_workers: int = 8,
+    file_extension: str = None,
+    max_open_partitions: int = MAX_OPEN_PARTITIONS,
+    **writer_options,
+) -> dict:
+    """
+    Write DataFrame chunks as several part files instead of one object,
+    so that downstream readers (Spark, Athena) can read them in parallel.
+    A part is closed once it holds rows_per_part rows or bytes_per_part
+    bytes. With partition_by, rows are split by the value of that column
+    into Hive-style prefixes (<column>=<value>/); parquet parts leave the
+    column out, as Hive-aware readers restore it from the key. At most
+    max_open_partitions partitions have a part open: writing to another
+    one closes the part of the least recently written partition, and
+    its next rows go to a new part.
+
+    Closed parts are uploaded concurrently while the next ones are
+    written. A '_manifest.json' object listing every part is written
+    last, so its presence marks a complete output.
+
+    Args:
+        chunks (Iterator[pd.DataFrame]): obfuscated DataFrame chunks
+        write_part (Callable): writes one part, (key, body) -> any
+        output_prefix (str): prefix of the part files, ending with '/'
+        output_format (str): csv/json/parquet
+        rows_per_part (int): maximum rows per part
+        bytes_per_part (int): approximate maximum bytes per part
+        partition_by (str): column to partition the rows by
+        max_workers (int): parts uploaded concurrently
+        file_extension (str): extension of the part keys, output_format
+                              by default, e.g. 'csv.gz' for compressed parts
+        max_open_partitions (int): partitions with a part open at a time
+        **writer_options: options of the chunk writer, e.g. compression
+
+    Returns:
+        dict: the manifest ('format', 'partition_by', 'rows' and 'parts',
+              each part with its 'key', 'rows' and 'partition')
+    """
+    if rows_per_part is None and bytes_per_part is None \
+            and partition_by is None:
+        raise ValueError("Set rows_per_part, bytes_per_part or partition_by")
+    logger.info(f"Writing {output_format} parts to {output_prefix}")
+    file_extension = file_extension or output_format
+    part_sets = {}
+    # Partitions with a part open, least recently written first
+    open_part_sets = OrderedDict()
+    parts = []
+    in_flight = set()
+    row_bytes = {"estimate": None}
+    executor = ThreadPoolExecutor(max_workers=max_workers,
+                                  thread_name_prefix="part-upload")
+
+    def submit(part_set):
+        key, body, rows = part_set.close()
+        if rows == 0:
+            return
+        # Bound the parts held in memory while waiting for uploads
+        while len(in_flight) >= 2 * max_workers:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                future.result()
+        in_flight.add(executor.submit(write_part, key, body))
+        parts.append({"key": key, "rows": rows,
+                      "partition": part_set.partition})
+
+    def write_rows(part_set, df):
+        while len(df):
+            if part_set.writer is None:
+                part_set.open()
+            rows = len(df)
+            written = part_set.writer.rows_written
+            if rows_per_part is not None:
+                rows = min(rows, rows_per_part - written)
+            if bytes_per_part is not None:
+                if written:
+                    row_bytes["estimate"] = part_set.size() / written
+                if row_bytes["estimate"] is None:
+                    # Measure the row width on a few rows first
+                    rows = min(rows, PROBE_ROWS)
+                else:
+                    # Split the chunk at the estimated row reaching the size
+                    rows = min(rows, max(1, int(
+                        (bytes_per_part - part_set.size())
+                        / row_bytes["estimate"])))
+            part_set.writer.write(df.iloc[:rows])
+            df = df.iloc[rows:]
+            if (rows_per_part is not None
+                    and part_set.writer.rows_written >= rows_per_part) or \
+                    (bytes_per_part is not None
+                     and part_set.size() >= bytes_per_part):
+                submit(part_set)
+
+    def get_part_set(partition_key, partition):
+        if partition_key not in part_sets:
+            prefix = output_prefix
+            if partition is not None:
+                prefix += f"{partition_by}={partition_key}/"
+            part_sets[partition_key] = _PartSet(
+                prefix, output_format, file_extension, writer_options,
+                partition)
+        return part_sets[partition_key]
+
+    try:
+        for chunk in chunks:
+            if partition_by is None:
+                write_rows(get_part_set(None, None), chunk)
+                continue
+            if partition_by not in chunk.columns:
+                raise KeyError(f"Partition column '{partition_by}' not " +
+                               "found in the data.")
+            groups = chunk.groupby(chunk[partition_by].map(_partition_value),
+                                   sort=False, dropna=False)
+            for partition_key, group in groups:
+                value = group[partition_by].iloc[0]
+                partition = {partition_by: None if pd.isna(value)
+                             else str(value)}
+                if output_format == "parquet":
+                    group = group.drop(columns=[partition_by])
+                part_set = get_part_set(partition_key, partition)
+                write_rows(part_set, group)
+                open_part_sets.pop(partition_key, None)
+                if part_set.writer is not None:
+                    open_part_sets[partition_key] = part_set
+                while len(open_part_sets) > max_open_partitions:
+                    _, oldest = open_part_sets.popitem(last=False)
+                    submit(oldest)
+        for part_set in part_sets.values():
+            if part_set.writer is not None:
+                submit(part_set)
+        for future in in_flight:
+            future.result()
+    finally:
+        executor.shutdown(wait=True)
+
+    manifest = {
+        "format": output_format,
+        "partition_by": partition_by,
+        "rows": sum(part["rows"] for part in parts),
+        "parts": parts,
+    }
+    write_part(output_prefix + MANIFEST_NAME,
+               io.BytesIO(json.dumps(manifest, indent=2).encode("utf8")))
+    logger.info(f"Wrote {len(parts)} parts and the manifest " +
+                f"to {output_prefix}")
+    return manifest
@@ -1,4 +1,5 @@
 import re
+from typing import Callable
 from src.setup_logger import setup_logger
 
 
@@ -91,6 +92,46 @@ pii_patterns = [r"\bni\b",
                 r"(?=.*credit)(?=.*card)"]
 
 
+# Likelihood that a column is PII given what its name matches,
+# see score_pii_by_heuristic
+HEURISTIC_SCORES = {
+    "pii_term": 0.9,
+    "pii_pattern": 0.85,
+    "pii_and_non_pii_terms": 0.5,
+    "no_match": 0.3,
+    "non_pii_term": 0.1,
+}
+# A score this far from 0.5 (>= 0.8 or <= 0.2) is confident enough
+# to decide a column without the model tier
+CONFIDENCE_THRESHOLD = 0.8
+
+
+def score_pii_by_heuristic(column_name: str) -> float:
+    """
+    Score how likely a column name is PII based on predefined terms
+    and patterns, see HEURISTIC_SCORES
+
+    Args:
+        column_name (str): The column_name want to detect if pii
+
+    Returns:
+        float: score from 0.0 (not PII) to 1.0 (PII)
+    """
+    name = column_name.lower()
+    if any(term in name for term in pii_terms):
+        if any(term in name for term in non_pii_terms):
+            return HEURISTIC_SCORES["pii_and_non_pii_terms"]
+        return HEURISTIC_SCORES["pii_term"]
+    for pattern in pii_patterns:
+        if re.search(pattern, column_name, re.IGNORECASE):
+            logger.debug(f"Column '{column_name}' " +
+                         f"matches pattern: {pattern}.")
+            return HEURISTIC_SCORES["pii_pattern"]
+    if any(term in name for term in non_pii_terms):
+        return HEURISTIC_SCORES["non_pii_term"]
+    return HEURISTIC_SCORES["no_match"]
+
+
 def is_pii_by_heuristic(column_name: str) -> bool:
     """
     Check if a column name is PII based on predefined partterns and exclusion
@@ -103,16 +144,8 @@ def is_pii_by_heuristic(column_name: str) -> bool:
     """
     logger.debug(f"Checking if column '{column_name}' " +
                  "is PII using heuristic method.")
-    if any(term in column_name.lower() for term in pii_terms):
-        if any(term in column_name.lower() for term in non_pii_terms):
-            return False
+    if score_pii_by_heuristic(column_name) > 0.5:
         return True
-    else:
-        for pattern in pii_patterns:
-            if re.search(pattern, column_name, re.IGNORECASE):
-                logger.debug(f"Column '{column_name}' " +
-                             "matches pattern: {pattern}.")
-                return True
     logger.debug(f"Column '{column_name}' is not " +
                  "detected as PII by heuristic.")
     return False
@@ -144,3 +177,65 @@ def detect_if_pii(column_name: str) -> bool:
             + " Applying heuristic."
         )
         return is_pii_by_heuristic(column_name)
+
+
+def detect_pii_tiered(
+    column_names: list[str],
+    escalate: Callable[[list[str]], list[dict]] = None,
+    confidence_threshold: float = CONFIDENCE_THRESHOLD,
+) -> list[dict]:
+    """
+    Detect PII columns in tiers, from the cheapest to the most
+    expensive, each column being decided by the first confident tier:
+    - 'dictionary': exact hits in pii_dict (score 1.0 or 0.0)
+    - 'heuristic': names whose heuristic score is confident,
+      i.e. >= confidence_threshold or <= 1 - confidence_threshold
+    - 'model': only the remaining, ambiguous columns are escalated,
+      in one call, to the expensive detector (GPT or a local model).
+      Without one, or for columns it does not report, the heuristic
+      decides them.
+
+    Args:
+        column_names (list): the column names of the dataset
+        escalate (Callable): expensive detector, called with the
+            ambiguous column names and returning a list of dicts with
+            'column_name', 'is_pii' and 'score'
+        confidence_threshold (float): heuristic score from which a
+            column is decided without the model
+
+    Returns:
+        list[dict]: for each column, 'column_name', 'is_pii', 'score'
+                    and the 'tier' that decided it
+    """
+    report = {}
+    ambiguous = []
+    for column_name in column_names:
+        key = column_name.replace(" ", "_")
+        if key in pii_dict:
+            report[column_name] = {
+                "column_name": column_name, "is_pii": pii_dict[key],
+                "score": 1.0 if pii_dict[key] else 0.0,
+                "tier": "dictionary"}
+            continue
+        score = score_pii_by_heuristic(column_name)
+        report[column_name] = {"column_name": column_name,
+                               "is_pii": score > 0.5, "score": score,
+                               "tier": "heuristic"}
+        if max(score, 1 - score) < confidence_threshold:
+            ambiguous.append(column_name)
+
+    if escalate is not None and ambiguous:
+        logger.info(f"Escalating {len(ambiguous)} of {len(column_names)} " +
+                    f"columns to the model tier: {ambiguous}")
+        for item in escalate(ambiguous):
+            if item.get("column_name") in ambiguous:
+                report[item["column_name"]] = {
+                    "column_name": item["column_name"],
+                    "is_pii": bool(item["is_pii"]),
+                    "score": float(item["score"]),
+                    "tier": "model"}
+    tiers = [item["tier"] for item in report.values()]
+    logger.info("Columns decided per tier: " + str(
+        {tier: tiers.count(tier)
+         for tier in ["dictionary", "heuristic", "model"]}))
+    return [report[column_name] for column_name in column_names]
@@ -0,0 +1,259 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from src.setup_logger import setup_logger
+try:
+    import torch
+    from transformers import AutoModelForTokenClassification, AutoTokenizer
+except ImportError:
+    torch = None
+
+
+logger = setup_logger(__name__)
+
+# A small English NER model; any token classification model with
+# PER/LOC style labels works, e.g. a local directory for offline use
+DEFAULT_NER_MODEL = os.getenv("PII_NER_MODEL", "dslim/distilbert-NER")
+# NER entity labels (without their B-/I- prefix) that are PII
+PII_ENTITY_LABELS = {"PER": "NAME", "LOC": "ADDRESS"}
+# Share of the sampled values of a column holding PII entities
+# from which the column is PII
+PII_VALUE_SHARE = 0.3
+
+# One loaded model per process, keyed by (model, quantize)
+_model_cache = {}
+_model_lock = threading.Lock()
+
+
+def load_ner_model(model_name: str = DEFAULT_NER_MODEL,
+                   quantize: bool = False,
+                   local_files_only: bool = None) -> tuple:
+    """
+    Load a token classification model and its tokenizer, once per
+    process: later calls return the cached instances
+
+    Args:
+        model_name (str): Hugging Face model id or local directory
+        quantize (bool): If True, the Linear layers are dynamically
+                         quantized to int8 for faster CPU inference
+        local_files_only (bool): If True, never download the model.
+            Defaults to True when HF_HUB_OFFLINE is set.
+
+    Returns:
+        tuple: (tokenizer, model) with the model in eval mode
+    """
+    if torch is None:
+        raise ImportError("Local NER detection requires the torch and "
+                          "transformers packages")
+    if local_files_only is None:
+        local_files_only = bool(os.getenv("HF_HUB_OFFLINE"))
+    key = (model_name, quantize)
+    with _model_lock:
+        if key not in _model_cache:
+            logger.info(f"Loading NER model {model_name} " +
+                        f"(int8: {quantize})")
+            tokenizer = AutoTokenizer.from_pretrained(
+                model_name, local_files_only=local_files_only)
+            model = AutoModelForTokenClassification.from_pretrained(
+                model_name, local_files_only=local_files_only)
+            model.eval()
+            if quantize:
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8)
+            _model_cache[key] = (tokenizer, model)
+    return _model_cache[key]
+
+
+def clear_ner_model_cache():
+    """
+    Drop the cached models, e.g. to free memory
+    """
+    with _model_lock:
+        _model_cache.clear()
+
+
+def sample_column_values(series: pd.Series, sample_size: int = 50,
+                         seed: int = 0) -> list[str]:
+    """
+    Sample distinct non-empty values of a column as strings
+
+    Args:
+        series (pd.Series): column to sample
+        sample_size (int): maximum number of values
+        seed (int): seed of the sample, for reproducible detection
+
+    Returns:
+        list[str]: sampled values
+    """
+    values = series.dropna().astype(str).str.strip()
+    values = values[values != ""].drop_duplicates()
+    if len(values) > sample_size:
+        values = values.sample(sample_size, random_state=seed)
+    return values.tolist()
+
+
+class NerPiiDetector:
+    """
+    Detect PII columns from their content with a token classification
+    (NER) model run locally on CPU, with no network call.
+
+    Distinct values are sorted by length and tokenized in batches
+    padded to their longest value only, so little compute is spent on
+    padding. Batches run on a thread pool (torch releases the GIL
+    during inference), and the entities found in a value are memoized,
+    so a value repeated within or across columns and files is only
+    run once.
+
+    Args:
+        model_name (str): Hugging Face model id or local directory
+        batch_size (int): values per inference batch
+        max_workers (int): inference threads, 1 by default
+        quantize (bool): If True, use an int8 quantized model
+        max_length (int): tokens kept per value
+        cache_size (int): values whose entities are memoized
+        threshold (float): minimum probability of an entity token
+    """
+
+    def __init__(self, model_name: str = DEFAULT_NER_MODEL,
+                 batch_size: int = 32, max_workers: int = 1,
+                 quantize: bool = False, max_length: int = 64,
+                 cache_size: int = 100000, threshold: float = 0.5):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.quantize = quantize
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.threshold = threshold
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
+        self.stats = {"values": 0, "cache_hits": 0, "batches": 0}
+
+    def _predict_batch(self, values: list[str]) -> list[set[str]]:
+        tokenizer, model = load_ner_model(self.model_name, self.quantize)
+        # Fast tokenizers cannot be used by two threads at once
+        with self._tokenizer_lock:
+            inputs = tokenizer(values, padding="longest", truncation=True,
+                               max_length=self.max_length,
+                               return_tensors="pt")
+        with torch.inference_mode():
+            logits = model(**inputs).logits
+        scores, label_ids = torch.softmax(logits, dim=-1).max(dim=-1)
+        keep = inputs["attention_mask"].bool() & (scores >= self.threshold)
+        pii_types = {}
+        for label_id, label in model.config.id2label.items():
+            label = label.split("-", 1)[-1]
+            if label in PII_ENTITY_LABELS:
+                pii_types[int(label_id)] = PII_ENTITY_LABELS[label]
+        return [{pii_types[label_id] for label_id in
+                 label_ids[row][keep[row]].unique().tolist()
+                 if label_id in pii_types}
+                for row in range(len(values))]
+
+    def predict(self, values: list[str]) -> list[set[str]]:
+        """
+        Find the PII entity types in each value
+
+        Args:
+            values (list): strings to classify
+
+        Returns:
+            list[set]: PII types (e.g. {'NAME'}) found in each value
+        """
+        with self._cache_lock:
+            known = {value: self._cache[value] for value in set(values)
+                     if value in self._cache}
+            for value in known:
+                self._cache.move_to_end(value)
+        self.stats["values"] += len(values)
+        self.stats["cache_hits"] += sum(value in known for value in values)
+        new_values = sorted(set(values) - set(known), key=len)
+        batches = [new_values[i:i + self.batch_size]
+                   for i in range(0, len(new_values), self.batch_size)]
+        self.stats["batches"] += len(batches)
+        if self.max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers,
+                                    thread_name_prefix="ner") as executor:
+                results = list(executor.map(self._predict_batch, batches))
+        else:
+            results = [self._predict_batch(batch) for batch in batches]
+        with self._cache_lock:
+            for batch, entities in zip(batches, results):
+                for value, found in zip(batch, entities):
+                    known[value] = found
+                    self._cache[value] = found
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return [known[value] for value in values]
+
+    def detect_column(self, series: pd.Series,
+                      sample_size: int = 50) -> dict:
+        """
+        Classify a column from a sample of its values
+
+        Args:
+            series (pd.Series): column to classify
+            sample_size (int): values sampled from the column
+
+        Returns:
+            dict: 'is_pii', 'score' (share of sampled values holding
+                  PII entities) and 'entities' (PII types found)
+        """
+        values = sample_column_values(series, sample_size)
+        if not values:
+            return {"is_pii": False, "score": 0.0, "entities": []}
+        predictions = self.predict(values)
+        score = sum(bool(found) for found in predictions) / len(values)
+        return {"is_pii": score >= PII_VALUE_SHARE,
+                "score": round(score, 3),
+                "entities": sorted(set().union(*predictions))}
+
+
+# One detector per process and set of options, so that memoized
+# values are reused across files
+_detector_cache = {}
+
+
+def get_ner_detector(**options) -> NerPiiDetector:
+    """
+    Return the process-wide NerPiiDetector built with these options
+
+    Args:
+        **options: NerPiiDetector arguments
+
+    Returns:
+        NerPiiDetector: cached detector
+    """
+    key = tuple(sorted(options.items()))
+    with _model_lock:
+        if key not in _detector_cache:
+            _detector_cache[key] = NerPiiDetector(**options)
+    return _detector_cache[key]
+
+
+def detect_if_pii_with_ner(df: pd.DataFrame, sample_size: int = 50,
+                           detector: NerPiiDetector = None) -> list[dict]:
+    """
+    Identify the columns of a DataFrame holding PII from their values
+    with a local NER model
+
+    Args:
+        df (pd.DataFrame): sample of the dataset, e.g. its first rows
+        sample_size (int): values sampled per column
+        detector (NerPiiDetector): detector to use, the process-wide
+                                   default one when None
+
+    Returns:
+        list[dict]: for each column, 'column_name', 'is_pii', 'score'
+                    and 'entities'
+    """
+    detector = detector or get_ner_detector()
+    results = []
+    for column in df.columns:
+        result = detector.detect_column(df[column], sample_size)
+        results.append({"column_name": column, **result})
+    logger.info(f"NER detection stats: {detector.stats}")
+    return results
@@ -0,0 +1,511 @@
+import io
+import queue
+import threading
+import time
+from functools import partial
+from typing import BinaryIO, Callable, Iterator
+from src.obfuscator import iter_df_chunks, obfuscate_fields_in_df
+from src.chunk_writers import get_chunk_writer
+from src.chunk_sizing import as_chunk_sizer
+from src.file_formats import FOOTER_FILE_TYPES
+from src.json_paths import is_json_path
+from src.memory_governor import MemoryGovernor
+from src.tokenization import TokenVault
+from src.pseudonym_map import PseudonymMap
+from src.utils import ChunkIterReader
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+DOWNLOAD_BLOCK_SIZE = 8 * 1024 * 1024
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised in a stage when another stage of the pipeline failed"""
+
+
+class BoundedChannel:
+    """
+    Bounded queue between two pipeline stages. A full channel blocks
+    the producer (backpressure); aborting it makes both sides raise
+    PipelineAborted instead of waiting forever.
+
+    Args:
+        maxsize (int): number of items the channel holds before the
+                       producer blocks
+        governor (MemoryGovernor): If given, tracks the items in flight
+                                   in the channel
+        stage (str): name of the consuming stage for the governor
+        spill (bool): If True, the governor may spill byte items to
+                      disk until they are consumed
+    """
+
+    def __init__(self, maxsize: int = 4, governor: MemoryGovernor = None,
+                 stage: str = None, spill: bool = False):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._aborted = threading.Event()
+        self.wait_seconds = 0.0
+        self.governor = governor
+        self.stage = stage
+        self.spill = spill
+
+    def put(self, item):
+        if self.governor is not None and item is not _END:
+            item = self.governor.admit(self.stage, item, self.spill)
+        start = time.perf_counter()
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                self.wait_seconds += time.perf_counter() - start
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted("Pipeline aborted")
+
+    def close(self):
+        self.put(_END)
+
+    def abort(self):
+        self._aborted.set()
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._aborted.is_set():
+                    raise PipelineAborted("Pipeline aborted")
+                continue
+            if item is _END:
+                return
+            if self.governor is not None:
+                item = self.governor.release(self.stage, item)
+            yield item
+
+
+class ChannelWriter(io.RawIOBase):
+    """
+    Writable stream sending what is written to a channel
+    in parts of part_size bytes
+
+    Args:
+        channel (BoundedChannel): channel to the upload stage
+        part_size (int): bytes per part sent to the channel
+    """
+
+    def __init__(self, channel: BoundedChannel,
+                 part_size: int = UPLOAD_PART_SIZE):
+        self.channel = channel
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._buffer += data
+        self._position += size
+        if len(self._buffer) >= self.part_size:
+            self.channel.put(bytes(self._buffer))
+            self._buffer.clear()
+        return size
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buffer:
+            self.channel.put(bytes(self._buffer))
+            self._buffer.clear()
+        self.channel.close()
+        super().close()
+
+
+class _Stage(threading.Thread):
+    """
+    Pipeline stage running on its own thread, recording its busy time
+    and any error so that the other stages can be aborted
+    """
+
+    def __init__(self, name: str, target: Callable, channels: list):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._channels = channels
+        self.error = None
+        self.seconds = 0.0
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self._target_fn()
+        except Exception as e:
+            self.error = e
+            for channel in self._channels:
+                channel.abort()
+        finally:
+            self.seconds = time.perf_counter() - start
+
+
+def _start_download(source: BinaryIO, file_type: str,
+                    download_channel: BoundedChannel, block_size: int,
+                    channels: list) -> tuple[BinaryIO, _Stage | None]:
+    """
+    Start the download stage streaming source into download_channel
+
+    Returns:
+        tuple: the stream chunks are read from, and the download stage
+               (None when the input needs random access)
+    """
+    if file_type in FOOTER_FILE_TYPES:
+        # Parquet, orc and feather need random access to their footer,
+        # no streaming input
+        return source, None
+
+    def download():
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            download_channel.put(block)
+        download_channel.close()
+
+    downloader = _Stage("download", download, channels)
+    downloader.start()
+    return (io.BufferedReader(ChunkIterReader(iter(download_channel))),
+            downloader)
+
+
+def check_pipelined_fields(
+        fields_list: list[str] | Callable[[list[str]], list[str]],
+        file_type: str):
+    """
+    Raise ValueError for JSON path fields of a JSON input, which
+    pipelined and fan-out jobs cannot obfuscate: their chunks are flat
+    DataFrames. Other inputs may have '.' or '[' in their column names.
+
+    Args:
+        fields_list (list/Callable): fields to be obfuscated
+        file_type (str): type of the input file
+    """
+    if callable(fields_list) or file_type != "json":
+        return
+    path_fields = [field for field in fields_list if is_json_path(field)]
+    if path_fields:
+        raise ValueError(f"JSON path fields {path_fields} are not " +
+                         "available for pipelined, fan-out or " +
+                         "partitioned processing")
+
+
+def _raise_first_error(errors: list[Exception], stages: list):
+    errors += [stage.error for stage in stages
+               if stage is not None and stage.error is not None]
+    if errors:
+        root_causes = [e for e in errors
+                       if not isinstance(e, PipelineAborted)]
+        error = (root_causes or errors)[0]
+        logger.error(f"Pipeline failed: {str(error)}")
+        raise error
+
+
+def run_pipelined_obfuscation(
+    source: BinaryIO,
+    file_type: str,
+    fields_list: list[str] | Callable[[list[str]], list[str]],
+    write_output: Callable[[Iterator[bytes]], object],
+    output_format: str = None,
+    chunk_size: int = 5000,
+    obfuscate_method: str | dict[str, str] = "replace",
+    queue_size: int = 4,
+    block_size: int = DOWNLOAD_BLOCK_SIZE,
+    part_size: int = UPLOAD_PART_SIZE,
+    chunk_bytes: int = None,
+    max_memory_mb: int = None,
+    spill_dir: str = None,
+    writer_options: dict = None,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
+    **csv_options,
+) -> dict:
+    """
+    Obfuscate a file with download, obfuscation and upload overlapped:
+    the next input block downloads while the current chunk is obfuscated
+    and the previous output part uploads. Stages are connected by
+    bounded channels, so a slow stage applies backpressure to the
+    stages before it.
+
+    Args:
+        source (BinaryIO): input stream, e.g. an S3 body
+        file_type (str): input file type (csv/json/parquet)
+        fields_list (list/Callable): fields to be obfuscated, or a function
+            choosing them from the column names of the first chunk
+        write_output (Callable): uploads an iterator of output byte parts,
+            e.g. lambda parts: write_s3_file(bucket, key, parts)
+        output_format (str): csv/json/parquet, same as file_type if None
+        chunk_size (int): number of rows to process at a time
+        obfuscate_method (str/dict)
+            ['mask'/'hash'/'random_hash'/'replace'/'redact']:
+            how to obfuscate the data, default to be 'replace', or a dict
+            of field to method
+        queue_size (int): maximum blocks/parts waiting between two stages
+        block_size (int): bytes per downloaded block
+        part_size (int): bytes per output part handed to the upload
+        chunk_bytes (int): If given, chunks are sized to this many bytes
+            in memory and chunk_size only bounds the first chunk
+        max_memory_mb (int): If given, a MemoryGovernor keeps the
+            process under this many MB: chunks shrink, output parts are
+            spilled to disk and the obfuscation waits for buffers in
+            flight to drain as the limit nears
+        spill_dir (str): directory of the spilled output parts, the
+            system temp directory by default
+        writer_options (dict): options of the chunk writer,
+            e.g. {"compression": "zstd"} for parquet output
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
+        **csv_options: csv_schema/infer_schema/raw_non_pii/csv_engine
+
+    Returns:
+        dict: busy seconds of each stage ('download_seconds',
+              'obfuscate_seconds', 'upload_seconds'), seconds producers
+              were blocked by full channels ('backpressure_seconds'),
+              'total_seconds', 'rows', 'fields_list', 'chunk_sizes'
+              (see ChunkSizer.metrics) and with max_memory_mb 'memory'
+              (see MemoryGovernor.metrics)
+    """
+    check_pipelined_fields(fields_list, file_type)
+    output_format = output_format or file_type
+    logger.info(f"Running pipelined obfuscation of {file_type} " +
+                f"to {output_format}")
+    start = time.perf_counter()
+    governor = None if max_memory_mb is None else \
+        MemoryGovernor(max_memory_mb, spill_dir)
+    download_channel = BoundedChannel(queue_size, governor, "obfuscate")
+    upload_channel = BoundedChannel(queue_size, governor, "upload",
+                                    spill=True)
+    channels = [download_channel, upload_channel]
+    result = {"rows": 0, "fields_list": fields_list}
+    sizer = as_chunk_sizer(chunk_size, chunk_bytes)
+
+    def upload():
+        write_output(iter(upload_channel))
+
+    stream, downloader = _start_download(source, file_type, download_channel,
+                                         block_size, channels)
+    uploader = _Stage("upload", upload, channels)
+    uploader.start()
+
+    obfuscate_start = time.perf_counter()
+    errors = []
+    try:
+        writer = get_chunk_writer(output_format,
+                                  ChannelWriter(upload_channel, part_size),
+                                  **(writer_options or {}))
+        chunks = iter_df_chunks(stream, file_type, sizer,
+                                fields_list=None if callable(fields_list)
+                                else fields_list,
+                                **csv_options)
+        for chunk in chunks:
+            if callable(result["fields_list"]):
+                result["fields_list"] = result["fields_list"](
+                    list(chunk.columns))
+                logger.info(f"Fields to obfuscate: {result['fields_list']}")
+            writer.write(obfuscate_fields_in_df(
+                chunk, result["fields_list"], obfuscate_method,
+                token_vault, pseudonym_map))
+            result["rows"] += len(chunk)
+            if governor is not None:
+                governor.throttle(sizer)
+        writer.close().close()
+    except Exception as e:
+        errors.append(e)
+        for channel in channels:
+            channel.abort()
+    obfuscate_seconds = time.perf_counter() - obfuscate_start
+    if downloader is not None:
+        downloader.join()
+    uploader.join()
+    if governor is not None:
+        governor.close()
+        result["memory"] = governor.metrics()
+
+    _raise_first_error(errors, [downloader, uploader])
+    result.update({
+        "download_seconds": downloader.seconds if downloader else 0.0,
+        "obfuscate_seconds": obfuscate_seconds,
+        "upload_seconds": uploader.seconds,
+        "backpressure_seconds": (download_channel.wait_seconds
+                                 + upload_channel.wait_seconds),
+        "total_seconds": time.perf_counter() - start,
+        "chunk_sizes": sizer.metrics(),
+    })
+    logger.info(f"Pipeline finished: {result['rows']} rows in " +
+                f"{result['total_seconds']:.3f}s")
+    return result
+
+
+def run_fan_out_obfuscation(
+    source: BinaryIO,
+    file_type: str,
+    fields_list: list[str] | Callable[[list[str]], list[str]],
+    write_outputs: dict[str, Callable[[Iterator[bytes]], object]],
+    chunk_size: int = 5000,
+    obfuscate_method: str | dict[str, str] = "replace",
+    queue_size: int = 4,
+    block_size: int = DOWNLOAD_BLOCK_SIZE,
+    part_size: int = UPLOAD_PART_SIZE,
+    chunk_bytes: int = None,
+    writer_options: dict[str, dict] = None,
+    max_memory_mb: int = None,
+    spill_dir: str = None,
+    token_vault: TokenVault = None,
+    pseudonym_map: PseudonymMap = None,
+    **csv_options,
+) -> dict:
+    """
+    Obfuscate a file once and write it in several output formats.
+    Every obfuscated chunk is teed to one bounded channel per format,
+    each encoded by its own writer stage and uploaded by its own upload
+    stage, so the formats are encoded concurrently and the input is
+    only downloaded and obfuscated once. The slowest writer applies
+    backpressure to the obfuscation, bounding the chunks in flight.
+
+    Args:
+        source (BinaryIO): input stream, e.g. an S3 body
+        file_type (str): input file type, see FILE_TYPES
+        fields_list (list/Callable): fields to be obfuscated, or a function
+            choosing them from the column names of the first chunk
+        write_outputs (dict): output format to the function uploading an
+            iterator of its output byte parts, see
+            run_pipelined_obfuscation
+        chunk_size (int): number of rows to process at a time
+        obfuscate_method (str/dict): how to obfuscate the data, see
+            obfuscate_fields_in_df
+        queue_size (int): maximum blocks/chunks/parts waiting between
+                          two stages
+        block_size (int): bytes per downloaded block
+        part_size (int): bytes per output part handed to an upload
+        chunk_bytes (int): If given, chunks are sized to this many bytes
+            in memory and chunk_size only bounds the first chunk
+        writer_options (dict): output format to the options of its
+            chunk writer, e.g. {"parquet": {"compression": "zstd"}}
+        max_memory_mb (int): memory limit, see run_pipelined_obfuscation
+        spill_dir (str): directory of the spilled output parts
+        token_vault (TokenVault): vault of 'tokenize',
+            get_token_vault() when None
+        pseudonym_map (PseudonymMap): map of 'pseudonymize',
+            get_pseudonym_map() when None
+        **csv_options: csv_schema/infer_schema/raw_non_pii/csv_engine
+
+    Returns:
+        dict: as run_pipelined_obfuscation, with 'encode_seconds' and
+              'upload_seconds' given per output format
+    """
+    if not write_outputs:
+        raise ValueError("At least one output format is required")
+    check_pipelined_fields(fields_list, file_type)
+    writer_options = writer_options or {}
+    logger.info(f"Running fan-out obfuscation of {file_type} " +
+                f"to {', '.join(write_outputs)}")
+    start = time.perf_counter()
+    governor = None if max_memory_mb is None else \
+        MemoryGovernor(max_memory_mb, spill_dir)
+    download_channel = BoundedChannel(queue_size, governor, "obfuscate")
+    chunk_channels = {output_format: BoundedChannel(
+                          queue_size, governor, f"encode-{output_format}")
+                      for output_format in write_outputs}
+    upload_channels = {output_format: BoundedChannel(
+                           queue_size, governor, f"upload-{output_format}",
+                           spill=True)
+                       for output_format in write_outputs}
+    channels = [download_channel, *chunk_channels.values(),
+                *upload_channels.values()]
+    result = {"rows": 0, "fields_list": fields_list}
+    sizer = as_chunk_sizer(chunk_size, chunk_bytes)
+
+    def encode(output_format):
+        writer = get_chunk_writer(
+            output_format,
+            ChannelWriter(upload_channels[output_format], part_size),
+            **writer_options.get(output_format, {}))
+        for chunk in chunk_channels[output_format]:
+            writer.write(chunk)
+        writer.close().close()
+
+    def upload(output_format):
+        write_outputs[output_format](iter(upload_channels[output_format]))
+
+    stream, downloader = _start_download(source, file_type, download_channel,
+                                         block_size, channels)
+    encoders = {output_format: _Stage(f"encode-{output_format}",
+                                      partial(encode, output_format),
+                                      channels)
+                for output_format in write_outputs}
+    uploaders = {output_format: _Stage(f"upload-{output_format}",
+                                       partial(upload, output_format),
+                                       channels)
+                 for output_format in write_outputs}
+    for stage in [*encoders.values(), *uploaders.values()]:
+        stage.start()
+
+    obfuscate_start = time.perf_counter()
+    errors = []
+    try:
+        chunks = iter_df_chunks(stream, file_type, sizer,
+                                fields_list=None if callable(fields_list)
+                                else fields_list,
+                                **csv_options)
+        for chunk in chunks:
+            if callable(result["fields_list"]):
+                result["fields_list"] = result["fields_list"](
+                    list(chunk.columns))
+                logger.info(f"Fields to obfuscate: {result['fields_list']}")
+            chunk = obfuscate_fields_in_df(
+                chunk, result["fields_list"], obfuscate_method,
+                token_vault, pseudonym_map)
+            # Writers only read the chunk, so they all share it
+            for channel in chunk_channels.values():
+                channel.put(chunk)
+            result["rows"] += len(chunk)
+            if governor is not None:
+                governor.throttle(sizer)
+        for channel in chunk_channels.values():
+            channel.close()
+    except Exception as e:
+        errors.append(e)
+        for channel in channels:
+            channel.abort()
+    obfuscate_seconds = time.perf_counter() - obfuscate_start
+    stages = [downloader, *encoders.values(), *uploaders.values()]
+    for stage in stages:
+        if stage is not None:
+            stage.join()
+    if governor is not None:
+        governor.close()
+        result["memory"] = governor.metrics()
+
+    _raise_first_error(errors, stages)
+    result.update({
+        "download_seconds": downloader.seconds if downloader else 0.0,
+        "obfuscate_seconds": obfuscate_seconds,
+        "encode_seconds": {output_format: stage.seconds
+                           for output_format, stage in encoders.items()},
+        "upload_seconds": {output_format: stage.seconds
+                           for output_format, stage in uploaders.items()},
+        "backpressure_seconds": sum(channel.wait_seconds
+                                    for channel in channels),
+        "total_seconds": time.perf_counter() - start,
+        "chunk_sizes": sizer.metrics(),
+    })
+    logger.info(f"Fan-out finished: {result['rows']} rows to " +
+                f"{len(write_outputs)} formats in " +
+                f"{result['total_seconds']:.3f}s")
+    return result
@@ -0,0 +1,319 @@
+import hashlib
+import math
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.arrow_strings import (
+    is_arrow_string,
+    map_valid,
+    string_array,
+    string_series,
+)
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+PSEUDONYM_PREFIX = "psn_"
+PSEUDONYM_BYTES = 12
+LOOKUP_BYTES = 16
+# SQLite accepts up to 32766 parameters per statement
+QUERY_BATCH = 10000
+MAP_PATH_ENV = "OBFUSCATOR_PSEUDONYM_MAP"
+DEFAULT_MAP_PATH = "pseudonym_map.db"
+# Distinct values the Bloom filter is sized for, and its false
+# positive rate at that size (about 1.2 bytes per value)
+DEFAULT_CAPACITY = 10_000_000
+DEFAULT_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """
+    Bloom filter over 16 byte digests, with its bits in a memory-mapped
+    file: pages are loaded by the OS as they are used, so a filter of
+    hundreds of millions of values does not need to fit in RAM.
+
+    The k bit positions of a digest are derived from its two 64-bit
+    halves (double hashing), for whole arrays of digests at once.
+
+    Args:
+        path (str): file of the bits, None to keep them in memory
+        num_bits (int): size of the filter in bits
+        num_hashes (int): bits set per value
+    """
+
+    def __init__(self, path: str | None, num_bits: int, num_hashes: int):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        num_bytes = (num_bits + 7) // 8
+        if path is None:
+            self._bits = np.zeros(num_bytes, dtype=np.uint8)
+        else:
+            if not os.path.exists(path):
+                # A sparse file, its blocks are only written once used
+                with open(path, "wb") as bits_file:
+                    bits_file.truncate(num_bytes)
+            self._bits = np.memmap(path, dtype=np.uint8, mode="r+",
+                                   shape=(num_bytes,))
+
+    @staticmethod
+    def size_for(capacity: int, error_rate: float) -> tuple[int, int]:
+        """
+        Bits and hashes of a filter holding capacity values with the
+        given false positive rate
+
+        Returns:
+            tuple[int, int]: num_bits, num_hashes
+        """
+        num_bits = math.ceil(-capacity * math.log(error_rate) /
+                             math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return num_bits, num_hashes
+
+    def _positions(self, digests: list[bytes]) -> np.ndarray:
+        halves = np.frombuffer(b"".join(digests),
+                               dtype=np.uint64).reshape(-1, 2)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        # uint64 arithmetic wraps around, as double hashing expects
+        return (halves[:, :1] + steps * halves[:, 1:]) % \
+            np.uint64(self.num_bits)
+
+    def might_contain(self, digests: list[bytes]) -> np.ndarray:
+        """
+        Args:
+            digests (list): 16 byte digests
+
+        Returns:
+            np.ndarray: False for each digest never added, True for the
+                        others (and for a few false positives)
+        """
+        if not digests:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(digests)
+        bits = self._bits[positions >> np.uint64(3)] >> \
+            (positions & np.uint64(7)).astype(np.uint8)
+        return (bits & 1).all(axis=1).astype(bool)
+
+    def add(self, digests: list[bytes]):
+        """
+        Args:
+            digests (list): 16 byte digests
+        """
+        if not digests:
+            return
+        positions = self._positions(digests).ravel()
+        np.bitwise_or.at(self._bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7))
+                         .astype(np.uint8))
+
+    def flush(self):
+        if isinstance(self._bits, np.memmap):
+            self._bits.flush()
+
+
+class PseudonymMap:
+    """
+    Persistent map of values to random pseudonyms (e.g psn_9b1e...),
+    shared by every file and job using it, so that a value gets the same
+    pseudonym in all the files of a batch and they can still be joined.
+
+    Values are only stored as their BLAKE2b digest, keyed with a salt
+    drawn when the map is created, in a SQLite table: the map grows on
+    disk, not in RAM. A Bloom filter of the stored values lets values
+    never seen skip the lookup, and each call inserts its new values in
+    one batch. Pseudonyms are random, so they cannot be computed back
+    from values, even with the salt.
+
+    Args:
+        path (str): path of the SQLite map, ':memory:' for tests. The
+            Bloom filter is kept next to it, in <path>.bloom
+        capacity (int): distinct values the Bloom filter is sized for,
+            when the map is created. Beyond it more lookups are made.
+        error_rate (float): false positive rate of the Bloom filter
+        cache_size (int): recent pseudonyms memoized for
+                          pseudonymize_value
+    """
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY,
+                 error_rate: float = DEFAULT_ERROR_RATE,
+                 cache_size: int = 10000):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"values": 0, "bloom_skipped": 0, "inserted": 0}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            # Several jobs of a batch may share the map
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        num_bits, num_hashes = BloomFilter.size_for(capacity, error_rate)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pseudonyms (lookup BLOB "
+                "PRIMARY KEY, pseudonym TEXT NOT NULL) WITHOUT ROWID")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, "
+                "value)")
+            # The first job creating the map chooses its salt and filter
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO meta VALUES (?, ?)",
+                [("salt", secrets.token_bytes(32)),
+                 ("bloom_bits", num_bits), ("bloom_hashes", num_hashes)])
+        meta = dict(self._connection.execute("SELECT name, value FROM meta"))
+        self._salt = meta["salt"]
+        self.bloom = BloomFilter(
+            None if path == ":memory:" else path + ".bloom",
+            meta["bloom_bits"], meta["bloom_hashes"])
+
+    def _lookup(self, value: str) -> bytes:
+        # Keyed BLAKE2b is a MAC, cheaper per value than HMAC-SHA256
+        return hashlib.blake2b(value.encode("utf8"), key=self._salt,
+                               digest_size=LOOKUP_BYTES).digest()
+
+    def _select(self, keys: list[bytes]) -> dict[bytes, str]:
+        found = {}
+        for i in range(0, len(keys), QUERY_BATCH):
+            batch = keys[i:i + QUERY_BATCH]
+            found.update(self._connection.execute(
+                "SELECT lookup, pseudonym FROM pseudonyms WHERE lookup IN " +
+                f"({','.join('?' * len(batch))})", batch))
+        return found
+
+    def pseudonymize(self, values: list[str]) -> list[str]:
+        """
+        Pseudonymize values, drawing pseudonyms for the values never seen
+
+        Args:
+            values (list): strings to pseudonymize
+
+        Returns:
+            list[str]: pseudonym of each value
+        """
+        lookups = {value: self._lookup(value) for value in values}
+        keys = list(lookups.values())
+        with self._lock:
+            maybe_seen = self.bloom.might_contain(keys)
+            pseudonyms = self._select(
+                [key for key, seen in zip(keys, maybe_seen) if seen])
+            new_keys = [key for key in keys if key not in pseudonyms]
+            if new_keys:
+                rows = [(key, PSEUDONYM_PREFIX +
+                         secrets.token_hex(PSEUDONYM_BYTES))
+                        for key in new_keys]
+                with self._connection:
+                    changes = self._connection.total_changes
+                    self._connection.executemany(
+                        "INSERT OR IGNORE INTO pseudonyms VALUES (?, ?)",
+                        rows)
+                    inserted = self._connection.total_changes - changes
+                if inserted == len(rows):
+                    pseudonyms.update(rows)
+                else:
+                    # Another job added some of these values meanwhile
+                    pseudonyms.update(self._select(new_keys))
+                self.bloom.add(new_keys)
+                self.stats["inserted"] += inserted
+            self.stats["values"] += len(keys)
+            self.stats["bloom_skipped"] += int((~maybe_seen).sum())
+        logger.debug(f"Pseudonymized {len(keys)} distinct values, " +
+                     f"{len(new_keys)} new")
+        return [pseudonyms[lookups[value]] for value in values]
+
+    def pseudonymize_value(self, value: str) -> str:
+        """
+        Pseudonymize one value, for callers working value by value.
+        Recent pseudonyms are memoized, so repeated values skip the map.
+
+        Args:
+            value (str): string to pseudonymize
+
+        Returns:
+            str: pseudonym of the value
+        """
+        with self._lock:
+            pseudonym = self._cache.get(value)
+        if pseudonym is None:
+            pseudonym = self.pseudonymize([value])[0]
+            with self._lock:
+                self._cache[value] = pseudonym
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return pseudonym
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM pseudonyms").fetchone()[0]
+
+    def close(self):
+        self.bloom.flush()
+        self._connection.close()
+
+
+def pseudonymize_series(series: pd.Series,
+                        pseudonym_map: PseudonymMap = None) -> pd.Series:
+    """
+    Pseudonymize a column with one bulk map call. Missing values
+    are kept.
+
+    Args:
+        series (pd.Series): column to pseudonymize
+        pseudonym_map (PseudonymMap): map to use, see get_pseudonym_map
+
+    Returns:
+        pd.Series: pseudonymized column
+    """
+    if pseudonym_map is None:
+        pseudonym_map = get_pseudonym_map()
+    if is_arrow_string(series):
+        return string_series(map_valid(string_array(series),
+                                       pseudonym_map.pseudonymize), series)
+    present = series.notna().to_numpy()
+    if not present.any():
+        return series
+    output = series.astype(object)
+    output[present] = pseudonym_map.pseudonymize(
+        series[present].astype(str).tolist())
+    return output
+
+
+# The map used by the 'pseudonymize' method, one per process
+_map_cache = {}
+
+
+def set_pseudonym_map(pseudonym_map: PseudonymMap | str | None):
+    """
+    Choose the map used by the 'pseudonymize' method
+
+    Args:
+        pseudonym_map (PseudonymMap/str): a map, or the path of a SQLite
+            map. The map in use is kept when it has this path. None to
+            go back to the map of OBFUSCATOR_PSEUDONYM_MAP.
+    """
+    current = _map_cache.get("map")
+    if isinstance(pseudonym_map, str):
+        if current is not None and current.path == pseudonym_map:
+            return
+        pseudonym_map = PseudonymMap(pseudonym_map)
+    _map_cache.clear()
+    if pseudonym_map is not None:
+        _map_cache["map"] = pseudonym_map
+
+
+def get_pseudonym_map() -> PseudonymMap:
+    """
+    Return the map of the 'pseudonymize' method: the one chosen with
+    set_pseudonym_map, or else the map at OBFUSCATOR_PSEUDONYM_MAP
+    (pseudonym_map.db by default)
+
+    Returns:
+        PseudonymMap: map of this process
+    """
+    if "map" not in _map_cache:
+        _map_cache["map"] = PseudonymMap(
+            os.getenv(MAP_PATH_ENV, DEFAULT_MAP_PATH))
+    return _map_cache["map"]
@@ -0,0 +1,389 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import BinaryIO
+from src.compression import split_compression_extension
+from src.chunk_writers import get_chunk_writer
+from src.file_formats import BATCH_FILE_TYPES
+from src.obfuscator import iter_df_chunks
+from src.utils import get_s3_client
+from src.storage import StorageBackend, S3Backend
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+FILTER_OPERATORS = ["=", "==", "!=", "<", "<=", ">", ">=", "in", "not in"]
+# Compression codecs S3 Select can read, keyed by our codec names
+SELECT_COMPRESSION_TYPES = {None: "NONE", "gzip": "GZIP", "bz2": "BZIP2"}
+LOCAL_CHUNK_SIZE = 50000
+
+
+def validate_row_filter(row_filter: list | None) -> list[tuple]:
+    """
+    Check a row filter: a list of (column, operator, value) predicates
+    that must all hold, as used by pyarrow's parquet filters.
+    'in'/'not in' take a list of values.
+
+    Args:
+        row_filter (list): predicates, None for no filter
+
+    Returns:
+        list[tuple]: the predicates as tuples
+    """
+    predicates = []
+    for predicate in row_filter or []:
+        if len(predicate) != 3 or predicate[1] not in FILTER_OPERATORS:
+            raise ValueError(f"Invalid row filter predicate: {predicate}. " +
+                             "Expected [column, operator, value] with an " +
+                             f"operator in {FILTER_OPERATORS}")
+        column, operator, value = predicate
+        if operator in ["in", "not in"] and \
+                not isinstance(value, (list, tuple)):
+            raise ValueError(f"'{operator}' needs a list of values")
+        predicates.append((column, "=" if operator == "==" else operator,
+                           value))
+    return predicates
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_column(column: str) -> str:
+    return 's."' + column.replace('"', '""') + '"'
+
+
+def build_select_expression(columns: list[str] | None,
+                            row_filter: list | None,
+                            file_type: str) -> str:
+    """
+    Build the S3 Select SQL expression of a projection and row filter.
+    CSV values are strings in S3 Select, so columns compared with
+    numbers are cast to FLOAT.
+
+    Args:
+        columns (list): columns to keep, None for all
+        row_filter (list): predicates, see validate_row_filter
+        file_type (str): csv/json
+
+    Returns:
+        str: SQL expression
+    """
+    projection = ", ".join(_sql_column(c) for c in columns) \
+        if columns else "*"
+    source = "S3Object s" if file_type == "csv" else "S3Object[*] s"
+    conditions = []
+    for column, operator, value in validate_row_filter(row_filter):
+        values = value if operator in ["in", "not in"] else [value]
+        operand = _sql_column(column)
+        if file_type == "csv" and all(
+                isinstance(v, (int, float)) and not isinstance(v, bool)
+                for v in values):
+            operand = f"CAST({operand} AS FLOAT)"
+        if operator in ["in", "not in"]:
+            literals = ", ".join(_sql_literal(v) for v in values)
+            conditions.append(f"{operand} {operator.upper()} ({literals})")
+        else:
+            conditions.append(f"{operand} {operator} {_sql_literal(value)}")
+    expression = f"SELECT {projection} FROM {source}"
+    if conditions:
+        expression += " WHERE " + " AND ".join(conditions)
+    return expression
+
+
+def _comparable(series: pd.Series, values: list) -> tuple[pd.Series, list]:
+    # As S3 Select on csv: compared with numbers the column is cast to
+    # a number, otherwise values are compared as text, missing as ''
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool)
+           for v in values):
+        return pd.to_numeric(series, errors="coerce"), values
+    if all(isinstance(v, bool) for v in values):
+        return series, values
+    return (series.astype(str).where(series.notna(), ""),
+            [str(v) for v in values])
+
+
+def filter_df(df: pd.DataFrame, row_filter: list | None) -> pd.DataFrame:
+    """
+    Keep the rows of a DataFrame matching every predicate of a row
+    filter, the local equivalent of the pushed down filter: a column
+    compared with numbers is compared as numbers, with other values as
+    text, whatever its dtype, as S3 Select does on csv
+
+    Args:
+        df (pd.DataFrame): rows to filter
+        row_filter (list): predicates, see validate_row_filter
+
+    Returns:
+        pd.DataFrame: matching rows
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, operator, value in validate_row_filter(row_filter):
+        if column not in df.columns:
+            raise KeyError(f"Filter column '{column}' not found in the data.")
+        values = value if operator in ["in", "not in"] else [value]
+        series, values = _comparable(df[column], list(values))
+        value = values if operator in ["in", "not in"] else values[0]
+        if operator == "in":
+            mask &= series.isin(value)
+        elif operator == "not in":
+            mask &= ~series.isin(value)
+        elif operator == "=":
+            mask &= series == value
+        elif operator == "!=":
+            mask &= series != value
+        elif operator == "<":
+            mask &= series < value
+        elif operator == "<=":
+            mask &= series <= value
+        elif operator == ">":
+            mask &= series > value
+        elif operator == ">=":
+            mask &= series >= value
+    return df[mask]
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Seekable read-only view of an S3 object, each read served by a
+    ranged GET, so that parquet readers only download the footer and
+    the column chunks they need
+
+    Args:
+        s3_bucket (str): bucket of the object
+        file_key (str): key of the object
+    """
+
+    def __init__(self, s3_bucket: str, file_key: str):
+        self.s3_bucket = s3_bucket
+        self.file_key = file_key
+        self._s3_client = get_s3_client()
+        self.size = self._s3_client.head_object(
+            Bucket=s3_bucket, Key=file_key)["ContentLength"]
+        self._position = 0
+        self.bytes_read = 0
+        self.requests = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, target) -> int:
+        end = min(self._position + len(target), self.size)
+        if end <= self._position:
+            return 0
+        body = self._s3_client.get_object(
+            Bucket=self.s3_bucket, Key=self.file_key,
+            Range=f"bytes={self._position}-{end - 1}")["Body"].read()
+        target[:len(body)] = body
+        self._position += len(body)
+        self.bytes_read += len(body)
+        self.requests += 1
+        return len(body)
+
+
+def read_parquet_projected(source: BinaryIO, columns: list[str] | None,
+                           row_filter: list | None) -> pa.Table:
+    """
+    Read only the selected columns of a parquet file, skipping the row
+    groups whose min/max statistics rule out the row filter
+
+    Args:
+        source (BinaryIO): seekable parquet data
+        columns (list): columns to keep, None for all
+        row_filter (list): predicates, see validate_row_filter
+
+    Returns:
+        pa.Table: projected and filtered rows
+    """
+    predicates = validate_row_filter(row_filter)
+    return pq.read_table(source, columns=columns,
+                         filters=predicates or None)
+
+
+def _select_s3_object(s3_bucket: str, file_key: str, file_type: str,
+                      codec: str | None, columns: list[str] | None,
+                      row_filter: list | None) -> tuple[bytes, dict]:
+    if file_type == "csv":
+        input_serialization = {"CSV": {"FileHeaderInfo": "USE"}}
+        output_serialization = {"CSV": {}}
+    else:
+        input_serialization = {"JSON": {"Type": "DOCUMENT"}}
+        output_serialization = {"JSON": {"RecordDelimiter": "\n"}}
+    input_serialization["CompressionType"] = SELECT_COMPRESSION_TYPES[codec]
+    response = get_s3_client().select_object_content(
+        Bucket=s3_bucket, Key=file_key,
+        Expression=build_select_expression(columns, row_filter, file_type),
+        ExpressionType="SQL",
+        InputSerialization=input_serialization,
+        OutputSerialization=output_serialization)
+    records = io.BytesIO()
+    stats = {}
+    for event in response["Payload"]:
+        if "Records" in event:
+            records.write(event["Records"]["Payload"])
+        elif "Stats" in event:
+            details = event["Stats"]["Details"]
+            stats = {"bytes_scanned": details["BytesScanned"],
+                     "bytes_returned": details["BytesReturned"]}
+    return records.getvalue(), stats
+
+
+def _as_json_array(json_lines: bytes) -> bytes:
+    records = [line for line in json_lines.split(b"\n") if line.strip()]
+    return b"[" + b",".join(records) + b"]"
+
+
+def _read_header(s3_bucket: str, file_key: str) -> list[str]:
+    body = get_s3_client().get_object(Bucket=s3_bucket, Key=file_key,
+                                      Range="bytes=0-65535")["Body"].read()
+    return list(pd.read_csv(io.BytesIO(body), nrows=0).columns)
+
+
+def _project_locally(content: BinaryIO, file_type: str,
+                     columns: list[str] | None,
+                     row_filter: list | None) -> io.BytesIO:
+    if file_type in BATCH_FILE_TYPES:
+        writer = get_chunk_writer(file_type)
+        for chunk in iter_df_chunks(content, file_type, LOCAL_CHUNK_SIZE):
+            chunk = filter_df(chunk, row_filter)
+            writer.write(chunk[columns] if columns else chunk)
+        return writer.close()
+    output = io.BytesIO()
+    is_first_chunk = True
+    if file_type == "json":
+        output.write(b"[")
+    for chunk in iter_df_chunks(content, file_type, LOCAL_CHUNK_SIZE):
+        chunk = filter_df(chunk, row_filter)
+        if columns:
+            chunk = chunk[columns]
+        if file_type == "csv":
+            chunk.to_csv(output, index=False, header=is_first_chunk)
+        elif len(chunk):
+            records = chunk.to_json(orient="records").encode("utf8")[1:-1]
+            if not is_first_chunk:
+                output.write(b",")
+            output.write(records)
+        else:
+            continue
+        is_first_chunk = False
+    if file_type == "json":
+        output.write(b"]")
+    output.seek(0)
+    return output
+
+
+def read_projected_file(
+    s3_bucket: str,
+    file_key: str,
+    columns: list[str] = None,
+    row_filter: list = None,
+    storage_backend: StorageBackend = None,
+) -> tuple[BinaryIO, str, dict]:
+    """
+    Read only the selected columns and the rows matching a filter,
+    pushing both down to the storage where possible so that less data
+    is transferred and parsed:
+    - parquet in S3 is read with ranged GETs: the footer, then only the
+      selected column chunks of the row groups whose statistics can
+      match the filter
+    - csv/json in S3 are queried with S3 Select
+    - other backends, and S3 objects S3 Select cannot query, are read
+      and projected locally with the same semantics
+
+    Args:
+        s3_bucket (str): bucket of the file
+        file_key (str): key of the file
+        columns (list): columns to keep, None for all
+        row_filter (list): (column, operator, value) predicates that must
+            all hold, e.g. [("cohort", "=", "2024")], None for all rows
+        storage_backend (StorageBackend): where the file is stored,
+            S3 when None
+
+    Returns:
+        tuple[BinaryIO, str, dict]: projected content in the input format
+            (csv with a header, json array, parquet, orc, feather or
+            avro), the file type, and
+            'method' and byte counts of the read
+    """
+    validate_row_filter(row_filter)
+    file_type, codec = split_compression_extension(file_key)
+    output = None
+    is_s3 = storage_backend is None or storage_backend.name == "s3"
+    if is_s3 and file_type == "parquet":
+        reader = S3RangeReader(s3_bucket, file_key)
+        table = read_parquet_projected(reader, columns, row_filter)
+        stats = {"method": "parquet_pushdown",
+                 "bytes_read": reader.bytes_read,
+                 "object_size": reader.size,
+                 "requests": reader.requests}
+        output = io.BytesIO()
+        pq.write_table(table, output)
+    elif is_s3 and file_type in ["csv", "json"] and \
+            codec in SELECT_COMPRESSION_TYPES:
+        try:
+            records, stats = _select_s3_object(
+                s3_bucket, file_key, file_type, codec, columns, row_filter)
+            stats["method"] = "s3_select"
+            if file_type == "csv":
+                header = columns or _read_header(s3_bucket, file_key)
+                output = io.BytesIO(
+                    pd.DataFrame(columns=header).to_csv(
+                        index=False).encode("utf8") + records)
+            else:
+                output = io.BytesIO(_as_json_array(records))
+        except Exception as e:
+            logger.warning("S3 Select unavailable, projecting " +
+                           f"locally: {str(e)}")
+
+    if output is None:
+        if storage_backend is None:
+            storage_backend = S3Backend()
+        content, file_type = storage_backend.open_stream(s3_bucket, file_key)
+        if file_type == "parquet":
+            output = io.BytesIO()
+            pq.write_table(
+                read_parquet_projected(content, columns, row_filter), output)
+        else:
+            output = _project_locally(content, file_type, columns,
+                                      row_filter)
+        stats = {"method": "local"}
+    output.seek(0)
+    stats["output_bytes"] = output.getbuffer().nbytes
+    logger.info(f"Projected read of {s3_bucket}/{file_key}: {stats}")
+    return output, file_type, stats
+
+
+def parse_row_filter(row_filter: str | None) -> list | None:
+    """
+    Parse a row filter given as a JSON list of [column, operator, value]
+
+    Args:
+        row_filter (str): e.g '[["cohort", "=", "2024"]]'
+
+    Returns:
+        list: the predicates, None when no filter is given
+    """
+    if row_filter is None:
+        return None
+    return validate_row_filter(json.loads(row_filter))
@@ -0,0 +1,474 @@
+import argparse
+import io
+import json
+import queue
+import socketserver
+import statistics
+import threading
+import time
+import uuid
+import boto3
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.main import handle_file_obfuscation
+from src.pseudonym_map import PseudonymMap
+from src.storage import get_storage_backend
+from src.tokenization import open_token_vault
+from src.utils import enable_s3_client_cache
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+class LocalJobQueue:
+    """
+    In-memory stand-in for an SQS queue, with the same
+    send/receive/delete cycle as SQSJobQueue.
+    Received messages stay in flight until they are deleted; as with
+    SQS, a message not deleted within visibility_timeout seconds (e.g.
+    its job failed) is received again.
+
+    Args:
+        visibility_timeout (float): seconds a received message is hidden
+                                    from other receives, 30 by default
+    """
+
+    def __init__(self, visibility_timeout: float = 30):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self.visibility_timeout = visibility_timeout
+        self.in_flight = {}
+
+    def send_message(self, body: str) -> str:
+        message_id = str(uuid.uuid4())
+        self._queue.put((message_id, body))
+        return message_id
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [receipt for receipt, deadline
+                       in self._deadlines.items() if deadline <= now]
+            for receipt in expired:
+                del self._deadlines[receipt]
+                self._queue.put((receipt, self.in_flight.pop(receipt)))
+
+    def receive_messages(self, max_messages: int = 1,
+                         wait_seconds: float = 0) -> list[tuple[str, str]]:
+        """
+        Args:
+            max_messages (int): maximum number of messages to receive
+            wait_seconds (float): how long to wait for the first message
+
+        Returns:
+            list[tuple[str, str]]: (receipt handle, body) pairs
+        """
+        messages = []
+        deadline = time.monotonic() + wait_seconds
+        while not messages:
+            # Messages whose visibility timed out while waiting are
+            # received too
+            self._requeue_expired()
+            remaining = deadline - time.monotonic()
+            try:
+                messages.append(
+                    self._queue.get(timeout=max(0, min(remaining, 0.1))))
+            except queue.Empty:
+                if remaining <= 0:
+                    break
+        try:
+            while messages and len(messages) < max_messages:
+                messages.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        visible_at = time.monotonic() + self.visibility_timeout
+        with self._lock:
+            for receipt, body in messages:
+                self.in_flight[receipt] = body
+                self._deadlines[receipt] = visible_at
+        return messages
+
+    def delete_message(self, receipt: str):
+        with self._lock:
+            self.in_flight.pop(receipt, None)
+            self._deadlines.pop(receipt, None)
+
+
+class SQSJobQueue:
+    """
+    Jobs read from an AWS SQS queue
+
+    Args:
+        queue_url (str): url of the SQS queue
+    """
+
+    def __init__(self, queue_url: str):
+        self.queue_url = queue_url
+        self._client = boto3.client("sqs")
+
+    def send_message(self, body: str) -> str:
+        response = self._client.send_message(QueueUrl=self.queue_url,
+                                             MessageBody=body)
+        return response["MessageId"]
+
+    def receive_messages(self, max_messages: int = 1,
+                         wait_seconds: float = 0) -> list[tuple[str, str]]:
+        response = self._client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, 10),
+            WaitTimeSeconds=int(wait_seconds))
+        return [(message["ReceiptHandle"], message["Body"])
+                for message in response.get("Messages", [])]
+
+    def delete_message(self, receipt: str):
+        self._client.delete_message(QueueUrl=self.queue_url,
+                                    ReceiptHandle=receipt)
+
+
+class ObfuscationService:
+    """
+    Long-running obfuscation service. pandas/pyarrow, the detection
+    models, the s3 client and the storage backends are loaded once,
+    and jobs run on a pool of warm worker threads.
+
+    A job is a dict with "file_to_obfuscate" and "pii_fields", as in
+    the json string of handle_file_obfuscation, plus optional "job_id"
+    and "options" (keyword arguments of handle_file_obfuscation).
+
+    Args:
+        max_workers (int): number of jobs run concurrently
+        **default_options: handle_file_obfuscation keyword arguments
+                           used by every job unless it overrides them
+    """
+
+    def __init__(self, max_workers: int = 4, **default_options):
+        enable_s3_client_cache()
+        self.max_workers = max_workers
+        self.default_options = default_options
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="obfuscation")
+        self._backends = {}
+        self._vaults = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+        self.latencies_ms = []
+        self.failed_jobs = 0
+
+    def _get_backend(self, name):
+        if name is None or not isinstance(name, str) or name == "s3":
+            return name
+        with self._lock:
+            if name not in self._backends:
+                self._backends[name] = get_storage_backend(name)
+            return self._backends[name]
+
+    def _get_token_vault(self, path):
+        # Jobs given the same vault path share one open vault
+        if path is None or not isinstance(path, str):
+            return path
+        with self._lock:
+            if path not in self._vaults:
+                self._vaults[path] = open_token_vault(path)
+            return self._vaults[path]
+
+    def _get_pseudonym_map(self, path):
+        if path is None or not isinstance(path, str):
+            return path
+        with self._lock:
+            if path not in self._maps:
+                self._maps[path] = PseudonymMap(path)
+            return self._maps[path]
+
+    def run_job(self, job: dict) -> dict:
+        """
+        Run one job on the calling thread
+
+        Args:
+            job (dict): "file_to_obfuscate", "pii_fields" and optionally
+                        "job_id" and "options"
+
+        Returns:
+            dict: 'job_id', 'status' ('succeeded'/'failed'), 'latency_ms'
+                  and 'result', or 'output' (BytesIO) and 'output_bytes'
+                  when the output is not saved, or 'error'
+        """
+        start = time.perf_counter()
+        job_id = job.get("job_id") or str(uuid.uuid4())
+        report = {"job_id": job_id}
+        try:
+            options = {**self.default_options, **job.get("options", {})}
+            options["storage_backend"] = self._get_backend(
+                options.get("storage_backend"))
+            if options.get("tokenize_fields"):
+                options["token_vault"] = self._get_token_vault(
+                    options.get("token_vault"))
+            if options.get("pseudonymize_fields"):
+                options["pseudonym_map"] = self._get_pseudonym_map(
+                    options.get("pseudonym_map"))
+            json_string = json.dumps({
+                "file_to_obfuscate": job["file_to_obfuscate"],
+                "pii_fields": job.get("pii_fields", []),
+            })
+            result = handle_file_obfuscation(json_string, **options)
+            report["status"] = "succeeded"
+            if isinstance(result, io.BytesIO):
+                report["output_bytes"] = result.getbuffer().nbytes
+                report["output"] = result
+            else:
+                report["result"] = result
+        except Exception as e:
+            report["status"] = "failed"
+            report["error"] = str(e)
+        report["latency_ms"] = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latencies_ms.append(report["latency_ms"])
+            self.failed_jobs += report["status"] == "failed"
+        logger.info(f"Job {job_id} {report['status']} in " +
+                    f"{report['latency_ms']:.1f} ms")
+        return report
+
+    def submit(self, job: dict) -> Future:
+        """
+        Queue a job on the worker pool
+
+        Args:
+            job (dict): see run_job
+
+        Returns:
+            Future: resolves to the report of run_job
+        """
+        return self._executor.submit(self.run_job, job)
+
+    def consume(self, job_queue, max_jobs: int = None,
+                wait_seconds: float = 1,
+                stop_event: threading.Event = None) -> list[dict]:
+        """
+        Run jobs received from a queue (LocalJobQueue/SQSJobQueue) until
+        max_jobs have run, the queue is empty (when max_jobs is None and
+        no stop_event is given) or stop_event is set. At most max_workers
+        jobs are in flight; a message is deleted once its job succeeded,
+        failed jobs are left on the queue and received again once their
+        visibility timeout expires.
+
+        Args:
+            job_queue: queue with send/receive/delete_message
+            max_jobs (int): stop after this number of jobs
+            wait_seconds (float): long-polling time of each receive
+            stop_event (threading.Event): set to stop consuming
+
+        Returns:
+            list[dict]: reports of the jobs run
+        """
+        reports = []
+        in_flight = {}
+        received = 0
+
+        def collect(futures):
+            for future in futures:
+                report = future.result()
+                if report["status"] == "succeeded":
+                    job_queue.delete_message(in_flight[future])
+                reports.append(report)
+                del in_flight[future]
+
+        while max_jobs is None or received < max_jobs:
+            if stop_event is not None and stop_event.is_set():
+                break
+            collect([f for f in in_flight if f.done()])
+            capacity = self.max_workers - len(in_flight)
+            if max_jobs is not None:
+                capacity = min(capacity, max_jobs - received)
+            if capacity <= 0:
+                wait(in_flight, return_when=FIRST_COMPLETED)
+                continue
+            messages = job_queue.receive_messages(capacity, wait_seconds)
+            if not messages:
+                if max_jobs is None and stop_event is None:
+                    break
+                continue
+            for receipt, body in messages:
+                received += 1
+                try:
+                    job = json.loads(body)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Invalid job message: {str(e)}")
+                    continue
+                in_flight[self.submit(job)] = receipt
+        collect(list(in_flight))
+        return reports
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: 'jobs', 'failed_jobs' and mean/p50/p95 latency in ms
+        """
+        with self._lock:
+            latencies = sorted(self.latencies_ms)
+            failed_jobs = self.failed_jobs
+        stats = {"jobs": len(latencies), "failed_jobs": failed_jobs}
+        if latencies:
+            stats.update({
+                "mean_latency_ms": statistics.fmean(latencies),
+                "p50_latency_ms": latencies[len(latencies) // 2],
+                "p95_latency_ms": latencies[
+                    min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            })
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        enable_s3_client_cache(False)
+        with self._lock:
+            for resource in [*self._vaults.values(), *self._maps.values()]:
+                resource.close()
+            self._vaults.clear()
+            self._maps.clear()
+
+
+def make_request_handler(service: ObfuscationService):
+    """
+    Build the HTTP request handler of a service:
+        POST /jobs  runs a job (or a list of jobs) and returns the reports
+        GET /health returns the service stats
+    """
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload):
+            body = json.dumps(payload).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send_json(404, {"error": "Not found"})
+            self._send_json(200, {"status": "ok", **service.stats()})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                return self._send_json(404, {"error": "Not found"})
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError as e:
+                return self._send_json(400, {"error": str(e)})
+            jobs = payload if isinstance(payload, list) else [payload]
+            futures = [service.submit(job) for job in jobs]
+            reports = [future.result() for future in futures]
+            for report in reports:
+                report.pop("output", None)
+            failed = any(r["status"] == "failed" for r in reports)
+            self._send_json(500 if failed else 200,
+                            reports if isinstance(payload, list)
+                            else reports[0])
+
+        def address_string(self):
+            # Unix socket clients have no (host, port) address
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return "unix"
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    return RequestHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: ObfuscationService, host: str = "127.0.0.1",
+                port: int = 8080, socket_path: str = None):
+    """
+    Build the HTTP server of a service, on host:port or on a Unix socket
+
+    Args:
+        service (ObfuscationService): service running the jobs
+        host (str): host to listen on
+        port (int): port to listen on, 0 for any free port
+        socket_path (str): path of a Unix socket, used instead of host/port
+
+    Returns:
+        socketserver.BaseServer: server, call serve_forever() to start it
+    """
+    handler = make_request_handler(service)
+    if socket_path is not None:
+        logger.info(f"Listening on unix socket {socket_path}")
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(f"Listening on http://{host}:{server.server_port}")
+    return server
+
+
+def main():
+
+    parser = argparse.ArgumentParser('File Obfuscation Service')
+    parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of jobs run concurrently. Default is 4.'
+        )
+    parser.add_argument(
+            '--host',
+            type=str,
+            default="127.0.0.1",
+            help='Host of the HTTP endpoint. Default is 127.0.0.1.'
+        )
+    parser.add_argument(
+            '--port',
+            type=int,
+            default=8080,
+            help='Port of the HTTP endpoint. Default is 8080.'
+        )
+    parser.add_argument(
+            '--socket_path',
+            type=str,
+            default=None,
+            help='Serve on this Unix socket instead of host and port.'
+        )
+    parser.add_argument(
+            '--queue_url',
+            type=str,
+            default=None,
+            help='Consume jobs from this SQS queue instead of serving HTTP.'
+        )
+    parser.add_argument(
+            '--storage_backend',
+            type=str,
+            choices=["s3", "local"],
+            default="s3",
+            help='Default storage backend of the jobs.'
+        )
+
+    args = parser.parse_args()
+    service = ObfuscationService(max_workers=args.workers,
+                                 storage_backend=args.storage_backend)
+    try:
+        if args.queue_url is not None:
+            logger.info(f"Consuming jobs from {args.queue_url}")
+            service.consume(SQSJobQueue(args.queue_url), wait_seconds=20,
+                            stop_event=threading.Event())
+        else:
+            make_server(service, args.host, args.port,
+                        args.socket_path).serve_forever()
+    except KeyboardInterrupt:
+        logger.info(f"Stopping service: {service.stats()}")
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import pyarrow as pa
+from typing import BinaryIO
+from src.compression import (
+    split_compression_extension,
+    open_decompressed,
+    compress_stream,
+)
+from src.utils import (
+    read_s3_file,
+    write_s3_file,
+    open_s3_stream,
+    as_readable_stream,
+    get_s3_client,
+)
+from src.file_formats import FILE_TYPES, TEXT_FILE_TYPES
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+SUPPORTED_FILE_TYPES = FILE_TYPES
+
+
+def _check_file_type(file_extension: str, codec: str | None):
+    if codec is not None and file_extension not in TEXT_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}" +
+                         f" compressed with {codec}")
+    if file_extension not in SUPPORTED_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+
+class StorageBackend:
+    """
+    Where input files are read from and obfuscated files are written to.
+    A location is a bucket and a file key, as in
+    "<scheme>://<bucket>/<file_key>".
+    """
+
+    name = None
+
+    def read_file(self, bucket: str, file_key: str) -> tuple:
+        """
+        Read a file and return its content and file type
+
+        Args:
+            bucket (str): bucket (or top level directory) of the file
+            file_key (str): name of the file, e.g new_data/file.csv
+
+        Returns:
+            tuple: File content (str or binary stream) and its file type
+        """
+        raise NotImplementedError
+
+    def head(self, bucket: str, file_key: str) -> dict:
+        """
+        Read the version of a file without reading its content
+
+        Args:
+            bucket (str): bucket (or top level directory) of the file
+            file_key (str): name of the file, e.g new_data/file.csv
+
+        Returns:
+            dict: 'etag' and 'version_id' (None when not versioned)
+                  identifying the content, and 'size' in bytes
+        """
+        raise NotImplementedError
+
+    def open_stream(self, bucket: str,
+                    file_key: str) -> tuple[BinaryIO, str]:
+        """
+        Open a file as a binary stream that can be consumed while
+        it is still being read from storage
+
+        Args:
+            bucket (str): bucket (or top level directory) of the file
+            file_key (str): name of the file, e.g new_data/file.csv
+
+        Returns:
+            tuple[BinaryIO, str]: File content and its file type
+        """
+        content, file_extension = self.read_file(bucket, file_key)
+        if isinstance(content, str):
+            content = io.BytesIO(content.encode("utf8"))
+        return content, file_extension
+
+    def write_file(self, bucket: str, file_key: str, file_content,
+                   compression_level: int = None,
+                   compress_in_thread: bool = False) -> str:
+        """
+        Write a file, compressing csv/json when the key ends with
+        .gz/.zst/.bz2
+
+        Args:
+            bucket (str): bucket (or top level directory) of the file
+            file_key (str): name of the file to write
+            file_content: a file-like object, a bytes-like object
+                          or an iterable of byte chunks
+            compression_level (int): compression level, codec default
+            compress_in_thread (bool): If True, compress on a worker thread
+
+        Returns:
+            str: message confirming where the file was written
+        """
+        raise NotImplementedError
+
+    def _prepare_body(self, file_key: str, file_content,
+                      compression_level: int = None,
+                      compress_in_thread: bool = False) -> BinaryIO:
+        file_extension, codec = split_compression_extension(file_key)
+        _check_file_type(file_extension, codec)
+        body = as_readable_stream(file_content)
+        if codec is not None:
+            body = compress_stream(
+                body, codec, compression_level, compress_in_thread)
+        return body
+
+    def _open_content(self, file_key: str, buffer) -> tuple[BinaryIO, str]:
+        file_extension, codec = split_compression_extension(file_key)
+        _check_file_type(file_extension, codec)
+        content = pa.BufferReader(buffer)
+        if codec is not None:
+            content = open_decompressed(content, codec)
+        return content, file_extension
+
+
+class S3Backend(StorageBackend):
+    """
+    Files stored in AWS S3, read with read_s3_file
+    and written with write_s3_file
+    """
+
+    name = "s3"
+
+    def read_file(self, bucket: str, file_key: str) -> tuple[str, str]:
+        return read_s3_file(bucket, file_key)
+
+    def head(self, bucket: str, file_key: str) -> dict:
+        response = get_s3_client().head_object(Bucket=bucket, Key=file_key)
+        return {
+            "etag": response["ETag"].strip('"'),
+            "version_id": response.get("VersionId"),
+            "size": response["ContentLength"],
+        }
+
+    def open_stream(self, bucket: str,
+                    file_key: str) -> tuple[BinaryIO, str]:
+        return open_s3_stream(bucket, file_key)
+
+    def write_file(self, bucket: str, file_key: str, file_content,
+                   compression_level: int = None,
+                   compress_in_thread: bool = False) -> str:
+        return write_s3_file(bucket, file_key, file_content,
+                             compression_level=compression_level,
+                             compress_in_thread=compress_in_thread)
+
+
+class LocalBackend(StorageBackend):
+    """
+    Files on the local filesystem, at <root>/<bucket>/<file_key>, or at
+    /<file_key> for an empty bucket, as in "file:///<absolute path>".
+    Inputs are memory-mapped and handed over as zero-copy pyarrow
+    buffers, so no full-file Python str is created.
+
+    Args:
+        root (str): directory containing the buckets, '.' by default
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = "."):
+        self.root = root
+
+    def directory(self, bucket: str) -> str:
+        # file:///<absolute path> has an empty bucket
+        return os.path.join(self.root, bucket) if bucket else os.sep
+
+    def path(self, bucket: str, file_key: str) -> str:
+        return os.path.join(self.directory(bucket), file_key)
+
+    def head(self, bucket: str, file_key: str) -> dict:
+        stat = os.stat(self.path(bucket, file_key))
+        return {
+            "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            "version_id": None,
+            "size": stat.st_size,
+        }
+
+    def read_file(self, bucket: str,
+                  file_key: str) -> tuple[BinaryIO, str]:
+        path = self.path(bucket, file_key)
+        logger.debug(f"Memory-mapping local file '{path}'")
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                buffer = pa.py_buffer(b"")
+            else:
+                buffer = pa.py_buffer(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        content, file_extension = self._open_content(file_key, buffer)
+        logger.info(f"Successfully read '{path}' ({file_extension})")
+        return content, file_extension
+
+    def write_file(self, bucket: str, file_key: str, file_content,
+                   compression_level: int = None,
+                   compress_in_thread: bool = False) -> str:
+        path = self.path(bucket, file_key)
+        body = self._prepare_body(file_key, file_content,
+                                  compression_level, compress_in_thread)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(body, f, length=1 << 20)
+        logger.info(f"Successfully wrote '{path}'")
+        return f"{file_key} has been successfully " \
+               f"written to {self.directory(bucket)}"
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Files kept in memory, keyed by (bucket, file_key).
+    Useful for tests and for chaining jobs without any I/O.
+
+    Args:
+        objects (dict): initial files, {(bucket, file_key): bytes}
+    """
+
+    name = "memory"
+
+    def __init__(self, objects: dict = None):
+        self.objects = objects if objects is not None else {}
+
+    def read_file(self, bucket: str,
+                  file_key: str) -> tuple[BinaryIO, str]:
+        if (bucket, file_key) not in self.objects:
+            raise FileNotFoundError(f"{bucket}/{file_key} does not exist")
+        return self._open_content(
+            file_key, pa.py_buffer(self.objects[(bucket, file_key)]))
+
+    def head(self, bucket: str, file_key: str) -> dict:
+        if (bucket, file_key) not in self.objects:
+            raise FileNotFoundError(f"{bucket}/{file_key} does not exist")
+        content = self.objects[(bucket, file_key)]
+        return {
+            # Content fingerprint like the S3 ETag, not a security use
+            "etag": hashlib.md5(content,
+                                usedforsecurity=False).hexdigest(),
+            "version_id": None,
+            "size": len(content),
+        }
+
+    def write_file(self, bucket: str, file_key: str, file_content,
+                   compression_level: int = None,
+                   compress_in_thread: bool = False) -> str:
+        body = self._prepare_body(file_key, file_content,
+                                  compression_level, compress_in_thread)
+        if isinstance(body, io.BytesIO):
+            self.objects[(bucket, file_key)] = body.getvalue()
+        else:
+            self.objects[(bucket, file_key)] = body.read()
+        logger.info(f"Successfully stored '{bucket}/{file_key}' in memory")
+        return f"{file_key} has been successfully " \
+               f"stored in memory bucket {bucket}"
+
+
+STORAGE_BACKENDS = {
+    "s3": S3Backend,
+    "local": LocalBackend,
+    "memory": MemoryBackend,
+}
+
+
+def get_storage_backend(name: str, **options) -> StorageBackend:
+    """
+    Build a storage backend by name
+
+    Args:
+        name (str): s3/local/memory
+        **options: backend options, e.g. root for local
+
+    Returns:
+        StorageBackend: the storage backend
+    """
+    if name not in STORAGE_BACKENDS:
+        logger.error(f"Unsupported storage backend: {name}")
+        raise ValueError(
+            f"Unknown storage backend: {name}. "
+            + "Only 's3', 'local' or 'memory' are accepted."
+        )
+    return STORAGE_BACKENDS[name](**options)
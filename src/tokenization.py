@@ -0,0 +1,272 @@
+import base64
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+import pandas as pd
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from src.arrow_strings import (
+    is_arrow_string,
+    map_valid,
+    string_array,
+    string_series,
+)
+from src.setup_logger import setup_logger
+
+
+logger = setup_logger(__name__)
+
+TOKEN_PREFIX = "tok_"
+TOKEN_BYTES = 12
+NONCE_BYTES = 12
+# SQLite accepts up to 32766 parameters per statement
+QUERY_BATCH = 10000
+VAULT_PATH_ENV = "OBFUSCATOR_VAULT_PATH"
+VAULT_KEY_ENV = "OBFUSCATOR_VAULT_KEY"
+DEFAULT_VAULT_PATH = "token_vault.db"
+
+
+def generate_vault_key() -> str:
+    """
+    Draw a new vault key, to be kept secret, e.g in OBFUSCATOR_VAULT_KEY
+
+    Returns:
+        str: 32 random bytes, base64 encoded
+    """
+    return base64.urlsafe_b64encode(secrets.token_bytes(32)).decode()
+
+
+class TokenVault:
+    """
+    Reversible tokenization: each distinct value gets a random surrogate
+    token (e.g tok_3f9c0a...), and the token-to-value mapping is kept in
+    a local SQLite vault, encrypted with AES-GCM. Values are looked up
+    by their keyed HMAC, so the vault holds no value in clear and the
+    same value always gets the same token.
+
+    tokenize and detokenize work on whole lists, so that a chunk costs
+    one batched query (and one batched insert of its new values)
+    instead of one round trip per row.
+
+    Args:
+        path (str): path of the SQLite vault, ':memory:' for tests
+        key (str): base64 vault key, see generate_vault_key
+        cache_size (int): recent tokens memoized for tokenize_value
+    """
+
+    def __init__(self, path: str, key: str, cache_size: int = 10000):
+        self.path = path
+        master_key = base64.urlsafe_b64decode(key)
+        if len(master_key) != 32:
+            raise ValueError("The vault key must be 32 bytes, " +
+                             "base64 encoded")
+        self._aead = AESGCM(hmac.digest(master_key, b"encrypt", "sha256"))
+        self._lookup_key = hmac.digest(master_key, b"lookup", "sha256")
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "token BLOB PRIMARY KEY, lookup BLOB NOT NULL UNIQUE, "
+                "value BLOB NOT NULL) WITHOUT ROWID")
+
+    def _lookup(self, value: str) -> bytes:
+        return hmac.digest(self._lookup_key, value.encode("utf8"),
+                           "sha256")[:16]
+
+    def _encrypt(self, token: bytes, value: str) -> bytes:
+        nonce = secrets.token_bytes(NONCE_BYTES)
+        # The token is authenticated with the value, so an encrypted
+        # value cannot be moved to another token
+        return nonce + self._aead.encrypt(nonce, value.encode("utf8"), token)
+
+    def _decrypt(self, token: bytes, value: bytes) -> str:
+        return self._aead.decrypt(value[:NONCE_BYTES], value[NONCE_BYTES:],
+                                  token).decode("utf8")
+
+    def _select(self, column: str, keys: list[bytes]) -> list[tuple]:
+        rows = []
+        for i in range(0, len(keys), QUERY_BATCH):
+            batch = keys[i:i + QUERY_BATCH]
+            rows += self._connection.execute(
+                f"SELECT {column}, token, value FROM tokens WHERE " +
+                f"{column} IN ({','.join('?' * len(batch))})",
+                batch).fetchall()
+        return rows
+
+    def tokenize(self, values: list[str]) -> list[str]:
+        """
+        Tokenize values, creating tokens for the values never seen
+
+        Args:
+            values (list): strings to tokenize
+
+        Returns:
+            list[str]: token of each value
+        """
+        lookups = {value: self._lookup(value) for value in values}
+        with self._lock, self._connection:
+            tokens = {lookup: token for lookup, token, _ in
+                      self._select("lookup", list(lookups.values()))}
+            new_values = {value: lookup for value, lookup in lookups.items()
+                          if lookup not in tokens}
+            if new_values:
+                rows = []
+                for value, lookup in new_values.items():
+                    token = secrets.token_bytes(TOKEN_BYTES)
+                    rows.append((token, lookup, self._encrypt(token, value)))
+                # Another process may have added the same values since,
+                # so the stored tokens are read back
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO tokens VALUES (?, ?, ?)", rows)
+                tokens.update((lookup, token) for lookup, token, _ in
+                              self._select("lookup",
+                                           list(new_values.values())))
+        logger.debug(f"Tokenized {len(lookups)} distinct values, " +
+                     f"{len(new_values)} new")
+        return [TOKEN_PREFIX + tokens[lookups[value]].hex()
+                for value in values]
+
+    def tokenize_value(self, value: str) -> str:
+        """
+        Tokenize one value, for callers working value by value.
+        Recent tokens are memoized, so repeated values skip the vault.
+
+        Args:
+            value (str): string to tokenize
+
+        Returns:
+            str: token of the value
+        """
+        with self._lock:
+            token = self._cache.get(value)
+        if token is None:
+            token = self.tokenize([value])[0]
+            with self._lock:
+                self._cache[value] = token
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return token
+
+    def detokenize(self, tokens: list[str]) -> list[str | None]:
+        """
+        Find the values of tokens
+
+        Args:
+            tokens (list): tokens, as returned by tokenize
+
+        Returns:
+            list: value of each token, None for unknown tokens
+        """
+        keys = {}
+        for token in set(tokens):
+            if isinstance(token, str) and token.startswith(TOKEN_PREFIX):
+                try:
+                    keys[token] = bytes.fromhex(token[len(TOKEN_PREFIX):])
+                except ValueError:
+                    continue
+        with self._lock:
+            rows = self._select("token", list(keys.values()))
+        values = {token: self._decrypt(token, value)
+                  for _, token, value in rows}
+        return [values.get(keys.get(token)) for token in tokens]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM tokens").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+
+def tokenize_series(series: pd.Series, vault: "TokenVault" = None,
+                    reverse: bool = False) -> pd.Series:
+    """
+    Tokenize (or detokenize) a column with one bulk vault call.
+    Missing values are kept.
+
+    Args:
+        series (pd.Series): column to tokenize
+        vault (TokenVault): vault to use, see get_token_vault
+        reverse (bool): If True, replace tokens by their values instead;
+                        unknown tokens are kept
+
+    Returns:
+        pd.Series: tokenized column
+    """
+    if vault is None:
+        vault = get_token_vault()
+
+    def convert(values: list[str]) -> list[str]:
+        if not reverse:
+            return vault.tokenize(values)
+        return [value if value is not None else token
+                for token, value in zip(values, vault.detokenize(values))]
+
+    if is_arrow_string(series):
+        return string_series(map_valid(string_array(series), convert),
+                             series)
+    present = series.notna().to_numpy()
+    if not present.any():
+        return series
+    results = convert(series[present].astype(str).tolist())
+    output = series.astype(object)
+    output[present] = results
+    return output
+
+
+# The vault used by the 'tokenize' method, one per process
+_vault_cache = {}
+
+
+def set_token_vault(vault: TokenVault | str | None):
+    """
+    Choose the vault used by the 'tokenize' method
+
+    Args:
+        vault (TokenVault/str): a vault, or the path of a SQLite vault
+            opened with the key in OBFUSCATOR_VAULT_KEY. None to go back
+            to the vault of OBFUSCATOR_VAULT_PATH.
+    """
+    if isinstance(vault, str):
+        vault = open_token_vault(vault)
+    _vault_cache.clear()
+    if vault is not None:
+        _vault_cache["vault"] = vault
+
+
+def open_token_vault(path: str) -> TokenVault:
+    """
+    Open a SQLite vault with the key in OBFUSCATOR_VAULT_KEY
+
+    Args:
+        path (str): path of the SQLite vault
+
+    Returns:
+        TokenVault: opened vault
+    """
+    key = os.getenv(VAULT_KEY_ENV)
+    if not key:
+        raise ValueError(f"Tokenization needs a vault key in {VAULT_KEY_ENV}"
+                         ", see generate_vault_key")
+    return TokenVault(path, key)
+
+
+def get_token_vault() -> TokenVault:
+    """
+    Return the vault of the 'tokenize' method: the one chosen with
+    set_token_vault, or else the vault at OBFUSCATOR_VAULT_PATH
+    (token_vault.db by default) with the key in OBFUSCATOR_VAULT_KEY
+
+    Returns:
+        TokenVault: vault of this process
+    """
+    if "vault" not in _vault_cache:
+        _vault_cache["vault"] = open_token_vault(
+            os.getenv(VAULT_PATH_ENV, DEFAULT_VAULT_PATH))
+    return _vault_cache["vault"]
@@ -1,40 +1,106 @@
 import boto3
 import io
 import json
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
+from typing import BinaryIO, Iterable
+import pyarrow as pa
 import pyarrow.parquet as pq
 from src.setup_logger import setup_logger
+from src.file_formats import (
+    FILE_TYPES,
+    TEXT_FILE_TYPES,
+    BATCH_FILE_TYPES,
+    FOOTER_FILE_TYPES,
+)
+from src.compression import (
+    ChunkIterReader,
+    split_compression_extension,
+    open_decompressed,
+    compress_stream,
+)
 
 
 logger = setup_logger(__name__)
 
+_client_cache = {}
+_client_cache_lock = threading.Lock()
 
-def read_s3_file(s3_bucket: str, file_key: str) -> tuple[str, str]:
+
+def enable_s3_client_cache(enabled: bool = True):
+    """
+    Reuse one s3 client for every read and write instead of building
+    a new one per call. Meant for long-running processes (service mode,
+    warm Lambda containers) where client creation dominates small jobs.
+    Disabling the cache also drops the cached client.
+
+    Args:
+        enabled (bool): If True, cache the s3 client
+    """
+    with _client_cache_lock:
+        _client_cache.clear()
+        if enabled:
+            _client_cache["enabled"] = True
+
+
+def get_s3_client():
+    """
+    Return an s3 client, the cached one when the cache is enabled
+
+    Returns:
+        botocore.client.S3: s3 client
+    """
+    if not _client_cache.get("enabled"):
+        return boto3.client("s3")
+    # boto3 sessions are not thread safe, so worker threads must not
+    # build the cached client concurrently
+    with _client_cache_lock:
+        if "s3" not in _client_cache:
+            logger.debug("Creating cached s3 client")
+            _client_cache["s3"] = boto3.client("s3")
+        return _client_cache["s3"]
+
+
+def read_s3_file(s3_bucket: str,
+                 file_key: str) -> tuple[str | BinaryIO, str]:
     """
     Load and read a file from the specified s3_bucket
-    and returns its content and file type as a tuple of str
+    and returns its content and file type as a tuple of str.
+    Compressed csv/json files (.gz/.zst/.bz2) are decompressed
+    incrementally while the object is streamed from s3.
+    ORC, Feather (Arrow IPC) and Avro files are returned as an Arrow
+    buffer reader over the downloaded bytes, read without copies.
 
     Args:
         s3_bucket (str): name of the s3_bucket where the file is stored
         file_key (str): name of the file to be obfuscated, e.g filename.csv
 
     Returns:
-        tuple [str,str]: File content as a str and its file type
+        tuple [str,str]: File content as a str (a binary stream for
+                         orc/feather/avro) and its file type
     """
     logger.debug(f"Reading file '{file_key}' from bucket '{s3_bucket}'")
 
-    s3_client = boto3.client("s3")
+    s3_client = get_s3_client()
 
     obj = s3_client.get_object(Bucket=s3_bucket, Key=file_key)
-    file_extension = file_key.split(".")[-1].lower()
-
-    content = obj["Body"].read()
+    file_extension, codec = split_compression_extension(file_key)
 
     try:
-        if file_extension in ["csv", "json"]:
-            content_str = content.decode("utf8")
+        if codec is not None and file_extension not in TEXT_FILE_TYPES:
+            raise ValueError(f"Unsupported file type: {file_extension}" +
+                             f" compressed with {codec}")
+        if file_extension in TEXT_FILE_TYPES:
+            body = obj["Body"]
+            if codec is not None:
+                body = open_decompressed(body, codec)
+            content_str = body.read().decode("utf8")
         elif file_extension == "parquet":
-            table = pq.read_table(io.BytesIO(content))
+            table = pq.read_table(io.BytesIO(obj["Body"].read()))
             content_str = table.to_pandas().to_csv(index=False)
+        elif file_extension in BATCH_FILE_TYPES:
+            content_str = pa.BufferReader(obj["Body"].read())
         else:
             raise ValueError(f"Unsupported file type: {file_extension}")
         logger.info(f"Successfully read '{file_key}' " +
@@ -48,30 +114,173 @@ def read_s3_file(s3_bucket: str, file_key: str) -> tuple[str, str]:
         raise
 
 
-def write_s3_file(s3_bucket: str, file_key: str, file_content: io.BytesIO):
+def open_s3_stream(s3_bucket: str, file_key: str) -> tuple[BinaryIO, str]:
+    """
+    Open a file in s3 as a binary stream, so that it can be processed
+    while it is still downloading. Compressed csv/json files are
+    decompressed on the fly; parquet, orc and feather need random
+    access to their footer, so they are downloaded fully into a byte
+    system.
+
+    Args:
+        s3_bucket (str): name of the s3_bucket where the file is stored
+        file_key (str): name of the file to be obfuscated, e.g filename.csv
+
+    Returns:
+        tuple[BinaryIO, str]: File content as a binary stream
+                              and its file type
+    """
+    logger.debug(f"Streaming file '{file_key}' from bucket '{s3_bucket}'")
+    file_extension, codec = split_compression_extension(file_key)
+    if codec is not None and file_extension not in TEXT_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}" +
+                         f" compressed with {codec}")
+    if file_extension not in FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+    s3_client = get_s3_client()
+    body = s3_client.get_object(Bucket=s3_bucket, Key=file_key)["Body"]
+    if file_extension in FOOTER_FILE_TYPES:
+        return io.BytesIO(body.read()), file_extension
+    if codec is not None:
+        body = open_decompressed(body, codec)
+    return body, file_extension
+
+
+# Multipart uploads in 16MB parts with 8 concurrent part uploads
+DEFAULT_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+
+
+class BufferReader(io.RawIOBase):
     """
-    Write a file back to s3, currently support csv/json/parquet.
+    Readable stream over a bytes-like object (bytes, bytearray,
+    memoryview), handing out slices of the buffer without copying it
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        size = min(len(target), len(self._view) - self._position)
+        target[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+
+def as_readable_stream(
+    file_content: BinaryIO | bytes | memoryview | Iterable[bytes],
+) -> BinaryIO:
+    """
+    Turn the supported kinds of file content into a readable byte stream
+    positioned at the start of the content, without copying it
+
+    Args:
+        file_content: a file-like object, a bytes-like object
+                      or an iterable of byte chunks
+
+    Returns:
+        BinaryIO: readable byte stream
+    """
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        return io.BufferedReader(BufferReader(file_content))
+    if hasattr(file_content, "read"):
+        if file_content.seekable():
+            file_content.seek(0)
+        return file_content
+    return io.BufferedReader(ChunkIterReader(file_content))
+
+
+def upload_s3_stream(
+    s3_bucket: str,
+    file_key: str,
+    body: BinaryIO,
+    transfer_config: TransferConfig = None,
+) -> dict:
+    """
+    Upload a readable byte stream to s3 with upload_fileobj,
+    in multipart uploads for large bodies
+
+    Args:
+        s3_bucket (str): name of the s3_bucket to write to
+        file_key (str): name of the file to write
+        body (BinaryIO): readable byte stream to upload
+        transfer_config (TransferConfig): multipart settings,
+                                          DEFAULT_TRANSFER_CONFIG if None
+
+    Returns:
+        dict: 'bytes_written', 'seconds' and 'throughput_mb_s'
+    """
+    s3_client = get_s3_client()
+    bytes_written = []
+    start = time.perf_counter()
+    s3_client.upload_fileobj(
+        body, s3_bucket, file_key,
+        Config=transfer_config or DEFAULT_TRANSFER_CONFIG,
+        Callback=bytes_written.append,
+    )
+    seconds = time.perf_counter() - start
+    total = sum(bytes_written)
+    stats = {
+        "bytes_written": total,
+        "seconds": seconds,
+        "throughput_mb_s": total / 1024 / 1024 / seconds if seconds else 0.0,
+    }
+    logger.info(f"Uploaded {total} bytes to '{file_key}' in " +
+                f"{seconds:.3f}s ({stats['throughput_mb_s']:.2f} MB/s)")
+    return stats
+
+
+def write_s3_file(
+    s3_bucket: str,
+    file_key: str,
+    file_content: BinaryIO | bytes | memoryview | Iterable[bytes],
+    compression_level: int = None,
+    compress_in_thread: bool = False,
+    transfer_config: TransferConfig = None,
+):
+    """
+    Write a file back to s3, currently support
+    csv/json/parquet/orc/feather/avro.
+    csv/json files whose key ends with .gz/.zst/.bz2 are compressed
+    with the matching codec before uploading.
+    The content is streamed to s3 without decoding or copying it.
 
     Args:
         s3_bucket (str): name of the s3_bucket where the file is stored
         file_key (str): name of the file to be obfuscated
-        file_content (io.BytesIO): Content to write in a byte system
+        file_content: Content to write, a byte system or other file-like
+            object, a bytes-like object (e.g. memoryview),
+            or a generator of byte chunks
+        compression_level (int): compression level, codec default if None
+        compress_in_thread (bool): If True, compress on a worker thread
+        transfer_config (TransferConfig): multipart upload settings
     """
     logger.debug(f"Writing file '{file_key}' to bucket '{s3_bucket}'")
 
-    s3_client = boto3.client("s3")
-
-    file_extension = file_key.split(".")[-1].lower()
+    file_extension, codec = split_compression_extension(file_key)
 
     try:
-        if file_extension in ["csv", "json"]:
-            body_content = file_content.getvalue().decode("utf8")
-        elif file_extension == "parquet":
-            body_content = file_content.getvalue()
-        else:
+        if codec is not None and file_extension not in TEXT_FILE_TYPES:
+            raise ValueError(f"Unsupported file type: {file_extension}" +
+                             f" compressed with {codec}")
+        elif file_extension not in FILE_TYPES:
             raise ValueError(f"Unsupported file type: {file_extension}")
 
-        s3_client.put_object(Bucket=s3_bucket, Key=file_key, Body=body_content)
+        body = as_readable_stream(file_content)
+        if codec is not None:
+            body = compress_stream(
+                body, codec, compression_level, compress_in_thread)
+
+        upload_s3_stream(s3_bucket, file_key, body, transfer_config)
         logger.info(f"Successfully uploaded '{file_key}' " +
                     f"to S3 bucket '{s3_bucket}'")
         return f"{file_key} has been successfully " \
@@ -107,7 +316,7 @@ def json_input_handler(json_input: str) -> tuple[str, str, list]:
             raise ValueError("Missing required keys in JSON input")
 
         s3_url = json_dict["file_to_obfuscate"]
-        s3_bucket, file_key = s3_url.replace("s3://", "").split("/", 1)
+        s3_bucket, file_key = s3_url.split("://", 1)[-1].split("/", 1)
 
         fields_list = json_dict["pii_fields"]
 
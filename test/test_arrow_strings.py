@@ -0,0 +1,185 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.arrow_strings import ARROW_STRING, is_arrow_string, to_arrow_strings
+from src.obfuscation_methods import (
+    make_array_obfuscator,
+    make_value_obfuscator,
+)
+from src.obfuscator import (
+    obfuscate_fields_in_df,
+    iter_df_chunks,
+    obfuscate_file,
+)
+from src.redaction import redact_series
+from src.tokenization import TokenVault, generate_vault_key, tokenize_series
+from src.pseudonym_map import PseudonymMap, pseudonymize_series
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": [1, 2, 3],
+        "name": ["John Smith", None, "Jo"],
+        "notes": ["call 07700 900123", "fine", "a@b.com"],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+class TestToArrowStrings:
+    @pytest.mark.it("Test if only columns of strings are converted")
+    def test_convert(self, test_df):
+        test_df["mixed"] = ["a", 1, None]
+        df = to_arrow_strings(test_df)
+        assert df["name"].dtype == ARROW_STRING
+        assert df["name"].tolist()[::2] == ["John Smith", "Jo"]
+        assert df["name"].isna().tolist() == [False, True, False]
+        assert df["mixed"].dtype == object
+        assert df["student_id"].dtype == "int64"
+
+    @pytest.mark.it("Test if Arrow strings take less memory than objects")
+    def test_memory(self):
+        df = pd.DataFrame({"name": [f"Customer {i}" for i in range(1000)]})
+        object_bytes = df.memory_usage(deep=True)["name"]
+        arrow_bytes = to_arrow_strings(df).memory_usage(deep=True)["name"]
+        assert arrow_bytes * 3 < object_bytes
+
+
+class TestArrayObfuscator:
+    @pytest.mark.it("Test if arrays get the values of the per value methods")
+    @pytest.mark.parametrize("method", ["mask", "hash", "random_hash"])
+    def test_same_values(self, method):
+        values = ["John Smith", "Jo", "J", "", "Zoë"]
+        obfuscated = make_array_obfuscator(method, "1")(
+            pa.array(values + [None]))
+        value_obfuscator = make_value_obfuscator(method, "1")
+        assert obfuscated.to_pylist() == \
+            [value_obfuscator(value) for value in values] + [None]
+
+    @pytest.mark.it("Test if 'replace' replaces every cell")
+    def test_replace(self):
+        obfuscated = make_array_obfuscator("replace")(pa.array(["a", None]))
+        assert obfuscated.to_pylist() == ["***", "***"]
+        assert obfuscated.type == pa.string()
+
+    @pytest.mark.it("Test if other methods have no array function")
+    def test_other_methods(self):
+        with pytest.raises(ValueError):
+            make_array_obfuscator("redact")
+        with pytest.raises(ValueError):
+            make_array_obfuscator("other")
+
+
+class TestObfuscateArrowColumns:
+    @pytest.mark.it("Test if obfuscated columns stay Arrow-backed")
+    @pytest.mark.parametrize("method", ["mask", "hash", "replace", "redact"])
+    def test_methods(self, test_df, method):
+        expected = obfuscate_fields_in_df(
+            test_df.dropna().copy(), ["name", "notes"], method)
+        df = obfuscate_fields_in_df(to_arrow_strings(test_df),
+                                    ["name", "notes"], method)
+        assert is_arrow_string(df["name"]) and is_arrow_string(df["notes"])
+        assert df["notes"].tolist()[::2] == expected["notes"].tolist()
+        assert df["name"].tolist()[::2] == expected["name"].tolist()
+        # Missing values are kept, except by 'replace'
+        assert df["name"].isna()[1] == (method != "replace")
+
+    @pytest.mark.it("Test if tokens and pseudonyms stay Arrow-backed")
+    def test_vaults(self, test_df):
+        series = to_arrow_strings(test_df)["name"]
+        vault = TokenVault(":memory:", generate_vault_key())
+        tokens = tokenize_series(series, vault)
+        assert is_arrow_string(tokens) and tokens.isna()[1]
+        assert tokenize_series(tokens, vault, reverse=True).tolist()[::2] \
+            == ["John Smith", "Jo"]
+        pseudonyms = pseudonymize_series(series, PseudonymMap(":memory:"))
+        assert is_arrow_string(pseudonyms)
+        assert pseudonyms[0].startswith("psn_") and pseudonyms.isna()[1]
+        assert is_arrow_string(redact_series(series))
+
+
+class TestReadArrowStrings:
+    @pytest.mark.it("Test if every reader gives Arrow string columns")
+    @pytest.mark.parametrize("file_type,options", [
+        ("csv", {}), ("csv", {"csv_engine": "pyarrow"}),
+        ("csv", {"infer_schema": True}), ("json", {}), ("parquet", {})])
+    def test_readers(self, test_df, file_type, options):
+        if file_type == "csv":
+            content = test_df.to_csv(index=False)
+        elif file_type == "json":
+            content = test_df.to_json(orient="records")
+        else:
+            content = io.BytesIO(test_df.to_parquet(index=False))
+        chunks = list(iter_df_chunks(content, file_type, 2, ["name"],
+                                     arrow_strings=True, **options))
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        for chunk in chunks:
+            assert chunk["name"].dtype == ARROW_STRING
+            assert chunk["notes"].dtype == ARROW_STRING
+            assert pd.api.types.is_integer_dtype(chunk["student_id"])
+
+    @pytest.mark.it("Test if the output is the same as with objects")
+    @pytest.mark.parametrize("output_format", ["csv", "json", "parquet"])
+    def test_obfuscate_file(self, test_df, output_format):
+        content = test_df.dropna().to_csv(index=False)
+        expected = obfuscate_file(content, ["name"], "csv", output_format,
+                                  chunk_size=2, obfuscate_method="mask")
+        output = obfuscate_file(content, ["name"], "csv", output_format,
+                                chunk_size=2, obfuscate_method="mask",
+                                arrow_strings=True)
+        if output_format == "parquet":
+            # The pandas metadata differ, the Arrow schema and rows do not
+            output, expected = pq.read_table(output), pq.read_table(expected)
+            assert output.schema.remove_metadata() == \
+                expected.schema.remove_metadata()
+            assert output.to_pylist() == expected.to_pylist()
+        else:
+            assert output.read() == expected.read()
+
+
+class TestHandleFileObfuscationArrowStrings:
+    @pytest.mark.it("Test if pipelined jobs read Arrow string columns")
+    def test_pipelined(self, s3_client, test_df):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(json_str, pipelined=True, chunk_size=2,
+                                arrow_strings=True)
+        df = pd.read_csv(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()))
+        assert (df["name"] == "***").all()
+        assert df["notes"].tolist() == test_df["notes"].tolist()
@@ -0,0 +1,245 @@
+import pytest
+import boto3
+from moto import mock_aws
+from unittest.mock import patch
+import io
+import os
+import json
+import pandas as pd
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+import src.checkpoint as checkpoint
+from src.checkpoint import (
+    LocalCheckpointStore,
+    S3CheckpointStore,
+    get_checkpoint_store,
+    get_job_id,
+    run_checkpointed_obfuscation,
+)
+from src.csv_passthrough import rewrite_csv_pii_fields
+from src.main import handle_file_obfuscation
+
+INPUT_KEY = "new_data/big_file.csv"
+OUTPUT_KEY = "processed_data/big_file.csv"
+
+
+@pytest.fixture
+def test_csv_bytes():
+    rows = "".join(f'{i},Name {i % 7},"Software, DE",n{i}@email.com\r\n'
+                   for i in range(2000))
+    return ("student_id,name,course,email_address\r\n" + rows).encode()
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_csv_bytes, monkeypatch):
+    # Lets the tests use parts smaller than the 5 MB S3 minimum
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 256)
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket", Key=INPUT_KEY,
+                             Body=test_csv_bytes)
+        yield s3_client
+
+
+def read_output(s3_client):
+    return s3_client.get_object(Bucket="test_bucket",
+                                Key=OUTPUT_KEY)["Body"].read()
+
+
+def fail_on_part(part_number):
+    upload_part = checkpoint._upload_part
+
+    def failing_upload_part(s3_client, state, body):
+        if len(state["parts"]) + 1 == part_number:
+            raise ConnectionError("connection reset")
+        upload_part(s3_client, state, body)
+    return failing_upload_part
+
+
+class TestCheckpointStores:
+    @pytest.mark.it("Test if a local checkpoint is saved, loaded and deleted")
+    def test_local_store(self, tmp_path):
+        store = get_checkpoint_store(str(tmp_path / "checkpoints"))
+        assert isinstance(store, LocalCheckpointStore)
+        assert store.load("job") is None
+        store.save("job", {"offset": 10})
+        store.save("job", {"offset": 20})
+        assert store.load("job") == {"offset": 20}
+        store.delete("job")
+        assert store.load("job") is None
+        store.delete("job")
+
+    @pytest.mark.it("Test if an S3 checkpoint is saved, loaded and deleted")
+    def test_s3_store(self, s3_client):
+        store = get_checkpoint_store("s3://test_bucket/checkpoints/")
+        assert isinstance(store, S3CheckpointStore)
+        assert store.load("job") is None
+        store.save("job", {"offset": 10})
+        assert store.load("job") == {"offset": 10}
+        store.delete("job")
+        assert store.load("job") is None
+
+
+class TestRunCheckpointedObfuscation:
+    @pytest.mark.it("Test if the output matches a single-pass rewrite")
+    def test_full_run(self, s3_client, tmp_path, test_csv_bytes):
+        store = LocalCheckpointStore(str(tmp_path))
+        stats = run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name", "email_address"],
+            store, block_size=1000, part_size=10000)
+        expected = rewrite_csv_pii_fields(test_csv_bytes,
+                                          ["name", "email_address"])
+        assert read_output(s3_client) == expected.getvalue()
+        assert stats["rows"] == 2000
+        assert stats["parts"] > 3
+        assert stats["resumed_from"] == 0
+        assert os.listdir(tmp_path) == []
+
+    @pytest.mark.it("Test if parts are cut on output bytes")
+    def test_part_sizes(self, s3_client, tmp_path):
+        rows = "".join(f"{i},{'Long Name ' * 20}{i}\n" for i in range(2000))
+        s3_client.put_object(Bucket="test_bucket", Key=INPUT_KEY,
+                             Body=("student_id,name\n" + rows).encode())
+        sizes = []
+        upload_part = checkpoint._upload_part
+
+        def recording_upload_part(s3_client, state, body):
+            sizes.append(len(body))
+            upload_part(s3_client, state, body)
+
+        with patch("src.checkpoint._upload_part", recording_upload_part):
+            run_checkpointed_obfuscation(
+                "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"],
+                LocalCheckpointStore(str(tmp_path)), block_size=1000,
+                part_size=5000)
+        assert len(sizes) > 2
+        assert all(size >= 5000 for size in sizes[:-1])
+        assert sum(sizes) == len(read_output(s3_client))
+
+    @pytest.mark.it("Test if quoted header names are parsed for detection")
+    def test_quoted_header(self, s3_client, tmp_path):
+        s3_client.put_object(
+            Bucket="test_bucket", Key=INPUT_KEY,
+            Body=b'id,"name, full",email\n1,"Smith, John",j@email.com\n')
+        stats = run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY,
+            lambda columns: [c for c in columns if c.startswith("name")],
+            LocalCheckpointStore(str(tmp_path)))
+        assert stats["rows"] == 1
+        assert read_output(s3_client) == \
+            b'id,"name, full",email\n1,***,j@email.com\n'
+
+    @pytest.mark.it("Test if a BOM header and stray quotes are handled")
+    def test_bom_and_stray_quote(self, s3_client, tmp_path):
+        s3_client.put_object(
+            Bucket="test_bucket", Key=INPUT_KEY,
+            Body=b'\xef\xbb\xbfname,height\nJohn,5\'11"\nAmy,6ft\n')
+        stats = run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY,
+            lambda columns: [c for c in columns if c == "name"],
+            LocalCheckpointStore(str(tmp_path)))
+        assert stats["rows"] == 2
+        assert read_output(s3_client) == \
+            b'\xef\xbb\xbfname,height\n***,5\'11"\n***,6ft\n'
+
+    @pytest.mark.it("Test if a failed job resumes from its last checkpoint")
+    def test_resume(self, s3_client, tmp_path, test_csv_bytes):
+        store = LocalCheckpointStore(str(tmp_path))
+        job_id = get_job_id("test_bucket", INPUT_KEY, OUTPUT_KEY)
+        with patch("src.checkpoint._upload_part", fail_on_part(4)):
+            with pytest.raises(ConnectionError):
+                run_checkpointed_obfuscation(
+                    "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+                    part_size=10000)
+        saved = store.load(job_id)
+        assert len(saved["parts"]) == 3
+        assert saved["offset"] > 30000
+
+        stats = run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+            part_size=10000)
+        assert stats["resumed_from"] == saved["offset"]
+        assert stats["rows"] == 2000
+        expected = rewrite_csv_pii_fields(test_csv_bytes, ["name"])
+        assert read_output(s3_client) == expected.getvalue()
+        assert store.load(job_id) is None
+
+    @pytest.mark.it("Test if random_hash salts are kept across a resume")
+    def test_resume_keeps_salts(self, s3_client, tmp_path):
+        store = LocalCheckpointStore(str(tmp_path))
+        with patch("src.checkpoint._upload_part", fail_on_part(3)):
+            with pytest.raises(ConnectionError):
+                run_checkpointed_obfuscation(
+                    "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+                    obfuscate_method="random_hash", part_size=10000)
+        run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+            obfuscate_method="random_hash", part_size=10000)
+        df = pd.read_csv(io.BytesIO(read_output(s3_client)))
+        assert df["name"].nunique() == 7
+        assert df["name"].iloc[0] == df["name"].iloc[1995]
+
+    @pytest.mark.it("Test if a checkpoint of a changed input is dropped")
+    def test_stale_checkpoint(self, s3_client, tmp_path):
+        store = LocalCheckpointStore(str(tmp_path))
+        with patch("src.checkpoint._upload_part", fail_on_part(2)):
+            with pytest.raises(ConnectionError):
+                run_checkpointed_obfuscation(
+                    "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+                    part_size=10000)
+        new_content = b"student_id,name\n1,John Smith\n"
+        s3_client.put_object(Bucket="test_bucket", Key=INPUT_KEY,
+                             Body=new_content)
+        stats = run_checkpointed_obfuscation(
+            "test_bucket", INPUT_KEY, OUTPUT_KEY, ["name"], store,
+            part_size=10000)
+        assert stats["resumed_from"] == 0
+        assert read_output(s3_client) == b"student_id,name\n1,***\n"
+
+    @pytest.mark.it("Test ValueError for a compressed or non-csv input")
+    def test_unsupported_input(self, tmp_path):
+        store = LocalCheckpointStore(str(tmp_path))
+        for file_key in ["new_data/file.csv.gz", "new_data/file.json"]:
+            with pytest.raises(ValueError):
+                run_checkpointed_obfuscation("test_bucket", file_key,
+                                             OUTPUT_KEY, ["name"], store)
+
+
+class TestHandleFileObfuscationCheckpoint:
+    @pytest.mark.it("Test if a checkpointed job auto detects PII fields")
+    def test_handle_file_obfuscation(self, s3_client, tmp_path):
+        json_str = json.dumps({
+            "file_to_obfuscate": f"s3://test_bucket/{INPUT_KEY}",
+            "pii_fields": []})
+        message = handle_file_obfuscation(json_str, auto_detect_pii=True,
+                                          checkpoint=str(tmp_path))
+        assert message == f"Obfuscated file saved to s3://test_bucket/" \
+                          f"{OUTPUT_KEY}"
+        df = pd.read_csv(io.BytesIO(read_output(s3_client)))
+        assert (df["email_address"] == "***").all()
+        assert (df["course"] == "Software, DE").all()
+
+    @pytest.mark.it("Test if a non-csv output is rejected")
+    def test_rejects_parquet_output(self, tmp_path):
+        json_str = json.dumps({
+            "file_to_obfuscate": f"s3://test_bucket/{INPUT_KEY}",
+            "pii_fields": ["name"]})
+        with pytest.raises(Exception, match="only supports csv output"):
+            handle_file_obfuscation(
+                json_str, if_output_different_format=True,
+                output_format="parquet", checkpoint=str(tmp_path))
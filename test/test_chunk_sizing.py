@@ -0,0 +1,143 @@
+import pytest
+import io
+import os
+import json
+import pandas as pd
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from unittest.mock import patch
+from src.chunk_sizing import ChunkSizer, as_chunk_sizer, rebatch, PROBE_ROWS
+from src.obfuscator import iter_df_chunks, obfuscate_file
+
+
+def make_df(rows, text_width):
+    return pd.DataFrame({"id": range(rows),
+                         "name": ["x" * text_width] * rows})
+
+
+@pytest.fixture
+def narrow_and_wide():
+    narrow = make_df(20000, 1)
+    wide = make_df(2000, 5000)
+    return narrow, wide
+
+
+class TestChunkSizer:
+    @pytest.mark.it("Test if the size stays fixed without a byte budget")
+    def test_fixed(self):
+        sizer = ChunkSizer(5000)
+        sizer.observe(make_df(5000, 10))
+        assert sizer.rows == 5000
+        assert sizer.metrics()["chunk_rows"] == [5000]
+        assert sizer.metrics()["row_bytes"] is None
+
+    @pytest.mark.it("Test if the first adaptive chunk is a small probe")
+    def test_probe(self):
+        assert ChunkSizer(5000, target_bytes=1 << 20).rows == PROBE_ROWS
+        assert ChunkSizer(10, target_bytes=1 << 20).rows == 10
+
+    @pytest.mark.it("Test if narrow rows get larger chunks than wide rows")
+    def test_adapts_to_row_width(self):
+        narrow = ChunkSizer(5000, target_bytes=1 << 20)
+        narrow.observe(make_df(1000, 1))
+        wide = ChunkSizer(5000, target_bytes=1 << 20)
+        wide.observe(make_df(1000, 5000))
+        assert narrow.rows > 5000
+        assert wide.rows < 1000
+        assert wide.rows * wide.row_bytes <= 1 << 20
+
+    @pytest.mark.it("Test if the chunk rows stay within min and max rows")
+    def test_bounds(self):
+        sizer = ChunkSizer(5000, target_bytes=1, min_rows=7)
+        sizer.observe(make_df(10, 100))
+        assert sizer.rows == 7
+        sizer = ChunkSizer(5000, target_bytes=1 << 40, max_rows=9999)
+        sizer.observe(make_df(10, 1))
+        assert sizer.rows == 9999
+
+    @pytest.mark.it("Test if batch rows follow the byte budget")
+    def test_batch_rows(self):
+        sizer = ChunkSizer(5000, target_bytes=1000 * 100)
+        assert sizer.batch_rows(100) == 1000
+        assert sizer.batch_rows(1e9) == sizer.rows
+        assert ChunkSizer(5000).batch_rows(1) == 5000
+
+    @pytest.mark.it("Test ValueError for a non positive size")
+    def test_invalid_sizes(self):
+        with pytest.raises(ValueError):
+            ChunkSizer(0)
+        with pytest.raises(ValueError):
+            ChunkSizer(10, target_bytes=0)
+
+    @pytest.mark.it("Test if as_chunk_sizer returns a given sizer unchanged")
+    def test_as_chunk_sizer(self):
+        sizer = ChunkSizer(10)
+        assert as_chunk_sizer(sizer) is sizer
+        assert as_chunk_sizer(10, 1000).target_bytes == 1000
+
+
+class TestAdaptiveReaders:
+    @pytest.mark.it("Test if every reader adapts chunks to the byte budget")
+    @pytest.mark.parametrize("file_type", ["csv", "csv_pyarrow",
+                                           "json", "parquet"])
+    def test_readers(self, narrow_and_wide, file_type):
+        target_bytes = 1 << 20
+        for df in narrow_and_wide:
+            options = {}
+            if file_type == "csv":
+                content = df.to_csv(index=False)
+            elif file_type == "csv_pyarrow":
+                content = df.to_csv(index=False)
+                options = {"csv_engine": "pyarrow"}
+            elif file_type == "json":
+                content = df.to_json(orient="records")
+            else:
+                content = io.BytesIO()
+                df.to_parquet(content, index=False)
+                content.seek(0)
+            sizer = ChunkSizer(5000, target_bytes=target_bytes)
+            chunks = list(iter_df_chunks(content, file_type.split("_")[0],
+                                         sizer, ["name"], **options))
+            assert sum(len(c) for c in chunks) == len(df)
+            metrics = sizer.metrics()
+            assert metrics["chunk_rows"] == [len(c) for c in chunks]
+            assert metrics["chunk_rows"][0] == PROBE_ROWS
+            if df["name"].str.len().iloc[0] > 1:
+                assert max(metrics["chunk_rows"][1:]) < 5000
+                assert max(metrics["chunk_bytes"][1:]) < 2 * target_bytes
+            else:
+                assert max(metrics["chunk_rows"]) > 5000
+
+    @pytest.mark.it("Test if parquet batches are not read at the probe size")
+    def test_parquet_batch_rows(self, narrow_and_wide):
+        df = narrow_and_wide[0]
+        content = io.BytesIO()
+        df.to_parquet(content, index=False)
+        content.seek(0)
+        batch_rows = []
+
+        def recorded(batches):
+            for batch in batches:
+                batch_rows.append(batch.num_rows)
+                yield batch
+
+        def recording_rebatch(batches, sizer):
+            return rebatch(recorded(batches), sizer)
+
+        sizer = ChunkSizer(5000, target_bytes=1 << 20)
+        with patch("src.obfuscator.rebatch", side_effect=recording_rebatch):
+            chunks = list(iter_df_chunks(content, "parquet", sizer, ["name"]))
+        assert sum(len(c) for c in chunks) == len(df)
+        assert batch_rows[0] > PROBE_ROWS
+        assert len(batch_rows) < len(df) // PROBE_ROWS
+
+    @pytest.mark.it("Test if chunk_bytes does not change the output")
+    def test_obfuscate_file(self, narrow_and_wide):
+        content = narrow_and_wide[0].to_json(orient="records")
+        fixed = obfuscate_file(content, ["name"], "json")
+        adaptive = obfuscate_file(content, ["name"], "json",
+                                  chunk_bytes=1 << 20)
+        assert fixed.getvalue() == adaptive.getvalue()
+        assert json.loads(content)[0]["name"] == "x"
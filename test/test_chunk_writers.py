@@ -0,0 +1,99 @@
+import pytest
+from src.chunk_writers import (
+    get_chunk_writer,
+    CsvChunkWriter,
+    JsonChunkWriter,
+    ParquetChunkWriter,
+    to_arrow_table,
+)
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+
+
+@pytest.fixture
+def test_chunks():
+    return [
+        pd.DataFrame({"student_id": [1234], "name": ["***"]}),
+        pd.DataFrame({"student_id": [5678], "name": ["***"]}),
+    ]
+
+
+class TestGetChunkWriter:
+    @pytest.mark.it("Test if the correct writer is returned")
+    def test_correct_writer(self):
+        assert isinstance(get_chunk_writer("csv"), CsvChunkWriter)
+        assert isinstance(get_chunk_writer("json"), JsonChunkWriter)
+        assert isinstance(get_chunk_writer("parquet"), ParquetChunkWriter)
+
+    @pytest.mark.it("Test ValueError for an unsupported format")
+    def test_unsupported_format(self):
+        with pytest.raises(ValueError, match="xml is not supported"):
+            get_chunk_writer("xml")
+
+
+class TestChunkWriters:
+    @pytest.mark.it("Test if the csv header is only written once")
+    def test_csv_header_once(self, test_chunks):
+        writer = get_chunk_writer("csv")
+        for chunk in test_chunks:
+            writer.write(chunk)
+        output = writer.close()
+        assert output.getvalue().decode("utf8") == \
+            "student_id,name\n1234,***\n5678,***\n"
+
+    @pytest.mark.it("Test if json output is one record per line")
+    def test_json_lines(self, test_chunks):
+        writer = get_chunk_writer("json")
+        for chunk in test_chunks:
+            writer.write(chunk)
+        lines = writer.close().getvalue().decode("utf8").splitlines()
+        assert [json.loads(line)["student_id"] for line in lines] == \
+            [1234, 5678]
+
+    @pytest.mark.it("Test if each parquet chunk is a row group")
+    def test_parquet_row_groups(self, test_chunks):
+        writer = get_chunk_writer("parquet")
+        for chunk in test_chunks:
+            writer.write(chunk)
+        output = writer.close()
+        assert writer.rows_written == 2
+        assert pq.ParquetFile(output).num_row_groups == 2
+
+
+class TestToArrowTable:
+    @pytest.mark.it("Test if empty first columns are typed as strings")
+    def test_empty_columns(self):
+        table = to_arrow_table(pd.DataFrame({"id": [1, 2],
+                                             "notes": [None, float("nan")]}))
+        assert table.schema.field("notes").type == pa.string()
+        assert table.schema.field("id").type == pa.int64()
+
+    @pytest.mark.it("Test if later chunks are cast to the file schema")
+    def test_cast(self):
+        schema = pa.schema([("id", pa.float64()), ("notes", pa.string())])
+        table = to_arrow_table(pd.DataFrame({"notes": [1.5], "id": [2]}),
+                               schema)
+        assert table.schema == schema
+        assert table.to_pylist() == [{"id": 2.0, "notes": "1.5"}]
+
+    @pytest.mark.it("Test if values that do not fit raise ValueError")
+    def test_conflict(self):
+        schema = pa.schema([("id", pa.int64())])
+        with pytest.raises(ValueError, match="Column id holds string"):
+            to_arrow_table(pd.DataFrame({"id": ["x"]}), schema)
+
+
+class TestParquetRowGroups:
+    @pytest.mark.it("Test if chunks are regrouped in row_group_size rows")
+    def test_row_group_size(self):
+        writer = ParquetChunkWriter(row_group_size=4)
+        for start in range(0, 10, 3):
+            writer.write(pd.DataFrame({"id": range(start, start + 3),
+                                       "notes": [None] * 3}))
+        parquet_file = pq.ParquetFile(writer.close())
+        assert [parquet_file.metadata.row_group(index).num_rows
+                for index in range(parquet_file.num_row_groups)] == \
+            [4, 4, 4]
+        assert parquet_file.read()["id"].to_pylist() == list(range(12))
@@ -0,0 +1,85 @@
+import pytest
+from src.compression import (
+    split_compression_extension,
+    set_compression_extension,
+    open_decompressed,
+    compress_stream,
+    CompressingWriter,
+)
+import io
+import gzip
+
+
+@pytest.fixture
+def test_bytes():
+    return b"student_id,name\n" + b"1234,***\n" * 10000
+
+
+class TestSplitCompressionExtension:
+    @pytest.mark.it("Test if the codec and file type are found")
+    def test_compressed_key(self):
+        assert split_compression_extension("new_data/f.csv.gz") == \
+            ("csv", "gzip")
+        assert split_compression_extension("f.json.zst") == ("json", "zstd")
+        assert split_compression_extension("f.csv.bz2") == ("csv", "bz2")
+
+    @pytest.mark.it("Test if uncompressed keys have no codec")
+    def test_uncompressed_key(self):
+        assert split_compression_extension("new_data/f.csv") == ("csv", None)
+        assert split_compression_extension("f.gz") == ("gz", None)
+
+
+class TestSetCompressionExtension:
+    @pytest.mark.it("Test if the extension is added or replaced")
+    def test_set_extension(self):
+        assert set_compression_extension("a/f.csv", "gzip") == "a/f.csv.gz"
+        assert set_compression_extension("a/f.csv.gz", "zstd") == \
+            "a/f.csv.zst"
+        assert set_compression_extension("a/f.csv.bz2", None) == "a/f.csv"
+
+    @pytest.mark.it("Test ValueError for an unknown codec")
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError, match="Unknown compression codec"):
+            set_compression_extension("f.csv", "lz4")
+
+
+class TestCompressStream:
+    @pytest.mark.it("Test if compressed data round trips for every codec")
+    @pytest.mark.parametrize("codec", ["gzip", "zstd", "bz2"])
+    @pytest.mark.parametrize("threaded", [False, True])
+    def test_round_trip(self, test_bytes, codec, threaded):
+        compressed = compress_stream(io.BytesIO(test_bytes), codec,
+                                     threaded=threaded, block_size=1000)
+        data = compressed.read()
+        assert len(data) < len(test_bytes)
+        assert open_decompressed(io.BytesIO(data), codec).read() == \
+            test_bytes
+
+    @pytest.mark.it("Test if gzip output is readable by the gzip module")
+    def test_gzip_compatible(self, test_bytes):
+        compressed = compress_stream(io.BytesIO(test_bytes), "gzip", level=1)
+        assert gzip.decompress(compressed.read()) == test_bytes
+
+    @pytest.mark.it("Test if the source is compressed as it is read")
+    def test_streamed(self, test_bytes):
+        source = io.BytesIO(test_bytes * 10)
+        compressed = compress_stream(source, "zstd", block_size=1000)
+        first = compressed.read(10)
+        assert len(first) == 10
+        assert source.tell() < len(test_bytes * 10)
+        data = first + compressed.read()
+        assert open_decompressed(io.BytesIO(data), "zstd").read() == \
+            test_bytes * 10
+
+
+class TestCompressingWriter:
+    @pytest.mark.it("Test if the sink is left open after closing")
+    def test_sink_left_open(self, test_bytes):
+        sink = io.BytesIO()
+        writer = CompressingWriter(sink, "zstd", threaded=True)
+        writer.write(test_bytes)
+        writer.close()
+        assert writer.bytes_in == len(test_bytes)
+        assert not sink.closed
+        sink.seek(0)
+        assert open_decompressed(sink, "zstd").read() == test_bytes
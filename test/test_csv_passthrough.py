@@ -0,0 +1,107 @@
+import pytest
+from src.csv_passthrough import rewrite_csv_pii_fields
+from src.obfuscator import obfuscate_file
+import pandas as pd
+import io
+
+
+@pytest.fixture
+def test_csv_data():
+    content = (
+        "student_id,name,amount,notes,email_address\n"
+        "1234,John Smith,10.50,\"likes, commas\",j.smith@email.com\n"
+        "5678,\"Lee, Steve\",1e3,\"multi\nline\",sl123@email.com\n"
+        "9012,Amy Tan,007,,\n"
+    )
+    fields = ["name", "email_address"]
+    return content, fields
+
+
+class TestRewriteCsvPiiFields:
+    @pytest.mark.it("Test if non-PII fields are copied byte for byte")
+    def test_non_pii_unchanged(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        output = rewrite_csv_pii_fields(test_content, test_fields)
+        result = output.getvalue().decode("utf8")
+        assert result == (
+            "student_id,name,amount,notes,email_address\n"
+            "1234,***,10.50,\"likes, commas\",***\n"
+            "5678,***,1e3,\"multi\nline\",***\n"
+            "9012,***,007,,***\n"
+        )
+
+    @pytest.mark.it("Test if quoted PII values are unquoted before masking")
+    def test_mask_quoted_value(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        output = rewrite_csv_pii_fields(test_content, test_fields, "mask")
+        df = pd.read_csv(output, dtype=str, keep_default_na=False)
+        assert df["name"].tolist() == ["J********h", "L********e",
+                                       "A*****n"]
+        assert df["email_address"].iloc[2] == ""
+
+    @pytest.mark.it("Test if the output matches the DataFrame path for hash")
+    def test_same_hash_as_dataframe_path(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        passthrough = pd.read_csv(rewrite_csv_pii_fields(
+            test_content, ["name"], "hash"))
+        dataframe = pd.read_csv(obfuscate_file(
+            test_content, ["name"], "csv", obfuscate_method="hash"))
+        assert passthrough["name"].tolist() == dataframe["name"].tolist()
+
+    @pytest.mark.it("Test if records spanning read blocks are handled")
+    def test_small_blocks(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        expected = rewrite_csv_pii_fields(test_content, test_fields)
+        output = rewrite_csv_pii_fields(
+            io.BytesIO(test_content.encode("utf8")), test_fields,
+            block_size=7)
+        assert output.getvalue() == expected.getvalue()
+
+    @pytest.mark.it("Test if CRLF line endings are kept")
+    def test_crlf(self):
+        content = "a,name\r\n1,Bob\r\n2,Amy"
+        output = rewrite_csv_pii_fields(content, ["name"])
+        assert output.getvalue() == b"a,name\r\n1,***\r\n2,***"
+
+    @pytest.mark.it("Test if a quote inside an unquoted field is literal")
+    def test_stray_quote(self):
+        content = "id,height,name\n1,5'11\",John\n2,6ft,Amy\n3,5ft,Bob\n" + \
+            "4,x,Eve\n"
+        output = rewrite_csv_pii_fields(content, ["name"], block_size=8)
+        assert output.getvalue().decode("utf8") == (
+            "id,height,name\n1,5'11\",***\n2,6ft,***\n3,5ft,***\n4,x,***\n"
+        )
+
+    @pytest.mark.it("Test ValueError when a quoted field is never closed")
+    def test_unbalanced_quotes(self):
+        content = "id,name\n1,\"John\n2,Amy\n"
+        with pytest.raises(ValueError, match="Unbalanced quotes"):
+            rewrite_csv_pii_fields(content, ["name"])
+
+    @pytest.mark.it("Test if a UTF-8 BOM before the header is kept")
+    def test_bom_header(self):
+        content = "﻿name,id\nJohn,1\n"
+        output = rewrite_csv_pii_fields(content, ["name"])
+        assert output.getvalue() == b"\xef\xbb\xbfname,id\n***,1\n"
+
+    @pytest.mark.it("Test KeyError when a field is not in the header")
+    def test_missing_field(self, test_csv_data):
+        test_content, _ = test_csv_data
+        with pytest.raises(KeyError):
+            rewrite_csv_pii_fields(test_content, ["cohort"])
+
+    @pytest.mark.it("Test ValueError with an invalid method")
+    def test_invalid_method(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        with pytest.raises(ValueError, match="Unknown method: other"):
+            rewrite_csv_pii_fields(test_content, test_fields, "other")
+
+
+class TestObfuscateFilePassthrough:
+    @pytest.mark.it("Test if obfuscate_file uses the rewriter for csv")
+    def test_obfuscate_file_passthrough(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        output = obfuscate_file(test_content, test_fields, "csv",
+                                csv_passthrough=True)
+        assert b"10.50" in output.getvalue()
+        assert b"007" in output.getvalue()
@@ -0,0 +1,164 @@
+import pytest
+from src.csv_schema import (
+    infer_csv_schema,
+    build_csv_dtype,
+    read_csv_chunks,
+    RewindableReader,
+)
+from src.utils import ChunkIterReader
+from src.obfuscator import convert_str_file_content_to_obfuscated_csv
+import pandas as pd
+import io
+
+
+@pytest.fixture
+def test_csv_data():
+    content = (
+        "student_id,name,amount,graduation_date,email_address\n"
+        "1234,John Smith,10.5,2024-03-31,j.smith@email.com\n"
+        "5678,Steve Lee,,2024-06-30,sl123@email.com\n"
+        "9012,Amy Tan,7.25,2024-09-30,amy@email.com\n"
+    )
+    fields = ["name", "email_address"]
+    return content, fields
+
+
+class TestInferCsvSchema:
+    @pytest.mark.it("Test if the schema has the correct dtypes")
+    def test_correct_dtypes(self, test_csv_data):
+        test_content, _ = test_csv_data
+        schema = infer_csv_schema(test_content)
+        assert schema == {
+            "student_id": "Int64",
+            "name": "str",
+            "amount": "float64",
+            "graduation_date": "str",
+            "email_address": "str",
+        }
+
+    @pytest.mark.it("Test if a non-seekable stream is sampled and replayed")
+    def test_non_seekable_stream(self, test_csv_data):
+        test_content, _ = test_csv_data
+        data = test_content.encode("utf8")
+        stream = io.BufferedReader(RewindableReader(ChunkIterReader(
+            data[i:i + 10] for i in range(0, len(data), 10))))
+        assert infer_csv_schema(stream)["student_id"] == "Int64"
+        assert stream.read() == data
+        with pytest.raises(io.UnsupportedOperation):
+            stream.seek(0)
+
+
+class TestBuildCsvDtype:
+    @pytest.mark.it("Test if non-PII columns become str when raw_non_pii")
+    def test_raw_non_pii(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        schema = infer_csv_schema(test_content)
+        dtype = build_csv_dtype(schema, test_fields, raw_non_pii=True)
+        assert dtype["student_id"] == "str"
+        assert dtype["amount"] == "str"
+        assert dtype["name"] == "str"
+
+    @pytest.mark.it("Test if the schema is unchanged otherwise")
+    def test_schema_unchanged(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        schema = infer_csv_schema(test_content)
+        assert build_csv_dtype(schema, test_fields) == schema
+
+
+class TestReadCsvChunks:
+    @pytest.mark.it("Test if every chunk has the same dtypes")
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_consistent_dtypes(self, test_csv_data, engine):
+        test_content, _ = test_csv_data
+        schema = infer_csv_schema(test_content)
+        chunks = list(read_csv_chunks(test_content, 1,
+                                      dtype=schema, engine=engine))
+        assert len(chunks) == 3
+        for chunk in chunks:
+            assert chunk.dtypes.equals(chunks[0].dtypes)
+            assert str(chunk["student_id"].dtype) == "Int64"
+
+    @pytest.mark.it("Test if raw strings are not converted")
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_raw_strings(self, test_csv_data, engine):
+        test_content, test_fields = test_csv_data
+        dtype = build_csv_dtype(infer_csv_schema(test_content),
+                                test_fields, raw_non_pii=True)
+        df = pd.concat(read_csv_chunks(test_content, 2,
+                                       dtype=dtype, engine=engine))
+        assert df["amount"].iloc[2] == "7.25"
+        assert df["student_id"].iloc[0] == "1234"
+
+    @pytest.mark.it("Test if usecols limits the columns read")
+    def test_usecols(self, test_csv_data):
+        test_content, _ = test_csv_data
+        chunks = list(read_csv_chunks(test_content, 10,
+                                      usecols=["name", "amount"],
+                                      engine="pyarrow"))
+        assert list(chunks[0].columns) == ["name", "amount"]
+
+    @pytest.mark.it("Test ValueError for an unknown engine")
+    def test_unknown_engine(self, test_csv_data):
+        test_content, _ = test_csv_data
+        with pytest.raises(ValueError, match="Unknown CSV engine"):
+            list(read_csv_chunks(test_content, 10, engine="other"))
+
+
+class TestConvertWithSchema:
+    @pytest.mark.it("Test if a schema keeps values unchanged in the output")
+    def test_output_with_raw_non_pii(self, test_csv_data):
+        test_content, test_fields = test_csv_data
+        output = convert_str_file_content_to_obfuscated_csv(
+            test_content, test_fields, "csv", chunk_size=1,
+            raw_non_pii=True, csv_engine="pyarrow"
+        )
+        lines = output.getvalue().decode("utf8").splitlines()
+        assert lines[0] == ("student_id,name,amount," +
+                            "graduation_date,email_address")
+        assert lines[1] == "1234,***,10.5,2024-03-31,***"
+        assert lines[2] == "5678,***,,2024-06-30,***"
+        assert len(lines) == 4
+
+
+class TestSchemaFallback:
+    @pytest.mark.it("Test if a value the sample missed falls back to str")
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_fallback(self, engine):
+        rows = "".join(f"{i},{i / 2}\n" for i in range(1500))
+        content = "student_id,amount\n" + rows + "x,y\n"
+        schema = infer_csv_schema(content)
+        assert schema == {"student_id": "Int64", "amount": "float64"}
+        chunks = list(read_csv_chunks(content, 2000, dtype=schema,
+                                      engine=engine))
+        assert chunks[0]["student_id"].tolist()[-2:] == ["1499", "x"]
+        assert chunks[0]["amount"].tolist()[-1] == "y"
+        assert schema["student_id"] == "Int64"
+
+    @pytest.mark.it("Test if a value not fitting after the first chunk raises")
+    @pytest.mark.parametrize("engine", ["c", "pyarrow"])
+    def test_later_misfit(self, engine):
+        rows = "".join(f"{i},{i / 2}\n" for i in range(1500))
+        content = "student_id,amount\n" + rows + "x,y\n"
+        schema = infer_csv_schema(content)
+        chunks = read_csv_chunks(content, 1000, dtype=schema, engine=engine)
+        assert str(next(chunks)["student_id"].dtype) == "Int64"
+        with pytest.raises(ValueError, match="student_id.*'str'"):
+            next(chunks)
+
+    @pytest.mark.it("Test if a fallen back column stays str")
+    def test_later_chunks(self):
+        content = "student_id\n1\nx\n3\n4\n"
+        chunks = list(read_csv_chunks(content, 2,
+                                      dtype={"student_id": "Int64"}))
+        assert [chunk["student_id"].tolist() for chunk in chunks] == \
+            [["1", "x"], ["3", "4"]]
+
+    @pytest.mark.it("Test if raw_non_pii reads the header, not a sample")
+    def test_raw_non_pii_header(self):
+        rows = "".join(f"{i},Name {i}\n" for i in range(1500))
+        content = "student_id,name\n" + rows + "x,Name\n"
+        output = convert_str_file_content_to_obfuscated_csv(
+            content, ["name"], "csv", chunk_size=1000, raw_non_pii=True)
+        lines = output.getvalue().decode("utf8").splitlines()
+        assert lines[1] == "0,***"
+        assert lines[-1] == "x,***"
@@ -0,0 +1,230 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import importlib.util
+import pandas as pd
+import pyarrow.parquet as pq
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.engines import ArrowEngine, get_engine
+from src.obfuscator import obfuscate_fields_in_df, obfuscate_file
+from src.tokenization import TokenVault, generate_vault_key, set_token_vault
+from src.pseudonym_map import PseudonymMap, set_pseudonym_map
+from src.main import handle_file_obfuscation
+
+
+ENGINES = [
+    "pandas",
+    "arrow",
+    pytest.param("duckdb", marks=pytest.mark.skipif(
+        importlib.util.find_spec("duckdb") is None,
+        reason="duckdb is not installed")),
+]
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": [1234, 5678, 9012, 3456],
+        "name": ["John Smith", "Steve Lee", "Jo", "Zoë Ng"],
+        "email_address": ["j.smith@email.com", "sl123@email.com",
+                          "jo@email.com", "zoe@email.com"],
+        "notes": ["call 07700 900123", "fine", "mail jo@email.com", "ok"],
+        "score": [1.5, 2.0, 3.25, 4.0],
+        "graduated": [True, False, True, False],
+    })
+
+
+@pytest.fixture
+def vaults():
+    set_token_vault(TokenVault(":memory:", generate_vault_key()))
+    pseudonym_map = PseudonymMap(":memory:", capacity=1000)
+    set_pseudonym_map(pseudonym_map)
+    yield
+    set_token_vault(None)
+    set_pseudonym_map(None)
+    pseudonym_map.close()
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+def make_content(df, file_type):
+    if file_type == "csv":
+        return df.to_csv(index=False)
+    elif file_type == "json":
+        return df.to_json(orient="records")
+    return io.BytesIO(df.to_parquet(index=False))
+
+
+def read_output(output, output_format):
+    if output_format == "csv":
+        return pd.read_csv(output)
+    elif output_format == "json":
+        return pd.read_json(output, lines=True)
+    return pd.read_parquet(output)
+
+
+class TestEngineConformance:
+    @pytest.mark.it("Test if every engine gives the values of each method")
+    @pytest.mark.parametrize("engine", ENGINES)
+    @pytest.mark.parametrize("file_type", ["csv", "json", "parquet"])
+    @pytest.mark.parametrize("method", ["mask", "hash", "replace",
+                                        "redact"])
+    def test_methods(self, test_df, engine, file_type, method):
+        fields = ["name", "notes"]
+        expected = obfuscate_fields_in_df(test_df.copy(), fields, method)
+        output = obfuscate_file(make_content(test_df, file_type), fields,
+                                file_type, "csv", chunk_size=3,
+                                obfuscate_method=method, engine=engine)
+        pd.testing.assert_frame_equal(read_output(output, "csv"),
+                                      expected, check_dtype=False)
+
+    @pytest.mark.it("Test if every engine writes every output format")
+    @pytest.mark.parametrize("engine", ENGINES)
+    @pytest.mark.parametrize("output_format", ["csv", "json", "parquet"])
+    def test_output_formats(self, test_df, engine, output_format):
+        method = {"name": "mask", "email_address": "hash",
+                  "notes": "redact"}
+        fields = list(method)
+        expected = obfuscate_fields_in_df(test_df.copy(), fields, method)
+        output = obfuscate_file(make_content(test_df, "csv"), fields,
+                                "csv", output_format, chunk_size=3,
+                                obfuscate_method=method, engine=engine)
+        pd.testing.assert_frame_equal(read_output(output, output_format),
+                                      expected, check_dtype=False)
+
+    @pytest.mark.it("Test if random hashes use one salt per file")
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_random_hash(self, test_df, engine):
+        df = pd.concat([test_df, test_df], ignore_index=True)
+        output = read_output(obfuscate_file(
+            make_content(df, "csv"), ["name"], "csv",
+            obfuscate_method="random_hash", engine=engine), "csv")
+        hashes = output["name"].tolist()
+        assert hashes[:4] == hashes[4:]
+        assert len(set(hashes)) == 4
+        assert all(len(value) == 64 for value in hashes)
+        hashed = obfuscate_fields_in_df(test_df.copy(), ["name"], "hash")
+        assert not set(hashes) & set(hashed["name"])
+
+    @pytest.mark.it("Test if engines share tokens and pseudonyms")
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_vaults(self, test_df, vaults, engine):
+        method = {"name": "tokenize", "email_address": "pseudonymize"}
+        content = make_content(test_df, "csv")
+        expected = read_output(obfuscate_file(
+            content, list(method), "csv", obfuscate_method=method), "csv")
+        output = read_output(obfuscate_file(
+            content, list(method), "csv", obfuscate_method=method,
+            engine=engine), "csv")
+        pd.testing.assert_frame_equal(output, expected)
+        assert output["name"].str.startswith("tok_").all()
+
+    @pytest.mark.it("Test if fields that cannot be masked are replaced")
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_not_text(self, test_df, engine):
+        output = read_output(obfuscate_file(
+            make_content(test_df, "csv"), ["student_id"], "csv",
+            obfuscate_method="mask", engine=engine), "csv")
+        assert (output["student_id"] == "***").all()
+
+    @pytest.mark.it("Test if a missing field raises KeyError")
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_missing_field(self, test_df, engine):
+        with pytest.raises(KeyError):
+            obfuscate_file(make_content(test_df, "csv"), ["phone"], "csv",
+                           engine=engine)
+
+    @pytest.mark.it("Test if Arrow engines keep missing values")
+    @pytest.mark.parametrize("engine", ENGINES[1:])
+    def test_nulls(self, test_df, engine):
+        test_df.loc[1, "name"] = None
+        output = read_output(obfuscate_file(
+            make_content(test_df, "parquet"), ["name"], "parquet",
+            obfuscate_method="mask", engine=engine), "parquet")
+        assert output["name"].tolist()[::2] == ["J********h", "**"]
+        assert output["name"].isna().tolist() == [False, True, False, False]
+
+
+class TestArrowEngine:
+    @pytest.mark.it("Test if chunks and parquet options are used")
+    def test_chunks(self, test_df):
+        output = ArrowEngine().obfuscate_file(
+            make_content(test_df, "parquet"), ["name"], "parquet",
+            chunk_size=1, parquet_compression="zstd")
+        metadata = pq.ParquetFile(output).metadata
+        assert metadata.num_row_groups == 4
+        assert metadata.row_group(0).column(1).compression == "ZSTD"
+
+    @pytest.mark.it("Test if JSON paths are refused")
+    def test_json_paths(self, test_df):
+        with pytest.raises(ValueError, match="pandas engine"):
+            ArrowEngine().obfuscate_file("[]", ["contact.email"], "json")
+
+    @pytest.mark.it("Test if unsupported formats are refused")
+    def test_formats(self, test_df):
+        with pytest.raises(ValueError, match="xml is not supported"):
+            ArrowEngine().obfuscate_file("", ["name"], "csv", "xml")
+
+
+class TestGetEngine:
+    @pytest.mark.it("Test if an unknown engine raises ValueError")
+    def test_unknown(self):
+        with pytest.raises(ValueError, match="Unknown engine: spark"):
+            get_engine("spark")
+
+    @pytest.mark.it("Test if the duckdb engine needs the duckdb package")
+    def test_duckdb_missing(self, monkeypatch):
+        monkeypatch.setattr("src.engines.duckdb", None)
+        with pytest.raises(ImportError, match="duckdb"):
+            get_engine("duckdb")
+
+
+class TestHandleFileObfuscationEngine:
+    @pytest.mark.it("Test if jobs run with the chosen engine")
+    def test_arrow(self, s3_client, test_df):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(json_str, if_output_different_format=True,
+                                output_format="parquet", engine="arrow")
+        df = pd.read_parquet(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()))
+        assert (df["name"] == "***").all()
+        assert df["notes"].tolist() == test_df["notes"].tolist()
+
+    @pytest.mark.it("Test if pipelined jobs refuse other engines")
+    def test_pipelined(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        with pytest.raises(Exception, match="not available"):
+            handle_file_obfuscation(json_str, pipelined=True,
+                                    engine="arrow")
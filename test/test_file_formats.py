@@ -0,0 +1,248 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.orc as pa_orc
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.file_formats import (
+    avro_schema,
+    get_batch_file_writer,
+    iter_record_batches,
+)
+from src.chunk_writers import get_chunk_writer
+from src.compression import split_compression_extension
+from src.obfuscator import iter_df_chunks, obfuscate_file
+from src.storage import LocalBackend
+from src.utils import read_s3_file
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": [1234, 5678, 9012],
+        "name": ["John Smith", "Steve Lee", "Jo"],
+        "score": [1.5, 2.0, 3.25],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        yield s3_client
+
+
+def write_file(df, file_type, **options):
+    writer = get_chunk_writer(file_type, **options)
+    writer.write(df)
+    return writer.close()
+
+
+def read_file(output, file_type):
+    return pa.Table.from_batches(
+        list(iter_record_batches(output, file_type, 1000))).to_pandas()
+
+
+class TestSplitCompressionExtension:
+    @pytest.mark.it("Test if the new formats are found from the extension")
+    @pytest.mark.parametrize("file_key,file_type", [
+        ("data/file.orc", "orc"), ("data/file.feather", "feather"),
+        ("data/file.arrow", "feather"), ("data/file.ipc", "feather"),
+        ("data/file.avro", "avro")])
+    def test_extensions(self, file_key, file_type):
+        assert split_compression_extension(file_key) == (file_type, None)
+
+
+class TestIterRecordBatches:
+    @pytest.mark.it("Test if ORC files are read one stripe at a time")
+    def test_orc(self, test_df):
+        df = pd.DataFrame({"student_id": range(10000)})
+        content = io.BytesIO()
+        pa_orc.write_table(pa.Table.from_pandas(df), content,
+                           stripe_size=1024, batch_size=1000)
+        batches = list(iter_record_batches(content, "orc", 1000))
+        assert [len(batch) for batch in batches] == [1000] * 10
+        assert pa.Table.from_batches(batches).to_pandas().equals(df)
+
+    @pytest.mark.it("Test if Arrow IPC files and streams are read")
+    @pytest.mark.parametrize("new_writer", [pa.ipc.new_file,
+                                            pa.ipc.new_stream])
+    def test_feather(self, test_df, new_writer):
+        table = pa.Table.from_pandas(test_df, preserve_index=False)
+        content = io.BytesIO()
+        with new_writer(content, table.schema) as writer:
+            writer.write_table(table, max_chunksize=2)
+        batches = list(iter_record_batches(content.getvalue(), "feather",
+                                           1000))
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert pa.Table.from_batches(batches).to_pandas().equals(test_df)
+
+    @pytest.mark.it("Test if memory-mapped IPC files are read without copies")
+    def test_zero_copy(self, test_df, tmp_path):
+        df = pd.concat([test_df] * 10000, ignore_index=True)
+        path = tmp_path / "file.arrow"
+        with open(path, "wb") as output:
+            write_file(df, "feather", output=output)
+        with pa.memory_map(str(path)) as source:
+            allocated = pa.total_allocated_bytes()
+            batches = list(iter_record_batches(source, "feather", 1000))
+            assert pa.total_allocated_bytes() == allocated
+            assert sum(len(batch) for batch in batches) == len(df)
+
+    @pytest.mark.it("Test if unknown types raise ValueError")
+    def test_unknown(self):
+        with pytest.raises(ValueError, match="Unsupported file type: xml"):
+            list(iter_record_batches(b"", "xml", 1000))
+
+
+class TestBatchFileWriters:
+    @pytest.mark.it("Test if every chunk is appended to the file")
+    @pytest.mark.parametrize("file_type", ["orc", "feather"])
+    def test_chunks(self, test_df, file_type):
+        writer = get_chunk_writer(file_type)
+        writer.write(test_df[:2])
+        writer.write(test_df[2:])
+        df = read_file(writer.close(), file_type)
+        assert df.equals(test_df)
+
+    @pytest.mark.it("Test if the codec of the format is used")
+    def test_compression(self, test_df):
+        df = pd.concat([test_df] * 1000, ignore_index=True)
+        plain = write_file(df, "feather")
+        compressed = write_file(df, "feather", compression="zstd")
+        assert compressed.getbuffer().nbytes < plain.getbuffer().nbytes
+        assert read_file(compressed, "feather").equals(df)
+        orc = write_file(df, "orc", compression="zstd")
+        assert pa_orc.ORCFile(orc).compression == "ZSTD"
+
+    @pytest.mark.it("Test if unknown types raise ValueError")
+    def test_unknown(self):
+        with pytest.raises(ValueError, match="Unsupported file type: csv"):
+            get_batch_file_writer("csv", io.BytesIO(), pa.schema([]))
+
+
+class TestAvro:
+    @pytest.mark.it("Test if Avro schemas are nullable and map types")
+    def test_schema(self):
+        schema = avro_schema(pa.schema([("id", pa.int64()),
+                                        ("day", pa.date32())]))
+        assert [field["type"] for field in schema["fields"]] == \
+            [["null", "long"], ["null", "string"]]
+
+    @pytest.mark.it("Test if Avro files need the fastavro package")
+    def test_fastavro_missing(self, monkeypatch):
+        monkeypatch.setattr("src.file_formats.fastavro", None)
+        with pytest.raises(ImportError, match="fastavro"):
+            get_batch_file_writer("avro", io.BytesIO(), pa.schema([]))
+        with pytest.raises(ImportError, match="fastavro"):
+            list(iter_record_batches(b"", "avro", 1000))
+
+    @pytest.mark.it("Test if Avro files are written and read in chunks")
+    def test_round_trip(self, test_df):
+        pytest.importorskip("fastavro")
+        writer = get_chunk_writer("avro", compression="deflate")
+        writer.write(test_df[:2])
+        writer.write(test_df[2:])
+        output = writer.close()
+        batches = list(iter_record_batches(output, "avro", 2))
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert pa.Table.from_batches(batches).to_pandas().equals(test_df)
+
+
+class TestObfuscateBatchFiles:
+    @pytest.mark.it("Test if the formats are read as DataFrame chunks")
+    @pytest.mark.parametrize("file_type", ["orc", "feather"])
+    def test_chunks(self, test_df, file_type):
+        content = write_file(test_df, file_type)
+        chunks = list(iter_df_chunks(content, file_type, 2))
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        assert pd.concat(chunks, ignore_index=True).equals(test_df)
+
+    @pytest.mark.it("Test if files are obfuscated in their format")
+    @pytest.mark.parametrize("file_type", ["orc", "feather"])
+    def test_same_format(self, test_df, file_type):
+        output = obfuscate_file(write_file(test_df, file_type), ["name"],
+                                file_type, chunk_size=2,
+                                obfuscate_method="mask")
+        df = read_file(output, file_type)
+        assert df["name"].tolist() == ["J********h", "S*******e", "**"]
+        assert df["score"].tolist() == test_df["score"].tolist()
+
+    @pytest.mark.it("Test if formats are converted to each other")
+    @pytest.mark.parametrize("file_type,output_format", [
+        ("csv", "orc"), ("csv", "feather"), ("orc", "csv"),
+        ("feather", "parquet"), ("orc", "feather")])
+    def test_conversion(self, test_df, file_type, output_format):
+        if file_type == "csv":
+            content = test_df.to_csv(index=False)
+        else:
+            content = write_file(test_df, file_type)
+        output = obfuscate_file(content, ["name"], file_type, output_format)
+        if output_format == "csv":
+            df = pd.read_csv(output)
+        elif output_format == "parquet":
+            df = pd.read_parquet(output)
+        else:
+            df = read_file(output, output_format)
+        assert (df["name"] == "***").all()
+        assert df["student_id"].tolist() == test_df["student_id"].tolist()
+
+    @pytest.mark.it("Test if local IPC files are memory-mapped")
+    def test_local_backend(self, test_df, tmp_path):
+        backend = LocalBackend(str(tmp_path))
+        backend.write_file("bucket", "new_data/file.arrow",
+                           write_file(test_df, "feather"))
+        content, file_type = backend.read_file("bucket",
+                                               "new_data/file.arrow")
+        assert file_type == "feather"
+        assert isinstance(content, pa.BufferReader)
+        assert read_file(content, file_type).equals(test_df)
+
+
+class TestS3BatchFiles:
+    @pytest.mark.it("Test if S3 files are read as Arrow buffers")
+    def test_read_s3_file(self, s3_client, test_df):
+        s3_client.put_object(Bucket="test_bucket", Key="new_data/file.orc",
+                             Body=write_file(test_df, "orc").getvalue())
+        content, file_type = read_s3_file("test_bucket",
+                                          "new_data/file.orc")
+        assert file_type == "orc"
+        assert read_file(content, file_type).equals(test_df)
+
+    @pytest.mark.it("Test if jobs read and write the new formats")
+    @pytest.mark.parametrize("pipelined", [False, True])
+    def test_handle_file_obfuscation(self, s3_client, test_df, pipelined):
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/file.feather",
+                             Body=write_file(test_df, "feather").getvalue())
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/file.feather",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(json_str, if_output_different_format=True,
+                                output_format="orc", pipelined=pipelined)
+        df = read_file(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/file.feather")["Body"].read()), "orc")
+        assert (df["name"] == "***").all()
+        assert df["score"].tolist() == test_df["score"].tolist()
@@ -0,0 +1,164 @@
+import pytest
+import io
+import os
+import json
+import pandas as pd
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.json_paths import (
+    is_json_path,
+    parse_json_path,
+    compile_json_path,
+    JsonRecordTransformer,
+    obfuscate_json_records,
+)
+from src.obfuscator import obfuscate_file, process_json_chunk
+
+
+@pytest.fixture
+def test_records():
+    return [
+        {
+            "order_id": 1,
+            "customer": {"name": "John Smith",
+                         "contact": {"email": "j.smith@email.com",
+                                     "phone": "07700900000"}},
+            "orders": [{"card": "4111111111111111", "amount": 9.5},
+                       {"card": "5500000000000004", "amount": 20}],
+        },
+        {
+            "order_id": 2,
+            "customer": {"name": "Steve Lee", "contact": None},
+            "orders": [],
+        },
+    ]
+
+
+def read_lines(output):
+    return [json.loads(line) for line in output.read().splitlines()]
+
+
+class TestParseJsonPath:
+    @pytest.mark.it("Test if paths are split into keys, indexes and '*'")
+    def test_parse(self):
+        assert parse_json_path("name") == ["name"]
+        assert parse_json_path("customer.contact.email") == \
+            ["customer", "contact", "email"]
+        assert parse_json_path("orders[*].card") == ["orders", "*", "card"]
+        assert parse_json_path("matrix[0][*]") == ["matrix", 0, "*"]
+
+    @pytest.mark.it("Test ValueError for invalid paths")
+    def test_invalid(self):
+        for path in ["", "a..b", "a.", ".a", "[*]", "a[x]", "a[*]b"]:
+            with pytest.raises(ValueError):
+                parse_json_path(path)
+
+    @pytest.mark.it("Test if only dotted or indexed fields are paths")
+    def test_is_json_path(self):
+        assert is_json_path("orders[*].card")
+        assert is_json_path("customer.name")
+        assert not is_json_path("email_address")
+
+
+class TestCompileJsonPath:
+    @pytest.mark.it("Test if only the values on the path are changed")
+    def test_nested(self, test_records):
+        accessor = compile_json_path("customer.contact.email",
+                                     lambda x: "***")
+        record = test_records[0]
+        assert accessor(record) == 1
+        assert record["customer"]["contact"] == {"email": "***",
+                                                 "phone": "07700900000"}
+        assert record["customer"]["name"] == "John Smith"
+
+    @pytest.mark.it("Test if wildcards reach every list element")
+    def test_wildcard(self, test_records):
+        accessor = compile_json_path("orders[*].card", lambda x: "***")
+        assert accessor(test_records[0]) == 2
+        assert test_records[0]["orders"] == [{"card": "***", "amount": 9.5},
+                                             {"card": "***", "amount": 20}]
+        assert accessor(test_records[1]) == 0
+
+    @pytest.mark.it("Test if a path to an object obfuscates all its values")
+    def test_subtree(self, test_records):
+        accessor = compile_json_path("customer.contact", lambda x: "***")
+        accessor(test_records[0])
+        accessor(test_records[1])
+        assert test_records[0]["customer"]["contact"] == {"email": "***",
+                                                          "phone": "***"}
+        assert test_records[1]["customer"]["contact"] is None
+
+    @pytest.mark.it("Test if non-string values are obfuscated as strings")
+    def test_non_string(self, test_records):
+        accessor = compile_json_path("orders[1].amount", lambda x: x[::-1])
+        accessor(test_records[0])
+        assert test_records[0]["orders"][1]["amount"] == "02"
+
+
+class TestJsonRecordTransformer:
+    @pytest.mark.it("Test KeyError for a field matching no value")
+    def test_unmatched(self, test_records):
+        transformer = JsonRecordTransformer(["orders[*].iban"])
+        for record in test_records:
+            transformer(record)
+        with pytest.raises(KeyError):
+            transformer.check_matched()
+
+    @pytest.mark.it("Test if random_hash uses one salt per field")
+    def test_random_hash(self, test_records):
+        transformer = JsonRecordTransformer(["orders[*].card"],
+                                            "random_hash")
+        test_records[0]["orders"][1]["card"] = "4111111111111111"
+        transformer(test_records[0])
+        cards = [order["card"] for order in test_records[0]["orders"]]
+        assert cards[0] == cards[1]
+        assert len(cards[0]) == 64
+
+
+class TestObfuscateJsonRecords:
+    @pytest.mark.it("Test if records are written as obfuscated JSON lines")
+    def test_records(self, test_records):
+        output = obfuscate_json_records(
+            json.dumps(test_records),
+            ["customer.name", "orders[*].card"], "mask")
+        records = read_lines(output)
+        assert records[0]["customer"]["name"] == "J********h"
+        assert records[0]["orders"][0] == {"card": "4**************1",
+                                           "amount": 9.5}
+        assert records[0]["customer"]["contact"]["email"] == \
+            "j.smith@email.com"
+        assert records[1] == test_records[1] | {"customer": {
+            "name": "S*******e", "contact": None}}
+
+    @pytest.mark.it("Test if obfuscate_file streams json to json output")
+    def test_obfuscate_file(self, test_records):
+        content = io.BytesIO(json.dumps(test_records).encode("utf8"))
+        output = obfuscate_file(content, ["order_id", "customer.contact"],
+                                "json")
+        records = read_lines(output)
+        assert [r["order_id"] for r in records] == ["***", "***"]
+        assert records[0]["customer"]["contact"]["phone"] == "***"
+        assert records[0]["orders"] == test_records[0]["orders"]
+
+    @pytest.mark.it("Test if top level fields still use chunked DataFrames")
+    def test_top_level_fields(self):
+        content = json.dumps([{"id": 1, "name": None},
+                              {"id": 2, "name": "Jo"}])
+        with patch("src.obfuscator.obfuscate_json_records") as mock_stream:
+            output = obfuscate_file(content, ["name"], "json", chunk_size=1)
+            mock_stream.assert_not_called()
+        assert read_lines(output) == [{"id": 1, "name": "***"},
+                                      {"id": 2, "name": "***"}]
+
+    @pytest.mark.it("Test if paths are obfuscated for csv output too")
+    def test_csv_output(self, test_records):
+        output = io.BytesIO()
+        process_json_chunk(json.dumps(test_records),
+                           ["order_id", "customer.name"], output, 1)
+        output.seek(0)
+        df = pd.read_csv(output)
+        assert list(df["order_id"]) == ["***", "***"]
+        assert "John Smith" not in df["customer"][0]
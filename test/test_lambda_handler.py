@@ -0,0 +1,162 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import pandas as pd
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.lambda_handler import (
+    plan_job,
+    lambda_handler,
+    invoke_locally,
+    reset_warm_state,
+    get_memory_mb,
+    LocalLambdaContext,
+    MIN_CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+)
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        for i in range(3):
+            s3_client.put_object(
+                Bucket="test_bucket", Key=f"new_data/file {i}.csv",
+                Body=b"student_id,name,email_address\n"
+                     b"1234,John Smith,j.smith@email.com\n")
+        yield s3_client
+        reset_warm_state()
+
+
+def s3_record(file_key, size=None):
+    s3_object = {"key": file_key.replace(" ", "+")}
+    if size is not None:
+        s3_object["size"] = size
+    return {"eventSource": "aws:s3",
+            "s3": {"bucket": {"name": "test_bucket"}, "object": s3_object}}
+
+
+def read_output(s3_client, file_key):
+    body = s3_client.get_object(Bucket="test_bucket", Key=file_key)
+    return pd.read_csv(io.BytesIO(body["Body"].read()))
+
+
+class TestPlanJob:
+    @pytest.mark.it("Test if the chunk size grows with memory, within bounds")
+    def test_chunk_size(self):
+        small = plan_job(1000, 128)["options"]["chunk_size"]
+        large = plan_job(1000, 4096)["options"]["chunk_size"]
+        assert MIN_CHUNK_SIZE <= small < large <= MAX_CHUNK_SIZE
+        assert plan_job(1000, 10240, row_bytes=16)["options"]["chunk_size"] \
+            == MAX_CHUNK_SIZE
+        assert plan_job(1000, 1024)["options"]["chunk_bytes"] \
+            == 256 * 1024 * 1024
+
+    @pytest.mark.it("Test if the chunk budget is shared by the workers")
+    def test_chunk_budget_per_worker(self):
+        plan = plan_job(1000, 10240)
+        assert plan["workers"] == 6
+        assert plan["options"]["chunk_bytes"] \
+            == int(10240 * 1024 * 1024 * 0.25 / 6)
+        assert plan["options"]["chunk_bytes"] * plan["workers"] \
+            <= 10240 * 1024 * 1024 * 0.25
+
+    @pytest.mark.it("Test if workers follow the vCPUs of the memory size")
+    def test_workers(self):
+        assert plan_job(1000, 512)["workers"] == 1
+        assert plan_job(1000, 3538)["workers"] == 2
+        assert plan_job(1000, 10240)["workers"] == 6
+
+    @pytest.mark.it("Test if large or unknown objects are pipelined")
+    def test_large_objects(self):
+        assert not plan_job(1024, 1024)["options"]["pipelined"]
+        large = plan_job(1024 * 1024 * 1024, 1024)["options"]
+        assert large["pipelined"]
+        assert "chunked_conversion" not in large
+        assert plan_job(None, 1024)["options"]["pipelined"]
+
+    @pytest.mark.it("Test if the memory is read from context or environment")
+    def test_memory_mb(self, monkeypatch):
+        assert get_memory_mb(LocalLambdaContext(2048)) == 2048
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "512")
+        assert get_memory_mb() == 512
+
+
+class TestLambdaHandler:
+    @pytest.mark.it("Test if a direct job invocation is obfuscated")
+    def test_direct_invocation(self, s3_client):
+        response = lambda_handler({
+            "file_to_obfuscate": "s3://test_bucket/new_data/file 0.csv",
+            "pii_fields": ["name"],
+        }, LocalLambdaContext(1024))
+        assert response["statusCode"] == 200
+        assert response["results"][0]["status"] == "succeeded"
+        df = read_output(s3_client, "processed_data/file 0.csv")
+        assert df["name"].tolist() == ["***"]
+
+    @pytest.mark.it("Test if an S3 event batch is obfuscated")
+    def test_s3_event_batch(self, s3_client, monkeypatch):
+        monkeypatch.setenv("PII_FIELDS", "name, email_address")
+        response = lambda_handler({"Records": [
+            s3_record("new_data/file 0.csv", 60),
+            s3_record("new_data/file 1.csv"),
+            s3_record("processed_data/file 2.csv", 60),
+        ]})
+        assert response["statusCode"] == 200
+        assert len(response["results"]) == 2
+        for i in range(2):
+            df = read_output(s3_client, f"processed_data/file {i}.csv")
+            assert df["email_address"].tolist() == ["***"]
+
+    @pytest.mark.it("Test if S3 events without PII_FIELDS auto detect PII")
+    def test_s3_event_auto_detect(self, s3_client, monkeypatch):
+        monkeypatch.delenv("PII_FIELDS", raising=False)
+        lambda_handler({"Records": [s3_record("new_data/file 1.csv")]})
+        df = read_output(s3_client, "processed_data/file 1.csv")
+        assert df["name"].tolist() == ["***"]
+        assert df["student_id"].tolist() == [1234]
+
+    @pytest.mark.it("Test if only failed SQS messages are reported")
+    def test_sqs_partial_failure(self, s3_client):
+        ok = {"file_to_obfuscate": "s3://test_bucket/new_data/file 2.csv",
+              "pii_fields": ["name"]}
+        missing = {"file_to_obfuscate": "s3://test_bucket/new_data/x.csv",
+                   "pii_fields": ["name"]}
+        response = lambda_handler({"Records": [
+            {"eventSource": "aws:sqs", "messageId": "m1",
+             "body": json.dumps(ok)},
+            {"eventSource": "aws:sqs", "messageId": "m2",
+             "body": json.dumps(missing)},
+        ]})
+        assert response["statusCode"] == 500
+        assert response["batchItemFailures"] == [{"itemIdentifier": "m2"}]
+
+
+class TestInvokeLocally:
+    @pytest.mark.it("Test if warm invocations reuse the cached state")
+    def test_warm_invocations(self, s3_client):
+        event = {"file_to_obfuscate": "s3://test_bucket/new_data/file 0.csv",
+                 "pii_fields": ["name"]}
+        responses = invoke_locally([event, event, event], memory_mb=512)
+        assert [r["cold_start"] for r in responses] == [True, False, False]
+        assert all(r["statusCode"] == 200 for r in responses)
+        assert all(r["duration_ms"] > 0 for r in responses)
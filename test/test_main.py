@@ -6,11 +6,12 @@ import os
 import json
 import io
 import pandas as pd
+import pyarrow.parquet as pq
 try:
     os.environ["OPENAI_API_KEY"] = "test_api_key"
 except KeyError:
     pass
-from src.main import handle_file_obfuscation
+from src.main import handle_file_obfuscation, detect_pii_report
 
 
 @pytest.fixture()
@@ -90,13 +91,31 @@ class TestHFO:
 
             mock_read.assert_called_once_with('test_bucket',
                                               'new_data/test_file.csv')
-            mock_obfuscate.assert_called_once_with(test_file_content,
-                                                   ["name", "email_address"],
-                                                   test_file_type,
-                                                   chunk_size=5000)
+            mock_obfuscate.assert_called_once_with(
+                test_file_content, ["name", "email_address"], test_file_type,
+                chunk_size=5000,
+                obfuscate_method="replace",
+                csv_schema=None,
+                infer_schema=False,
+                raw_non_pii=False,
+                csv_engine="c",
+                csv_passthrough=False,
+                chunked_conversion=False,
+                row_group_size=100000,
+                parquet_compression="snappy",
+                parquet_compression_level=None,
+                parquet_use_dictionary=True,
+                chunk_bytes=None,
+                arrow_strings=False,
+                engine="pandas",
+                token_vault=None,
+                pseudonym_map=None,
+            )
             mock_write.assert_called_once_with('test_bucket',
                                                'processed_data/test_file.csv',
-                                               test_csv_output_file_content)
+                                               test_csv_output_file_content,
+                                               compression_level=None,
+                                               compress_in_thread=False)
 
     @pytest.mark.it(
         "Test if handle_file_obfuscation return BytesIO when "
@@ -155,6 +174,20 @@ class TestHFO:
         assert result_df["email_address"].iloc[0] == "***"
         assert result_df["course"].iloc[0] != "***"
 
+    @pytest.mark.it("Test if gpt only sees the ambiguous columns")
+    @patch("src.main.detect_if_pii_with_gpt")
+    def test_gpt_tiered(self, mock_auto_gpt):
+        mock_auto_gpt.return_value = [
+            {"column_name": "remarks", "score": 0.9},
+            {"column_name": "company_address", "score": 0.2},
+        ]
+        report = detect_pii_report(
+            ["name", "remarks", "user_phone", "company_address"], use_gpt=True)
+        mock_auto_gpt.assert_called_once_with(["remarks", "company_address"])
+        assert [(r["is_pii"], r["tier"]) for r in report] == [
+            (True, "dictionary"), (True, "model"),
+            (True, "heuristic"), (False, "model")]
+
     @pytest.mark.it('Test if corrent field_list auto without gpt')
     @patch('src.main.detect_if_pii_with_gpt')
     def test_correct_field_list_auto_without_gpt(
@@ -174,3 +207,38 @@ class TestHFO:
         )
         result_df = pd.read_csv(result)
         assert result_df["name"].iloc[0] == "***"
+
+
+class TestHFOCsvSchema:
+    @pytest.mark.it("Test if the csv schema is used to read the file")
+    def test_csv_schema(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        result = handle_file_obfuscation(
+            json_str, if_save_to_s3=False,
+            csv_schema={"student_id": "str", "name": "str"})
+        df = pd.read_csv(result, dtype=str)
+        assert list(df.columns) == ["student_id", "name"]
+        assert df["name"].tolist() == ["***", "***"]
+
+
+class TestHFOParquetOptions:
+    @pytest.mark.it("Test if the Parquet level and dictionary are used")
+    def test_parquet_options(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        with patch("src.chunk_writers.pq.ParquetWriter",
+                   wraps=pq.ParquetWriter) as mock_writer:
+            result = handle_file_obfuscation(
+                json_str, if_save_to_s3=False,
+                if_output_different_format=True, output_format="parquet",
+                parquet_compression="zstd", compression_level=19,
+                parquet_compression_level=5, parquet_use_dictionary=False)
+        assert mock_writer.call_args.kwargs["compression_level"] == 5
+        metadata = pq.ParquetFile(result).metadata
+        column = metadata.row_group(0).column(1)
+        assert column.compression == "ZSTD"
+        assert not any("DICTIONARY" in encoding
+                       for encoding in column.encodings)
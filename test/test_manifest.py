@@ -0,0 +1,215 @@
+import pytest
+import boto3
+from moto import mock_aws
+from unittest.mock import patch
+import os
+import json
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.manifest import (
+    SQLiteManifestStore,
+    S3ManifestStore,
+    get_manifest_store,
+    make_manifest_record,
+    is_unchanged,
+)
+from src.storage import LocalBackend
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=b"student_id,name\n1234,John Smith\n")
+        yield s3_client
+
+
+@pytest.fixture
+def record():
+    head = {"etag": "abc", "version_id": None, "size": 10}
+    return make_manifest_record("bucket", "new_data/file.csv", head,
+                                ["name", "email"], "replace",
+                                "processed_data/file.csv")
+
+
+def job(fields=("name",)):
+    return json.dumps({
+        "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+        "pii_fields": list(fields),
+    })
+
+
+class TestManifestRecords:
+    @pytest.mark.it("Test if a record is unchanged only if all keys match")
+    def test_is_unchanged(self, record):
+        assert not is_unchanged(None, record)
+        assert is_unchanged(record, dict(record, processed_at=0))
+        assert not is_unchanged(record, dict(record, etag="def"))
+        assert not is_unchanged(record, dict(record, fields=["name"]))
+        assert not is_unchanged(record, dict(record, output_format="json"))
+        assert not is_unchanged(record, dict(record,
+                                             options={"engine": "arrow"}))
+
+    @pytest.mark.it("Test if the fields are recorded in a stable order")
+    def test_sorted_fields(self, record):
+        assert record["fields"] == ["email", "name"]
+
+
+class TestManifestStores:
+    @pytest.mark.it("Test if SQLite records persist across connections")
+    def test_sqlite(self, tmp_path, record):
+        path = str(tmp_path / "manifest.db")
+        store = SQLiteManifestStore(path)
+        assert store.get("bucket", "new_data/file.csv") is None
+        store.put(record)
+        store.put(dict(record, etag="def"))
+        store.close()
+        stored = get_manifest_store(path).get("bucket", "new_data/file.csv")
+        assert stored["etag"] == "def"
+
+    @pytest.mark.it("Test if S3 records persist across instances")
+    def test_s3(self, s3_client, record):
+        store = get_manifest_store("s3://test_bucket/_manifest/m.json")
+        assert isinstance(store, S3ManifestStore)
+        assert store.get("bucket", "new_data/file.csv") is None
+        store.put(record)
+        stored = S3ManifestStore("test_bucket", "_manifest/m.json").get(
+            "bucket", "new_data/file.csv")
+        assert stored == record
+
+    @pytest.mark.it("Test if a concurrent S3 write is kept, not overwritten")
+    def test_s3_concurrent_put(self, s3_client, record):
+        first = S3ManifestStore("test_bucket", "_manifest/m.json")
+        second = S3ManifestStore("test_bucket", "_manifest/m.json")
+        assert first.get("bucket", "new_data/file.csv") is None
+        assert second.get("bucket", "other.csv") is None
+        first.put(record)
+        second.put(dict(record, file_key="other.csv"))
+        first.put(dict(record, etag="def"))
+        stored = S3ManifestStore("test_bucket", "_manifest/m.json")
+        assert stored.get("bucket", "new_data/file.csv")["etag"] == "def"
+        assert stored.get("bucket", "other.csv")["etag"] == "abc"
+
+
+class TestHandleFileObfuscationManifest:
+    @pytest.mark.it("Test if an unchanged input is skipped without reading")
+    def test_skip_unchanged(self, s3_client, tmp_path):
+        manifest = SQLiteManifestStore(str(tmp_path / "manifest.db"))
+        message = handle_file_obfuscation(job(), manifest=manifest)
+        assert message == ("Obfuscated file saved to s3://test_bucket/" +
+                           "processed_data/test_file.csv")
+        with patch("src.main.read_s3_file") as mock_read:
+            message = handle_file_obfuscation(job(), manifest=manifest)
+            mock_read.assert_not_called()
+        assert message.startswith("Unchanged file")
+
+    @pytest.mark.it("Test if a manifest opened from a path is closed")
+    def test_close_manifest(self, s3_client, tmp_path):
+        path = str(tmp_path / "manifest.db")
+        with patch.object(SQLiteManifestStore, "close",
+                          autospec=True) as mock_close:
+            handle_file_obfuscation(job(), manifest=path)
+            mock_close.assert_called_once()
+        assert get_manifest_store(path).get(
+            "test_bucket", "new_data/test_file.csv") is not None
+
+    @pytest.mark.it("Test if a changed input or field list is reprocessed")
+    def test_reprocess_changed(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.db")
+        handle_file_obfuscation(job(), manifest=manifest)
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=b"student_id,name\n5678,Steve Lee\n")
+        message = handle_file_obfuscation(job(), manifest=manifest)
+        assert message.startswith("Obfuscated file saved")
+        message = handle_file_obfuscation(job(["name", "student_id"]),
+                                          manifest=manifest)
+        assert message.startswith("Obfuscated file saved")
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()
+        assert body == b"student_id,name\n***,***\n"
+
+    @pytest.mark.it("Test if changed output settings are reprocessed")
+    def test_reprocess_changed_options(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.db")
+        options = {"if_output_different_format": True,
+                   "output_format": "parquet", "manifest": manifest}
+        handle_file_obfuscation(job(), **options)
+        message = handle_file_obfuscation(job(), **options)
+        assert message.startswith("Unchanged file")
+        message = handle_file_obfuscation(job(), parquet_compression="zstd",
+                                          **options)
+        assert message.startswith("Obfuscated file saved")
+        message = handle_file_obfuscation(job(), parquet_compression="zstd",
+                                          **options)
+        assert message.startswith("Unchanged file")
+
+    @pytest.mark.it("Test if changed partitioning is reprocessed")
+    def test_reprocess_changed_partitioning(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.db")
+        handle_file_obfuscation(job(), manifest=manifest, partition_rows=1)
+        message = handle_file_obfuscation(job(), manifest=manifest,
+                                          partition_rows=1)
+        assert message.startswith("Unchanged file")
+        message = handle_file_obfuscation(job(), manifest=manifest,
+                                          partition_rows=2)
+        assert message.startswith("Obfuscated file saved")
+
+    @pytest.mark.it("Test if a changed projection or filter is reprocessed")
+    def test_reprocess_changed_projection(self, s3_client, tmp_path):
+        manifest = str(tmp_path / "manifest.db")
+        row_filter = [("student_id", "in", (1234, 5678))]
+        handle_file_obfuscation(job(), manifest=manifest,
+                                row_filter=row_filter)
+        message = handle_file_obfuscation(job(), manifest=manifest,
+                                          row_filter=row_filter)
+        assert message.startswith("Unchanged file")
+        message = handle_file_obfuscation(job(), manifest=manifest,
+                                          columns=["name"],
+                                          row_filter=row_filter)
+        assert message.startswith("Obfuscated file saved")
+        message = handle_file_obfuscation(job(), manifest=manifest,
+                                          columns=["name"])
+        assert message.startswith("Obfuscated file saved")
+
+    @pytest.mark.it("Test if a failed job is not recorded")
+    def test_failed_not_recorded(self, s3_client, tmp_path):
+        manifest = SQLiteManifestStore(str(tmp_path / "manifest.db"))
+        with pytest.raises(Exception):
+            handle_file_obfuscation(job(["cohort"]), manifest=manifest)
+        assert manifest.get("test_bucket", "new_data/test_file.csv") is None
+
+    @pytest.mark.it("Test if local files are skipped when unchanged")
+    def test_local_backend(self, tmp_path):
+        (tmp_path / "bucket" / "new_data").mkdir(parents=True)
+        (tmp_path / "bucket" / "new_data" / "file.csv").write_bytes(
+            b"id,name\n1,a\n")
+        json_str = json.dumps({
+            "file_to_obfuscate": "file://bucket/new_data/file.csv",
+            "pii_fields": ["name"]})
+        backend = LocalBackend(str(tmp_path))
+        manifest = SQLiteManifestStore(":memory:")
+        for expected in ["Obfuscated file saved", "Unchanged file"]:
+            message = handle_file_obfuscation(
+                json_str, storage_backend=backend, manifest=manifest,
+                pipelined=True)
+            assert message.startswith(expected)
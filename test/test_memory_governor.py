@@ -0,0 +1,256 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import time
+import pandas as pd
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.memory_governor import MemoryGovernor, SpilledPart, estimate_bytes
+from src.chunk_sizing import ChunkSizer, MIN_CHUNK_ROWS
+from src.pipeline import run_pipelined_obfuscation, run_fan_out_obfuscation
+from src.main import handle_file_obfuscation
+
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def test_csv_bytes():
+    rows = "".join(f"{i},Name {i},Software,name{i}@email.com\n"
+                   for i in range(5000))
+    return ("student_id,name,course,email_address\n" + rows).encode("utf8")
+
+
+@pytest.fixture
+def governor(tmp_path):
+    governor = MemoryGovernor(1024, spill_dir=str(tmp_path),
+                              max_wait_seconds=0.3)
+    yield governor
+    governor.close()
+
+
+def set_rss(governor, monkeypatch, rss_mb):
+    monkeypatch.setattr(governor, "rss_bytes", lambda: rss_mb * MB)
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_csv_bytes):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_csv_bytes)
+        yield s3_client
+
+
+class TestEstimateBytes:
+    @pytest.mark.it("Test if bytes and DataFrames are measured")
+    def test_estimate(self):
+        assert estimate_bytes(b"12345") == 5
+        df = pd.DataFrame({"name": ["John Smith"] * 5000})
+        assert estimate_bytes(df) == \
+            df.memory_usage(index=False, deep=True).sum()
+        assert estimate_bytes(df.iloc[:0]) == 0
+
+
+class TestMemoryGovernor:
+    @pytest.mark.it("Test if buffers in flight are tracked per stage")
+    def test_in_flight(self, governor):
+        part = governor.admit("upload", b"x" * 1000)
+        governor.admit("obfuscate", b"y" * 500)
+        assert governor.in_flight_bytes() == 1500
+        assert governor.in_flight_bytes(exclude="obfuscate") == 1000
+        assert governor.release("upload", part) == b"x" * 1000
+        assert governor.in_flight_bytes() == 500
+
+    @pytest.mark.it("Test if a chunk shared by channels is counted once")
+    def test_shared_chunk(self, governor):
+        chunk = pd.DataFrame({"name": ["John Smith"] * 1000})
+        size = estimate_bytes(chunk)
+        for stage in ["encode-csv", "encode-json", "encode-parquet"]:
+            governor.admit(stage, chunk)
+        assert governor.in_flight_bytes() == size
+        governor.release("encode-json", chunk)
+        governor.release("encode-csv", chunk)
+        assert governor.in_flight_bytes() == size
+        governor.release("encode-parquet", chunk)
+        assert governor.in_flight_bytes() == 0
+        assert governor.metrics()["peak_in_flight_mb"] == \
+            round(size / MB, 3)
+
+    @pytest.mark.it("Test if parts are spilled over the soft limit")
+    def test_spill(self, governor, monkeypatch, tmp_path):
+        assert governor.admit("upload", b"part", spill=True) == b"part"
+        set_rss(governor, monkeypatch, 900)
+        spilled = governor.admit("upload", b"part", spill=True)
+        assert isinstance(spilled, SpilledPart)
+        assert governor.admit("obfuscate", b"block") == b"block"
+        assert len(list(tmp_path.glob("*/part-*"))) == 1
+        assert governor.release("upload", spilled) == b"part"
+        assert not list(tmp_path.glob("*/part-*"))
+        assert governor.metrics()["spilled_parts"] == 1
+
+    @pytest.mark.it("Test if the spill directory is removed on close")
+    def test_close(self, governor, monkeypatch, tmp_path):
+        set_rss(governor, monkeypatch, 900)
+        governor.admit("upload", b"part", spill=True)
+        governor.close()
+        assert not list(tmp_path.iterdir())
+
+    @pytest.mark.it("Test if chunks shrink over the soft limit")
+    def test_shrink(self, governor, monkeypatch):
+        sizer = ChunkSizer(1000)
+        governor.throttle(sizer)
+        assert sizer.rows == 1000
+        set_rss(governor, monkeypatch, 900)
+        governor.throttle(sizer)
+        assert sizer.rows == 500
+        for rss_mb in [1000, 1100, 1200, 1300, 1400]:
+            set_rss(governor, monkeypatch, rss_mb)
+            governor.throttle(sizer)
+        assert sizer.rows == MIN_CHUNK_ROWS
+        set_rss(governor, monkeypatch, 500)
+        governor.throttle(sizer)
+        set_rss(governor, monkeypatch, 900)
+        adaptive = ChunkSizer(1000, target_bytes=MB)
+        governor.throttle(adaptive)
+        assert adaptive.target_bytes == MB // 2
+
+    @pytest.mark.it("Test if chunks are not halved again while RSS is flat")
+    def test_shrink_hysteresis(self, governor, monkeypatch):
+        sizer = ChunkSizer(1000)
+        set_rss(governor, monkeypatch, 900)
+        for _ in range(5):
+            governor.throttle(sizer)
+        assert sizer.rows == 500
+        set_rss(governor, monkeypatch, 920)
+        governor.throttle(sizer)
+        assert sizer.rows == 500
+        set_rss(governor, monkeypatch, 960)
+        governor.throttle(sizer)
+        assert sizer.rows == 250
+        set_rss(governor, monkeypatch, 700)
+        governor.throttle(sizer)
+        set_rss(governor, monkeypatch, 900)
+        governor.throttle(sizer)
+        assert sizer.rows == 125
+        assert governor.metrics()["shrinks"] == 3
+
+    @pytest.mark.it("Test if it waits over the limit for later stages")
+    def test_wait(self, governor, monkeypatch):
+        set_rss(governor, monkeypatch, 2048)
+        sizer = ChunkSizer(1000)
+        governor.admit("obfuscate", b"block")
+        start = time.perf_counter()
+        governor.throttle(sizer)
+        assert time.perf_counter() - start < 0.1
+        part = governor.admit("upload", b"part")
+        start = time.perf_counter()
+        governor.throttle(sizer)
+        assert time.perf_counter() - start >= 0.3
+        governor.release("upload", part)
+        start = time.perf_counter()
+        governor.throttle(sizer)
+        assert time.perf_counter() - start < 0.1
+        assert governor.metrics()["wait_seconds"] >= 0.3
+
+    @pytest.mark.it("Test if invalid limits and missing psutil raise")
+    def test_errors(self, monkeypatch):
+        with pytest.raises(ValueError, match="positive"):
+            MemoryGovernor(0)
+        monkeypatch.setattr("src.memory_governor.psutil", None)
+        with pytest.raises(ImportError, match="psutil"):
+            MemoryGovernor(1024)
+
+
+class TestGovernedPipeline:
+    @pytest.mark.it("Test if a job over its limit shrinks chunks and spills")
+    @pytest.mark.parametrize("output_format", ["csv", "parquet"])
+    def test_pipelined(self, test_csv_bytes, tmp_path, output_format):
+        parts = []
+        stats = run_pipelined_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"], parts.extend,
+            output_format=output_format, chunk_size=1000, part_size=1000,
+            max_memory_mb=1, spill_dir=str(tmp_path))
+        memory = stats["memory"]
+        assert memory["shrinks"] > 0 and memory["spilled_parts"] > 0
+        assert stats["chunk_sizes"]["chunk_rows"][:2] == [1000, 500]
+        assert not list(tmp_path.iterdir())
+        output = io.BytesIO(b"".join(parts))
+        df = pd.read_csv(output) if output_format == "csv" \
+            else pd.read_parquet(output)
+        assert df.shape == (5000, 4)
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test if a job under its limit is unchanged")
+    def test_under_limit(self, test_csv_bytes):
+        parts = []
+        stats = run_pipelined_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"], parts.extend,
+            chunk_size=1000, max_memory_mb=64 * 1024)
+        assert stats["memory"]["shrinks"] == 0
+        assert stats["memory"]["spilled_parts"] == 0
+        assert stats["memory"]["peak_rss_mb"] > 0
+        assert stats["chunk_sizes"]["chunk_rows"] == [1000] * 5
+
+    @pytest.mark.it("Test if fan-out outputs are governed")
+    def test_fan_out(self, test_csv_bytes, tmp_path):
+        outputs = {"csv": [], "json": []}
+        stats = run_fan_out_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"],
+            {output_format: output_parts.extend
+             for output_format, output_parts in outputs.items()},
+            chunk_size=1000, part_size=1000, max_memory_mb=1,
+            spill_dir=str(tmp_path))
+        assert stats["memory"]["spilled_parts"] > 0
+        df = pd.read_json(io.BytesIO(b"".join(outputs["json"])), lines=True)
+        assert df.shape == (5000, 4)
+
+
+class TestHandleFileObfuscationMaxMemory:
+    @pytest.mark.it("Test if jobs with a memory limit are saved to s3")
+    def test_max_memory(self, s3_client, tmp_path):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"],
+        })
+        message = handle_file_obfuscation(json_str, max_memory_mb=1,
+                                          spill_dir=str(tmp_path))
+        assert message == ("Obfuscated file saved to s3://test_bucket/" +
+                           "processed_data/test_file.csv")
+        df = pd.read_csv(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()))
+        assert df.shape == (5000, 4)
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test if unsupported modes are refused")
+    def test_not_available(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"],
+        })
+        with pytest.raises(Exception, match="max_memory_mb is not"):
+            handle_file_obfuscation(json_str, max_memory_mb=512,
+                                    engine="arrow")
+        with pytest.raises(Exception, match="csv_passthrough is not"):
+            handle_file_obfuscation(json_str, max_memory_mb=512,
+                                    csv_passthrough=True)
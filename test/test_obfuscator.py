@@ -11,7 +11,7 @@ from src.obfuscator import (
 import pandas as pd
 import json
 import io
-from unittest.mock import patch
+from unittest.mock import patch, ANY
 import pyarrow.parquet as pq
 import pyarrow as pa
 
@@ -147,7 +147,8 @@ class TestObfuscateFieldsInDf:
             ValueError,
             match="Unknown method: other. "
             + "Only 'mask', 'hash', 'random_hash',"
-            + " or 'replace' are accepted",
+            + " 'replace', 'redact', 'tokenize' or 'pseudonymize'"
+            + " are accepted",
         ):
             obfuscate_fields_in_df(test_content, test_fields, "other")
 
@@ -163,7 +164,7 @@ class TestProcessCSVChunk:
         mock_obfuscate_fields.return_value = test_content.copy()
         process_df_chunk(test_content, test_fields, output_buffer, True)
         mock_obfuscate_fields.assert_called_once_with(
-            test_content, test_fields, "replace"
+            test_content, test_fields, "replace", None, None
         )
 
     @pytest.mark.it("Test if the output is a valid csv")
@@ -381,10 +382,82 @@ class TestConvertCsvToOutputFormat:
 
         with pytest.raises(ValueError,
                            match="Unsupported format." +
-                           " Only 'json' and 'parquet' are allowed."):
+                           " Only 'json', 'parquet', 'orc', 'feather' " +
+                           "and 'avro' are allowed."):
             convert_csv_to_output_format(test_content, 'xml')
 
 
+class TestConvertCsvToOutputFormatChunked:
+    @pytest.mark.it("Tests if chunked JSON output matches unchunked output")
+    def test_chunked_json(self, test_csv_data):
+        test_content, _ = test_csv_data
+        expected = convert_csv_to_output_format(
+            io.BytesIO(test_content.encode("utf8")), "json")
+        output = convert_csv_to_output_format(
+            io.BytesIO(test_content.encode("utf8")), "json",
+            chunked=True, row_group_size=1)
+        assert output.getvalue() == expected.getvalue()
+
+    @pytest.mark.it("Tests if chunked PARQUET output has one row group " +
+                    "per chunk")
+    def test_chunked_parquet_row_groups(self, test_csv_data):
+        test_content, _ = test_csv_data
+        output = convert_csv_to_output_format(
+            io.BytesIO(test_content.encode("utf8")), "parquet",
+            chunked=True, row_group_size=1, compression="gzip")
+        parquet_file = pq.ParquetFile(output)
+        assert parquet_file.num_row_groups == 2
+        assert parquet_file.metadata.row_group(0).column(0)\
+            .compression == "GZIP"
+        df = parquet_file.read().to_pandas()
+        assert df.shape == (2, 5)
+        assert df["name"].iloc[1] == "Steve Lee"
+
+
+class TestObfuscateFileInChunks:
+    @pytest.mark.it("Test if a column empty in the first chunk can hold " +
+                    "text later")
+    @pytest.mark.parametrize("output_format", ["parquet", "feather"])
+    def test_empty_first_chunk(self, output_format):
+        content = "id,name,notes\n" + "".join(
+            f"{i},Name {i},{'hello' if i >= 150 else ''}\n"
+            for i in range(200))
+        output = obfuscate_file(content, ["name"], "csv", output_format,
+                                chunk_size=100, chunked_conversion=True,
+                                row_group_size=100)
+        table = pa.ipc.open_file(output).read_all() \
+            if output_format == "feather" else pq.read_table(output)
+        assert table["notes"].to_pylist()[149:151] == [None, "hello"]
+        assert set(table["name"].to_pylist()) == {"***"}
+        expected = convert_csv_to_output_format(
+            io.BytesIO(content.encode("utf8")), "parquet", chunked=True,
+            row_group_size=100)
+        assert pq.read_table(expected)["notes"].to_pylist() == \
+            table["notes"].to_pylist()
+
+    @pytest.mark.it("Test if chunks are written without an intermediate csv")
+    @patch("src.obfuscator.convert_str_file_content_to_obfuscated_csv")
+    def test_no_csv(self, mock_convert, test_csv_data):
+        test_content, test_fields = test_csv_data
+        output = obfuscate_file(test_content, test_fields, "csv", "parquet",
+                                chunk_size=1, chunked_conversion=True,
+                                row_group_size=2,
+                                parquet_compression="gzip")
+        mock_convert.assert_not_called()
+        metadata = pq.ParquetFile(output).metadata
+        assert metadata.num_row_groups == 1
+        assert metadata.row_group(0).column(0).compression == "GZIP"
+
+    @pytest.mark.it("Test if JSON paths are obfuscated in chunks")
+    def test_json_paths(self):
+        content = json.dumps([{"id": 1, "contact": {"email": "a@b.com"}},
+                              {"id": 2, "contact": {"email": "c@d.com"}}])
+        output = obfuscate_file(content, ["contact.email"], "json",
+                                "parquet", chunked_conversion=True)
+        assert pq.read_table(output)["contact"].to_pylist() == \
+            [{"email": "***"}, {"email": "***"}]
+
+
 class TestObfuscateFile:
     @pytest.mark.it("Test if inner functions are called")
     @patch("src.obfuscator.convert_str_file_content_to_obfuscated_csv")
@@ -397,10 +470,18 @@ class TestObfuscateFile:
                                             test_content.encode('utf8'))
         obfuscate_file(test_content, test_fields, 'csv', 'json')
         mock_convert_str_csv.assert_called_once_with(
-            test_content, test_fields, "csv", 5000, "replace"
+            test_content, test_fields, "csv", ANY, "replace",
+            csv_schema=None, infer_schema=False,
+            raw_non_pii=False, csv_engine="c", arrow_strings=False,
+            token_vault=None, pseudonym_map=None
         )
+        sizer = mock_convert_str_csv.call_args.args[3]
+        assert sizer.rows == 5000 and not sizer.adaptive
         mock_convert_csv_output.assert_called_once_with(
-            mock_convert_str_csv.return_value, "json"
+            mock_convert_str_csv.return_value, "json",
+            chunked=False, row_group_size=100000, compression="snappy",
+            compression_level=None, use_dictionary=True,
+            arrow_strings=False
         )
 
     @pytest.mark.it("Test ValueError when an unsupported type is inputed")
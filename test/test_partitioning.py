@@ -0,0 +1,250 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import pandas as pd
+import pyarrow.parquet as pq
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.partitioning import (
+    MANIFEST_NAME,
+    get_partition_prefix,
+    write_partitioned_output,
+)
+from src.storage import MemoryBackend
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": range(100),
+        "name": [f"Name {i}" for i in range(100)],
+        "cohort": [["2024-01", "2024-02", None][i % 3] for i in range(100)],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+def chunks_of(df, size):
+    return (df.iloc[i:i + size] for i in range(0, len(df), size))
+
+
+def write_to(objects):
+    def write_part(key, body):
+        objects[key] = body.read()
+    return write_part
+
+
+class TestGetPartitionPrefix:
+    @pytest.mark.it("Test if the prefix is named after the output file")
+    def test_prefix(self):
+        assert get_partition_prefix("processed_data/file.csv") == \
+            "processed_data/file/"
+        assert get_partition_prefix("processed_data/a/file.csv.gz") == \
+            "processed_data/a/file/"
+
+
+class TestWritePartitionedOutput:
+    @pytest.mark.it("Test if parts are rolled over at rows_per_part rows")
+    def test_rows_per_part(self, test_df):
+        objects = {}
+        manifest = write_partitioned_output(
+            chunks_of(test_df, 30), write_to(objects), "out/",
+            rows_per_part=40)
+        assert [part["rows"] for part in manifest["parts"]] == [40, 40, 20]
+        assert manifest["rows"] == 100
+        assert sorted(objects) == ["out/_manifest.json",
+                                   "out/part-00000.csv",
+                                   "out/part-00001.csv",
+                                   "out/part-00002.csv"]
+        parts = [pd.read_csv(io.BytesIO(objects[part["key"]]))
+                 for part in manifest["parts"]]
+        expected = pd.read_csv(io.StringIO(test_df.to_csv(index=False)))
+        pd.testing.assert_frame_equal(
+            pd.concat(parts, ignore_index=True), expected)
+
+    @pytest.mark.it("Test if parts stay near bytes_per_part bytes")
+    def test_bytes_per_part(self, test_df):
+        objects = {}
+        df = pd.concat([test_df] * 10, ignore_index=True)
+        manifest = write_partitioned_output(
+            chunks_of(df, 300), write_to(objects), "out/",
+            output_format="json", bytes_per_part=5000)
+        sizes = [len(objects[part["key"]]) for part in manifest["parts"]]
+        assert len(sizes) > 5
+        assert all(4500 < size < 5500 for size in sizes[:-1])
+        assert manifest["rows"] == 1000
+
+    @pytest.mark.it("Test if rows are split into Hive-style partitions")
+    def test_partition_by(self, test_df):
+        objects = {}
+        manifest = write_partitioned_output(
+            chunks_of(test_df, 30), write_to(objects), "out/",
+            partition_by="cohort")
+        prefixes = {part["key"].rsplit("/", 1)[0]
+                    for part in manifest["parts"]}
+        assert prefixes == {"out/cohort=2024-01", "out/cohort=2024-02",
+                            "out/cohort=__HIVE_DEFAULT_PARTITION__"}
+        part = pd.read_csv(io.BytesIO(
+            objects["out/cohort=2024-02/part-00000.csv"]))
+        assert (part["cohort"] == "2024-02").all()
+        assert len(part) == 33
+
+    @pytest.mark.it("Test if the least recently written partition is closed")
+    def test_max_open_partitions(self, test_df):
+        objects = {}
+        manifest = write_partitioned_output(
+            chunks_of(test_df, 30), write_to(objects), "out/",
+            partition_by="cohort", max_open_partitions=2)
+        keys = [part["key"] for part in manifest["parts"]
+                if part["key"].startswith("out/cohort=2024-02/")]
+        assert len(keys) > 1
+        assert len(keys) == len(set(keys))
+        parts = [pd.read_csv(io.BytesIO(objects[key])) for key in keys]
+        assert sum(len(part) for part in parts) == 33
+        assert manifest["rows"] == 100
+
+    @pytest.mark.it("Test if parquet partitions read back as a dataset")
+    def test_parquet_dataset(self, test_df, tmp_path):
+        def write_part(key, body):
+            path = tmp_path / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(body.read())
+        write_partitioned_output(
+            chunks_of(test_df, 30), write_part, "out/",
+            output_format="parquet", rows_per_part=20,
+            partition_by="cohort")
+        table = pq.read_table(str(tmp_path / "out"))
+        assert table.num_rows == 100
+        assert "cohort" in table.column_names
+        assert sorted(table.column("student_id").to_pylist()) == \
+            list(range(100))
+
+    @pytest.mark.it("Test if the manifest lists every part, written last")
+    def test_manifest(self, test_df):
+        objects = {}
+        manifest = write_partitioned_output(
+            chunks_of(test_df, 30), write_to(objects), "out/",
+            rows_per_part=50)
+        assert list(objects)[-1] == "out/" + MANIFEST_NAME
+        assert json.loads(objects["out/" + MANIFEST_NAME]) == manifest
+        assert manifest["format"] == "csv"
+        assert manifest["parts"][0] == {"key": "out/part-00000.csv",
+                                        "rows": 50, "partition": None}
+
+    @pytest.mark.it("Test if no manifest is written when a part fails")
+    def test_failed_part(self, test_df):
+        objects = {}
+
+        def write_part(key, body):
+            if key.endswith("part-00001.csv"):
+                raise ConnectionError("connection reset")
+            objects[key] = body.read()
+        with pytest.raises(ConnectionError):
+            write_partitioned_output(chunks_of(test_df, 30), write_part,
+                                     "out/", rows_per_part=40)
+        assert "out/" + MANIFEST_NAME not in objects
+
+    @pytest.mark.it("Test errors for missing options or partition column")
+    def test_errors(self, test_df):
+        with pytest.raises(ValueError):
+            write_partitioned_output(iter([test_df]), write_to({}), "out/")
+        with pytest.raises(KeyError):
+            write_partitioned_output(iter([test_df]), write_to({}), "out/",
+                                     partition_by="country")
+
+
+class TestHandleFileObfuscationPartitioned:
+    @pytest.mark.it("Test if an S3 input is saved as obfuscated parts")
+    def test_s3(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        message = handle_file_obfuscation(
+            json_str, chunk_size=30, partition_rows=40,
+            output_compression="gzip")
+        assert message == ("Obfuscated file saved to s3://test_bucket/" +
+                           "processed_data/test_file/ in 3 parts")
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file/_manifest.json")["Body"].read()
+        manifest = json.loads(body)
+        assert manifest["parts"][0]["key"] == \
+            "processed_data/test_file/part-00000.csv.gz"
+        part = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file/part-00002.csv.gz")["Body"]
+        df = pd.read_csv(part, compression="gzip")
+        assert len(df) == 20
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test if parts can be written in another format")
+    def test_output_format(self, test_df):
+        backend = MemoryBackend({("bucket", "new_data/file.csv"):
+                                 test_df.to_csv(index=False).encode()})
+        json_str = json.dumps({
+            "file_to_obfuscate": "memory://bucket/new_data/file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(
+            json_str, if_output_different_format=True,
+            output_format="parquet", storage_backend=backend,
+            partition_by="cohort")
+        content, _ = backend.read_file(
+            "bucket", "processed_data/file/cohort=2024-01/part-00000.parquet")
+        df = pq.read_table(content).to_pandas()
+        assert len(df) == 34
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test if parquet parts use the Parquet options")
+    def test_parquet_options(self, test_df):
+        backend = MemoryBackend({("bucket", "new_data/file.csv"):
+                                 test_df.to_csv(index=False).encode()})
+        json_str = json.dumps({
+            "file_to_obfuscate": "memory://bucket/new_data/file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(
+            json_str, if_output_different_format=True,
+            output_format="parquet", storage_backend=backend,
+            partition_rows=40, parquet_compression="zstd",
+            parquet_use_dictionary=False)
+        content, _ = backend.read_file(
+            "bucket", "processed_data/file/part-00000.parquet")
+        column = pq.ParquetFile(content).metadata.row_group(0).column(1)
+        assert column.compression == "ZSTD"
+        assert not any("DICTIONARY" in encoding
+                       for encoding in column.encodings)
+
+    @pytest.mark.it("Test if partitioned output must be saved")
+    def test_not_saved(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        with pytest.raises(Exception, match="must be saved"):
+            handle_file_obfuscation(json_str, if_save_to_s3=False,
+                                    partition_rows=10)
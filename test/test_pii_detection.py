@@ -1,5 +1,10 @@
 import pytest
-from src.pii_detection import is_pii_by_heuristic, detect_if_pii
+from src.pii_detection import (
+    is_pii_by_heuristic,
+    detect_if_pii,
+    score_pii_by_heuristic,
+    detect_pii_tiered,
+)
 
 
 class TestIsPIIByHeruistic:
@@ -33,3 +38,53 @@ class TestDetectIfPII:
         assert detect_if_pii("email address") is True
         assert detect_if_pii("total_amount") is False
         assert detect_if_pii("nonsense") is False
+
+
+class TestScorePIIByHeuristic:
+    @pytest.mark.it("Test if names get a score per kind of match")
+    def test_scores(self):
+        assert score_pii_by_heuristic("user_phone") == 0.9
+        assert score_pii_by_heuristic("account number") == 0.85
+        assert score_pii_by_heuristic("company_address") == 0.5
+        assert score_pii_by_heuristic("notes") == 0.3
+        assert score_pii_by_heuristic("product_category") == 0.1
+
+
+class TestDetectPIITiered:
+    @pytest.mark.it("Test if only ambiguous columns reach the model tier")
+    def test_tiers(self):
+        calls = []
+
+        def escalate(columns):
+            calls.append(columns)
+            return [{"column_name": "notes", "is_pii": True, "score": 0.7}]
+
+        report = detect_pii_tiered(
+            ["cvv", "customer_feedback", "home phone", "product_category",
+             "notes", "company_address"], escalate)
+        assert calls == [["notes", "company_address"]]
+        assert [(r["column_name"], r["is_pii"], r["tier"])
+                for r in report] == [
+            ("cvv", True, "dictionary"),
+            ("customer_feedback", False, "dictionary"),
+            ("home phone", True, "heuristic"),
+            ("product_category", False, "heuristic"),
+            ("notes", True, "model"),
+            ("company_address", False, "heuristic"),
+        ]
+        assert report[4]["score"] == 0.7
+
+    @pytest.mark.it("Test if the model is not called without ambiguity")
+    def test_no_escalation(self):
+        def escalate(columns):
+            raise AssertionError("model called")
+
+        report = detect_pii_tiered(["name", "email address"], escalate)
+        assert [r["is_pii"] for r in report] == [True, True]
+
+    @pytest.mark.it("Test if tiers match detect_if_pii without a model")
+    def test_same_as_detect_if_pii(self):
+        columns = ["cvv", "email address", "total_amount", "nonsense",
+                   "course_name", "ni"]
+        assert [r["is_pii"] for r in detect_pii_tiered(columns)] == \
+            [detect_if_pii(column) for column in columns]
@@ -0,0 +1,185 @@
+import pytest
+import boto3
+from moto import mock_aws
+import os
+import json
+import threading
+import pandas as pd
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.pii_detection_ner import (
+    NerPiiDetector,
+    sample_column_values,
+    detect_if_pii_with_ner,
+    load_ner_model,
+    clear_ner_model_cache,
+)
+from src.main import handle_file_obfuscation
+
+
+class CapitalisedNameDetector(NerPiiDetector):
+    """
+    Detector whose 'model' finds a NAME in values with two capitalised
+    words, recording the batches it is given
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.batches = []
+        self.threads = set()
+
+    def _predict_batch(self, values):
+        self.batches.append(list(values))
+        self.threads.add(threading.current_thread().name)
+        return [{"NAME"} if sum(word[:1].isupper()
+                                for word in value.split()) >= 2 else set()
+                for value in values]
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": [1, 2, 3, 4],
+        "full_text": ["John Smith", "Steve Lee", "Amy Tan", None],
+        "course": ["software", "de", "software", "de"],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+class TestSampleColumnValues:
+    @pytest.mark.it("Test if distinct non-empty values are sampled")
+    def test_sample(self):
+        series = pd.Series(["a", "a", None, " ", 5] + list("bcdefgh"))
+        assert sample_column_values(series[:5]) == ["a", "5"]
+        sample = sample_column_values(series, sample_size=3)
+        assert len(sample) == 3
+        assert sample == sample_column_values(series, sample_size=3)
+
+
+class TestNerPiiDetector:
+    @pytest.mark.it("Test if values are batched by length without repeats")
+    def test_batches(self):
+        detector = CapitalisedNameDetector(batch_size=2)
+        values = ["Amy Tan", "x", "John Smith", "x", "Steve Lee"]
+        assert detector.predict(values) == [{"NAME"}, set(), {"NAME"},
+                                            set(), {"NAME"}]
+        assert detector.batches == [["x", "Amy Tan"],
+                                    ["Steve Lee", "John Smith"]]
+
+    @pytest.mark.it("Test if results are memoized for repeated strings")
+    def test_memoized(self):
+        detector = CapitalisedNameDetector(cache_size=2)
+        detector.predict(["Amy Tan", "x"])
+        detector.predict(["Amy Tan", "Amy Tan", "John Smith"])
+        assert detector.batches == [["x", "Amy Tan"], ["John Smith"]]
+        assert detector.stats == {"values": 5, "cache_hits": 2,
+                                  "batches": 2}
+        # 'x' was the least recently used value, so it was evicted
+        detector.predict(["x", "Amy Tan"])
+        assert detector.batches[-1] == ["x"]
+
+    @pytest.mark.it("Test if batches run on several threads")
+    def test_threads(self):
+        detector = CapitalisedNameDetector(batch_size=1, max_workers=2)
+        values = [f"Name {i} Smith" for i in range(20)]
+        assert detector.predict(values) == [{"NAME"}] * 20
+        assert all(name.startswith("ner") for name in detector.threads)
+
+    @pytest.mark.it("Test if a column is PII from the share of its values")
+    def test_detect_column(self, test_df):
+        detector = CapitalisedNameDetector()
+        assert detector.detect_column(test_df["full_text"]) == {
+            "is_pii": True, "score": 1.0, "entities": ["NAME"]}
+        assert detector.detect_column(test_df["course"]) == {
+            "is_pii": False, "score": 0.0, "entities": []}
+        assert detector.detect_column(pd.Series([None]))["is_pii"] is False
+
+    @pytest.mark.it("Test if every column of a DataFrame is reported")
+    def test_detect_if_pii_with_ner(self, test_df):
+        result = detect_if_pii_with_ner(test_df,
+                                        detector=CapitalisedNameDetector())
+        assert [(r["column_name"], r["is_pii"]) for r in result] == [
+            ("student_id", False), ("full_text", True), ("course", False)]
+
+
+class TestHandleFileObfuscationNer:
+    @pytest.mark.it("Test if NER detected columns are obfuscated")
+    def test_handle_file_obfuscation(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": []})
+        detector = CapitalisedNameDetector()
+        with patch("src.pii_detection_ner.get_ner_detector",
+                   return_value=detector):
+            result = handle_file_obfuscation(
+                json_str, if_save_to_s3=False, auto_detect_pii=True,
+                auto_detect_pii_ner=True)
+        df = pd.read_csv(result)
+        assert list(df["full_text"]) == ["***"] * 4
+        assert list(df["course"]) == ["software", "de", "software", "de"]
+
+    @pytest.mark.it("Test if NER detection is refused for pipelined jobs")
+    def test_pipelined(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": []})
+        with pytest.raises(Exception, match="NER detection"):
+            handle_file_obfuscation(json_str, auto_detect_pii=True,
+                                    auto_detect_pii_ner=True, pipelined=True)
+
+
+class TestLoadNerModel:
+    @pytest.mark.it("Test if a local model is loaded once and quantized")
+    def test_tiny_model(self, tmp_path):
+        torch = pytest.importorskip("torch")
+        transformers = pytest.importorskip("transformers")
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "john", "smith", "x"]
+        (tmp_path / "vocab.txt").write_text("\n".join(vocab))
+        tokenizer = transformers.BertTokenizerFast(
+            str(tmp_path / "vocab.txt"))
+        config = transformers.BertConfig(
+            vocab_size=len(vocab), hidden_size=8, num_hidden_layers=1,
+            num_attention_heads=1, intermediate_size=8,
+            id2label={0: "O", 1: "B-PER"}, label2id={"O": 0, "B-PER": 1})
+        model = transformers.BertForTokenClassification(config)
+        with torch.no_grad():
+            model.classifier.weight.zero_()
+            model.classifier.bias.copy_(torch.tensor([0.0, 10.0]))
+        tokenizer.save_pretrained(tmp_path)
+        model.save_pretrained(tmp_path)
+        clear_ner_model_cache()
+        try:
+            assert load_ner_model(str(tmp_path)) is \
+                load_ner_model(str(tmp_path))
+            detector = NerPiiDetector(model_name=str(tmp_path),
+                                      quantize=True, batch_size=1,
+                                      max_workers=2)
+            assert detector.predict(["john smith", "x"]) == [{"NAME"},
+                                                             {"NAME"}]
+        finally:
+            clear_ner_model_cache()
@@ -0,0 +1,407 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import time
+import pandas as pd
+import pyarrow.parquet as pq
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.pipeline import run_pipelined_obfuscation, run_fan_out_obfuscation
+from src.main import handle_file_obfuscation, get_fan_out_file_keys
+
+
+@pytest.fixture
+def test_csv_bytes():
+    rows = "".join(f"{i},Name {i},Software,name{i}@email.com\n"
+                   for i in range(1000))
+    return ("student_id,name,course,email_address\n" + rows).encode("utf8")
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_csv_bytes):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_csv_bytes)
+        yield s3_client
+
+
+class SlowReader(io.BytesIO):
+    def read(self, size=-1):
+        time.sleep(0.05)
+        return super().read(size)
+
+
+class TestRunPipelinedObfuscation:
+    @pytest.mark.it("Test if the output is obfuscated for every format")
+    @pytest.mark.parametrize("output_format", ["csv", "json", "parquet"])
+    def test_output_formats(self, test_csv_bytes, output_format):
+        parts = []
+        stats = run_pipelined_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name", "email_address"],
+            parts.extend, output_format=output_format, chunk_size=100,
+            block_size=1000, part_size=2000)
+        output = io.BytesIO(b"".join(parts))
+        if output_format == "csv":
+            df = pd.read_csv(output)
+        elif output_format == "json":
+            df = pd.read_json(output, lines=True)
+        else:
+            df = pq.read_table(output).to_pandas()
+        assert stats["rows"] == 1000
+        assert len(parts) > 1
+        assert df.shape == (1000, 4)
+        assert (df["name"] == "***").all()
+        assert df["course"].iloc[999] == "Software"
+
+    @pytest.mark.it("Test if csv options sampling the stream are supported")
+    @pytest.mark.parametrize("csv_options", [{"infer_schema": True},
+                                             {"raw_non_pii": True},
+                                             {"csv_engine": "pyarrow"}])
+    def test_sampling_csv_options(self, test_csv_bytes, csv_options):
+        parts = []
+        stats = run_pipelined_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"], parts.extend,
+            chunk_size=100, block_size=1000, part_size=2000, **csv_options)
+        expected = pd.read_csv(io.BytesIO(test_csv_bytes))
+        expected["name"] = "***"
+        assert stats["rows"] == 1000
+        pd.testing.assert_frame_equal(
+            pd.read_csv(io.BytesIO(b"".join(parts))), expected)
+
+    @pytest.mark.it("Test if csv columns may contain '.' and '['")
+    def test_dotted_csv_columns(self):
+        parts = []
+        run_pipelined_obfuscation(
+            io.BytesIO(b"id,contact.email,tags[0]\n1,a@email.com,x\n"),
+            "csv", ["contact.email", "tags[0]"], parts.extend)
+        assert b"".join(parts) == b"id,contact.email,tags[0]\n1,***,***\n"
+
+    @pytest.mark.it("Test if fields can be chosen from the first chunk")
+    def test_callable_fields_list(self, test_csv_bytes):
+        parts = []
+        stats = run_pipelined_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv",
+            lambda columns: [c for c in columns if "name" in c],
+            parts.extend, chunk_size=100)
+        assert stats["fields_list"] == ["name"]
+        df = pd.read_csv(io.BytesIO(b"".join(parts)))
+        assert (df["name"] == "***").all()
+        assert df["email_address"].iloc[0] == "name0@email.com"
+
+    @pytest.mark.it("Test if download and upload overlap")
+    def test_stages_overlap(self):
+        rows = "".join(f"{i},Name {i},Software\n" for i in range(200000))
+        content = ("student_id,name,course\n" + rows).encode("utf8")
+        uploaded = []
+
+        def slow_upload(parts):
+            for part in parts:
+                time.sleep(0.05)
+                uploaded.append(part)
+
+        stats = run_pipelined_obfuscation(
+            SlowReader(content), "csv", ["name"], slow_upload,
+            chunk_size=10000, block_size=len(content) // 10 + 1,
+            part_size=len(content) // 10, queue_size=2)
+        sequential_seconds = (0.05 * 11 + 0.05 * len(uploaded)
+                              + stats["obfuscate_seconds"])
+        assert stats["rows"] == 200000
+        assert stats["total_seconds"] < 0.8 * sequential_seconds
+
+    @pytest.mark.it("Test if an upload error is raised without hanging")
+    def test_upload_error(self, test_csv_bytes):
+        def failing_upload(parts):
+            next(parts)
+            raise ConnectionError("upload failed")
+
+        with pytest.raises(ConnectionError, match="upload failed"):
+            run_pipelined_obfuscation(
+                io.BytesIO(test_csv_bytes * 20), "csv", ["name"],
+                failing_upload, chunk_size=100, block_size=1000,
+                part_size=1000, queue_size=1)
+
+    @pytest.mark.it("Test if an obfuscation error is raised")
+    def test_obfuscation_error(self, test_csv_bytes):
+        with pytest.raises(KeyError):
+            run_pipelined_obfuscation(
+                io.BytesIO(test_csv_bytes), "csv", ["cohort"],
+                lambda parts: list(parts), chunk_size=100, block_size=100)
+
+    @pytest.mark.it("Test ValueError up front for JSON path fields")
+    def test_json_path_fields(self):
+        source = io.BytesIO(b'[{"customer": {"name": "Jo"}}]')
+        with pytest.raises(ValueError, match="JSON path"):
+            run_pipelined_obfuscation(source, "json", ["customer.name"],
+                                      list)
+        with pytest.raises(ValueError, match="JSON path"):
+            run_fan_out_obfuscation(source, "json", ["customer.name"],
+                                    {"json": list})
+        assert source.tell() == 0
+
+
+def read_output(output, output_format):
+    if output_format == "csv":
+        return pd.read_csv(output)
+    elif output_format == "json":
+        return pd.read_json(output, lines=True)
+    return pq.read_table(output).to_pandas()
+
+
+class TestRunFanOutObfuscation:
+    @pytest.mark.it("Test if every format gets the same obfuscated rows")
+    def test_formats(self, test_csv_bytes):
+        parts = {"csv": [], "json": [], "parquet": []}
+        stats = run_fan_out_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name", "email_address"],
+            {output_format: output_parts.extend
+             for output_format, output_parts in parts.items()},
+            chunk_size=100, block_size=1000, part_size=2000,
+            writer_options={"parquet": {"compression": "zstd"}})
+        assert stats["rows"] == 1000
+        assert set(stats["encode_seconds"]) == set(parts)
+        expected = pd.read_csv(io.BytesIO(test_csv_bytes))
+        expected[["name", "email_address"]] = "***"
+        for output_format, output_parts in parts.items():
+            df = read_output(io.BytesIO(b"".join(output_parts)),
+                             output_format)
+            pd.testing.assert_frame_equal(df, expected)
+        metadata = pq.ParquetFile(io.BytesIO(b"".join(parts["parquet"]))) \
+            .metadata
+        assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+    @pytest.mark.it("Test if a sampled csv schema is used for every format")
+    def test_infer_schema(self, test_csv_bytes):
+        parts = {"csv": [], "parquet": []}
+        stats = run_fan_out_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"],
+            {output_format: output_parts.extend
+             for output_format, output_parts in parts.items()},
+            chunk_size=100, block_size=1000, infer_schema=True)
+        assert stats["rows"] == 1000
+        df = read_output(io.BytesIO(b"".join(parts["parquet"])), "parquet")
+        assert str(df["student_id"].dtype) == "Int64"
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test if the input is read and obfuscated once")
+    def test_one_read(self, test_csv_bytes):
+        calls = []
+
+        def fields_list(columns):
+            calls.append(columns)
+            return ["name"]
+
+        source = io.BytesIO(test_csv_bytes)
+        outputs = {"csv": [], "json": []}
+        run_fan_out_obfuscation(
+            source, "csv", fields_list,
+            {output_format: output_parts.extend
+             for output_format, output_parts in outputs.items()},
+            chunk_size=100, block_size=1000)
+        assert len(calls) == 1
+        assert source.tell() == len(test_csv_bytes)
+        assert len(read_output(io.BytesIO(b"".join(outputs["json"])),
+                               "json")) == 1000
+
+    @pytest.mark.it("Test if writers of the formats run concurrently")
+    def test_concurrent_writers(self, test_csv_bytes):
+        def slow_upload(parts):
+            for part in parts:
+                time.sleep(0.02)
+
+        write_outputs = {"csv": slow_upload, "json": slow_upload,
+                         "parquet": slow_upload}
+        one = run_fan_out_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"],
+            {"csv": slow_upload}, chunk_size=50, part_size=1000)
+        three = run_fan_out_obfuscation(
+            io.BytesIO(test_csv_bytes), "csv", ["name"], write_outputs,
+            chunk_size=50, part_size=1000)
+        assert three["total_seconds"] < 2 * one["total_seconds"]
+
+    @pytest.mark.it("Test if a writer error is raised without hanging")
+    def test_upload_error(self, test_csv_bytes):
+        def failing_upload(parts):
+            next(parts)
+            raise ConnectionError("upload failed")
+
+        with pytest.raises(ConnectionError, match="upload failed"):
+            run_fan_out_obfuscation(
+                io.BytesIO(test_csv_bytes * 20), "csv", ["name"],
+                {"csv": lambda parts: list(parts), "json": failing_upload},
+                chunk_size=100, block_size=1000, part_size=1000,
+                queue_size=1)
+
+    @pytest.mark.it("Test if at least one format is required")
+    def test_no_format(self, test_csv_bytes):
+        with pytest.raises(ValueError, match="At least one output format"):
+            run_fan_out_obfuscation(io.BytesIO(test_csv_bytes), "csv",
+                                    ["name"], {})
+
+
+class TestGetFanOutFileKeys:
+    @pytest.mark.it("Test if each format gets its extension")
+    def test_keys(self):
+        assert get_fan_out_file_keys("new_data/file.csv.gz",
+                                     ["parquet", "csv", "json"], "zstd") == {
+            "parquet": "processed_data/file.parquet",
+            "csv": "processed_data/file.csv.zst",
+            "json": "processed_data/file.json.zst"}
+        assert get_fan_out_file_keys("new_data/file.csv.gz", ["csv"]) == \
+            {"csv": "processed_data/file.csv.gz"}
+
+
+class TestHandleFileObfuscationPipelined:
+    @pytest.mark.it("Test if a pipelined job writes the output to s3")
+    def test_pipelined_s3(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name", "email_address"],
+        })
+        message = handle_file_obfuscation(json_str, pipelined=True,
+                                          output_compression="gzip")
+        assert message == ("Obfuscated file saved to s3://test_bucket/" +
+                           "processed_data/test_file.csv.gz")
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv.gz")["Body"].read()
+        df = pd.read_csv(io.BytesIO(body), compression="gzip")
+        assert df.shape == (1000, 4)
+        assert (df["email_address"] == "***").all()
+
+    @pytest.mark.it("Test if a pipelined job can auto detect PII")
+    def test_pipelined_auto_detect(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": [],
+        })
+        result = handle_file_obfuscation(
+            json_str, pipelined=True, if_save_to_s3=False,
+            auto_detect_pii=True)
+        df = pd.read_csv(result)
+        assert (df["name"] == "***").all()
+        assert (df["course"] == "Software").all()
+
+    @pytest.mark.it("Test if a pipelined job rejects JSON path fields")
+    def test_pipelined_json_paths(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.json",
+            "pii_fields": ["customer.name"],
+        })
+        with patch("src.main.run_pipelined_obfuscation") as mock_run:
+            with pytest.raises(Exception, match="JSON path"):
+                handle_file_obfuscation(json_str, pipelined=True)
+            mock_run.assert_not_called()
+
+    @pytest.mark.it("Test if csv columns with a dot are not JSON paths")
+    def test_pipelined_dotted_csv_column(self, s3_client):
+        s3_client.put_object(
+            Bucket="test_bucket", Key="new_data/contacts.csv",
+            Body=b"id,contact.email\n1,a@email.com\n2,b@email.com\n")
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/contacts.csv",
+            "pii_fields": ["contact.email"],
+        })
+        result = handle_file_obfuscation(json_str, pipelined=True,
+                                         if_save_to_s3=False)
+        df = pd.read_csv(result)
+        assert df["contact.email"].tolist() == ["***", "***"]
+
+    @pytest.mark.it("Test if a pipelined job uses the Parquet options")
+    def test_pipelined_parquet_options(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"],
+        })
+        result = handle_file_obfuscation(
+            json_str, pipelined=True, if_save_to_s3=False,
+            if_output_different_format=True, output_format="parquet",
+            parquet_compression="gzip", parquet_use_dictionary=False)
+        column = pq.ParquetFile(result).metadata.row_group(0).column(1)
+        assert column.compression == "GZIP"
+        assert not any("DICTIONARY" in encoding
+                       for encoding in column.encodings)
+
+
+class TestHandleFileObfuscationFanOut:
+    @pytest.mark.it("Test if every output format is saved to s3")
+    def test_fan_out_s3(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name", "email_address"],
+        })
+        message = handle_file_obfuscation(
+            json_str, output_formats=["parquet", "csv"])
+        assert message == (
+            "Obfuscated files saved to s3://test_bucket/processed_data/" +
+            "test_file.parquet, s3://test_bucket/processed_data/" +
+            "test_file.csv")
+        for output_format in ["parquet", "csv"]:
+            body = s3_client.get_object(
+                Bucket="test_bucket",
+                Key=f"processed_data/test_file.{output_format}")["Body"]
+            df = read_output(io.BytesIO(body.read()), output_format)
+            assert df.shape == (1000, 4)
+            assert (df["email_address"] == "***").all()
+
+    @pytest.mark.it("Test if the outputs are returned when not saved")
+    def test_fan_out_not_saved(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": [],
+        })
+        result = handle_file_obfuscation(
+            json_str, output_formats=["json", "csv"], if_save_to_s3=False,
+            auto_detect_pii=True)
+        assert list(result) == ["json", "csv"]
+        df = read_output(result["json"], "json")
+        assert (df["name"] == "***").all()
+        assert (df["course"] == "Software").all()
+
+    @pytest.mark.it("Test if the Parquet output uses the Parquet options")
+    def test_fan_out_parquet_options(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"],
+        })
+        result = handle_file_obfuscation(
+            json_str, output_formats=["parquet", "csv"],
+            if_save_to_s3=False, parquet_compression="gzip",
+            parquet_use_dictionary=False)
+        column = pq.ParquetFile(result["parquet"]).metadata.row_group(
+            0).column(1)
+        assert column.compression == "GZIP"
+        assert not any("DICTIONARY" in encoding
+                       for encoding in column.encodings)
+
+    @pytest.mark.it("Test if unsupported formats and options are refused")
+    def test_fan_out_errors(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"],
+        })
+        with pytest.raises(Exception, match="xml is not supported"):
+            handle_file_obfuscation(json_str, output_formats=["csv", "xml"])
+        with pytest.raises(Exception, match="not available"):
+            handle_file_obfuscation(json_str, output_formats=["csv"],
+                                    engine="arrow")
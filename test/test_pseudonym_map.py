@@ -0,0 +1,221 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.pseudonym_map import (
+    BloomFilter,
+    PseudonymMap,
+    pseudonymize_series,
+    set_pseudonym_map,
+    get_pseudonym_map,
+)
+from src.obfuscator import obfuscate_fields_in_df
+from src.json_paths import obfuscate_json_records
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def pseudonym_map():
+    pseudonym_map = PseudonymMap(":memory:", capacity=1000)
+    set_pseudonym_map(pseudonym_map)
+    yield pseudonym_map
+    set_pseudonym_map(None)
+    pseudonym_map.close()
+
+
+@pytest.fixture
+def customers():
+    return pd.DataFrame({
+        "customer_id": [1, 2, 3],
+        "customer_name": ["John Smith", "Steve Lee", "Amy Tan"],
+    })
+
+
+@pytest.fixture
+def orders():
+    return [
+        {"order_id": 10, "customer_name": "Amy Tan", "amount": 5},
+        {"order_id": 11, "customer_name": "John Smith", "amount": 7},
+        {"order_id": 12, "customer_name": "Amy Tan", "amount": 9},
+    ]
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, customers, orders):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/customers.csv",
+                             Body=customers.to_csv(index=False).encode())
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/orders.json",
+                             Body=json.dumps(orders).encode())
+        yield s3_client
+
+
+def digests(values):
+    return [bytes(16 - len(value)) + value.encode() for value in values]
+
+
+class TestBloomFilter:
+    @pytest.mark.it("Test if added values are always found")
+    def test_no_false_negatives(self):
+        num_bits, num_hashes = BloomFilter.size_for(1000, 0.01)
+        bloom = BloomFilter(None, num_bits, num_hashes)
+        added = [os.urandom(16) for _ in range(1000)]
+        bloom.add(added)
+        assert bloom.might_contain(added).all()
+        others = [os.urandom(16) for _ in range(10000)]
+        assert bloom.might_contain(others).mean() < 0.03
+        assert not bloom.might_contain([]).any()
+
+    @pytest.mark.it("Test if the bits are kept in a file")
+    def test_file(self, tmp_path):
+        path = str(tmp_path / "map.bloom")
+        bloom = BloomFilter(path, 8000, 5)
+        bloom.add(digests(["a", "b"]))
+        bloom.flush()
+        assert os.path.getsize(path) == 1000
+        reopened = BloomFilter(path, 8000, 5)
+        assert reopened.might_contain(digests(["a", "b"])).all()
+        assert not reopened.might_contain(digests(["c"])).any()
+
+
+class TestPseudonymMap:
+    @pytest.mark.it("Test if a value keeps its pseudonym")
+    def test_pseudonymize(self, pseudonym_map):
+        pseudonyms = pseudonym_map.pseudonymize(["a", "b", "a"])
+        assert pseudonyms[0] == pseudonyms[2] != pseudonyms[1]
+        assert all(p.startswith("psn_") for p in pseudonyms)
+        assert pseudonym_map.pseudonymize(["b", "c"])[0] == pseudonyms[1]
+        assert pseudonym_map.pseudonymize_value("a") == pseudonyms[0]
+        assert len(pseudonym_map) == 3
+
+    @pytest.mark.it("Test if values never seen skip the lookup")
+    def test_bloom_skipped(self, pseudonym_map):
+        pseudonym_map.pseudonymize(["a", "b"])
+        with patch.object(pseudonym_map, "_select",
+                          wraps=pseudonym_map._select) as select:
+            pseudonym_map.pseudonymize(["a", "c", "d"])
+        assert select.call_args_list[0].args[0] == \
+            [pseudonym_map._lookup("a")]
+        # Every new value was inserted, so nothing is read back
+        assert select.call_count == 1
+        assert pseudonym_map.stats == {"values": 5, "bloom_skipped": 4,
+                                       "inserted": 4}
+
+    @pytest.mark.it("Test if large lists are looked up in batches")
+    def test_batches(self, pseudonym_map):
+        values = [str(i) for i in range(25)]
+        first = pseudonym_map.pseudonymize(values)
+        with patch("src.pseudonym_map.QUERY_BATCH", 10):
+            assert pseudonym_map.pseudonymize(values) == first
+        assert len(set(first)) == 25
+
+    @pytest.mark.it("Test if a reopened map keeps its pseudonyms")
+    def test_persistent(self, tmp_path):
+        path = str(tmp_path / "map.db")
+        pseudonym_map = PseudonymMap(path, capacity=1000)
+        pseudonyms = pseudonym_map.pseudonymize(["a", "b"])
+        pseudonym_map.close()
+        assert os.path.exists(path + ".bloom")
+        # The first job's salt and filter size are kept
+        reopened = PseudonymMap(path, capacity=10)
+        assert reopened.bloom.num_bits == pseudonym_map.bloom.num_bits
+        assert reopened.pseudonymize(["b", "a"]) == pseudonyms[::-1]
+        assert reopened.stats["bloom_skipped"] == 0
+
+    @pytest.mark.it("Test if maps sharing a file agree on new values")
+    def test_shared(self, tmp_path):
+        path = str(tmp_path / "map.db")
+        first, second = PseudonymMap(path), PseudonymMap(path)
+        pseudonym = first.pseudonymize(["a"])[0]
+        # The second map's filter has not seen 'a' in memory, the
+        # insert is ignored and the stored pseudonym is read back
+        second.bloom = BloomFilter(None, 64, 1)
+        assert second.pseudonymize(["a", "b"])[0] == pseudonym
+        assert second.stats["inserted"] == 1
+
+
+class TestPseudonymizeSeries:
+    @pytest.mark.it("Test if missing values are kept")
+    def test_nulls(self, pseudonym_map):
+        series = pd.Series(["a", np.nan, "a", None], index=[3, 4, 5, 6])
+        pseudonymized = pseudonymize_series(series)
+        assert pseudonymized[3] == pseudonymized[5]
+        assert np.isnan(pseudonymized[4])
+        assert pseudonymized[6] is None
+        assert list(pseudonymized.index) == [3, 4, 5, 6]
+
+    @pytest.mark.it("Test if the map of OBFUSCATOR_PSEUDONYM_MAP is used")
+    def test_default_map(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "env_map.db")
+        monkeypatch.setenv("OBFUSCATOR_PSEUDONYM_MAP", path)
+        set_pseudonym_map(None)
+        try:
+            pseudonym_map = get_pseudonym_map()
+            assert pseudonym_map.path == path
+            # Jobs naming the map in use keep it open
+            set_pseudonym_map(path)
+            assert get_pseudonym_map() is pseudonym_map
+        finally:
+            get_pseudonym_map().close()
+            set_pseudonym_map(None)
+
+
+class TestPseudonymizeMethod:
+    @pytest.mark.it("Test if DataFrame and JSON paths share pseudonyms")
+    def test_paths(self, pseudonym_map, customers, orders):
+        df = obfuscate_fields_in_df(customers.copy(), ["customer_name"],
+                                    {"customer_name": "pseudonymize"})
+        records = [json.loads(line) for line in obfuscate_json_records(
+            json.dumps(orders), ["customer_name"], "pseudonymize")]
+        names = dict(zip(customers["customer_name"], df["customer_name"]))
+        assert [r["customer_name"] for r in records] == \
+            [names[order["customer_name"]] for order in orders]
+
+
+class TestHandleFileObfuscationPseudonyms:
+    @pytest.mark.it("Test if files of a batch can be joined on pseudonyms")
+    def test_join(self, s3_client, tmp_path, customers, orders):
+        path = str(tmp_path / "batch_map.db")
+        for file_key in ["new_data/customers.csv", "new_data/orders.json"]:
+            handle_file_obfuscation(
+                json.dumps({
+                    "file_to_obfuscate": f"s3://test_bucket/{file_key}",
+                    "pii_fields": []}),
+                pseudonymize_fields=["customer_name"],
+                pseudonym_map=path, chunk_size=2)
+        customers_out = pd.read_csv(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/customers.csv")["Body"].read()))
+        orders_out = pd.read_json(io.BytesIO(s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/orders.json")["Body"].read()), lines=True)
+        assert not customers_out["customer_name"].isin(
+            customers["customer_name"]).any()
+        joined = orders_out.merge(customers_out, on="customer_name")
+        assert sorted(zip(joined["order_id"], joined["customer_id"])) == \
+            [(10, 3), (11, 1), (12, 3)]
@@ -0,0 +1,260 @@
+import pytest
+import boto3
+from moto import mock_aws
+from botocore.exceptions import ClientError
+from unittest.mock import patch
+import io
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.pushdown import (
+    build_select_expression,
+    filter_df,
+    parse_row_filter,
+    read_projected_file,
+    validate_row_filter,
+)
+from src.storage import LocalBackend
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": range(1000),
+        "name": [f"Name {i}" for i in range(1000)],
+        "email_address": [f"n{i}@email.com" for i in range(1000)],
+        "course": [["Software", "DE"][i % 2] for i in range(1000)],
+        "notes": ["x" * 50] * 1000,
+    })
+
+
+@pytest.fixture
+def large_df():
+    return pd.DataFrame({
+        "student_id": range(20000),
+        "name": [f"Name {i}" for i in range(20000)],
+        "course": [["Software", "DE"][i % 2] for i in range(20000)],
+        "notes": [f"Note number {i} about the student" for i in range(20000)],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df, large_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        parquet = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(large_df, preserve_index=False),
+                       parquet, row_group_size=1000)
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.parquet",
+                             Body=parquet.getvalue())
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+def select_response(*payloads, scanned=100, returned=10):
+    events = [{"Records": {"Payload": payload}} for payload in payloads]
+    events.append({"Stats": {"Details": {"BytesScanned": scanned,
+                                         "BytesProcessed": scanned,
+                                         "BytesReturned": returned}}})
+    events.append({"End": {}})
+    return {"Payload": iter(events)}
+
+
+class TestRowFilter:
+    @pytest.mark.it("Test if invalid predicates raise ValueError")
+    def test_validate(self):
+        assert validate_row_filter([["a", "==", 1]]) == [("a", "=", 1)]
+        assert validate_row_filter(None) == []
+        with pytest.raises(ValueError):
+            validate_row_filter([["a", "like", "x"]])
+        with pytest.raises(ValueError):
+            validate_row_filter([["a", "in", "x"]])
+
+    @pytest.mark.it("Test if a row filter is parsed from JSON")
+    def test_parse(self):
+        assert parse_row_filter('[["course", "in", ["DE"]]]') == \
+            [("course", "in", ["DE"])]
+        assert parse_row_filter(None) is None
+
+    @pytest.mark.it("Test if the local evaluator keeps matching rows only")
+    def test_filter_df(self, test_df):
+        df = filter_df(test_df, [("course", "=", "DE"),
+                                 ("student_id", ">=", 990)])
+        assert list(df["student_id"]) == [991, 993, 995, 997, 999]
+        df = filter_df(test_df, [("student_id", "not in", [0, 1])])
+        assert len(df) == 998
+        with pytest.raises(KeyError):
+            filter_df(test_df, [("cohort", "=", "x")])
+
+    @pytest.mark.it("Test if values compare as S3 Select compares csv")
+    def test_filter_df_select_semantics(self):
+        df = pd.DataFrame({"id": [5, 50, 6], "code": ["10", "9", None]})
+        assert list(filter_df(df, [("id", "=", "5")])["id"]) == [5]
+        assert list(filter_df(df, [("id", "<", "6")])["id"]) == [5, 50]
+        assert list(filter_df(df, [("code", ">", 9)])["id"]) == [5]
+        assert list(filter_df(df, [("code", "=", "")])["id"]) == [6]
+        assert list(filter_df(df, [("code", "in", [9, 10])])["id"]) == \
+            [5, 50]
+
+
+class TestBuildSelectExpression:
+    @pytest.mark.it("Test the SQL of a csv projection and filter")
+    def test_csv(self):
+        expression = build_select_expression(
+            ["student_id", "name"],
+            [("course", "in", ["DE", "O'Neil"]), ("student_id", "<", 10)],
+            "csv")
+        assert expression == (
+            'SELECT s."student_id", s."name" FROM S3Object s WHERE '
+            "s.\"course\" IN ('DE', 'O''Neil') AND "
+            'CAST(s."student_id" AS FLOAT) < 10')
+
+    @pytest.mark.it("Test the SQL of a json query without projection")
+    def test_json(self):
+        assert build_select_expression(None, [("id", "=", 1)], "json") == \
+            'SELECT * FROM S3Object[*] s WHERE s."id" = 1'
+
+
+class TestReadProjectedFile:
+    @pytest.mark.it("Test if parquet reads only the needed bytes")
+    def test_parquet_pushdown(self, s3_client):
+        content, file_type, stats = read_projected_file(
+            "test_bucket", "new_data/test_file.parquet",
+            columns=["student_id", "name"],
+            row_filter=[("student_id", "<", 150)])
+        assert file_type == "parquet"
+        assert stats["method"] == "parquet_pushdown"
+        assert stats["bytes_read"] < stats["object_size"] / 4
+        df = pq.read_table(content).to_pandas()
+        assert list(df.columns) == ["student_id", "name"]
+        assert list(df["student_id"]) == list(range(150))
+
+    @pytest.mark.it("Test if csv is queried with S3 Select")
+    def test_csv_select(self, s3_client):
+        with patch.object(s3_client, "select_object_content",
+                          return_value=select_response(b"1,Name 1\r\n",
+                                                       b"3,Name 3\r\n")) \
+                as mock_select, \
+                patch("src.pushdown.get_s3_client", return_value=s3_client):
+            content, file_type, stats = read_projected_file(
+                "test_bucket", "new_data/test_file.csv",
+                columns=["student_id", "name"],
+                row_filter=[("course", "=", "DE")])
+        kwargs = mock_select.call_args.kwargs
+        assert kwargs["InputSerialization"] == {
+            "CSV": {"FileHeaderInfo": "USE"}, "CompressionType": "NONE"}
+        assert kwargs["Expression"].startswith('SELECT s."student_id"')
+        assert content.read() == b"student_id,name\n1,Name 1\r\n3,Name 3\r\n"
+        assert stats["method"] == "s3_select"
+        assert stats["bytes_returned"] == 10
+
+    @pytest.mark.it("Test if json S3 Select records become a JSON array")
+    def test_json_select(self, s3_client):
+        s3_client.put_object(Bucket="test_bucket", Key="new_data/f.json",
+                             Body=b'[{"id": 1}, {"id": 2}]')
+        with patch.object(s3_client, "select_object_content",
+                          return_value=select_response(b'{"id":2}\n')), \
+                patch("src.pushdown.get_s3_client", return_value=s3_client):
+            content, file_type, _ = read_projected_file(
+                "test_bucket", "new_data/f.json", row_filter=[("id", ">", 1)])
+        assert json.loads(content.read()) == [{"id": 2}]
+
+    @pytest.mark.it("Test if csv is projected locally without S3 Select")
+    def test_local_fallback(self, s3_client, test_df):
+        error = ClientError({"Error": {"Code": "MethodNotAllowed"}},
+                            "SelectObjectContent")
+        with patch.object(s3_client, "select_object_content",
+                          side_effect=error), \
+                patch("src.pushdown.get_s3_client", return_value=s3_client):
+            content, file_type, stats = read_projected_file(
+                "test_bucket", "new_data/test_file.csv",
+                columns=["student_id", "name"],
+                row_filter=[("course", "=", "DE"), ("student_id", "<", 10)])
+        assert stats["method"] == "local"
+        df = pd.read_csv(content)
+        assert list(df.columns) == ["student_id", "name"]
+        assert list(df["student_id"]) == [1, 3, 5, 7, 9]
+
+    @pytest.mark.it("Test if local json and parquet files are projected")
+    def test_local_backend(self, tmp_path, test_df):
+        (tmp_path / "bucket").mkdir()
+        (tmp_path / "bucket" / "f.json").write_text(
+            test_df.to_json(orient="records"))
+        pq.write_table(pa.Table.from_pandas(test_df, preserve_index=False),
+                       str(tmp_path / "bucket" / "f.parquet"),
+                       row_group_size=100)
+        backend = LocalBackend(str(tmp_path))
+        row_filter = [("student_id", "in", [5, 500])]
+        content, _, _ = read_projected_file(
+            "bucket", "f.json", ["student_id", "course"], row_filter,
+            backend)
+        assert json.loads(content.read()) == [
+            {"student_id": 5, "course": "DE"},
+            {"student_id": 500, "course": "Software"}]
+        content, _, _ = read_projected_file(
+            "bucket", "f.parquet", ["student_id"], row_filter, backend)
+        assert pq.read_table(content).column("student_id").to_pylist() == \
+            [5, 500]
+
+
+class TestHandleFileObfuscationPushdown:
+    @pytest.mark.it("Test if only the projected rows and columns are saved")
+    def test_handle_file_obfuscation(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/" +
+                                 "test_file.parquet",
+            "pii_fields": ["name", "email_address"]})
+        message = handle_file_obfuscation(
+            json_str, if_output_different_format=True, output_format="csv",
+            columns=["student_id", "name", "course"],
+            row_filter=[("course", "=", "DE"), ("student_id", "<", 10)])
+        assert message == ("Obfuscated file saved to s3://test_bucket/" +
+                           "processed_data/test_file.parquet")
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.parquet")["Body"].read()
+        df = pd.read_csv(io.BytesIO(body))
+        assert list(df.columns) == ["student_id", "name", "course"]
+        assert list(df["student_id"]) == [1, 3, 5, 7, 9]
+        assert (df["name"] == "***").all()
+
+    @pytest.mark.it("Test ValueError for a projection in other modes")
+    @pytest.mark.parametrize("options", [
+        {"pipelined": True},
+        {"checkpoint": "checkpoints"},
+        {"partition_rows": 100},
+    ])
+    def test_unsupported_modes(self, s3_client, options):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        for projection in [{"columns": ["student_id", "name"]},
+                           {"row_filter": [("course", "=", "DE")]}]:
+            with pytest.raises(Exception, match="row_filter are not"):
+                handle_file_obfuscation(json_str, **options, **projection)
+        assert "Contents" not in s3_client.list_objects_v2(
+            Bucket="test_bucket", Prefix="processed_data")
+        assert not os.path.exists("checkpoints")
@@ -0,0 +1,180 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.redaction import Redactor, redact_series
+from src.obfuscator import obfuscate_fields_in_df, obfuscate_file
+from src.csv_passthrough import rewrite_csv_pii_fields
+from src.json_paths import obfuscate_json_records
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def feedback():
+    return [
+        "Email me at jane.doe@example.co.uk please",
+        "Call +44 7700 900123 or 020 7946 0958 after 5pm",
+        "Card 4111 1111 1111 1111 was charged twice",
+        "Mrs Jones from SW1A 1AA, NI AB 12 34 56 C",
+        "Logged in from 192.168.0.12",
+        "Order 12345678 arrived on time",
+    ]
+
+
+@pytest.fixture
+def test_df(feedback):
+    return pd.DataFrame({
+        "student_id": range(len(feedback)),
+        "name": [f"Name {i}" for i in range(len(feedback))],
+        "customer_feedback": feedback,
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+EXPECTED = [
+    "Email me at [EMAIL] please",
+    "Call [PHONE] or [PHONE] after 5pm",
+    "Card [CARD] was charged twice",
+    "[NAME] from [POSTCODE], NI [NI_NUMBER]",
+    "Logged in from [IP_ADDRESS]",
+    "Order 12345678 arrived on time",
+]
+
+
+class TestRedactor:
+    @pytest.mark.it("Test if only the PII spans of a text are replaced")
+    def test_redact(self, feedback):
+        redactor = Redactor()
+        assert [redactor.redact(text) for text in feedback] == EXPECTED
+
+    @pytest.mark.it("Test if Arrow arrays match the per value redaction")
+    def test_redact_array(self, feedback):
+        redacted = Redactor().redact_array(pa.array(feedback + [None]))
+        assert redacted.to_pylist() == EXPECTED + [None]
+
+    @pytest.mark.it("Test if only the chosen entity types are redacted")
+    def test_entities(self):
+        redactor = Redactor(entities=["EMAIL"])
+        text = "a@b.com or 07700 900123"
+        assert redactor.redact(text) == "[EMAIL] or 07700 900123"
+        assert redactor.redact_array(pa.array([text])).to_pylist() == \
+            ["[EMAIL] or 07700 900123"]
+        with pytest.raises(ValueError):
+            Redactor(entities=["SHOE_SIZE"])
+
+    @pytest.mark.it("Test if extra terms are matched as whole words")
+    def test_terms(self):
+        redactor = Redactor(entities=[], terms=["Janet", "Janet Lee"])
+        text = "janet lee and Janet, not Janetta"
+        expected = "[TERM] and [TERM], not Janetta"
+        assert redactor.redact(text) == expected
+        assert redactor.redact_array(pa.array([text])).to_pylist() == \
+            [expected]
+
+    @pytest.mark.it("Test if a replacement text is used for every match")
+    def test_replacement(self):
+        redactor = Redactor(replacement="\\1***")
+        text = "a@b.com or 07700 900123"
+        assert redactor.redact(text) == "\\1*** or \\1***"
+        assert redactor.redact_array(pa.array([text])).to_pylist() == \
+            ["\\1*** or \\1***"]
+
+
+class TestRedactSeries:
+    @pytest.mark.it("Test if non-string cells are left unchanged")
+    def test_non_strings(self):
+        series = pd.Series(["a@b.com", np.nan, 5, None], index=[3, 4, 5, 6],
+                           name="notes")
+        redacted = redact_series(series)
+        assert redacted.tolist()[0] == "[EMAIL]"
+        assert np.isnan(redacted[4])
+        assert redacted.tolist()[2:] == [5, None]
+        assert list(redacted.index) == [3, 4, 5, 6]
+        assert redacted.name == "notes"
+
+    @pytest.mark.it("Test if slices redacted in threads keep their order")
+    def test_threads(self, feedback):
+        series = pd.Series(feedback * 50)
+        with patch("src.redaction.SLICE_CELLS", 7):
+            redacted = redact_series(series, max_workers=4)
+        assert redacted.tolist() == EXPECTED * 50
+
+
+class TestRedactMethod:
+    @pytest.mark.it("Test if 'redact' can be chosen for some fields only")
+    def test_obfuscate_fields_in_df(self, test_df):
+        df = obfuscate_fields_in_df(
+            test_df, ["name", "customer_feedback"],
+            {"customer_feedback": "redact"})
+        assert (df["name"] == "***").all()
+        assert df["customer_feedback"].tolist() == EXPECTED
+
+    @pytest.mark.it("Test if csv passthrough and json redact per value")
+    def test_other_paths(self, test_df):
+        csv_output = rewrite_csv_pii_fields(
+            test_df.to_csv(index=False), ["customer_feedback"], "redact")
+        assert pd.read_csv(csv_output)["customer_feedback"].tolist() == \
+            EXPECTED
+        json_output = obfuscate_json_records(
+            test_df.to_json(orient="records"), ["customer_feedback"],
+            "redact")
+        records = [json.loads(line) for line in json_output]
+        assert [r["customer_feedback"] for r in records] == EXPECTED
+
+    @pytest.mark.it("Test if obfuscate_file redacts parquet output")
+    def test_obfuscate_file(self, test_df):
+        output = obfuscate_file(test_df.to_csv(index=False),
+                                ["customer_feedback"], "csv", "parquet",
+                                obfuscate_method="redact")
+        df = pd.read_parquet(output)
+        assert df["customer_feedback"].tolist() == EXPECTED
+        assert df["name"].tolist() == list(test_df["name"])
+
+
+class TestHandleFileObfuscationRedaction:
+    @pytest.mark.it("Test if redact_fields are redacted, PII fields replaced")
+    def test_handle_file_obfuscation(self, s3_client):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(json_str,
+                                redact_fields=["customer_feedback"])
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()
+        df = pd.read_csv(io.BytesIO(body))
+        assert (df["name"] == "***").all()
+        assert df["customer_feedback"].tolist() == EXPECTED
+        assert list(df["student_id"]) == list(range(6))
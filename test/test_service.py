@@ -0,0 +1,265 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import socket
+import threading
+import time
+import urllib.request
+import urllib.error
+import pandas as pd
+from unittest.mock import patch
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.service import (
+    LocalJobQueue,
+    SQSJobQueue,
+    ObfuscationService,
+    make_server,
+)
+from src.tokenization import generate_vault_key
+from src.utils import get_s3_client, enable_s3_client_cache
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        for i in range(4):
+            s3_client.put_object(
+                Bucket="test_bucket", Key=f"new_data/file_{i}.csv",
+                Body=b"student_id,name,course\n"
+                     b"1234,John Smith,Software\n")
+        yield s3_client
+
+
+@pytest.fixture()
+def service(s3_client):
+    service = ObfuscationService(max_workers=2)
+    yield service
+    service.shutdown()
+
+
+def make_job(i, **options):
+    return {"job_id": f"job_{i}",
+            "file_to_obfuscate": f"s3://test_bucket/new_data/file_{i}.csv",
+            "pii_fields": ["name"],
+            "options": options}
+
+
+class TestS3ClientCache:
+    @pytest.mark.it("Test if the s3 client is only cached when enabled")
+    def test_client_cache(self, aws_credentials):
+        assert get_s3_client() is not get_s3_client()
+        enable_s3_client_cache()
+        try:
+            assert get_s3_client() is get_s3_client()
+        finally:
+            enable_s3_client_cache(False)
+        assert get_s3_client() is not get_s3_client()
+
+    @pytest.mark.it("Test if threads share one cached s3 client")
+    def test_client_cache_threads(self, aws_credentials):
+        def slow_client(*args):
+            time.sleep(0.05)
+            return object()
+
+        clients = []
+        enable_s3_client_cache()
+        try:
+            with patch("src.utils.boto3.client", side_effect=slow_client):
+                threads = [threading.Thread(
+                               target=lambda: clients.append(get_s3_client()))
+                           for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            enable_s3_client_cache(False)
+        assert len(clients) == 4
+        assert all(client is clients[0] for client in clients)
+
+
+class TestLocalJobQueue:
+    @pytest.mark.it("Test if messages stay in flight until deleted")
+    def test_receive_delete(self):
+        job_queue = LocalJobQueue()
+        job_queue.send_message("a")
+        job_queue.send_message("b")
+        messages = job_queue.receive_messages(max_messages=5)
+        assert [body for _, body in messages] == ["a", "b"]
+        assert len(job_queue.in_flight) == 2
+        job_queue.delete_message(messages[0][0])
+        assert list(job_queue.in_flight.values()) == ["b"]
+        assert job_queue.receive_messages(wait_seconds=0.01) == []
+
+    @pytest.mark.it("Test if a message not deleted is received again")
+    def test_visibility_timeout(self):
+        job_queue = LocalJobQueue(visibility_timeout=0.05)
+        job_queue.send_message("a")
+        [(receipt, _)] = job_queue.receive_messages()
+        assert job_queue.receive_messages() == []
+        assert job_queue.receive_messages(wait_seconds=1) == [(receipt, "a")]
+        job_queue.delete_message(receipt)
+        time.sleep(0.1)
+        assert job_queue.receive_messages() == []
+        assert job_queue.in_flight == {}
+
+
+class TestObfuscationService:
+    @pytest.mark.it("Test if a job is run and its latency reported")
+    def test_run_job(self, service, s3_client):
+        report = service.run_job(make_job(0))
+        assert report["status"] == "succeeded"
+        assert report["job_id"] == "job_0"
+        assert report["result"] == ("Obfuscated file saved to s3://" +
+                                    "test_bucket/processed_data/file_0.csv")
+        assert report["latency_ms"] > 0
+        body = s3_client.get_object(Bucket="test_bucket",
+                                    Key="processed_data/file_0.csv")
+        assert b"John Smith" not in body["Body"].read()
+        assert service.stats()["jobs"] == 1
+
+    @pytest.mark.it("Test if job options override the default options")
+    def test_job_options(self, service):
+        report = service.run_job(make_job(1, if_save_to_s3=False,
+                                          output_format="json",
+                                          if_output_different_format=True))
+        df = pd.read_json(report["output"], lines=True)
+        assert df["name"].tolist() == ["***"]
+        assert report["output_bytes"] > 0
+
+    @pytest.mark.it("Test if jobs share one vault per path")
+    def test_shared_vault(self, service, tmp_path, monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_VAULT_KEY", generate_vault_key())
+        path = str(tmp_path / "vault.db")
+        futures = [service.submit(make_job(
+            i, tokenize_fields=["course"], token_vault=path,
+            if_save_to_s3=False)) for i in range(4)]
+        reports = [future.result() for future in futures]
+        assert all(report["status"] == "succeeded" for report in reports)
+        assert list(service._vaults) == [path]
+        outputs = {pd.read_csv(report["output"])["course"][0]
+                   for report in reports}
+        assert len(outputs) == 1
+        assert len(service._vaults[path]) == 1
+
+    @pytest.mark.it("Test if a failed job is reported, not raised")
+    def test_failed_job(self, service):
+        report = service.run_job({"file_to_obfuscate":
+                                  "s3://test_bucket/new_data/missing.csv",
+                                  "pii_fields": ["name"]})
+        assert report["status"] == "failed"
+        assert "error" in report
+        assert service.stats()["failed_jobs"] == 1
+
+    @pytest.mark.it("Test if jobs are consumed from a local queue")
+    def test_consume_local_queue(self, service):
+        job_queue = LocalJobQueue()
+        for i in range(4):
+            job_queue.send_message(json.dumps(make_job(i)))
+        job_queue.send_message(json.dumps(
+            {"file_to_obfuscate": "s3://test_bucket/new_data/missing.csv",
+             "pii_fields": ["name"]}))
+        reports = service.consume(job_queue, wait_seconds=0)
+        assert len(reports) == 5
+        assert sorted(r["status"] for r in reports).count("succeeded") == 4
+        assert len(job_queue.in_flight) == 1
+        stats = service.stats()
+        assert stats["jobs"] == 5
+        assert stats["p95_latency_ms"] >= stats["p50_latency_ms"]
+
+    @pytest.mark.it("Test if a failed job is retried from a local queue")
+    def test_consume_retry(self, service):
+        job_queue = LocalJobQueue(visibility_timeout=0.05)
+        job_queue.send_message(json.dumps(
+            {"file_to_obfuscate": "s3://test_bucket/new_data/missing.csv",
+             "pii_fields": ["name"]}))
+        reports = service.consume(job_queue, max_jobs=2, wait_seconds=1)
+        assert [r["status"] for r in reports] == ["failed", "failed"]
+        assert len(job_queue.in_flight) == 1
+
+    @pytest.mark.it("Test if jobs are consumed from SQS")
+    def test_consume_sqs(self, service, s3_client):
+        queue_url = boto3.client("sqs").create_queue(
+            QueueName="jobs")["QueueUrl"]
+        job_queue = SQSJobQueue(queue_url)
+        for i in range(2):
+            job_queue.send_message(json.dumps(make_job(i)))
+        reports = service.consume(job_queue, max_jobs=2, wait_seconds=0)
+        assert [r["status"] for r in reports] == ["succeeded"] * 2
+        assert job_queue.receive_messages(wait_seconds=0) == []
+
+
+class TestHttpEndpoint:
+    @pytest.fixture()
+    def server(self, service):
+        server = make_server(service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+
+    @pytest.mark.it("Test if a job posted over HTTP is run")
+    def test_post_job(self, server):
+        request = urllib.request.Request(
+            f"{server}/jobs", data=json.dumps(make_job(2)).encode("utf8"),
+            method="POST")
+        with urllib.request.urlopen(request) as response:
+            report = json.loads(response.read())
+        assert report["status"] == "succeeded"
+        with urllib.request.urlopen(f"{server}/health") as response:
+            assert json.loads(response.read())["jobs"] == 1
+
+    @pytest.mark.it("Test if a failed job returns a 500 status")
+    def test_post_failed_job(self, server):
+        request = urllib.request.Request(
+            f"{server}/jobs", data=b'{"file_to_obfuscate": "s3://x/y.csv"}',
+            method="POST")
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 500
+        assert json.loads(e.value.read())["status"] == "failed"
+
+    @pytest.mark.it("Test if a job can be posted to a unix socket")
+    def test_unix_socket(self, service, tmp_path):
+        socket_path = str(tmp_path / "service.sock")
+        server = make_server(service, socket_path=socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            body = json.dumps(make_job(3)).encode("utf8")
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(socket_path)
+                client.sendall(b"POST /jobs HTTP/1.0\r\n" +
+                               f"Content-Length: {len(body)}\r\n\r\n"
+                               .encode("utf8") + body)
+                response = io.BytesIO()
+                while chunk := client.recv(4096):
+                    response.write(chunk)
+            status_line, _, payload = response.getvalue().partition(
+                b"\r\n\r\n")
+            assert b" 200 " in status_line.split(b"\r\n")[0]
+            assert json.loads(payload)["job_id"] == "job_3"
+        finally:
+            server.shutdown()
+            server.server_close()
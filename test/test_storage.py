@@ -0,0 +1,156 @@
+import pytest
+import os
+import io
+import json
+import pandas as pd
+import pyarrow.parquet as pq
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.storage import (
+    get_storage_backend,
+    LocalBackend,
+    MemoryBackend,
+    S3Backend,
+)
+from src.main import handle_file_obfuscation
+
+
+@pytest.fixture
+def test_csv_bytes():
+    return (
+        b"student_id,name,course,graduation_date,email_address\n"
+        b"1234,John Smith,Software,2024-03-31,j.smith@email.com\n"
+        b"5678,Steve Lee,DE,2024-06-31,sl123@email.com\n"
+    )
+
+
+@pytest.fixture
+def local_root(tmp_path, test_csv_bytes):
+    input_dir = tmp_path / "bucket" / "new_data"
+    input_dir.mkdir(parents=True)
+    (input_dir / "test_file.csv").write_bytes(test_csv_bytes)
+    df = pd.read_csv(io.BytesIO(test_csv_bytes))
+    df.to_parquet(input_dir / "test_file.parquet", index=False)
+    (input_dir / "test_file.json").write_text(
+        df.to_json(orient="records"))
+    return tmp_path
+
+
+class TestGetStorageBackend:
+    @pytest.mark.it("Test if the correct backend is returned")
+    def test_correct_backend(self, tmp_path):
+        assert isinstance(get_storage_backend("s3"), S3Backend)
+        assert isinstance(get_storage_backend("memory"), MemoryBackend)
+        backend = get_storage_backend("local", root=str(tmp_path))
+        assert isinstance(backend, LocalBackend)
+        assert backend.root == str(tmp_path)
+
+    @pytest.mark.it("Test ValueError for an unknown backend")
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError, match="Unknown storage backend"):
+            get_storage_backend("ftp")
+
+
+class TestLocalBackend:
+    @pytest.mark.it("Test if a local file is read as a binary stream")
+    def test_read_file(self, local_root, test_csv_bytes):
+        backend = LocalBackend(str(local_root))
+        content, file_extension = backend.read_file(
+            "bucket", "new_data/test_file.csv")
+        assert file_extension == "csv"
+        assert not isinstance(content, str)
+        assert content.read() == test_csv_bytes
+
+    @pytest.mark.it("Test if an empty bucket reads an absolute path")
+    def test_absolute_path(self, local_root, tmp_path_factory,
+                           test_csv_bytes):
+        backend = LocalBackend(str(tmp_path_factory.mktemp("other_root")))
+        input_path = local_root / "bucket" / "new_data" / "test_file.csv"
+        bucket, file_key = f"file://{input_path}".split(
+            "://", 1)[-1].split("/", 1)
+        content, _ = backend.read_file(bucket, file_key)
+        assert content.read() == test_csv_bytes
+        assert backend.head(bucket, file_key)["size"] == len(test_csv_bytes)
+        backend.write_file(bucket, os.path.join(
+            os.path.dirname(file_key), "copy_file.csv"), b"a\n")
+        assert (local_root / "bucket" / "new_data" /
+                "copy_file.csv").read_text() == "a\n"
+        assert not any(os.scandir(backend.root))
+
+    @pytest.mark.it("Test if a written file can be read back compressed")
+    def test_write_compressed(self, tmp_path, test_csv_bytes):
+        backend = LocalBackend(str(tmp_path))
+        message = backend.write_file("bucket", "out/file.csv.gz",
+                                     io.BytesIO(test_csv_bytes))
+        assert "out/file.csv.gz has been successfully written" in message
+        assert (tmp_path / "bucket" / "out" / "file.csv.gz").exists()
+        content, file_extension = backend.read_file("bucket",
+                                                    "out/file.csv.gz")
+        assert file_extension == "csv"
+        assert content.read() == test_csv_bytes
+
+    @pytest.mark.it("Test ValueError for an unsupported file type")
+    def test_unsupported_file_type(self, tmp_path):
+        backend = LocalBackend(str(tmp_path))
+        with pytest.raises(ValueError, match="Unsupported file type: xlsx"):
+            backend.write_file("bucket", "file.xlsx", b"data")
+
+
+class TestMemoryBackend:
+    @pytest.mark.it("Test if written content is stored and read back")
+    def test_round_trip(self, test_csv_bytes):
+        backend = MemoryBackend()
+        backend.write_file("bucket", "file.csv", memoryview(test_csv_bytes))
+        assert backend.objects[("bucket", "file.csv")] == test_csv_bytes
+        content, _ = backend.read_file("bucket", "file.csv")
+        assert content.read() == test_csv_bytes
+
+    @pytest.mark.it("Test FileNotFoundError for a missing file")
+    def test_missing_file(self):
+        with pytest.raises(FileNotFoundError):
+            MemoryBackend().read_file("bucket", "file.csv")
+
+
+class TestHandleFileObfuscationLocal:
+    @pytest.mark.it("Test if a local file is obfuscated without S3")
+    @pytest.mark.parametrize("file_key", ["new_data/test_file.csv",
+                                          "new_data/test_file.json",
+                                          "new_data/test_file.parquet"])
+    def test_local_pipeline(self, local_root, file_key):
+        json_str = json.dumps({
+            "file_to_obfuscate": f"file://bucket/{file_key}",
+            "pii_fields": ["name", "email_address"],
+        })
+        message = handle_file_obfuscation(
+            json_str, storage_backend=LocalBackend(str(local_root)))
+        output_key = file_key.replace("new_data", "processed_data")
+        assert message == \
+            f"Obfuscated file saved to local://bucket/{output_key}"
+        output_path = local_root / "bucket" / output_key
+        if file_key.endswith("parquet"):
+            df = pq.read_table(output_path).to_pandas()
+        elif file_key.endswith("json"):
+            df = pd.read_json(output_path, lines=True)
+        else:
+            df = pd.read_csv(output_path)
+        assert df["name"].tolist() == ["***", "***"]
+        assert df["course"].tolist() == ["Software", "DE"]
+
+    @pytest.mark.it("Test if auto_detect_pii works on a memory-mapped file")
+    @pytest.mark.parametrize("file_key", ["new_data/test_file.csv",
+                                          "new_data/test_file.parquet",
+                                          "new_data/test_file.json"])
+    def test_local_auto_detect(self, local_root, file_key):
+        json_str = json.dumps({
+            "file_to_obfuscate": f"file://bucket/{file_key}",
+            "pii_fields": [],
+        })
+        result = handle_file_obfuscation(
+            json_str, if_save_to_s3=False, auto_detect_pii=True,
+            if_output_different_format=True, output_format="csv",
+            storage_backend=LocalBackend(str(local_root)))
+        df = pd.read_csv(result)
+        assert df["email_address"].iloc[0] == "***"
+        assert df["course"].iloc[0] == "Software"
@@ -0,0 +1,279 @@
+import pytest
+import boto3
+from moto import mock_aws
+import io
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
+from cryptography.exceptions import InvalidTag
+try:
+    os.environ["OPENAI_API_KEY"] = "test_api_key"
+except KeyError:
+    pass
+from src.tokenization import (
+    TokenVault,
+    generate_vault_key,
+    tokenize_series,
+    set_token_vault,
+    get_token_vault,
+    open_token_vault,
+)
+from src.obfuscator import obfuscate_fields_in_df
+from src.csv_passthrough import rewrite_csv_pii_fields
+from src.json_paths import obfuscate_json_records
+from src.main import handle_file_obfuscation
+from src.detokenize import detokenize_file
+
+
+@pytest.fixture
+def vault():
+    vault = TokenVault(":memory:", generate_vault_key())
+    set_token_vault(vault)
+    yield vault
+    set_token_vault(None)
+    vault.close()
+
+
+@pytest.fixture
+def test_df():
+    return pd.DataFrame({
+        "student_id": [1, 2, 3, 4],
+        "name": ["John Smith", "Steve Lee", "John Smith", None],
+        "email": ["j@smith.com", "s@lee.com", "j@smith.com", "a@tan.com"],
+    })
+
+
+@pytest.fixture()
+def aws_credentials():
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-2"
+
+
+@pytest.fixture()
+def s3_client(aws_credentials, test_df):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(
+            Bucket='test_bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
+        )
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.csv",
+                             Body=test_df.to_csv(index=False).encode())
+        yield s3_client
+
+
+class TestTokenVault:
+    @pytest.mark.it("Test if tokens are stable and detokenize back")
+    def test_roundtrip(self, vault):
+        tokens = vault.tokenize(["a", "b", "a"])
+        assert tokens[0] == tokens[2] != tokens[1]
+        assert all(token.startswith("tok_") for token in tokens)
+        assert vault.tokenize(["b"]) == [tokens[1]]
+        assert vault.tokenize_value("a") == tokens[0]
+        assert vault.detokenize(tokens) == ["a", "b", "a"]
+        assert len(vault) == 2
+
+    @pytest.mark.it("Test if values are not stored in clear")
+    def test_encrypted(self, tmp_path):
+        path = str(tmp_path / "vault.db")
+        vault = TokenVault(path, generate_vault_key())
+        vault.tokenize(["john.smith@example.com"])
+        vault.close()
+        with open(path, "rb") as vault_file:
+            assert b"john.smith" not in vault_file.read()
+
+    @pytest.mark.it("Test if unknown tokens detokenize to None")
+    def test_unknown(self, vault):
+        token = vault.tokenize(["a"])[0]
+        assert vault.detokenize([token, "tok_zz", "tok_00ab", "a", None]) \
+            == ["a", None, None, None, None]
+
+    @pytest.mark.it("Test if a vault cannot be read with another key")
+    def test_wrong_key(self, tmp_path):
+        path = str(tmp_path / "vault.db")
+        token = TokenVault(path, generate_vault_key()).tokenize(["a"])[0]
+        with pytest.raises(InvalidTag):
+            TokenVault(path, generate_vault_key()).detokenize([token])
+        with pytest.raises(ValueError):
+            TokenVault(path, "c2hvcnQ=")
+
+    @pytest.mark.it("Test if large lists are looked up in batches")
+    def test_batches(self, vault):
+        values = [str(i) for i in range(25)]
+        with patch("src.tokenization.QUERY_BATCH", 10):
+            tokens = vault.tokenize(values)
+            assert vault.detokenize(tokens) == values
+        assert len(set(tokens)) == 25
+
+
+class TestTokenizeSeries:
+    @pytest.mark.it("Test if missing values are kept")
+    def test_nulls(self, vault):
+        series = pd.Series(["a", np.nan, 5, None], index=[3, 4, 5, 6])
+        tokenized = tokenize_series(series)
+        assert tokenized[3].startswith("tok_")
+        assert np.isnan(tokenized[4])
+        assert tokenized[6] is None
+        assert list(tokenized.index) == [3, 4, 5, 6]
+        restored = tokenize_series(tokenized, reverse=True)
+        assert restored[3] == "a" and restored[5] == "5"
+
+    @pytest.mark.it("Test if the vault needs a key")
+    def test_no_key(self, monkeypatch):
+        monkeypatch.delenv("OBFUSCATOR_VAULT_KEY", raising=False)
+        set_token_vault(None)
+        with pytest.raises(ValueError, match="OBFUSCATOR_VAULT_KEY"):
+            get_token_vault()
+
+
+class TestTokenizeMethod:
+    @pytest.mark.it("Test if 'tokenize' can be chosen for some fields only")
+    def test_obfuscate_fields_in_df(self, vault, test_df):
+        emails = test_df["email"].tolist()
+        df = obfuscate_fields_in_df(test_df, ["name", "email"],
+                                    {"email": "tokenize"})
+        assert (df["name"] == "***").all()
+        assert df["email"][0] == df["email"][2] != df["email"][1]
+        assert vault.detokenize(df["email"].tolist()) == emails
+
+    @pytest.mark.it("Test if streamed records are tokenized in batches")
+    def test_batched_vault_calls(self, test_df):
+        vault = TokenVault(":memory:", generate_vault_key())
+        emails = test_df["email"].tolist()
+        with patch.object(vault, "tokenize", wraps=vault.tokenize) as mock:
+            output = rewrite_csv_pii_fields(
+                test_df.to_csv(index=False), ["email"], "tokenize",
+                token_vault=vault)
+            assert mock.call_count == 1
+            df = pd.read_csv(output)
+            assert vault.detokenize(df["email"].tolist()) == emails
+
+            mock.reset_mock()
+            records = [{"contact": {"email": email}} for email in emails]
+            output = obfuscate_json_records(
+                json.dumps(records), ["contact.email"], "tokenize",
+                token_vault=vault)
+            assert mock.call_count == 1
+            tokens = [json.loads(line)["contact"]["email"]
+                      for line in output]
+            assert tokens == df["email"].tolist()
+        vault.close()
+
+
+class TestHandleFileObfuscationTokenization:
+    @pytest.mark.it("Test if a tokenized file can be detokenized")
+    def test_roundtrip(self, s3_client, vault, test_df):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        handle_file_obfuscation(json_str, tokenize_fields=["email"],
+                                token_vault=vault, chunk_size=2)
+        body = s3_client.get_object(
+            Bucket="test_bucket",
+            Key="processed_data/test_file.csv")["Body"].read()
+        df = pd.read_csv(io.BytesIO(body))
+        assert (df["name"] == "***").all()
+        assert df["email"].str.startswith("tok_").all()
+
+        result = detokenize_file(json.dumps({
+            "file_to_obfuscate":
+                "s3://test_bucket/processed_data/test_file.csv",
+            "pii_fields": ["email"]}),
+            "restored/test_file.csv", vault, chunk_size=3)
+        assert result == "Detokenized file saved to " + \
+            "s3://test_bucket/restored/test_file.csv"
+        body = s3_client.get_object(
+            Bucket="test_bucket", Key="restored/test_file.csv")["Body"].read()
+        restored = pd.read_csv(io.BytesIO(body))
+        assert restored["email"].tolist() == test_df["email"].tolist()
+        assert list(restored["student_id"]) == [1, 2, 3, 4]
+
+    @pytest.mark.it("Test if a tokenized JSON file can be detokenized")
+    def test_json_roundtrip(self, s3_client, vault, test_df):
+        s3_client.put_object(Bucket="test_bucket",
+                             Key="new_data/test_file.json",
+                             Body=test_df.to_json(orient="records"))
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.json",
+            "pii_fields": []})
+        handle_file_obfuscation(json_str, tokenize_fields=["email"],
+                                token_vault=vault, chunk_size=2)
+        detokenize_file(json.dumps({
+            "file_to_obfuscate":
+                "s3://test_bucket/processed_data/test_file.json",
+            "pii_fields": ["email"]}),
+            "restored/test_file.json", vault, chunk_size=3)
+        body = s3_client.get_object(
+            Bucket="test_bucket", Key="restored/test_file.json")["Body"].read()
+        restored = pd.read_json(io.BytesIO(body), lines=True)
+        assert restored["email"].tolist() == test_df["email"].tolist()
+        assert restored["name"].tolist()[:3] == test_df["name"].tolist()[:3]
+
+    @pytest.mark.it("Test if concurrent jobs keep their own vaults")
+    def test_concurrent_vaults(self, s3_client, test_df):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        vaults = [TokenVault(":memory:", generate_vault_key())
+                  for _ in range(4)]
+        outputs = {}
+
+        def run_job(vault):
+            outputs[id(vault)] = pd.read_csv(handle_file_obfuscation(
+                json_str, tokenize_fields=["email"], token_vault=vault,
+                if_save_to_s3=False, chunk_size=1))
+
+        threads = [threading.Thread(target=run_job, args=(vault,))
+                   for vault in vaults]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for vault in vaults:
+            assert len(vault) == 3
+            assert vault.detokenize(
+                outputs[id(vault)]["email"].tolist()) == \
+                test_df["email"].tolist()
+            vault.close()
+
+    @pytest.mark.it("Test if a vault opened from a path is closed after")
+    def test_vault_path_closed(self, s3_client, test_df, tmp_path,
+                               monkeypatch):
+        monkeypatch.setenv("OBFUSCATOR_VAULT_KEY", generate_vault_key())
+        path = str(tmp_path / "vault.db")
+        opened = []
+
+        def open_vault(path):
+            opened.append(open_token_vault(path))
+            return opened[-1]
+
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["name"]})
+        with patch("src.main.open_token_vault", side_effect=open_vault):
+            output = handle_file_obfuscation(
+                json_str, tokenize_fields=["email"], token_vault=path,
+                if_save_to_s3=False)
+        assert len(opened) == 1
+        with pytest.raises(sqlite3.ProgrammingError):
+            len(opened[0])
+        vault = open_token_vault(path)
+        assert vault.detokenize(pd.read_csv(output)["email"].tolist()) == \
+            test_df["email"].tolist()
+        vault.close()
+
+    @pytest.mark.it("Test if detokenizing a missing field raises")
+    def test_missing_field(self, s3_client, vault):
+        json_str = json.dumps({
+            "file_to_obfuscate": "s3://test_bucket/new_data/test_file.csv",
+            "pii_fields": ["phone"]})
+        with pytest.raises(KeyError):
+            detokenize_file(json_str, "restored/test_file.csv", vault)
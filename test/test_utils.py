@@ -1,5 +1,12 @@
 import pytest
-from src.utils import read_s3_file, write_s3_file, json_input_handler
+from src.utils import (
+    read_s3_file,
+    write_s3_file,
+    json_input_handler,
+    upload_s3_stream,
+    as_readable_stream,
+)
+from boto3.s3.transfer import TransferConfig
 import boto3
 from moto import mock_aws
 import os
@@ -323,6 +330,70 @@ class TestWriteParquet:
         pd.testing.assert_frame_equal(df, expected_df)
 
 
+class TestWriteStreams:
+    @pytest.mark.it('Test if a memoryview is uploaded unchanged')
+    def test_memoryview(self, s3_client, test_csv_output_file_content):
+        expected = test_csv_output_file_content.getvalue()
+        write_s3_file('test_bucket', 'test_output_file.csv',
+                      test_csv_output_file_content.getbuffer())
+        response = s3_client.get_object(Bucket='test_bucket',
+                                        Key='test_output_file.csv')
+        assert response['Body'].read() == expected
+
+    @pytest.mark.it('Test if a generator of byte chunks is uploaded')
+    def test_generator(self, s3_client):
+        chunks = (f"{i},***\n".encode('utf8') for i in range(1000))
+        write_s3_file('test_bucket', 'test_output_file.csv', chunks)
+        response = s3_client.get_object(Bucket='test_bucket',
+                                        Key='test_output_file.csv')
+        lines = response['Body'].read().decode('utf8').splitlines()
+        assert len(lines) == 1000
+        assert lines[-1] == "999,***"
+
+    @pytest.mark.it('Test if a generator can be compressed on upload')
+    def test_compressed_generator(self, s3_client):
+        chunks = (b"a,b\n" for _ in range(100))
+        write_s3_file('test_bucket', 'test_output_file.csv.gz', chunks)
+        content_str, _ = read_s3_file('test_bucket',
+                                      'test_output_file.csv.gz')
+        assert content_str == "a,b\n" * 100
+
+    @pytest.mark.it('Test if upload stats report bytes and throughput')
+    def test_upload_stats(self, s3_client):
+        body = as_readable_stream(b"x" * (6 * 1024 * 1024))
+        config = TransferConfig(multipart_threshold=5 * 1024 * 1024,
+                                multipart_chunksize=5 * 1024 * 1024)
+        stats = upload_s3_stream('test_bucket', 'big.csv', body, config)
+        assert stats['bytes_written'] == 6 * 1024 * 1024
+        assert stats['throughput_mb_s'] > 0
+        response = s3_client.head_object(Bucket='test_bucket', Key='big.csv')
+        assert response['ContentLength'] == 6 * 1024 * 1024
+
+
+class TestCompressedFiles:
+    @pytest.mark.it('Test if compressed csv/json round trip through s3')
+    @pytest.mark.parametrize("file_key", ["test_output_file.csv.gz",
+                                          "test_output_file.csv.zst",
+                                          "test_output_file.json.bz2"])
+    def test_round_trip(
+            self, s3_client, test_csv_output_file_content, file_key):
+        write_s3_file('test_bucket', file_key, test_csv_output_file_content)
+        raw = s3_client.get_object(Bucket='test_bucket',
+                                   Key=file_key)['Body'].read()
+        assert raw != test_csv_output_file_content.getvalue()
+        content_str, file_extension = read_s3_file('test_bucket', file_key)
+        assert content_str == \
+            test_csv_output_file_content.getvalue().decode('utf8')
+        assert file_extension == file_key.split('.')[1]
+
+    @pytest.mark.it('Test ValueError for a compressed parquet key')
+    def test_compressed_parquet(
+            self, s3_client, test_parquet_output_file_content):
+        with pytest.raises(ValueError):
+            write_s3_file('test_bucket', 'test_output_file.parquet.gz',
+                          test_parquet_output_file_content)
+
+
 class TestJsonHandler:
     @pytest.mark.it('Test if return the correct type of output')
     def test_correct_output_type(self, json_input):